@@ -234,6 +234,9 @@ else:                           # pragma: no cover
 # Example mmt file
 EXAMPLE = os.path.join(DIR_DATA, 'example.mmt')
 
+# Location of the compiled module cache
+DIR_CACHE = os.path.join(DIR_USER, 'cache')
+
 # Don't expose standard libraries as part of Myokit
 del(os, inspect)
 
@@ -313,6 +316,29 @@ OPENCL_LIB = []
 OPENCL_INC = []
 
 
+#
+# Compilation
+#
+
+# Backend used to compile simulation modules: "direct" to call the compiler and
+# linker directly, "setuptools" to use setuptools, or "auto" to use the direct
+# method where possible and fall back to setuptools if it fails.
+COMPILER_BACKEND = 'auto'
+
+# Optimisation profile used when compiling simulation modules: "default" to use
+# the compiler's default settings, "optimised" for aggressive optimisation,
+# "native" to also optimise for the current processor (the resulting modules
+# might not work on other machines), or "fast-math" to also allow floating
+# point optimisations that do not strictly follow the IEEE 754 standard.
+OPTIMISATION_PROFILE = 'default'
+
+# Store compiled simulation back-ends on disk and reuse them when possible
+CACHE_COMPILED_MODULES = True
+
+# Maximum size of the compiled module cache, in megabytes
+CACHE_SIZE = 500
+
+
 #
 # Imports
 #
@@ -543,6 +569,7 @@ from ._progress import (    # noqa
 # Data logging
 from ._datalog import (     # noqa
     DataLog,
+    DataLogWriter,
     _dimco,
     LoggedVariableInfo,
     prepare_log,
@@ -559,6 +586,10 @@ from ._datablock import (   # noqa
 from ._sim import (  # noqa
     CModule,
     CppModule,
+    OPTIMISATION_PROFILES,
+)
+from ._sim.cache import (  # noqa
+    ModuleCache,
 )
 from ._sim.compiler import (  # noqa
     Compiler,
@@ -572,12 +603,18 @@ from ._sim.opencl import (  # noqa
     OpenCLInfo,
     OpenCLPlatformInfo,
 )
-from ._sim.cvodesim import Simulation       # noqa
+from ._sim.cvodesim import (    # noqa
+    Biomarkers,
+    DenseOutput,
+    Simulation,
+)
 from ._sim.cable import Simulation1d        # noqa
 from ._sim.rhs import RhsBenchmarker        # noqa
 from ._sim.icsim import ICSimulation        # noqa
 from ._sim.psim import PSimulation          # noqa
 from ._sim.jacobian import JacobianTracer, JacobianCalculator   # noqa
+from ._sim.jacobian import _limit_newton_step   # noqa
+from ._sim.adjoint import LeastSquaresAdjoint                   # noqa
 #from ._sim.openmp import SimulationOpenMP                       # noqa
 from ._sim.openclsim import SimulationOpenCL                    # noqa
 from ._sim.fiber_tissue import FiberTissueSimulation            # noqa
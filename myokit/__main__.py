@@ -48,6 +48,7 @@ def main():
 
     # Add subparsers
     add_block_parser(subparsers)            # Launch the DataBlock viewer
+    add_cache_parser(subparsers)            # Manage the compiled module cache
     add_compare_parser(subparsers)          # Compare models
     add_compiler_parser(subparsers)         # Show compiler
     add_debug_parser(subparsers)            # Debug an RHS equation
@@ -161,6 +162,102 @@ def add_block_parser(subparsers):
     parser.set_defaults(func=block)
 
 
+#
+# Cache
+#
+
+def cache_clear():
+    """
+    Removes all modules from the compiled module cache.
+    """
+    import myokit
+    cache = myokit.ModuleCache()
+    n = cache.clear()
+    print('Removed ' + str(n) + ' module(s) from ' + cache.path())
+
+
+def cache_list():
+    """
+    Lists the modules in the compiled module cache.
+    """
+    import time
+    import myokit
+
+    cache = myokit.ModuleCache()
+    entries = cache.entries()
+    print('Compiled module cache: ' + cache.path())
+    if not myokit.CACHE_COMPILED_MODULES:
+        print('Caching is currently disabled.')
+    for key, name, size, last_used in entries:
+        print('{} {:>8.1f} KB  {}  {}'.format(
+            key[:16], size / 1024,
+            time.strftime(myokit.DATE_FORMAT, time.localtime(last_used)),
+            name))
+    total = sum([x[2] for x in entries])
+    print('{} module(s), {:.1f} MB used of {:.1f} MB.'.format(
+        len(entries), total / 1024**2, myokit.CACHE_SIZE))
+
+
+def cache_warm(filenames):
+    """
+    Compiles simulations for the models in the given files, and stores them in
+    the compiled module cache.
+    """
+    import myokit
+
+    if not myokit.CACHE_COMPILED_MODULES:
+        print('Caching is currently disabled.')
+        return
+
+    for filename in filenames:
+        print('Compiling simulation for ' + filename)
+        b = myokit.Benchmarker()
+        model, protocol, script = myokit.load(filename)
+        if model is None:
+            print('  No model found, skipping.')
+            continue
+        myokit.Simulation(model, protocol)
+        print('  Done in ' + b.format(b.time()))
+
+
+def add_cache_parser(subparsers):
+    """
+    Adds a subcommand parser for the ``cache`` command.
+    """
+    parser = subparsers.add_parser(
+        'cache',
+        description='Lists, warms, or clears the cache of compiled simulation'
+                    ' modules.',
+        help='Manages the compiled module cache.',
+    )
+    subparsers = parser.add_subparsers(help='commands')
+
+    # Clear
+    clear_parser = subparsers.add_parser(
+        'clear', help='Remove all modules from the cache.')
+    clear_parser.set_defaults(func=cache_clear)
+
+    # List
+    list_parser = subparsers.add_parser(
+        'list', help='List the modules in the cache.')
+    list_parser.set_defaults(func=cache_list)
+
+    # Warm
+    warm_parser = subparsers.add_parser(
+        'warm',
+        help='Compile simulations for one or more mmt files, and store them'
+             ' in the cache.')
+    warm_parser.add_argument(
+        'filenames',
+        metavar='model_file.mmt',
+        nargs='+',
+        help='One or more mmt files to compile simulations for.',
+    )
+    warm_parser.set_defaults(func=cache_warm)
+
+    parser.set_defaults(func=lambda: parser.print_help())
+
+
 #
 # Compare
 #
@@ -206,7 +303,7 @@ def add_compare_parser(subparsers):
 # Compiler
 #
 
-def compiler(debug):
+def compiler(debug, benchmark=False, repeats=3):
     """
     Tests for C compilation support.
     """
@@ -214,8 +311,37 @@ def compiler(debug):
     compiler = myokit.Compiler.info(debug)
     if compiler is None:
         print('Compilation with distutils/setuptools failed.')
-    else:
-        print('Compilation successful. Found: ' + compiler)
+        return
+    print('Compilation successful. Found: ' + compiler)
+    if benchmark:
+        compiler_benchmark(repeats)
+
+
+def compiler_benchmark(repeats):
+    """
+    Shows the time taken to create a :class:`myokit.Simulation` with each
+    compiler backend.
+    """
+    import myokit
+
+    model = myokit.load_model(myokit.EXAMPLE)
+    backend = myokit.COMPILER_BACKEND
+    cache = myokit.CACHE_COMPILED_MODULES
+    print('Time to create a Simulation (without caching):')
+    try:
+        myokit.CACHE_COMPILED_MODULES = False
+        for name in ('setuptools', 'direct'):
+            myokit.COMPILER_BACKEND = name
+            times = []
+            for i in range(repeats):
+                b = myokit.Benchmarker()
+                myokit.Simulation(model)
+                times.append(b.time())
+            print('  {:<10} : fastest {:.3f} s, mean {:.3f} s'.format(
+                name, min(times), sum(times) / len(times)))
+    finally:
+        myokit.COMPILER_BACKEND = backend
+        myokit.CACHE_COMPILED_MODULES = cache
 
 
 def add_compiler_parser(subparsers):
@@ -232,6 +358,18 @@ def add_compiler_parser(subparsers):
         action='store_true',
         help='Show error output.',
     )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='Show the time needed to create a simulation with each compiler'
+             ' backend.',
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=3,
+        help='The number of repeats to use when benchmarking.',
+    )
     parser.set_defaults(func=compiler)
 
 
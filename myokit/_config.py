@@ -169,6 +169,36 @@ def _create(path):
             paths.append('/System/Library/Frameworks')
         config.set('opencl', 'inc', ';'.join(paths))
 
+    # Compiler backend and compiled module cache
+    config.add_section('compilation')
+    config.set(
+        'compilation',
+        '# Method used to compile simulations: "direct" (call the compiler'
+        ' directly),')
+    config.set(
+        'compilation',
+        '# "setuptools", or "auto" (direct, with setuptools as a fallback).')
+    config.set('compilation', 'backend', myokit.COMPILER_BACKEND)
+    config.set(
+        'compilation',
+        '# Optimisation profile: "default", "optimised", "native" (optimise'
+        ' for this')
+    config.set(
+        'compilation',
+        '# machine), or "fast-math" (native, with non-IEEE floating point'
+        ' math).')
+    config.set('compilation', 'profile', myokit.OPTIMISATION_PROFILE)
+    config.set(
+        'compilation',
+        '# Store compiled simulation modules on disk and reuse them if'
+        ' possible.')
+    config.set('compilation', 'cache', myokit.CACHE_COMPILED_MODULES)
+    config.set(
+        'compilation', '# Maximum size of the compiled module cache, in MB.')
+    config.set('compilation', 'cache_size', myokit.CACHE_SIZE)
+    config.set('compilation', '# Location of the compiled module cache.')
+    config.set('compilation', '#cache_path = ' + myokit.DIR_CACHE)
+
     # Write ini file
     try:
         with open(path, 'w') as configfile:
@@ -300,6 +330,43 @@ def _load():
     if config.has_option('opencl', 'inc'):
         myokit.OPENCL_INC.extend(_path_list(config.get('opencl', 'inc')))
 
+    # Compiler backend and compiled module cache
+    if config.has_option('compilation', 'backend'):
+        x = config.get('compilation', 'backend').strip().lower()
+        if x in ('auto', 'direct', 'setuptools'):
+            myokit.COMPILER_BACKEND = x
+        elif x:     # pragma: no cover
+            log = logging.getLogger(__name__)
+            log.warning(
+                'Unknown compiler backend in myokit.ini: "' + x + '".'
+                ' Expecting "auto", "direct", or "setuptools".')
+    if config.has_option('compilation', 'profile'):
+        x = config.get('compilation', 'profile').strip().lower()
+        if x in myokit.OPTIMISATION_PROFILES:
+            myokit.OPTIMISATION_PROFILE = x
+        elif x:     # pragma: no cover
+            log = logging.getLogger(__name__)
+            log.warning(
+                'Unknown optimisation profile in myokit.ini: "' + x + '".'
+                ' Expecting one of ' + ', '.join(
+                    ['"' + y + '"' for y in myokit.OPTIMISATION_PROFILES])
+                + '.')
+    if config.has_option('compilation', 'cache'):
+        try:
+            myokit.CACHE_COMPILED_MODULES = config.getboolean(
+                'compilation', 'cache')
+        except ValueError:  # pragma: no cover
+            pass
+    if config.has_option('compilation', 'cache_size'):
+        try:
+            myokit.CACHE_SIZE = float(config.get('compilation', 'cache_size'))
+        except ValueError:  # pragma: no cover
+            pass
+    if config.has_option('compilation', 'cache_path'):
+        x = config.get('compilation', 'cache_path').strip()
+        if x:
+            myokit.DIR_CACHE = os.path.expanduser(x)
+
 
 def _dynamically_add_embedded_sundials_win():   # pragma: no linux cover
     """
@@ -1023,15 +1023,8 @@ class DataBlock2d(object):
 
         The returned data is a 1d numpy array.
         """
-        if self._nx != self._ny:
-            raise Exception(
-                'Eigenvalues can only be determined for square data blocks.')
-        data = self._2d[name]
-        dominants = []
-        for t in range(self._nt):
-            e = np.linalg.eigvals(data[t])
-            dominants.append(e[np.argmax(np.absolute(e))])
-        return np.array(dominants)
+        e = self.eigenvalues(name)
+        return e[np.arange(self._nt), np.argmax(np.absolute(e), axis=1)]
 
     def eigenvalues(self, name):
         """
@@ -1040,16 +1033,14 @@ class DataBlock2d(object):
         with a square 2d grid).
 
         The returned data is a 2d numpy array where the first axis is time and
-        the second axis is the index of each eigenvalue.
+        the second axis is the index of each eigenvalue. The eigenvalues for
+        all points in time are calculated in a single call to
+        ``numpy.linalg.eigvals``.
         """
         if self._nx != self._ny:
             raise Exception(
                 'Eigenvalues can only be determined for square data blocks.')
-        data = self._2d[name]
-        eigenvalues = []
-        for t in range(self._nt):
-            eigenvalues.append(np.linalg.eigvals(data[t]))
-        return np.array(eigenvalues)
+        return np.linalg.eigvals(self._2d[name])
 
     @staticmethod
     def from_DataLog(log):
@@ -1202,15 +1193,8 @@ class DataBlock2d(object):
 
         The returned data is a 1d numpy array.
         """
-        if self._nx != self._ny:
-            raise Exception(
-                'Eigenvalues can only be determined for square data blocks.')
-        data = self._2d[name]
-        largest = []
-        for t in range(self._nt):
-            e = np.linalg.eigvals(data[t])
-            largest.append(e[np.argmax(np.real(e))])
-        return np.array(largest)
+        e = self.eigenvalues(name)
+        return e[np.arange(self._nt), np.argmax(np.real(e), axis=1)]
 
     def len0d(self):
         """
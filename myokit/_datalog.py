@@ -11,6 +11,7 @@ import os
 import re
 import sys
 import array
+import tempfile
 import numpy as np
 from collections import OrderedDict
 import myokit
@@ -1413,6 +1414,162 @@ class DataLog(OrderedDict):
         return infos
 
 
+class DataLogWriter(object):
+    """
+    Writes time series data to disk in the binary format used by
+    :meth:`DataLog.save`, without storing all data in memory.
+
+    Data is added in chunks using :meth:`write`, and collected in a temporary
+    file until :meth:`close` is called, at which point the file ``filename`` is
+    created. The resulting file can be read with :meth:`DataLog.load`.
+
+    Writers can be passed to simulations (e.g. to :meth:`Simulation.run`) as
+    a ``log_sink``, so that the logged data is written to disk in fixed-size
+    chunks instead of being stored in memory. This allows very long
+    simulations, or simulations logging a large number of variables, to be
+    run without running out of memory. Any object with a ``write(log)`` method
+    can be used as a sink, so that custom writers can be created if needed.
+
+    Example::
+
+        with myokit.DataLogWriter('log.zip') as w:
+            s.run(86400000, log_sink=w)
+        d = myokit.DataLog.load('log.zip')
+
+    Arguments:
+
+    ``filename``
+        The file to write to (existing files will be overwritten without
+        warning).
+    ``precision``
+        The precision to store the data in, for example
+        ``myokit.SINGLE_PRECISION`` or ``myokit.DOUBLE_PRECISION`` (default).
+
+    """
+    def __init__(self, filename, precision=myokit.DOUBLE_PRECISION):
+        super(DataLogWriter, self).__init__()
+
+        # Output file and data type
+        self._filename = os.path.expanduser(filename)
+        self._dtype = str('d' if precision == myokit.DOUBLE_PRECISION else 'f')
+
+        # Fields and time key, set on first write
+        self._keys = None
+        self._time = None
+
+        # Temporary file, and the length of each chunk stored in it. Each
+        # chunk is stored as a contiguous block of data for each field.
+        self._file = tempfile.TemporaryFile()
+        self._chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Writes all collected data to disk, and closes this writer.
+
+        Calling :meth:`close` on a writer that has already been closed has no
+        effect.
+        """
+        if self._file is None:
+            return
+
+        # Load compression modules
+        import zipfile
+        try:
+            # Make sure zlib is available
+            import zlib
+            del(zlib)
+        except ImportError:
+            raise Exception(
+                'This method requires the `zlib` module to be installed.')
+
+        # Number of fields, length of data arrays, data type, time, fields
+        keys = self._keys or []
+        head_str = [str(len(keys)), str(self.length()), self._dtype]
+        head_str.append(self._time or '')
+        head_str.extend(keys)
+        head_str = '\n'.join(head_str)
+
+        # Rearrange chunks into one contiguous block per field, using a second
+        # temporary file, so that at most one chunk is in memory.
+        size = np.dtype(self._dtype).itemsize
+        handle, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'wb') as body:
+                for i in range(len(keys)):
+                    offset = 0
+                    for n in self._chunks:
+                        self._file.seek(offset + i * n * size)
+                        body.write(self._file.read(n * size))
+                        offset += len(keys) * n * size
+
+            # Write
+            head = zipfile.ZipInfo('structure.txt')
+            head.compress_type = zipfile.ZIP_DEFLATED
+            read = zipfile.ZipInfo('readme.txt')
+            read.compress_type = zipfile.ZIP_DEFLATED
+            with zipfile.ZipFile(self._filename, 'w', allowZip64=True) as f:
+                f.write(path, 'data.bin', zipfile.ZIP_DEFLATED)
+                f.writestr(head, head_str.encode(ENC))
+                f.writestr(read, README_SAVE_BIN.encode(ENC))
+        finally:
+            os.remove(path)
+            self._file.close()
+            self._file = None
+
+    def length(self):
+        """
+        Returns the number of data points written so far.
+        """
+        return sum(self._chunks)
+
+    def write(self, log):
+        """
+        Adds the data in ``log`` to this writer.
+
+        The argument ``log`` should be a :class:`DataLog`, or any other
+        dictionary mapping keys to sequences of equal length. The first call to
+        :meth:`write` determines which fields are stored (and the time key, if
+        ``log`` is a ``DataLog``), and each subsequent call must provide data
+        for exactly the same fields.
+        """
+        if self._file is None:
+            raise ValueError('Unable to write to closed DataLogWriter.')
+
+        # Check keys
+        keys = list(log.keys())
+        if self._keys is None:
+            self._keys = keys
+            if isinstance(log, DataLog):
+                self._time = log.time_key()
+        elif set(keys) != set(self._keys):
+            raise ValueError(
+                'The keys in each log written to a DataLogWriter must be the'
+                ' same.')
+
+        # Check lengths
+        data = [np.asarray(log[key], dtype='<' + self._dtype)
+                for key in self._keys]
+        n = len(data[0]) if data else 0
+        for x in data:
+            if x.shape != (n, ):
+                raise ValueError(
+                    'All arrays written to a DataLogWriter must be'
+                    ' one-dimensional and have the same length.')
+
+        # Store
+        if n > 0:
+            self._file.seek(0, 2)
+            for x in data:
+                self._file.write(x.tobytes())
+            self._chunks.append(n)
+
+
 class LoggedVariableInfo(object):
     """
     Contains information about the log entries for each variable. These objects
@@ -1840,13 +1997,17 @@ def prepare_log(
                         'DataLog contains non-indexed entry for'
                         ' cell-specific variable <' + str(kname) + '>.')
 
-        # Check dict values can be appended to
+        # Check dict values can be appended to, or are NumPy arrays (which
+        # simulations extend by creating a new array)
         m = 'append'
         for v in log.values():
+            if isinstance(v, np.ndarray):
+                continue
             if not (hasattr(v, m) and callable(getattr(v, m))):
                 raise ValueError(
                     'Logging dict must map qnames to objects'
-                    ' that support the append() method.')
+                    ' that support the append() method, or to NumPy'
+                    ' arrays.')
 
         # Return
         return log
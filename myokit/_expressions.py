@@ -163,6 +163,25 @@ class Expression(object):
         """
         return lhs in self._references
 
+    def diff(self, lhs):
+        """
+        Returns an expression for the partial derivative of this expression
+        with respect to the :class:`LhsExpression` ``lhs``.
+
+        All other variables are treated as independent of ``lhs``, so no
+        dependencies through intermediary variables are taken into account.
+        For example, if ``x = 2 * y`` and ``y = 3 * z``, the derivative of the
+        right-hand side of ``x`` with respect to ``z`` is zero. To take such
+        dependencies into account the chain rule must be applied separately.
+
+        Discontinuous operations such as ``floor()`` and conditions are
+        treated as piecewise constant, so that their derivative is zero.
+
+        The returned expression is not simplified, except that terms known to
+        be zero are omitted.
+        """
+        raise NotImplementedError
+
     def __eq__(self, other):
         if type(self) != type(other):
             return False
@@ -661,6 +680,9 @@ class Number(Expression):
         """
         return Number(Unit.convert(self._value, self._unit, unit), unit)
 
+    def diff(self, lhs):
+        return Number(0)
+
     def _eval(self, subst, precision):
         if precision == myokit.SINGLE_PRECISION:
             return numpy.float32(self._value)
@@ -787,6 +809,9 @@ class Name(LhsExpression):
             # And sneaky abuse of the expression system
             b.write(str(self._value))
 
+    def diff(self, lhs):
+        return Number(1 if self == lhs else 0)
+
     def _eval_unit(self, mode):
 
         # Try getting unit from variable, if linked
@@ -885,6 +910,9 @@ class Derivative(LhsExpression):
         self._op._code(b, c)
         b.write(')')
 
+    def diff(self, lhs):
+        return Number(1 if self == lhs else 0)
+
     def __eq__(self, other):
         if type(other) != Derivative:
             return False
@@ -991,6 +1019,9 @@ class PrefixPlus(PrefixExpression):
     """
     _rep = '+'
 
+    def diff(self, lhs):
+        return self._op.diff(lhs)
+
     def _eval(self, subst, precision):
         try:
             return self._op._eval(subst, precision)
@@ -1014,6 +1045,9 @@ class PrefixMinus(PrefixExpression):
     """
     _rep = '-'
 
+    def diff(self, lhs):
+        return _diff_minus(Number(0), self._op.diff(lhs))
+
     def _eval(self, subst, precision):
         try:
             return -self._op._eval(subst, precision)
@@ -1102,6 +1136,9 @@ class Plus(InfixExpression):
     _rep = '+'
     _description = 'Addition'
 
+    def diff(self, lhs):
+        return _diff_plus(self._op1.diff(lhs), self._op2.diff(lhs))
+
     def _eval(self, subst, precision):
         try:
             return (
@@ -1141,6 +1178,9 @@ class Minus(InfixExpression):
     _rep = '-'
     _description = 'Subtraction'
 
+    def diff(self, lhs):
+        return _diff_minus(self._op1.diff(lhs), self._op2.diff(lhs))
+
     def _eval(self, subst, precision):
         try:
             return (
@@ -1179,6 +1219,12 @@ class Multiply(InfixExpression):
     _rbp = PRODUCT
     _rep = '*'
 
+    def diff(self, lhs):
+        # Product rule
+        return _diff_plus(
+            _diff_multiply(self._op1.diff(lhs), self._op2),
+            _diff_multiply(self._op1, self._op2.diff(lhs)))
+
     def _eval(self, subst, precision):
         try:
             return (
@@ -1213,6 +1259,14 @@ class Divide(InfixExpression):
     _rbp = PRODUCT
     _rep = '/'
 
+    def diff(self, lhs):
+        # Quotient rule, as a' / b - a * b' / b^2
+        return _diff_minus(
+            _diff_divide(self._op1.diff(lhs), self._op2),
+            _diff_divide(
+                _diff_multiply(self._op1, self._op2.diff(lhs)),
+                Power(self._op2, Number(2))))
+
     def _eval(self, subst, precision):
         try:
             b = self._op2._eval(subst, precision)
@@ -1263,6 +1317,10 @@ class Quotient(InfixExpression):
     _rbp = PRODUCT
     _rep = '//'
 
+    def diff(self, lhs):
+        # Piecewise constant
+        return Number(0)
+
     def _eval(self, subst, precision):
         try:
             return (
@@ -1319,6 +1377,13 @@ class Remainder(InfixExpression):
     _rbp = PRODUCT
     _rep = '%'
 
+    def diff(self, lhs):
+        # a % b = a - b * floor(a / b)
+        return _diff_minus(
+            self._op1.diff(lhs),
+            _diff_multiply(
+                self._op2.diff(lhs), Floor(Divide(self._op1, self._op2))))
+
     def _eval(self, subst, precision):
         try:
             return (
@@ -1348,6 +1413,26 @@ class Power(InfixExpression):
     _rbp = POWER
     _rep = '^'
 
+    def diff(self, lhs):
+        d1 = self._op1.diff(lhs)
+        d2 = self._op2.diff(lhs)
+
+        # Constant exponent: a^b' = b * a^(b - 1) * a'
+        if _diff_is_zero(d2):
+            if _diff_is_zero(d1):
+                return Number(0)
+            if isinstance(self._op2, Number):
+                e = self._op2.eval() - 1
+                e = self._op1 if e == 1 else Power(self._op1, Number(e))
+            else:
+                e = Power(self._op1, Minus(self._op2, Number(1)))
+            return _diff_multiply(Multiply(self._op2, e), d1)
+
+        # General case: a^b' = a^b * (b' * log(a) + b * a' / a)
+        return _diff_multiply(self, _diff_plus(
+            _diff_multiply(d2, Log(self._op1)),
+            _diff_divide(_diff_multiply(self._op2, d1), self._op1)))
+
     def _eval(self, subst, precision):
         try:
             return (
@@ -1473,6 +1558,10 @@ class Sqrt(Function):
     """
     _fname = 'sqrt'
 
+    def diff(self, lhs):
+        return _diff_divide(
+            self._operands[0].diff(lhs), Multiply(Number(2), self))
+
     def _eval(self, subst, precision):
         try:
             return numpy.sqrt(self._operands[0]._eval(subst, precision))
@@ -1502,6 +1591,10 @@ class Sin(UnaryDimensionlessFunction):
     """
     _fname = 'sin'
 
+    def diff(self, lhs):
+        return _diff_multiply(
+            Cos(self._operands[0]), self._operands[0].diff(lhs))
+
     def _eval(self, subst, precision):
         try:
             return numpy.sin(self._operands[0]._eval(subst, precision))
@@ -1525,6 +1618,10 @@ class Cos(UnaryDimensionlessFunction):
     """
     _fname = 'cos'
 
+    def diff(self, lhs):
+        return _diff_minus(Number(0), _diff_multiply(
+            Sin(self._operands[0]), self._operands[0].diff(lhs)))
+
     def _eval(self, subst, precision):
         try:
             return numpy.cos(self._operands[0]._eval(subst, precision))
@@ -1545,6 +1642,11 @@ class Tan(UnaryDimensionlessFunction):
     """
     _fname = 'tan'
 
+    def diff(self, lhs):
+        return _diff_divide(
+            self._operands[0].diff(lhs),
+            Power(Cos(self._operands[0]), Number(2)))
+
     def _eval(self, subst, precision):
         try:
             return numpy.tan(self._operands[0]._eval(subst, precision))
@@ -1565,6 +1667,11 @@ class ASin(UnaryDimensionlessFunction):
     """
     _fname = 'asin'
 
+    def diff(self, lhs):
+        return _diff_divide(
+            self._operands[0].diff(lhs),
+            Sqrt(Minus(Number(1), Power(self._operands[0], Number(2)))))
+
     def _eval(self, subst, precision):
         try:
             return numpy.arcsin(self._operands[0]._eval(subst, precision))
@@ -1585,6 +1692,11 @@ class ACos(UnaryDimensionlessFunction):
     """
     _fname = 'acos'
 
+    def diff(self, lhs):
+        return _diff_minus(Number(0), _diff_divide(
+            self._operands[0].diff(lhs),
+            Sqrt(Minus(Number(1), Power(self._operands[0], Number(2))))))
+
     def _eval(self, subst, precision):
         try:
             return numpy.arccos(self._operands[0]._eval(subst, precision))
@@ -1610,6 +1722,11 @@ class ATan(UnaryDimensionlessFunction):
     """
     _fname = 'atan'
 
+    def diff(self, lhs):
+        return _diff_divide(
+            self._operands[0].diff(lhs),
+            Plus(Number(1), Power(self._operands[0], Number(2))))
+
     def _eval(self, subst, precision):
         try:
             return numpy.arctan(self._operands[0]._eval(subst, precision))
@@ -1630,6 +1747,9 @@ class Exp(UnaryDimensionlessFunction):
     """
     _fname = 'exp'
 
+    def diff(self, lhs):
+        return _diff_multiply(self, self._operands[0].diff(lhs))
+
     def _eval(self, subst, precision):
         try:
             return numpy.exp(self._operands[0]._eval(subst, precision))
@@ -1659,6 +1779,13 @@ class Log(Function):
     _fname = 'log'
     _nargs = [1, 2]
 
+    def diff(self, lhs):
+        if len(self._operands) == 1:
+            return _diff_divide(
+                self._operands[0].diff(lhs), self._operands[0])
+        return Divide(
+            Log(self._operands[0]), Log(self._operands[1])).diff(lhs)
+
     def _eval(self, subst, precision):
         try:
             if len(self._operands) == 1:
@@ -1714,6 +1841,11 @@ class Log10(UnaryDimensionlessFunction):
     """
     _fname = 'log10'
 
+    def diff(self, lhs):
+        return _diff_divide(
+            self._operands[0].diff(lhs),
+            Multiply(self._operands[0], Log(Number(10))))
+
     def _eval(self, subst, precision):
         try:
             return numpy.log10(self._operands[0]._eval(subst, precision))
@@ -1737,6 +1869,10 @@ class Floor(Function):
     """
     _fname = 'floor'
 
+    def diff(self, lhs):
+        # Piecewise constant
+        return Number(0)
+
     def _eval(self, subst, precision):
         try:
             return numpy.floor(self._operands[0]._eval(subst, precision))
@@ -1763,6 +1899,10 @@ class Ceil(Function):
     """
     _fname = 'ceil'
 
+    def diff(self, lhs):
+        # Piecewise constant
+        return Number(0)
+
     def _eval(self, subst, precision):
         try:
             return numpy.ceil(self._operands[0]._eval(subst, precision))
@@ -1789,6 +1929,14 @@ class Abs(Function):
     """
     _fname = 'abs'
 
+    def diff(self, lhs):
+        d = self._operands[0].diff(lhs)
+        if _diff_is_zero(d):
+            return d
+        return If(
+            Less(self._operands[0], Number(0)),
+            _diff_minus(Number(0), d), d)
+
     def _eval(self, subst, precision):
         try:
             return numpy.abs(self._operands[0]._eval(subst, precision))
@@ -1829,6 +1977,13 @@ class If(Function):
         """
         return self._i
 
+    def diff(self, lhs):
+        t = self._t.diff(lhs)
+        e = self._e.diff(lhs)
+        if _diff_is_zero(t) and _diff_is_zero(e):
+            return Number(0)
+        return If(self._i, t, e)
+
     def _eval(self, subst, precision):
         if self._i._eval(subst, precision):
             return self._t._eval(subst, precision)
@@ -1936,6 +2091,17 @@ class Piecewise(Function):
         """
         return iter(self._i)
 
+    def diff(self, lhs):
+        pieces = [x.diff(lhs) for x in self._e]
+        if all(_diff_is_zero(x) for x in pieces):
+            return Number(0)
+        ops = []
+        for cond, piece in zip(self._i, pieces):
+            ops.append(cond)
+            ops.append(piece)
+        ops.append(pieces[-1])
+        return Piecewise(*ops)
+
     def _eval(self, subst, precision):
         for k, cond in enumerate(self._i):
             if cond._eval(subst, precision):
@@ -1988,6 +2154,10 @@ class PrefixCondition(Condition, PrefixExpression):
     *Abstract class, extends:* :class:`Condition`, :class:`PrefixExpression`
     """
 
+    def diff(self, lhs):
+        # Conditions are piecewise constant
+        return Number(0)
+
 
 class Not(PrefixCondition):
     """
@@ -2043,6 +2213,10 @@ class InfixCondition(Condition, InfixExpression):
     """
     _rbp = CONDITIONAL
 
+    def diff(self, lhs):
+        # Conditions are piecewise constant
+        return Number(0)
+
 
 class BinaryComparison(InfixCondition):
     """
@@ -2278,6 +2452,53 @@ class Or(InfixCondition):
             self, 'Operator `or` expects dimensionless operands.')
 
 
+def _diff_is_zero(e):
+    """
+    Returns ``True`` if ``e`` is a literal zero.
+
+    Used by :meth:`Expression.diff` to omit terms that are known to be zero.
+    """
+    return isinstance(e, Number) and e.eval() == 0
+
+
+def _diff_plus(a, b):
+    """ Returns ``a + b``, omitting terms known to be zero. """
+    if _diff_is_zero(a):
+        return b
+    elif _diff_is_zero(b):
+        return a
+    return Plus(a, b)
+
+
+def _diff_minus(a, b):
+    """ Returns ``a - b``, omitting terms known to be zero. """
+    if _diff_is_zero(b):
+        return a
+    elif _diff_is_zero(a):
+        return PrefixMinus(b)
+    return Minus(a, b)
+
+
+def _diff_multiply(a, b):
+    """ Returns ``a * b``, omitting factors known to be one. """
+    if _diff_is_zero(a) or _diff_is_zero(b):
+        return Number(0)
+    elif isinstance(a, Number) and a.eval() == 1:
+        return b
+    elif isinstance(b, Number) and b.eval() == 1:
+        return a
+    return Multiply(a, b)
+
+
+def _diff_divide(a, b):
+    """ Returns ``a / b``, omitting terms known to be zero. """
+    if _diff_is_zero(a):
+        return Number(0)
+    elif isinstance(b, Number) and b.eval() == 1:
+        return a
+    return Divide(a, b)
+
+
 class EvalError(Exception):
     """
     Used internally when an error is encountered during an ``eval()``
@@ -9,12 +9,20 @@ from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
 # Library imports
+import logging
 import os
+import pickle
 import platform
+import shlex
+import subprocess
 import sys
+import sysconfig
 import tempfile
+import threading
 import traceback
 
+import numpy as np
+
 
 # Windows fix: On win7 with MinGW, when running distutils from Qt the
 # (deprecated) os.popen command fails. The docs suggest to replace calls to
@@ -36,7 +44,7 @@ if platform.system() == 'Windows':  # pragma: no linux cover
 
 
 # Setuptools imports
-from setuptools import setup, Extension  # noqa
+from setuptools import Distribution, Extension  # noqa
 
 
 # Myokit imports
@@ -44,6 +52,35 @@ import myokit  # noqa
 import myokit.pype as pype  # noqa
 
 
+# Lock used to prevent operations that affect the whole process (e.g.
+# redirecting the standard output) from being run in parallel by threads
+_lock = threading.RLock()
+
+# Thread pool used to create objects asynchronously
+_thread_pool_executor = None
+
+# Names of the available optimisation profiles, from least to most aggressive
+OPTIMISATION_PROFILES = ('default', 'optimised', 'native', 'fast-math')
+
+# Minimum size (in bytes, per logged variable) of the chunks passed to a
+# simulation's log sink
+LOG_SINK_CHUNK_SIZE = 8 * 2**16
+
+# Settings passed on to worker processes that compile modules
+_WORKER_SETTINGS = (
+    'CACHE_COMPILED_MODULES',
+    'CACHE_SIZE',
+    'COMPILER_BACKEND',
+    'DIR_CACHE',
+    'OPENCL_INC',
+    'OPENCL_LIB',
+    'OPTIMISATION_PROFILE',
+    'SUNDIALS_INC',
+    'SUNDIALS_LIB',
+    'SUNDIALS_VERSION',
+)
+
+
 # Dynamic module finding and loading in Python 3.5+ and younger
 if sys.hexversion >= 0x03050000:
     import importlib.machinery
@@ -68,6 +105,73 @@ class CModule(object):
     Abstract base class for classes that dynamically create and compile a
     back-end C-module.
     """
+    @classmethod
+    def build_async(cls, *args, **kwargs):
+        """
+        Creates an object of this class in a background thread, and returns a
+        ``concurrent.futures.Future`` that can be used to retrieve it.
+
+        All arguments are passed on to the class's constructor. For example::
+
+            f = myokit.Simulation.build_async(model, protocol)
+            # Do something else while compiling
+            s = f.result()
+
+        Code generation is performed one object at a time, but the compilation
+        step (which typically takes longest) runs in parallel when the
+        ``direct`` compiler backend is used (see :class:`myokit.ModuleCache`
+        and ``myokit.COMPILER_BACKEND``). Models and protocols are cloned by
+        the constructor, but should not be changed until the returned future
+        has completed.
+        """
+        return _thread_pool().submit(cls, *args, **kwargs)
+
+    @classmethod
+    def build_many(cls, models, *args, **kwargs):
+        """
+        Creates and returns a list of objects of this class, one for each
+        model in the sequence ``models``, compiling their back-ends in
+        parallel.
+
+        Any further arguments are passed on to the constructor, so that each
+        object is created with ``cls(model, *args, **kwargs)``. The number of
+        worker processes can be set with a keyword argument ``processes``; if
+        not set, the number of CPUs is used.
+
+        If compiled modules are cached (see :class:`myokit.ModuleCache`), the
+        back-ends are compiled in a pool of worker processes, after which the
+        objects are created in the current process from the cache. If caching
+        is disabled, the objects are created in a pool of threads instead.
+        """
+        processes = kwargs.pop('processes', None)
+        if processes is not None:
+            processes = int(processes)
+            if processes < 1:
+                raise ValueError('Number of processes must be at least 1.')
+        models = list(models)
+
+        if not myokit.CACHE_COMPILED_MODULES or len(models) < 2:
+            futures = [cls.build_async(m, *args, **kwargs) for m in models]
+            return [f.result() for f in futures]
+
+        # Models are sent to the workers in serialised form. The generated
+        # code (and so the cache key) depends on the order in which a model
+        # stores its variables, so the same form is used in this process.
+        models = [pickle.loads(pickle.dumps(m)) for m in models]
+
+        # Compile in worker processes, which store the results in the cache
+        import concurrent.futures
+        settings = dict([(x, getattr(myokit, x)) for x in _WORKER_SETTINGS])
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = [
+                pool.submit(_build_worker, cls, settings, m, args, kwargs)
+                for m in models]
+            for f in futures:
+                f.result()
+
+        # Create objects, loading their modules from the cache
+        return [cls(m, *args, **kwargs) for m in models]
+
     def _code(self, tpl, tpl_vars, line_numbers=False):  # pragma: no cover
         """
         Returns the code that would be created by the equivalent call to
@@ -85,7 +189,7 @@ class CModule(object):
             return self._export(tpl, tpl_vars)
 
     def _compile(self, name, tpl, tpl_vars, libs, libd=None, incd=None,
-                 carg=None, larg=None):
+                 carg=None, larg=None, cache=True, profile=None):
         """
         Compiles a source template into a module and returns it.
 
@@ -99,32 +203,58 @@ class CModule(object):
         type ``libs``. Library dirs and include dirs can be passed in using
         ``libd`` and ``incd``. Extra compiler arguments can be given in the
         list ``carg``, and linker args in ``larg``.
+
+        The optimisation profile to use can be set with ``profile``. If not
+        set, the value of ``myokit.OPTIMISATION_PROFILE`` is used. The compiler
+        arguments for the selected profile are added before any arguments in
+        ``carg``, and so become part of the cache key (see below).
+
+        If ``cache=True`` and ``myokit.CACHE_COMPILED_MODULES`` is set, the
+        compiled module is stored in a :class:`myokit.ModuleCache`, and any
+        existing module with the same source and compilation settings is
+        loaded from that cache instead of being recompiled.
         """
+        # Ensure headers can be read from myokit/_sim
+        if incd is None:
+            incd = []
+        incd.append(myokit.DIR_CFUNC)
+
+        # Inputs must all be strings
+        name = str(name)
+        incd = [str(x) for x in incd]
+        libd = None if libd is None else [str(x) for x in libd]
+        libs = None if libs is None else [str(x) for x in libs]
+        carg = None if carg is None else [str(x) for x in carg]
+        pargs = _profile_arguments(profile)
+        if pargs:
+            carg = pargs + (carg or [])
+        larg = None if larg is None else [str(x) for x in larg]
+
+        # Generate source code
+        source = self._export(tpl, tpl_vars)
+
+        # Check the module cache
+        module_cache = key = None
+        if cache and myokit.CACHE_COMPILED_MODULES:
+            module_cache = myokit.ModuleCache()
+            key = module_cache.key(
+                name, source, self._source_file(), libs, libd, incd, carg,
+                larg)
+            module = self._load_cached(module_cache, key)
+            if module is not None:
+                return module
+
         src_file = self._source_file()
-        working_dir = os.getcwd()
         d_cache = tempfile.mkdtemp('myokit')
         try:
             # Create output directories
             d_build = os.path.join(d_cache, 'build')
             os.makedirs(d_build)
 
-            # Export c file
-            src_file = os.path.join(d_cache, src_file)
-            self._export(tpl, tpl_vars, src_file)
-
-            # Ensure headers can be read from myokit/_sim
-            if incd is None:
-                incd = []
-            incd.append(myokit.DIR_CFUNC)
-
-            # Inputs must all be strings
-            name = str(name)
-            src_file = str(src_file)
-            incd = [str(x) for x in incd]
-            libd = None if libd is None else [str(x) for x in libd]
-            libs = None if libs is None else [str(x) for x in libs]
-            carg = None if carg is None else [str(x) for x in carg]
-            larg = None if larg is None else [str(x) for x in larg]
+            # Write c file
+            src_file = str(os.path.join(d_cache, src_file))
+            with open(src_file, 'w') as f:
+                f.write(source)
 
             # Uncomment to debug C89 issues
             '''
@@ -173,54 +303,158 @@ class CModule(object):
                     except AttributeError:
                         pass
 
-            # Create extension
-            ext = Extension(
-                name,
-                sources=[src_file],
-                libraries=libs,
-                library_dirs=libd,
-                runtime_library_dirs=runtime,
-                include_dirs=incd,
-                extra_compile_args=carg,
-                extra_link_args=larg,
-            )
-
-            # Compile in build directory, catch output
-            with myokit.SubCapture() as s:
+            # Compile, using the direct backend if possible
+            backend = str(myokit.COMPILER_BACKEND).strip().lower()
+            if backend not in ('auto', 'direct', 'setuptools'):
+                raise ValueError(
+                    'Unknown compiler backend: ' + str(backend) + '. Expecting'
+                    ' "auto", "direct", or "setuptools".')
+            built = False
+            if backend != 'setuptools':
+                if _direct_supported():
+                    try:
+                        self._build_direct(
+                            name, src_file, d_build, libs, libd, runtime,
+                            incd, carg, larg)
+                        built = True
+                    except myokit.CompilationError:
+                        if backend == 'direct':
+                            raise
+                        log = logging.getLogger(__name__)
+                        log.info(
+                            'Direct compilation failed, falling back to'
+                            ' setuptools.')
+                elif backend == 'direct':   # pragma: no linux cover
+                    raise myokit.CompilationError(
+                        'The direct compiler backend is not supported on this'
+                        ' platform.')
+            if not built:
+                self._build_setuptools(
+                    name, src_file, d_build, libs, libd, runtime, incd, carg,
+                    larg)
+
+            # Store in cache
+            if module_cache is not None:
                 try:
-                    os.chdir(d_build)
-                    setup(
-                        name=name,
-                        description='Temporary module',
-                        ext_modules=[ext],
-                        script_args=[
-                            str('build_ext'),
-                            str('--inplace'),
-                        ])
-                except (Exception, SystemExit) as e:    # pragma: no cover
-                    s.disable()
-                    t = ['Unable to compile.', 'Error message:']
-                    t.append(str(e))
-                    t.append('Error traceback')
-                    t.append(traceback.format_exc())
-                    t.append('Compiler output:')
-                    captured = s.text().strip()
-                    t.extend(['    ' + x for x in captured.splitlines()])
-                    raise myokit.CompilationError('\n'.join(t))
+                    module_cache.store(key, name, d_build)
+                except (IOError, OSError, ValueError) as e:  # pragma: no cover
+                    log = logging.getLogger(__name__)
+                    log.warning('Unable to cache compiled module: ' + str(e))
 
             # Include module (and refresh in case 2nd model is loaded)
             return load_module(name, d_build)
 
         finally:
-            # Revert changes to working directory
-            os.chdir(working_dir)
-
             # Delete cached module
             try:
                 myokit._rmtree(d_cache)
             except Exception:   # pragma: no cover
                 pass
 
+    def _load_cached(self, module_cache, key):
+        """
+        Loads and returns a module stored in the given ``module_cache`` under
+        the given ``key``, or returns ``None`` if no such module is found.
+        """
+        d_cache = tempfile.mkdtemp('myokit')
+        try:
+            name = module_cache.fetch(key, d_cache)
+            if name is None:
+                return None
+            try:
+                return load_module(name, d_cache)
+            except ImportError as e:    # pragma: no cover
+                log = logging.getLogger(__name__)
+                log.warning('Unable to load cached module: ' + str(e))
+                return None
+        finally:
+            try:
+                myokit._rmtree(d_cache)
+            except Exception:   # pragma: no cover
+                pass
+
+    def _build_direct(self, name, src_file, d_build, libs, libd, runtime,
+                      incd, carg, larg):
+        """
+        Compiles the C or C++ file ``src_file`` into a Python extension named
+        ``name``, stored in the directory ``d_build``, by calling the compiler
+        and linker directly.
+
+        The compiler, linker, and flags are the same ones that distutils and
+        setuptools would use, and are obtained from ``sysconfig`` and from the
+        environment variables ``CC``, ``CXX``, ``CFLAGS``, ``CPPFLAGS``,
+        ``LDSHARED``, and ``LDFLAGS``.
+        """
+        cpp = os.path.splitext(src_file)[1] != '.c'
+        cc, cxx, ldshared, cflags = _direct_commands()
+
+        # Compile
+        obj_file = os.path.splitext(src_file)[0] + '.o'
+        cmd = list(cc) + cflags
+        cmd.extend(['-I' + x for x in incd])
+        cmd.extend(['-I' + x for x in _python_includes()])
+        cmd.extend(['-c', src_file, '-o', obj_file])
+        cmd.extend(carg or [])
+        _run_compiler(cmd, d_build)
+
+        # Link
+        cmd = list(ldshared)
+        if cpp:
+            cmd[0] = cxx[0]
+        cmd.append(obj_file)
+        cmd.extend(['-L' + x for x in (libd or [])])
+        if platform.system() != 'Darwin':   # pragma: no osx cover
+            cmd.extend(['-Wl,-rpath,' + x for x in (runtime or [])])
+        cmd.extend(['-l' + x for x in (libs or [])])
+        cmd.extend(larg or [])
+        cmd.extend(['-o', os.path.join(d_build, name + _ext_suffix())])
+        _run_compiler(cmd, d_build)
+
+    def _build_setuptools(self, name, src_file, d_build, libs, libd, runtime,
+                          incd, carg, larg):
+        """
+        Compiles the C or C++ file ``src_file`` into a Python extension named
+        ``name``, stored in the directory ``d_build``, using setuptools.
+        """
+        # Create extension
+        ext = Extension(
+            name,
+            sources=[src_file],
+            libraries=libs,
+            library_dirs=libd,
+            runtime_library_dirs=runtime,
+            include_dirs=incd,
+            extra_compile_args=carg,
+            extra_link_args=larg,
+        )
+
+        # Compile into the build directory, catch output. Instead of calling
+        # setup(), which reads configuration files from the current working
+        # directory, the build_ext command is configured and run directly.
+        # The output capturing affects the whole process, so only one module
+        # is compiled this way at a time.
+        with _lock, myokit.SubCapture() as s:
+            try:
+                dist = Distribution({
+                    'name': name,
+                    'description': 'Temporary module',
+                    'ext_modules': [ext],
+                })
+                cmd = dist.get_command_obj('build_ext')
+                cmd.build_lib = d_build
+                cmd.build_temp = os.path.join(d_build, 'temp')
+                dist.run_command('build_ext')
+            except (Exception, SystemExit) as e:    # pragma: no cover
+                s.disable()
+                t = ['Unable to compile.', 'Error message:']
+                t.append(str(e))
+                t.append('Error traceback')
+                t.append(traceback.format_exc())
+                t.append('Compiler output:')
+                captured = s.text().strip()
+                t.extend(['    ' + x for x in captured.splitlines()])
+                raise myokit.CompilationError('\n'.join(t))
+
     def _export(self, source, varmap, target=None):
         """
         Exports the given ``source`` to the file ``target`` using the variable
@@ -244,9 +478,12 @@ class CModule(object):
         if target is not None:
             p.set_output_stream(handle)
 
+        # Templates write to sys.stdout, so only one can be processed at a
+        # time
         try:
             result = None
-            result = p.process(source, varmap)
+            with _lock:
+                result = p.process(source, varmap)
         except pype.PypeError:  # pragma: no cover
             # Not included in cover, because this can only happen if the
             # template code is wrong, i.e. during development.
@@ -262,6 +499,69 @@ class CModule(object):
 
         return result
 
+    def _log_buffers(self, log):
+        """
+        Returns a dict mapping each key in the :class:`myokit.DataLog` ``log``
+        to an empty ``bytearray``.
+
+        Generated modules use these as growable buffers of C ``double``
+        values, which can be added to the log with :meth:`_merge_log_buffers`
+        after the simulation has run.
+        """
+        return dict((key, bytearray()) for key in log.keys())
+
+    def _flush_log_buffers(self, log, buffers, sink, final=False):
+        """
+        Writes the data in the ``buffers`` created by :meth:`_log_buffers` to
+        a ``sink`` (e.g. a :class:`myokit.DataLogWriter`), and empties the
+        buffers.
+
+        To keep the number of calls to the sink low, data is only written once
+        the buffers contain at least ``LOG_SINK_CHUNK_SIZE`` bytes, unless
+        ``final=True`` is set. The data is passed to the sink's ``write``
+        method as a :class:`myokit.DataLog` with the same keys and time key as
+        ``log``.
+
+        With ``final=True`` the sink is always written to, even if the buffers
+        are empty, so that sinks such as :class:`myokit.DataLogWriter` learn
+        the log's keys even if no data was logged.
+        """
+        if not final:
+            size = max([len(x) for x in buffers.values()] or [0])
+            if size < LOG_SINK_CHUNK_SIZE:
+                return
+        chunk = myokit.DataLog(time=log.time_key())
+        for key in log.keys():
+            # Copy data, as the buffers are re-used
+            chunk[key] = np.frombuffer(buffers[key], dtype=np.float64).copy()
+            del buffers[key][:]
+        sink.write(chunk)
+
+    def _merge_log_buffers(self, log, buffers):
+        """
+        Adds the data in the ``buffers`` created by :meth:`_log_buffers` to
+        ``log``, as NumPy arrays.
+
+        Log entries that were empty are replaced by arrays that share their
+        memory with the buffer, while entries that already contained data are
+        extended. The precision of floating point entries, and of empty entries
+        with a typecode (e.g. ``array.array('f')``), is preserved.
+        """
+        for key, buffer in buffers.items():
+            if len(buffer) == 0:
+                data = np.zeros((0, ))
+            else:
+                data = np.frombuffer(buffer, dtype=np.float64)
+            old = log[key]
+            if len(old) == 0:
+                typecode = getattr(old, 'typecode', 'd')
+                log[key] = data if typecode == 'd' else data.astype(typecode)
+            else:
+                old = np.asarray(old)
+                if np.issubdtype(old.dtype, np.floating):
+                    data = data.astype(old.dtype)
+                log[key] = np.concatenate((old, data))
+
     def _source_file(self):
         """
         Returns a name for the source file created and compiled for this
@@ -277,3 +577,148 @@ class CppModule(CModule):
     def _source_file(self):
         return 'source.cpp'
 
+
+def _build_worker(cls, settings, model, args, kwargs):
+    """
+    Creates an object of class ``cls`` in a worker process, so that its
+    compiled module is stored in the module cache (see
+    :meth:`CModule.build_many`).
+    """
+    # Use the same settings as the parent process
+    for key, value in settings.items():
+        setattr(myokit, key, value)
+    cls(model, *args, **kwargs)
+
+
+def _direct_commands():
+    """
+    Returns a tuple ``(cc, cxx, ldshared, cflags)`` with the commands (as lists
+    of strings) used by the direct compiler backend. This mimics the
+    ``customize_compiler`` method used by distutils.
+    """
+    cc, cxx, cflags, ccshared, ldshared = sysconfig.get_config_vars(
+        'CC', 'CXX', 'CFLAGS', 'CCSHARED', 'LDSHARED')
+    cflags = cflags or ''
+    env = os.environ
+    if 'CC' in env:
+        new_cc = env['CC']
+        if 'LDSHARED' not in env and ldshared.startswith(cc):
+            ldshared = new_cc + ldshared[len(cc):]
+        cc = new_cc
+    if 'CXX' in env:
+        cxx = env['CXX']
+    if 'LDSHARED' in env:
+        ldshared = env['LDSHARED']
+    if 'CFLAGS' in env:
+        cflags = cflags + ' ' + env['CFLAGS']
+        ldshared = ldshared + ' ' + env['CFLAGS']
+    if 'CPPFLAGS' in env:
+        cflags = cflags + ' ' + env['CPPFLAGS']
+        ldshared = ldshared + ' ' + env['CPPFLAGS']
+    if 'LDFLAGS' in env:
+        ldshared = ldshared + ' ' + env['LDFLAGS']
+    cflags = shlex.split(cflags) + shlex.split(ccshared or '')
+    return (
+        shlex.split(cc), shlex.split(cxx or cc), shlex.split(ldshared), cflags)
+
+
+def _direct_supported():
+    """
+    Returns ``True`` if the direct compiler backend can be used on this
+    system.
+    """
+    if platform.system() == 'Windows':  # pragma: no linux cover
+        return False
+    cc, ldshared = sysconfig.get_config_vars('CC', 'LDSHARED')
+    return bool(cc and ldshared)
+
+
+def _ext_suffix():
+    """
+    Returns the file extension used for compiled Python extensions.
+    """
+    suffix = sysconfig.get_config_var('EXT_SUFFIX')
+    if suffix is None:  # pragma: no python 3 cover
+        suffix = sysconfig.get_config_var('SO')
+    return suffix
+
+
+def _profile_arguments(profile=None):
+    """
+    Returns a list of compiler arguments for the optimisation profile with the
+    given name, or for ``myokit.OPTIMISATION_PROFILE`` if no name is given.
+    """
+    if profile is None:
+        profile = myokit.OPTIMISATION_PROFILE
+    profile = str(profile).strip().lower()
+    if profile not in OPTIMISATION_PROFILES:
+        raise ValueError(
+            'Unknown optimisation profile: ' + str(profile) + '. Expecting one'
+            ' of ' + ', '.join(['"' + x + '"' for x in OPTIMISATION_PROFILES])
+            + '.')
+    if profile == 'default':
+        return []
+
+    if platform.system() == 'Windows':  # pragma: no linux cover
+        # Visual C++ has no option to target the current processor
+        args = ['/O2']
+        if profile == 'fast-math':
+            args.append('/fp:fast')
+        return args
+
+    args = ['-O3']
+    if profile in ('native', 'fast-math'):
+        if platform.machine().lower() in ('arm64', 'aarch64'):
+            args.append('-mcpu=native')     # pragma: no cover
+        else:
+            args.append('-march=native')
+    if profile == 'fast-math':
+        args.append('-ffast-math')
+    return args
+
+
+def _python_includes():
+    """
+    Returns a list of the directories containing the Python header files.
+    """
+    paths = sysconfig.get_paths()
+    incs = [paths['include']]
+    if paths['platinclude'] != paths['include']:    # pragma: no cover
+        incs.append(paths['platinclude'])
+    return incs
+
+
+def _thread_pool():
+    """
+    Returns the thread pool used by :meth:`CModule.build_async`.
+    """
+    global _thread_pool_executor
+    with _lock:
+        if _thread_pool_executor is None:
+            import concurrent.futures
+            import multiprocessing
+            _thread_pool_executor = concurrent.futures.ThreadPoolExecutor(
+                multiprocessing.cpu_count())
+    return _thread_pool_executor
+
+
+def _run_compiler(cmd, cwd):
+    """
+    Runs a compiler or linker command ``cmd`` in the directory ``cwd``, and
+    raises a :class:`myokit.CompilationError` if it fails.
+    """
+    try:
+        p = subprocess.Popen(
+            cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0]
+        code = p.returncode
+    except OSError as e:
+        output = str(e)
+        code = None
+    if code != 0:
+        if not isinstance(output, str):
+            output = output.decode('utf-8', 'replace')
+        t = ['Unable to compile.', 'Command:', '    ' + ' '.join(cmd)]
+        t.append('Compiler output:')
+        t.extend(['    ' + x for x in output.strip().splitlines()])
+        raise myokit.CompilationError('\n'.join(t))
@@ -0,0 +1,724 @@
+<?
+# adjoint.c
+#
+# A pype template for a single cell CVODES-based calculation of a
+# least-squares error and its gradient, using adjoint sensitivities.
+#
+# Required variables
+# -----------------------------------------------------------------------------
+# module_name A module name
+# model       A myokit model
+# output      The variable to compare with the data
+# parameters  A list of literal constants to calculate the gradient for
+# adjoint     A list of reverse-mode equations (see adjoint._adjoint_equations)
+# -----------------------------------------------------------------------------
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+import myokit
+import myokit.formats.ansic as ansic
+
+# Get model
+model.reserve_unique_names(*ansic.keywords)
+model.create_unique_names()
+
+# Get expression writer
+w = ansic.AnsiCExpressionWriter()
+
+# Define name of the field used to store a variable in the ModelData struct
+def field(var):
+    if var.is_constant():
+        return 'AC_' + var.uname()
+    else:
+        return 'AV_' + var.uname()
+
+# Define lhs function
+def v(var):
+    # Explicitly asking for derivative?
+    if isinstance(var, myokit.Derivative):
+        return 'NV_Ith_S(ydot, ' + str(var.var().indice()) + ')'
+    # Name given? get variable object from name
+    if isinstance(var, myokit.Name):
+        var = var.var()
+    # Handle states
+    if var.is_state():
+        return 'NV_Ith_S(y, ' + str(var.indice()) + ')'
+    # Handle constants and intermediary variables
+    return 'd->' + field(var)
+w.set_lhs_function(v)
+
+# Define name of the local variable used to store the adjoint of an lhs
+def b(lhs):
+    if isinstance(lhs, myokit.Derivative):
+        return 'BD_' + lhs.var().uname()
+    return 'B_' + lhs.var().uname()
+
+# Tab
+tab = '    '
+
+# Get mapping of bound variables to internal refs, set the RHS of unbound
+# variables to zero and remove any unsupported bindings.
+bound_variables = model.prepare_bindings({
+    'time' : 't',
+    'pace' : 'd->pace',
+    })
+
+# Get equations
+equations = model.solvable_order()
+
+# Get all adjoint variables
+states = list(model.states())
+adjoints = set([myokit.Name(x) for x in states])
+adjoints.update([x.lhs() for x in states])
+adjoints.update([myokit.Name(p) for p in parameters])
+adjoints.add(myokit.Name(output))
+for lhs, terms in adjoint:
+    adjoints.add(lhs)
+    adjoints.update([ref for ref, partial in terms])
+adjoints = sorted(adjoints, key=b)
+?>
+#include <Python.h>
+#include <stdio.h>
+#include <math.h>
+#include <string.h>
+#define MYOKIT_SUNDIALS_VERSION <?= myokit.SUNDIALS_VERSION ?>
+
+#include <cvodes/cvodes.h>
+#include <nvector/nvector_serial.h>
+#if MYOKIT_SUNDIALS_VERSION >= 30000
+    #include <sunmatrix/sunmatrix_dense.h>
+    #include <sunlinsol/sunlinsol_dense.h>
+    #include <cvodes/cvodes_direct.h>
+#else
+    #include <cvodes/cvodes_dense.h>
+#endif
+#include <sundials/sundials_types.h>
+#include "pacing.h"
+
+#define N_STATE <?= model.count_states() ?>
+#define N_PARAM <?= len(parameters) ?>
+
+/* Maximum number of solver steps between two output points */
+static long max_steps = 100000;
+
+/* Number of forward steps between two checkpoints */
+static long checkpoint_steps = 100;
+
+/*
+ * Model variables and pacing inputs.
+ */
+typedef struct {
+    realtype pace;          /* Pacing level */
+    Py_ssize_t n_pace;      /* Number of event-based pacing levels */
+    realtype* pace_times;   /* Time each event-based pacing level starts */
+    realtype* pace_levels;  /* Event-based pacing levels */
+    FSys fpacing;           /* Fixed-form pacing system, or NULL */
+    N_Vector ydot;          /* Used to store derivatives when calculating adjoints */
+    realtype xb[N_STATE];   /* Used to store state adjoints in the backward problem */
+    realtype pb[N_PARAM];   /* Used to store parameter adjoints in the backward problem */
+<?
+for var in model.variables(state=False, deep=True):
+    print(tab + 'realtype ' + field(var) + ';')
+?>} ModelData;
+
+/*
+ * Set the initial values of all model variables with a literal value
+ */
+static void
+initLiterals(ModelData* d)
+{
+    d->pace = 0;
+    d->n_pace = 0;
+    d->pace_times = NULL;
+    d->pace_levels = NULL;
+    d->fpacing = NULL;
+    d->ydot = NULL;
+<?
+for var in model.variables(state=False, deep=True):
+    if var.is_literal():
+        print(tab + v(var) + ' = ' + myokit.strfloat(var.rhs().eval()) + ';')
+?>}
+
+/*
+ * Set the parameter values
+ */
+static void
+setParameters(ModelData* d, realtype* p)
+{
+<?
+for k, p in enumerate(parameters):
+    print(tab + v(p) + ' = p[' + str(k) + '];')
+?>}
+
+/*
+ * Set values of calculated constants
+ */
+static void
+updateConstants(ModelData* d)
+{
+<?
+for label, eqs in equations.items():
+    for eq in eqs.equations(const=True):
+        if not eq.rhs.is_literal():
+            print(tab + w.eq(eq) + ';')
+?>}
+
+/*
+ * Sets the pacing level for time t.
+ *
+ * The solvers revisit earlier times when solving the adjoint system, so the
+ * pacing level is looked up from a precalculated list of levels instead of
+ * being updated as time progresses. At the time an event starts or ends, the
+ * new level is used.
+ */
+static int
+updatePacing(ModelData* d, realtype t)
+{
+    Py_ssize_t lo, hi, mid;
+    FSys_Flag flag_fpacing;
+    if (d->fpacing != NULL) {
+        d->pace = FSys_GetLevel(d->fpacing, t, &flag_fpacing);
+        return flag_fpacing != FSys_OK;
+    }
+    if (d->n_pace > 0) {
+        /* Find the last level starting at or before t */
+        lo = 0;
+        hi = d->n_pace;
+        while (hi - lo > 1) {
+            mid = (lo + hi) / 2;
+            if (d->pace_times[mid] <= t) {
+                lo = mid;
+            } else {
+                hi = mid;
+            }
+        }
+        d->pace = d->pace_levels[lo];
+    }
+    return 0;
+}
+
+/*
+ * Right-hand-side function of the model ODE
+ */
+static int
+rhs(realtype t, N_Vector y, N_Vector ydot, void *f_data)
+{
+    ModelData* d = (ModelData*)f_data;
+    if (updatePacing(d, t)) return -1;
+<?
+for label, eqs in equations.items():
+    if eqs.has_equations(const=False):
+        print(tab + '/* ' + label + ' */')
+        for eq in eqs.equations(const=False):
+            var = eq.lhs.var()
+            try:
+                print(tab + v(var) + ' = ' + bound_variables[var] + ';')
+            except KeyError:
+                print(tab + w.eq(eq) + ';')
+        print(tab)
+?>
+    return 0;
+}
+
+/*
+ * Returns the value of the output variable, after a call to rhs()
+ */
+static realtype
+output(N_Vector y, ModelData* d)
+{
+    return <?= v(output) ?>;
+}
+
+/*
+ * Calculates the vector-Jacobian products
+ *
+ *   xb = yb^T df/dx + ob * dg/dx
+ *   pb = yb^T df/dp + ob * dg/dp
+ *
+ * where f is the model's right-hand side function, g is the output variable,
+ * x is the state, and p are the parameters. Uses reverse-mode automatic
+ * differentiation, so that the cost does not depend on the number of
+ * parameters.
+ */
+static int
+vjp(realtype t, N_Vector y, realtype* yb, realtype ob, realtype* xb, realtype* pb, ModelData* d)
+{
+    N_Vector ydot = d->ydot;
+<?
+for lhs in adjoints:
+    print(tab + 'realtype ' + b(lhs) + ' = 0;')
+?>
+    /* Evaluate model variables */
+    if (rhs(t, y, ydot, d)) return -1;
+
+    /* Seed adjoints */
+<?
+for i, x in enumerate(states):
+    print(tab + b(x.lhs()) + ' = yb[' + str(i) + '];')
+print(tab + b(myokit.Name(output)) + ' += ob;')
+?>
+    /* Reverse sweep */
+<?
+for lhs, terms in adjoint:
+    for ref, partial in terms:
+        print(tab + b(ref) + ' += (' + w.ex(partial) + ') * ' + b(lhs) + ';')
+?>
+    /* Store results */
+<?
+for i, x in enumerate(states):
+    print(tab + 'xb[' + str(i) + '] = ' + b(myokit.Name(x)) + ';')
+for k, p in enumerate(parameters):
+    print(tab + 'pb[' + str(k) + '] = ' + b(myokit.Name(p)) + ';')
+?>
+    return 0;
+}
+
+/*
+ * Right-hand-side function of the adjoint ODE: dyB/dt = -(df/dx)^T yB
+ */
+static int
+rhsB(realtype t, N_Vector y, N_Vector yB, N_Vector yBdot, void *f_data)
+{
+    int i;
+    ModelData* d = (ModelData*)f_data;
+    if (vjp(t, y, NV_DATA_S(yB), 0, d->xb, d->pb, d)) return -1;
+    for (i=0; i<N_STATE; i++) {
+        NV_Ith_S(yBdot, i) = -d->xb[i];
+    }
+    return 0;
+}
+
+/*
+ * Right-hand-side function of the quadratures: dqB/dt = -(df/dp)^T yB
+ */
+static int
+rhsQB(realtype t, N_Vector y, N_Vector yB, N_Vector qBdot, void *f_data)
+{
+    int i;
+    ModelData* d = (ModelData*)f_data;
+    if (vjp(t, y, NV_DATA_S(yB), 0, d->xb, d->pb, d)) return -1;
+    for (i=0; i<N_PARAM; i++) {
+        NV_Ith_S(qBdot, i) = -d->pb[i];
+    }
+    return 0;
+}
+
+/*
+ * Error handler for CVODES: errors are reported through the returned flags,
+ * so the messages are ignored.
+ */
+static void
+cvode_error_handler(int error_code, const char *module, const char *function, char *msg, void *eh_data)
+{
+}
+
+/*
+ * Checks a flag returned by a CVODES function, and sets a Python error if it
+ * indicates failure. Returns 1 if an error was set, 0 otherwise.
+ */
+static int
+check_flag(int flag, const char* funcname)
+{
+    char str[200];
+    if (flag < 0) {
+        sprintf(str, "Function %s() failed with flag %d.", funcname, flag);
+        PyErr_SetString(PyExc_ArithmeticError, str);
+        return 1;
+    }
+    return 0;
+}
+
+/*
+ * Calculates the pacing levels for an event-based protocol in the interval
+ * [tmin, tmax], and stores them in d. Returns 0 if successful.
+ */
+static int
+createPacing(ModelData* d, PyObject* protocol, realtype tmin, realtype tmax)
+{
+    ESys epacing;
+    ESys_Flag flag_epacing;
+    Py_ssize_t n = 16;
+    realtype t = tmin;
+    realtype* x;
+
+    epacing = ESys_Create(&flag_epacing);
+    if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); return -1; }
+    flag_epacing = ESys_Populate(epacing, protocol);
+    if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto error; }
+    d->pace_times = (realtype*)malloc(n * sizeof(realtype));
+    d->pace_levels = (realtype*)malloc(n * sizeof(realtype));
+    if (d->pace_times == NULL || d->pace_levels == NULL) goto memory_error;
+    while (1) {
+        flag_epacing = ESys_AdvanceTime(epacing, t);
+        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto error; }
+        if (d->n_pace == n) {
+            n *= 2;
+            x = (realtype*)realloc(d->pace_times, n * sizeof(realtype));
+            if (x == NULL) goto memory_error;
+            d->pace_times = x;
+            x = (realtype*)realloc(d->pace_levels, n * sizeof(realtype));
+            if (x == NULL) goto memory_error;
+            d->pace_levels = x;
+        }
+        d->pace_times[d->n_pace] = t;
+        d->pace_levels[d->n_pace] = ESys_GetLevel(epacing, NULL);
+        d->n_pace++;
+        t = ESys_GetNextTime(epacing, NULL);
+        if (t >= tmax || ESys_eq(t, tmax)) break;
+    }
+    ESys_Destroy(epacing);
+    return 0;
+
+memory_error:
+    PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for pacing levels.");
+error:
+    ESys_Destroy(epacing);
+    return -1;
+}
+
+/*
+ * Calculates the sum-of-squares error and its gradient.
+ */
+static PyObject*
+adj_evaluate(PyObject *self, PyObject *args)
+{
+    double tmin, abs_tol, rel_tol, dt_max, dt_min;
+    PyObject *state_in, *params_in, *eprotocol, *fprotocol, *times_in, *values_in;
+    PyObject *gradient, *result;
+    ModelData data;
+    ModelData* d = &data;
+    Py_ssize_t i, j, k, n, ip;
+    realtype p[N_PARAM];
+    realtype xb[N_STATE];
+    realtype pb[N_PARAM];
+    realtype zero[N_STATE];
+    realtype grad[N_PARAM];
+    realtype* times = NULL;
+    realtype* values = NULL;
+    realtype* residuals = NULL;
+    realtype* states = NULL;
+    realtype t, tout, error;
+    void* cvode_mem = NULL;
+    N_Vector y = NULL;
+    N_Vector yB = NULL;
+    N_Vector qB = NULL;
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    SUNMatrix matrix = NULL;
+    SUNLinearSolver solver = NULL;
+    SUNMatrix matrixB = NULL;
+    SUNLinearSolver solverB = NULL;
+    #endif
+    FSys_Flag flag_fpacing;
+    int ncheck;
+    int which = 0;
+    int initB = 0;
+    int success = 0;
+
+    #ifndef SUNDIALS_DOUBLE_PRECISION
+    PyErr_SetString(PyExc_Exception, "Sundials must be compiled with double precision.");
+    return 0;
+    #endif
+
+    /* Check input arguments */
+    if (!PyArg_ParseTuple(args, "dOOOOOOdddd",
+            &tmin, &state_in, &params_in, &eprotocol, &fprotocol,
+            &times_in, &values_in, &abs_tol, &rel_tol, &dt_max, &dt_min)) {
+        PyErr_SetString(PyExc_Exception, "Incorrect input arguments.");
+        return 0;
+    }
+    if (!PyList_Check(state_in) || PyList_Size(state_in) != N_STATE) {
+        PyErr_SetString(PyExc_Exception, "'state_in' must be a list of size N_STATE.");
+        return 0;
+    }
+    if (!PyList_Check(params_in) || PyList_Size(params_in) != N_PARAM) {
+        PyErr_SetString(PyExc_Exception, "'parameters' must be a list of size N_PARAM.");
+        return 0;
+    }
+    if (!PyList_Check(times_in) || !PyList_Check(values_in)) {
+        PyErr_SetString(PyExc_Exception, "'times' and 'values' must be lists.");
+        return 0;
+    }
+    n = PyList_Size(times_in);
+    if (n < 1 || PyList_Size(values_in) != n) {
+        PyErr_SetString(PyExc_Exception, "'times' and 'values' must be non-empty lists of the same size.");
+        return 0;
+    }
+
+    /* Set up model data */
+    initLiterals(d);
+    for (i=0; i<N_PARAM; i++) {
+        p[i] = PyFloat_AsDouble(PyList_GetItem(params_in, i));
+    }
+    setParameters(d, p);
+    updateConstants(d);
+    for (i=0; i<N_STATE; i++) {
+        zero[i] = 0;
+    }
+    for (i=0; i<N_PARAM; i++) {
+        grad[i] = 0;
+    }
+
+    /* Copy data, and allocate space for the residuals and states at every
+       data point */
+    times = (realtype*)malloc(n * sizeof(realtype));
+    values = (realtype*)malloc(n * sizeof(realtype));
+    residuals = (realtype*)malloc(n * sizeof(realtype));
+    states = (realtype*)malloc(n * N_STATE * sizeof(realtype));
+    if (times == NULL || values == NULL || residuals == NULL || states == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for data.");
+        goto finish;
+    }
+    for (k=0; k<n; k++) {
+        times[k] = PyFloat_AsDouble(PyList_GetItem(times_in, k));
+        values[k] = PyFloat_AsDouble(PyList_GetItem(values_in, k));
+    }
+    if (PyErr_Occurred()) goto finish;
+
+    /* Set up pacing */
+    if (eprotocol != Py_None) {
+        if (createPacing(d, eprotocol, tmin, times[n - 1])) goto finish;
+    } else if (fprotocol != Py_None) {
+        d->fpacing = FSys_Create(&flag_fpacing);
+        if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); goto finish; }
+        flag_fpacing = FSys_Populate(d->fpacing,
+            PyTuple_GetItem(fprotocol, 0),  /* Borrowed, no decref */
+            PyTuple_GetItem(fprotocol, 1));
+        if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); goto finish; }
+    }
+
+    /* Create vectors */
+    y = N_VNew_Serial(N_STATE);
+    d->ydot = N_VNew_Serial(N_STATE);
+    yB = N_VNew_Serial(N_STATE);
+    qB = N_VNew_Serial(N_PARAM);
+    if (y == NULL || d->ydot == NULL || yB == NULL || qB == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to create vectors.");
+        goto finish;
+    }
+    for (i=0; i<N_STATE; i++) {
+        NV_Ith_S(y, i) = PyFloat_AsDouble(PyList_GetItem(state_in, i));
+        NV_Ith_S(yB, i) = 0;
+    }
+    for (i=0; i<N_PARAM; i++) {
+        NV_Ith_S(qB, i) = 0;
+    }
+    if (PyErr_Occurred()) goto finish;
+
+    /* Create solver, and allocate memory for checkpointing */
+    #if MYOKIT_SUNDIALS_VERSION >= 40000
+        cvode_mem = CVodeCreate(CV_BDF);
+    #else
+        cvode_mem = CVodeCreate(CV_BDF, CV_NEWTON);
+    #endif
+    if (cvode_mem == NULL) {
+        PyErr_SetString(PyExc_Exception, "Function CVodeCreate() failed.");
+        goto finish;
+    }
+    if (check_flag(CVodeSetErrHandlerFn(cvode_mem, cvode_error_handler, NULL), "CVodeSetErrHandlerFn")) goto finish;
+    if (check_flag(CVodeInit(cvode_mem, rhs, tmin, y), "CVodeInit")) goto finish;
+    if (check_flag(CVodeSStolerances(cvode_mem, RCONST(rel_tol), RCONST(abs_tol)), "CVodeSStolerances")) goto finish;
+    if (check_flag(CVodeSetUserData(cvode_mem, d), "CVodeSetUserData")) goto finish;
+    if (check_flag(CVodeSetMaxNumSteps(cvode_mem, max_steps), "CVodeSetMaxNumSteps")) goto finish;
+    if (check_flag(CVodeSetMaxStep(cvode_mem, dt_max), "CVodeSetMaxStep")) goto finish;
+    if (check_flag(CVodeSetMinStep(cvode_mem, dt_min), "CVodeSetMinStep")) goto finish;
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    matrix = SUNDenseMatrix(N_STATE, N_STATE);
+    if (matrix == NULL) { PyErr_SetString(PyExc_Exception, "Function SUNDenseMatrix() failed."); goto finish; }
+    solver = SUNDenseLinearSolver(y, matrix);
+    if (solver == NULL) { PyErr_SetString(PyExc_Exception, "Function SUNDenseLinearSolver() failed."); goto finish; }
+    if (check_flag(CVDlsSetLinearSolver(cvode_mem, solver, matrix), "CVDlsSetLinearSolver")) goto finish;
+    #else
+    if (check_flag(CVDense(cvode_mem, N_STATE), "CVDense")) goto finish;
+    #endif
+    if (check_flag(CVodeAdjInit(cvode_mem, checkpoint_steps, CV_HERMITE), "CVodeAdjInit")) goto finish;
+
+    /*
+     * Forward problem: calculate the residuals, and store the state at every
+     * data point. The solver is stopped at every pacing event.
+     */
+    error = 0;
+    t = tmin;
+    k = 0;
+    ip = 1;
+    while (1) {
+        /* Evaluate output at all data points at the current time */
+        while (k < n && times[k] <= t) {
+            if (rhs(t, y, d->ydot, d)) {
+                PyErr_SetString(PyExc_Exception, "Error evaluating the model's right-hand side function.");
+                goto finish;
+            }
+            residuals[k] = output(y, d) - values[k];
+            error += residuals[k] * residuals[k];
+            for (i=0; i<N_STATE; i++) {
+                states[k * N_STATE + i] = NV_Ith_S(y, i);
+            }
+            k++;
+        }
+        if (k == n) break;
+
+        /* Advance to the next data point or pacing event */
+        while (ip < d->n_pace && d->pace_times[ip] <= t) {
+            ip++;
+        }
+        tout = times[k];
+        if (ip < d->n_pace && d->pace_times[ip] < tout) {
+            tout = d->pace_times[ip];
+        }
+        if (check_flag(CVodeSetStopTime(cvode_mem, tout), "CVodeSetStopTime")) goto finish;
+        if (check_flag(CVodeF(cvode_mem, tout, y, &t, CV_NORMAL, &ncheck), "CVodeF")) goto finish;
+        t = tout;
+    }
+
+    /*
+     * Backward problem: integrate the adjoint system from the last data point
+     * to tmin, adding a jump at every data point, and restarting at every
+     * pacing event. The integral of the parameter sensitivities is
+     * calculated as a quadrature.
+     */
+    k = n - 1;
+    ip = d->n_pace - 1;
+    while (1) {
+        /* Add jumps for all data points at the current time */
+        while (k >= 0 && times[k] >= t) {
+            for (i=0; i<N_STATE; i++) {
+                NV_Ith_S(y, i) = states[k * N_STATE + i];
+            }
+            if (vjp(t, y, zero, 2 * residuals[k], xb, pb, d)) {
+                PyErr_SetString(PyExc_Exception, "Error evaluating the model's right-hand side function.");
+                goto finish;
+            }
+            for (i=0; i<N_STATE; i++) {
+                NV_Ith_S(yB, i) += xb[i];
+            }
+            for (i=0; i<N_PARAM; i++) {
+                grad[i] += pb[i];
+            }
+            k--;
+        }
+        if (t <= tmin) break;
+
+        /* Initialise or restart backward problem */
+        if (!initB) {
+            #if MYOKIT_SUNDIALS_VERSION >= 40000
+            if (check_flag(CVodeCreateB(cvode_mem, CV_BDF, &which), "CVodeCreateB")) goto finish;
+            #else
+            if (check_flag(CVodeCreateB(cvode_mem, CV_BDF, CV_NEWTON, &which), "CVodeCreateB")) goto finish;
+            #endif
+            if (check_flag(CVodeInitB(cvode_mem, which, rhsB, t, yB), "CVodeInitB")) goto finish;
+            if (check_flag(CVodeSStolerancesB(cvode_mem, which, RCONST(rel_tol), RCONST(abs_tol)), "CVodeSStolerancesB")) goto finish;
+            if (check_flag(CVodeSetUserDataB(cvode_mem, which, d), "CVodeSetUserDataB")) goto finish;
+            if (check_flag(CVodeSetMaxNumStepsB(cvode_mem, which, max_steps), "CVodeSetMaxNumStepsB")) goto finish;
+            if (check_flag(CVodeSetMaxStepB(cvode_mem, which, dt_max), "CVodeSetMaxStepB")) goto finish;
+            if (check_flag(CVodeSetMinStepB(cvode_mem, which, dt_min), "CVodeSetMinStepB")) goto finish;
+            #if MYOKIT_SUNDIALS_VERSION >= 30000
+            matrixB = SUNDenseMatrix(N_STATE, N_STATE);
+            if (matrixB == NULL) { PyErr_SetString(PyExc_Exception, "Function SUNDenseMatrix() failed."); goto finish; }
+            solverB = SUNDenseLinearSolver(yB, matrixB);
+            if (solverB == NULL) { PyErr_SetString(PyExc_Exception, "Function SUNDenseLinearSolver() failed."); goto finish; }
+            if (check_flag(CVDlsSetLinearSolverB(cvode_mem, which, solverB, matrixB), "CVDlsSetLinearSolverB")) goto finish;
+            #else
+            if (check_flag(CVDenseB(cvode_mem, which, N_STATE), "CVDenseB")) goto finish;
+            #endif
+            if (check_flag(CVodeQuadInitB(cvode_mem, which, rhsQB, qB), "CVodeQuadInitB")) goto finish;
+            if (check_flag(CVodeQuadSStolerancesB(cvode_mem, which, RCONST(rel_tol), RCONST(abs_tol)), "CVodeQuadSStolerancesB")) goto finish;
+            if (check_flag(CVodeSetQuadErrConB(cvode_mem, which, SUNTRUE), "CVodeSetQuadErrConB")) goto finish;
+            initB = 1;
+        } else {
+            if (check_flag(CVodeReInitB(cvode_mem, which, t, yB), "CVodeReInitB")) goto finish;
+            if (check_flag(CVodeQuadReInitB(cvode_mem, which, qB), "CVodeQuadReInitB")) goto finish;
+        }
+
+        /* Go back to the previous data point or pacing event */
+        tout = tmin;
+        if (k >= 0 && times[k] > tout) {
+            tout = times[k];
+        }
+        while (ip > 0 && d->pace_times[ip] >= t) {
+            ip--;
+        }
+        if (ip > 0 && d->pace_times[ip] > tout) {
+            tout = d->pace_times[ip];
+        }
+        if (check_flag(CVodeB(cvode_mem, tout, CV_NORMAL), "CVodeB")) goto finish;
+        if (check_flag(CVodeGetB(cvode_mem, which, &t, yB), "CVodeGetB")) goto finish;
+        if (check_flag(CVodeGetQuadB(cvode_mem, which, &t, qB), "CVodeGetQuadB")) goto finish;
+        t = tout;
+    }
+
+    /* Add integral to gradient */
+    for (i=0; i<N_PARAM; i++) {
+        grad[i] += NV_Ith_S(qB, i);
+    }
+    success = 1;
+
+finish:
+    /* Free memory */
+    if (cvode_mem != NULL) CVodeFree(&cvode_mem);
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    if (solver != NULL) SUNLinSolFree(solver);
+    if (matrix != NULL) SUNMatDestroy(matrix);
+    if (solverB != NULL) SUNLinSolFree(solverB);
+    if (matrixB != NULL) SUNMatDestroy(matrixB);
+    #endif
+    if (y != NULL) N_VDestroy_Serial(y);
+    if (d->ydot != NULL) N_VDestroy_Serial(d->ydot);
+    if (yB != NULL) N_VDestroy_Serial(yB);
+    if (qB != NULL) N_VDestroy_Serial(qB);
+    if (d->fpacing != NULL) FSys_Destroy(d->fpacing);
+    free(d->pace_times);
+    free(d->pace_levels);
+    free(times);
+    free(values);
+    free(residuals);
+    free(states);
+    if (!success) return 0;
+
+    /* Create return value */
+    gradient = PyTuple_New(N_PARAM);
+    if (gradient == NULL) return 0;
+    for (j=0; j<N_PARAM; j++) {
+        PyTuple_SetItem(gradient, j, PyFloat_FromDouble(grad[j]));
+        /* PyTuple_SetItem steals a reference: no need to decref the double! */
+    }
+    result = Py_BuildValue("(dN)", error, gradient);
+    return result;
+}
+
+/*
+ * Methods in this module
+ */
+static PyMethodDef AdjMethods[] = {
+    {"evaluate", adj_evaluate, METH_VARARGS, "Calculate a sum-of-squares error and its gradient."},
+    {NULL},
+};
+
+/*
+ * Module definition
+ */
+#if PY_MAJOR_VERSION >= 3
+
+    static struct PyModuleDef moduledef = {
+        PyModuleDef_HEAD_INIT,
+        "<?= module_name ?>",       /* m_name */
+        "Generated adjoint module", /* m_doc */
+        -1,                         /* m_size */
+        AdjMethods,                 /* m_methods */
+        NULL,                       /* m_reload */
+        NULL,                       /* m_traverse */
+        NULL,                       /* m_clear */
+        NULL,                       /* m_free */
+    };
+
+    PyMODINIT_FUNC PyInit_<?=module_name?>(void) {
+        return PyModule_Create(&moduledef);
+    }
+
+#else
+
+    PyMODINIT_FUNC
+    init<?=module_name?>(void) {
+        (void) Py_InitModule("<?= module_name ?>", AdjMethods);
+    }
+
+#endif
@@ -0,0 +1,291 @@
+#
+# Least-squares error and gradient calculation using adjoint sensitivities.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import os
+import platform
+
+import myokit
+
+# Location of C template
+SOURCE_FILE = 'adjoint.c'
+
+
+class LeastSquaresAdjoint(myokit.CModule):
+    """
+    Calculates the sum-of-squares error between a simulated output and a data
+    trace, along with its gradient with respect to a list of parameters, using
+    adjoint sensitivity analysis.
+
+    The error is defined as::
+
+        E(p) = sum_k (y(t_k, p) - d_k)^2
+
+    where ``y`` is an ``output`` variable, ``t_k`` are the given ``times``,
+    ``d_k`` are the measured ``values``, and ``p`` is a vector of
+    ``parameters``.
+
+    To calculate the gradient ``dE/dp``, the model is first solved forward
+    in time using CVODES, which stores checkpoints along the way. Next, the
+    adjoint system is solved backwards in time from the final data point, with
+    a jump in the adjoint variables at every data point, while the gradient is
+    obtained by integrating a set of quadratures. The products of the adjoint
+    variables with the model's Jacobian (and with its partial derivatives to
+    the parameters) are evaluated using reverse-mode automatic
+    differentiation, so that the cost of a gradient calculation is independent
+    of the number of parameters, and is roughly equal to two to three forward
+    simulations. This makes it much cheaper than forward sensitivities (see
+    :class:`Simulation` and :class:`PSimulation`) when the number of
+    parameters is large.
+
+    Arguments:
+
+    ``simulation``
+        A :class:`myokit.Simulation`. Its model (including any changes made
+        with :meth:`Simulation.set_constant`) is used to compile the adjoint
+        code when this object is created. Every call to :meth:`evaluate` then
+        starts from the simulation's current time and state, and uses its
+        current protocol, tolerances, and minimum and maximum step sizes. The
+        simulation itself is not changed.
+    ``times``
+        A non-decreasing sequence of times at which data was recorded. All
+        times must be greater than or equal to the simulation time at the
+        moment :meth:`evaluate` is called.
+    ``values``
+        A sequence containing the measured value at each time in ``times``.
+    ``output``
+        The state or intermediary variable to compare with the data, given as
+        a :class:`myokit.Variable` or a fully qualified name.
+    ``parameters``
+        A sequence of literal constants (given as variables or fully qualified
+        names) to calculate the gradient with respect to.
+
+    Partial derivatives are obtained using :meth:`myokit.Expression.diff()`,
+    so that discontinuous functions (e.g. ``floor``) and conditions are
+    handled as described in :meth:`myokit._sim.differential.sparse_equation`.
+    Discontinuities in the pacing signal are handled by stopping and
+    restarting the forward and backward solvers at every pacing event.
+
+    Requires a version of Sundials that includes CVODES.
+    """
+    _index = 0  # Unique id for the generated module
+
+    def __init__(self, simulation, times, values, output, parameters):
+        super(LeastSquaresAdjoint, self).__init__()
+        import numpy as np
+
+        # Check simulation and clone model
+        if not isinstance(simulation, myokit.Simulation):
+            raise ValueError('Expecting a myokit.Simulation.')
+        simulation._update_parameters()
+        self._simulation = simulation
+        self._model = model = simulation._model.clone()
+        if model.count_states() == 0:
+            raise ValueError('The model must have at least one state.')
+
+        # Check data
+        self._times = np.array(times, dtype=float, copy=True)
+        self._values = np.array(values, dtype=float, copy=True)
+        if self._times.ndim != 1 or len(self._times) == 0:
+            raise ValueError(
+                'The argument `times` must be a non-empty 1d sequence.')
+        if self._values.shape != self._times.shape:
+            raise ValueError(
+                'The arguments `times` and `values` must have the same'
+                ' length.')
+        if np.any(np.diff(self._times) < 0):
+            raise ValueError('The argument `times` must be non-decreasing.')
+        if not np.all(np.isfinite(self._times)):
+            raise ValueError('The argument `times` must be finite.')
+
+        # Check output
+        if isinstance(output, myokit.Variable):
+            output = output.qname()
+        output = model.get(output, myokit.Variable)
+        if output.is_bound():
+            raise ValueError(
+                'The output variable cannot be bound to an external input.')
+        if not (output.is_state() or output.is_intermediary()):
+            raise ValueError(
+                'The output variable must be a state or an intermediary'
+                ' variable.')
+        self._output = output
+
+        # Check parameters
+        if len(parameters) == 0:
+            raise ValueError('At least one parameter must be given.')
+        self._parameters = []
+        for p in parameters:
+            if isinstance(p, myokit.Variable):
+                p = p.qname()
+            p = model.get(p, myokit.Variable)
+            if not p.is_literal() or p.is_bound():
+                raise ValueError(
+                    'Parameters must be literal constants, got <'
+                    + p.qname() + '>.')
+            if p in self._parameters:
+                raise ValueError('Duplicate parameter <' + p.qname() + '>.')
+            self._parameters.append(p)
+
+        # Unique module name
+        LeastSquaresAdjoint._index += 1
+        module_name = 'myokit_adjoint_' + str(LeastSquaresAdjoint._index)
+        module_name += '_' + str(myokit._pid_hash())
+
+        # Arguments
+        args = {
+            'module_name': module_name,
+            'model': model,
+            'output': self._output,
+            'parameters': self._parameters,
+            'adjoint': _adjoint_equations(model, self._parameters),
+        }
+        fname = os.path.join(myokit.DIR_CFUNC, SOURCE_FILE)
+
+        # Debug
+        if myokit.DEBUG:
+            print(self._code(fname, args,
+                             line_numbers=myokit.DEBUG_LINE_NUMBERS))
+            import sys
+            sys.exit(1)
+
+        # Define libraries
+        libs = [
+            'sundials_cvodes',
+            'sundials_nvecserial',
+        ]
+        if platform.system() != 'Windows':  # pragma: no windows cover
+            libs.append('m')
+
+        # Define library paths
+        # Note: Sundials path on windows already includes local binaries
+        libd = list(myokit.SUNDIALS_LIB)
+        incd = list(myokit.SUNDIALS_INC)
+        incd.append(myokit.DIR_CFUNC)
+
+        # Create extension
+        self._sim = self._compile(module_name, fname, args, libs, libd, incd)
+
+    def evaluate(self, parameters):
+        """
+        Calculates the sum-of-squares error for the given ``parameters``, and
+        its gradient with respect to each parameter.
+
+        The parameter values must be given as a sequence, in the order
+        returned by :meth:`parameters`.
+
+        Returns a tuple ``(error, gradient)``, where ``error`` is a float and
+        ``gradient`` is a 1d NumPy array.
+        """
+        import numpy as np
+
+        parameters = [float(x) for x in parameters]
+        if len(parameters) != len(self._parameters):
+            raise ValueError(
+                'Expecting a sequence of ' + str(len(self._parameters))
+                + ' parameter values.')
+
+        # Get time, state, protocol, and solver settings from the simulation
+        sim = self._simulation
+        tmin = float(sim.time())
+        if self._times[0] < tmin:
+            raise ValueError(
+                'All times must be greater than or equal to the simulation'
+                ' time (' + str(tmin) + ').')
+        abs_tol, rel_tol = sim._tolerance
+        dtmax = sim._dtmax if sim._dtmax else 0
+        dtmin = sim._dtmin if sim._dtmin else 0
+
+        error, gradient = self._sim.evaluate(
+            tmin,
+            [float(x) for x in sim.state()],
+            parameters,
+            sim._protocol,
+            sim._fixed_form_protocol,
+            list(self._times),
+            list(self._values),
+            abs_tol,
+            rel_tol,
+            dtmax,
+            dtmin,
+        )
+        return error, np.array(gradient)
+
+    def output(self):
+        """
+        Returns the fully qualified name of the output variable.
+        """
+        return self._output.qname()
+
+    def parameters(self):
+        """
+        Returns the fully qualified names of the parameters, in the order used
+        by :meth:`evaluate`.
+        """
+        return [p.qname() for p in self._parameters]
+
+    def times(self):
+        """
+        Returns a copy of the data times.
+        """
+        return self._times.copy()
+
+    def values(self):
+        """
+        Returns a copy of the data values.
+        """
+        return self._values.copy()
+
+
+def _adjoint_equations(model, parameters):
+    """
+    Derives the equations needed to calculate vector-Jacobian products of a
+    model's right-hand side function (and of any other variable), with
+    respect to its states and a list of ``parameters``, using reverse-mode
+    differentiation.
+
+    Every equation in the model, including those for calculated constants, is
+    visited in reverse solvable order. For each equation ``lhs = f(...)`` a
+    tuple ``(lhs, terms)`` is returned, where ``terms`` is a list of tuples
+    ``(ref, partial)``, such that the adjoint of each ``ref`` should be
+    incremented with ``partial`` times the adjoint of ``lhs``. Only equations
+    and references that depend on a state or a parameter are included.
+
+    The partial derivatives are obtained using :meth:`Expression.diff`.
+    """
+    # Get equations, in solvable order, with calculated constants first
+    order = model.solvable_order().values()
+    equations = []
+    for eqs in order:
+        for eq in eqs.equations(const=True):
+            if not eq.rhs.is_literal():
+                equations.append(eq)
+    for eqs in order:
+        equations.extend(eqs.equations(const=False))
+
+    # Find all left-hand sides that depend on a state or a parameter
+    active = set([myokit.Name(x) for x in model.states()])
+    active.update([myokit.Name(p) for p in parameters])
+    for eq in equations:
+        if any([ref in active for ref in eq.rhs.references()]):
+            active.add(eq.lhs)
+
+    # Visit equations in reverse order
+    adjoint = []
+    for eq in reversed(equations):
+        if eq.lhs not in active:
+            continue
+        terms = []
+        refs = [x for x in eq.rhs.references() if x in active]
+        for ref in sorted(refs, key=lambda x: x.code()):
+            partial = eq.rhs.diff(ref)
+            if not (partial.is_literal() and partial.eval() == 0):
+                terms.append((ref, partial))
+        if terms:
+            adjoint.append((eq.lhs, terms))
+    return adjoint
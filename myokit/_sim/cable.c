@@ -27,8 +27,8 @@ w = ansic.AnsiCExpressionWriter()
 
 # Process bindings, remove unsupported bindings.
 bound_variables = model.prepare_bindings({
-    'time'         : 'engine_time',
-    'pace'         : 'engine_pace',
+    'time'         : 'r->time',
+    'pace'         : 'r->pace',
     'diffusion_current' : 'diffusion_current',
     })
 
@@ -69,12 +69,6 @@ equations = model.solvable_order()
 /* Show debug output */
 /*#define MYOKIT_DEBUG */
 
-/*
- * Engine variables
- */
-double engine_time = 0;
-double engine_pace = 0;
-
 /*
  * Cell component
  */
@@ -115,56 +109,94 @@ static int log_add(PyObject* data, PyObject** logs, double** vars, int i, char*
 }
 
 /*
- * Variables
+ * Appends n values, read from values with the given stride, to a bytearray
+ * used as a growable buffer of doubles. Must be called while holding the GIL.
+ * Returns 0 if successful, or -1 (with a Python exception set) if not.
  */
-/* Input arguments */
-int ncells;             /* Number of cells */
-int npaced;             /* Number of cells receiving stimulus */
-double g;               /* Conductance */
-double tmin;            /* The initial simulation time */
-double tmax;            /* The final simulation time */
-double default_dt;      /* The default step size */
-PyObject* state_in;     /* The initial states */
-PyObject* state_out;    /* The final states */
-PyObject *protocol;     /* The pacing protocol */
-PyObject *log_dict;     /* The log dict */
-double log_interval;    /* The log interval (0 to disable) */
-
-/* Cells */
-Cell *cells;            /* All used cells */
-
-/* Running */
-int running = 0;        /* Running yes/no */
-double dt;              /* The next step size to use */
-double dt_min;          /* The minimum step size to use */
-double tnext;           /* The next forced time (event or end of sim) */
-unsigned long istep;    /* The index of the current step */
-int intermediary_step;  /* True if an intermediary step is being taken */
-
-/* Logging */
-PyObject **logs;        /* An array of pointers to a PyObject */
-double **vars;          /* An array of pointers to double */
-int ivars;              /* Iterate over logging variables */
-int nvars;              /* Number of logging variables */
-unsigned long ilog;     /* The number of points in the log */
-double tlog;            /* Next logging point */
-
-/* Pacing */
-double tpace;           /* Next event start or end */
-ESys pacing;            /* Pacing system */
-
-/* Temporary objects: decref before re-using for another var :)
-   (Unless you got it through PyList_GetItem or PyTuble_GetItem) */
-PyObject *flt;              /* PyFloat, various uses */
-PyObject *ret;              /* PyFloat, used as return value from python calls */
-PyObject *list_update_str;  /* PyUnicode, ssed to call "append" method */
+static int
+log_extend(PyObject* buffer, const double* values, Py_ssize_t n, Py_ssize_t stride)
+{
+    Py_ssize_t i;
+    Py_ssize_t size = PyByteArray_Size(buffer);
+    double* data;
+    if (n == 0) return 0;
+    if (PyByteArray_Resize(buffer, size + n * (Py_ssize_t)sizeof(double))) return -1;
+    data = (double*)(PyByteArray_AsString(buffer) + size);
+    for (i=0; i<n; i++) {
+        data[i] = values[i * stride];
+    }
+    return 0;
+}
+
+/*
+ * Simulation run
+ *
+ * All the state of a single simulation run is stored in a SimRun struct,
+ * which is created by sim_init and passed back to Python as a capsule. This
+ * allows several runs to be active at the same time, and lets sim_step
+ * release the GIL while stepping.
+ */
+typedef struct {
+    int running;            /* Running yes/no */
+
+    /* Input arguments */
+    int ncells;             /* Number of cells */
+    int npaced;             /* Number of cells receiving stimulus */
+    double g;               /* Conductance */
+    double tmin;            /* The initial simulation time */
+    double tmax;            /* The final simulation time */
+    double default_dt;      /* The default step size */
+    PyObject* state_out;    /* The final states (new reference) */
+    PyObject *log_dict;     /* The log dict, with bytearray buffers (new reference) */
+    double log_interval;    /* The log interval (0 to disable) */
+
+    /* Engine variables */
+    double time;            /* The current simulation time */
+    double pace;            /* The current pacing level */
+
+    /* Cells */
+    Cell *cells;            /* All used cells */
+
+    /* Running */
+    double dt;              /* The next step size to use */
+    double dt_min;          /* The minimum step size to use */
+    unsigned long istep;    /* The index of the current step */
+
+    /* Logging */
+    PyObject **logs;        /* An array of pointers to a PyObject */
+    double **vars;          /* An array of pointers to double */
+    int nvars;              /* Number of logging variables */
+    unsigned long ilog;     /* The number of points in the log */
+    double tlog;            /* Next logging point */
+
+    /* Buffer for logged points, filled without the GIL */
+    double* log_buffer;         /* Logged values, nvars per point */
+    Py_ssize_t n_log_buffer;    /* Number of points in the buffer */
+    Py_ssize_t c_log_buffer;    /* Capacity of the buffer, in points */
+
+    /* Pacing */
+    double tpace;           /* Next event start or end */
+    ESys pacing;            /* Pacing system */
+    ESys_Flag flag_pacing;  /* Error flag set during stepping */
+
+    /* Steady-state detection */
+    PyObject* steady;       /* List [period, tolerance, beats, converged] or None (new reference) */
+    double beat_period;     /* The beat period (0 to disable detection) */
+    double beat_tol;        /* The tolerance for beat-to-beat changes */
+    double tbeat;           /* The start of the next beat */
+    long beats;             /* Number of beats completed */
+    int converged;          /* True if a steady state was detected */
+    double* y_beat;         /* The states of all cells at the start of the current beat */
+} SimRun;
+
+#define SIM_CAPSULE_NAME "myokit.Simulation1d.run"
 
 /*
  * Given a current state, this method calculates all diffusion currents, sets
  * the time and pacing variables and calculates all derivatives.
  */
 static void
-rhs()
+rhs(SimRun* r)
 {
     int icell;
     Cell* cell;
@@ -176,26 +208,26 @@ if var is not None:
     print(tab*1 + '/*')
     print(tab*1 + ' * Set diffusion currents')
     print(tab*1 + ' */')
-    print(tab*1 + 'if (ncells > 1) {')
+    print(tab*1 + 'if (r->ncells > 1) {')
     print(tab*2 + 'Cell *clast, *cnext;')
-    print(tab*2 + 'cell = clast = cnext = cells;')
+    print(tab*2 + 'cell = clast = cnext = r->cells;')
     print(tab*2 + 'cnext++;')
     print(tab*2 + '')
     print(tab*2 + '/* First cell */')
-    print(tab*2 + 'diffusion_current = g * (cell->' + vm + ' - cnext->' + vm + ');')
+    print(tab*2 + 'diffusion_current = r->g * (cell->' + vm + ' - cnext->' + vm + ');')
     print(tab*2 + v(var) + ' = diffusion_current;')
     print(tab*2 + 'cnext++;')
     print(tab*2 + 'cell++;')
     print(tab*2 + '/* Doubly-connected cells */')
-    print(tab*2 + 'for(icell=2; icell<ncells; icell++) {')
-    print(tab*3 + 'diffusion_current = g * (2.0*cell-> ' + vm + ' - clast-> ' + vm + ' - cnext->' + vm + ');')
+    print(tab*2 + 'for(icell=2; icell<r->ncells; icell++) {')
+    print(tab*3 + 'diffusion_current = r->g * (2.0*cell-> ' + vm + ' - clast-> ' + vm + ' - cnext->' + vm + ');')
     print(tab*3 + v(var) + ' = diffusion_current;')
     print(tab*3 + 'clast++;')
     print(tab*3 + 'cnext++;')
     print(tab*3 + 'cell++;')
     print(tab*2 + '}')
     print(tab*2 + '/* Last cell */')
-    print(tab*2 + 'diffusion_current = g * (cell->' + vm + ' - clast->' + vm + ');')
+    print(tab*2 + 'diffusion_current = r->g * (cell->' + vm + ' - clast->' + vm + ');')
     print(tab*2 + v(var) + ' = diffusion_current;')
     print(tab*1 + '}')
 
@@ -204,9 +236,9 @@ if var is not None:
     print(tab*1 + '/*')
     print(tab*1 + ' * Set pacing current')
     print(tab*1 + ' */')
-    print(tab*1 + 'cell = cells;')
-    print(tab*1 + 'for(icell=0; icell<npaced; icell++) {')
-    print(tab*2 + v(var) + ' = engine_pace;')
+    print(tab*1 + 'cell = r->cells;')
+    print(tab*1 + 'for(icell=0; icell<r->npaced; icell++) {')
+    print(tab*2 + v(var) + ' = r->pace;')
     print(tab*2 + 'cell++;')
     print(tab*1 + '}')
 
@@ -215,11 +247,11 @@ if var is not None:
     /*
      * Set time, calculate derivatives
      */
-    cell = cells;
-    for(icell=0; icell<ncells; icell++) {
+    cell = r->cells;
+    for(icell=0; icell<r->ncells; icell++) {
 <?
 var = model.time()
-print(tab*2 + v(var) + ' = engine_time;')
+print(tab*2 + v(var) + ' = r->time;')
 for label, eqs in equations.items():
     for eq in eqs.equations(const=False, bound=False):
         print(tab*2 + w.eq(eq) + ';')
@@ -229,80 +261,150 @@ for label, eqs in equations.items():
 }
 
 /*
- * Cleans up after a simulation
+ * Compares the current states of all cells with the states stored at the
+ * start of the previous beat, and then stores the current states. Returns 1
+ * if the change in every state x is within beat_tol * (1 + |x|), and 0 if not
+ * or if any NaNs are encountered.
+ */
+static int
+sim_check_beat(SimRun* r)
+{
+    int icell;
+    Cell* cell;
+    double* y = r->y_beat;
+    int converged = 1;
+
+    cell = r->cells;
+    for(icell=0; icell<r->ncells; icell++) {
+<?
+for var in model.states():
+    print(tab*2 + 'if (!(fabs(' + v(var) + ' - *y) <= r->beat_tol * (1 + fabs(' + v(var) + ')))) converged = 0;')
+    print(tab*2 + '*y = ' + v(var) + ';')
+    print(tab*2 + 'y++;')
+?>
+        cell++;
+    }
+    return converged;
+}
+
+/*
+ * Cleans up after a simulation, can safely be called more than once
  */
 static PyObject*
-sim_clean()
+sim_clean_run(SimRun* r)
 {
     #ifdef MYOKIT_DEBUG
     printf("Clean called.\n");
     #endif
 
-    if (running != 0) {
+    if (r->running != 0) {
 
         #ifdef MYOKIT_DEBUG
         printf("Cleaning.\n");
         #endif
 
-        /* Done with str="append", decref it */
-        Py_XDECREF(list_update_str); list_update_str = NULL;
+        /* Release input arguments */
+        Py_XDECREF(r->state_out); r->state_out = NULL;
+        Py_XDECREF(r->log_dict); r->log_dict = NULL;
+        Py_XDECREF(r->steady); r->steady = NULL;
 
         /* Free allocated space */
-        free(logs); logs = NULL;
-        free(vars); vars = NULL;
-        free(cells); cells = NULL;
+        free(r->logs); r->logs = NULL;
+        free(r->vars); r->vars = NULL;
+        free(r->cells); r->cells = NULL;
+        free(r->log_buffer); r->log_buffer = NULL;
+        free(r->y_beat); r->y_beat = NULL;
 
         /* Free pacing system memory */
-        ESys_Destroy(pacing); pacing = NULL;
+        if (r->pacing != NULL) { ESys_Destroy(r->pacing); r->pacing = NULL; }
 
         /* No longer running */
-        running = 0;
+        r->running = 0;
     }
 
     /* Return 0, allowing the construct
         PyErr_SetString(PyExc_Exception, "Oh noes!");
-        return sim_clean()
+        return sim_clean_run(r)
        to terminate a python function. */
     return 0;
 }
+
+/*
+ * Frees a SimRun when its capsule is garbage collected
+ */
+static void
+sim_run_destructor(PyObject* capsule)
+{
+    SimRun* r = (SimRun*)PyCapsule_GetPointer(capsule, SIM_CAPSULE_NAME);
+    if (r != NULL) {
+        sim_clean_run(r);
+        free(r);
+    }
+}
+
+/*
+ * Returns the SimRun stored in the capsule passed in as args, or NULL (with a
+ * Python exception set) if no valid capsule was passed in.
+ */
+static SimRun*
+sim_get_run(PyObject *args)
+{
+    PyObject* capsule;
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(PyExc_Exception, "Expected input argument: run (capsule).");
+        return NULL;
+    }
+    return (SimRun*)PyCapsule_GetPointer(capsule, SIM_CAPSULE_NAME);
+}
+
+/*
+ * Cleans up after an aborted simulation run
+ */
 static PyObject*
-py_sim_clean()
+py_sim_clean(PyObject *self, PyObject *args)
 {
-    sim_clean();
+    SimRun* r = sim_get_run(args);
+    if (r == NULL) return 0;
+    sim_clean_run(r);
     Py_RETURN_NONE;
 }
 
 /*
- * Initialise a run
+ * Initialise a run, and return a capsule containing its state
  */
 static PyObject*
 sim_init(PyObject *self, PyObject *args)
 {
-    #ifdef MYOKIT_DEBUG
-    printf("Initialising.\n");
-    #endif
-
     int icell;
     Cell* cell;
     int i_state;
+    int ivars;
     char log_var_name[1000];
     ESys_Flag flag_pacing;
+    PyObject *flt;
+    PyObject *capsule;
+    SimRun* r;
+
+    /* Input arguments (borrowed references) */
+    int ncells;             /* Number of cells */
+    int npaced;             /* Number of cells receiving stimulus */
+    double g;               /* Conductance */
+    double tmin;            /* The initial simulation time */
+    double tmax;            /* The final simulation time */
+    double default_dt;      /* The default step size */
+    PyObject* state_in;     /* The initial states */
+    PyObject* state_out;    /* The final states */
+    PyObject *protocol;     /* The pacing protocol */
+    PyObject *log_dict;     /* The log dict */
+    double log_interval;    /* The log interval (0 to disable) */
+    PyObject *steady;       /* Steady-state detection list, or None */
 
-    /* Check if already running */
-    if (running != 0) {
-        PyErr_SetString(PyExc_Exception, "Simulation already initialized.");
-        return 0;
-    }
-
-    /* Set all pointers used by sim_clean to null */
-    list_update_str = NULL;
-    logs = NULL;
-    vars = NULL;
-    cells = NULL;
-    pacing = NULL;
+    #ifdef MYOKIT_DEBUG
+    printf("Initialising.\n");
+    #endif
 
     /* Check input arguments (borrowed references) */
-    if (!PyArg_ParseTuple(args, "iddddOOOiOd",
+    if (!PyArg_ParseTuple(args, "iddddOOOiOdO",
             &ncells,
             &g,
             &tmin,
@@ -313,50 +415,76 @@ sim_init(PyObject *self, PyObject *args)
             &protocol,
             &npaced,
             &log_dict,
-            &log_interval)) {
+            &log_interval,
+            &steady)) {
         PyErr_SetString(PyExc_Exception, "Incorrect input arguments.");
         /* Nothing allocated yet, no pyobjects _created_, return directly */
         return 0;
     }
 
+    /* Create run struct, with all pointers used by sim_clean_run set to null */
+    r = (SimRun*)calloc(1, sizeof(SimRun));
+    if (r == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for simulation run.");
+        return 0;
+    }
+    capsule = PyCapsule_New((void*)r, SIM_CAPSULE_NAME, sim_run_destructor);
+    if (capsule == NULL) {
+        free(r);
+        return 0;
+    }
+
     /* Now officialy running :) */
-    running = 1;
+    r->running = 1;
 
     /***************************************************************
      *
-     * From this point on, no more direct returning! Use sim_clean()
+     * From this point on, no more direct returning! Use goto error, which
+     * cleans up and decrefs the capsule.
      *
      */
 
+    /* Store input arguments */
+    r->ncells = ncells;
+    r->npaced = npaced;
+    r->g = g;
+    r->tmin = tmin;
+    r->tmax = tmax;
+    r->default_dt = default_dt;
+    r->log_interval = log_interval;
+    Py_INCREF(state_out); r->state_out = state_out;
+    Py_INCREF(log_dict); r->log_dict = log_dict;
+    Py_INCREF(steady); r->steady = steady;
+
     /* Create cell structs */
-    cells = (Cell*)malloc(ncells*sizeof(Cell));
-    if (cells == 0) {
+    r->cells = (Cell*)malloc(ncells*sizeof(Cell));
+    if (r->cells == 0) {
         PyErr_SetString(PyExc_Exception, "Number of cells must be greater than zero.");
-        return sim_clean();
+        goto error;
     }
 
     /* Check number of paced cells */
     if (npaced > ncells) {
         PyErr_SetString(PyExc_Exception, "'npaced' cannot exceed ncells.");
-        return sim_clean();
+        goto error;
     } /* If this is violated you get random segfaults */
 
     /* Check state in and out lists */
     if (!PyList_Check(state_in)) {
         PyErr_SetString(PyExc_Exception, "'state_in' must be a list.");
-        return sim_clean();
+        goto error;
     }
     if (PyList_Size(state_in) != ncells * N_STATE) {
         PyErr_SetString(PyExc_Exception, "'state_in' must have size ncells * n_states.");
-        return sim_clean();
+        goto error;
     }
     if (!PyList_Check(state_out)) {
         PyErr_SetString(PyExc_Exception, "'state_out' must be a list.");
-        return sim_clean();
+        goto error;
     }
     if (PyList_Size(state_out) != ncells * N_STATE) {
         PyErr_SetString(PyExc_Exception, "'state_out' must have size ncells * n_states.");
-        return sim_clean();
+        goto error;
     }
     for(i_state=0; i_state<ncells * N_STATE; i_state++) {
         flt = PyList_GetItem(state_in, i_state);    /* Borrowed reference */
@@ -364,61 +492,66 @@ sim_init(PyObject *self, PyObject *args)
             char errstr[200];
             sprintf(errstr, "Item %d in state vector is not a float.", i_state);
             PyErr_SetString(PyExc_Exception, errstr);
-            return sim_clean();
+            goto error;
         }
     }
 
     /* Set minimum step size */
-    dt_min = 1e-2 * default_dt;
+    r->dt_min = 1e-2 * default_dt;
 
     /* Set up logging */
-    list_update_str = PyUnicode_FromString("append");
     if (!PyDict_Check(log_dict)) {
         PyErr_SetString(PyExc_Exception, "Log argument must be a dict.");
-        return sim_clean();
+        goto error;
     }
-    nvars = PyDict_Size(log_dict);
-    logs = (PyObject**)malloc(sizeof(PyObject*)*nvars); /* Pointers to logging lists */
-    vars = (double**)malloc(sizeof(double*)*nvars); /* Pointers to variables to log */
+    r->nvars = PyDict_Size(log_dict);
+    r->logs = (PyObject**)malloc(sizeof(PyObject*)*r->nvars); /* Pointers to logging lists */
+    r->vars = (double**)malloc(sizeof(double*)*r->nvars); /* Pointers to variables to log */
 
     ivars = 0;
-    cell = cells;
+    cell = r->cells;
 <?
 # Time is set globally, use only the value from the first cell
 var = model.time()
-print(tab + 'ivars += log_add(log_dict, logs, vars, ivars, "' + var.qname() + '", &' + v(var) + ');')
+print(tab + 'ivars += log_add(log_dict, r->logs, r->vars, ivars, "' + var.qname() + '", &' + v(var) + ');')
 ?>
     for(icell=0; icell<ncells; icell++) {
 <?
 for var in model.variables(deep=True, const=False):
     print(tab*2 + 'sprintf(log_var_name, "%d.' + var.qname() + '", icell);')
-    print(tab*2 + 'ivars += log_add(log_dict, logs, vars, ivars, log_var_name, &' + v(var) + ');')
+    print(tab*2 + 'ivars += log_add(log_dict, r->logs, r->vars, ivars, log_var_name, &' + v(var) + ');')
 ?>
         cell++;
     }
 
     /* Check if log contained extra variables */
-    if (ivars != nvars) {
+    if (ivars != r->nvars) {
         PyErr_SetString(PyExc_Exception, "Unknown variables found in logging dictionary.");
-        return sim_clean();
+        goto error;
+    }
+    for (ivars=0; ivars<r->nvars; ivars++) {
+        if (!PyByteArray_Check(r->logs[ivars])) {
+            PyErr_SetString(PyExc_Exception, "Logging dictionary must contain bytearray buffers.");
+            goto error;
+        }
     }
 
     /* Set up pacing */
-    pacing = ESys_Create(&flag_pacing);
-    if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-    flag_pacing = ESys_Populate(pacing, protocol);
-    if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-    flag_pacing = ESys_AdvanceTime(pacing, tmin);
-    if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-    tpace = ESys_GetNextTime(pacing, &flag_pacing);
-    engine_pace = ESys_GetLevel(pacing, &flag_pacing);
+    r->pacing = ESys_Create(&flag_pacing);
+    if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); goto error; }
+    flag_pacing = ESys_Populate(r->pacing, protocol);
+    if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); goto error; }
+    flag_pacing = ESys_AdvanceTime(r->pacing, tmin);
+    if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); goto error; }
+    r->tpace = ESys_GetNextTime(r->pacing, &flag_pacing);
+    r->pace = ESys_GetLevel(r->pacing, &flag_pacing);
 
     /* Set simulation starting time */
-    engine_time = tmin;
+    r->time = tmin;
 
     /* Initialize cells: set constants, calculated constants, initial values,
        zeros for pacing and stimulus */
-    cell = cells;
+    cell = r->cells;
     for(icell=0; icell<ncells; icell++) {
         /* Literal values & calculated constants */
 <?
@@ -444,81 +577,144 @@ if var is not None:
     }
 
     /* Calculate rhs at initial time */
-    rhs();
+    rhs(r);
+
+    /* Set up steady-state detection, storing the initial states */
+    if (steady != Py_None) {
+        if (!PyList_Check(steady) || PyList_Size(steady) != 4) {
+            PyErr_SetString(PyExc_Exception, "'steady' must be a list of size 4 or None.");
+            goto error;
+        }
+        r->beat_period = PyFloat_AsDouble(PyList_GetItem(steady, 0));
+        r->beat_tol = PyFloat_AsDouble(PyList_GetItem(steady, 1));
+        if (PyErr_Occurred()) goto error;
+        if (r->beat_period <= 0) {
+            PyErr_SetString(PyExc_Exception, "Beat period must be greater than zero.");
+            goto error;
+        }
+        r->tbeat = tmin + r->beat_period;
+        r->y_beat = (double*)malloc(sizeof(double) * (ncells * N_STATE > 0 ? ncells * N_STATE : 1));
+        if (r->y_beat == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for steady-state detection.");
+            goto error;
+        }
+        sim_check_beat(r);
+    } else {
+        r->tbeat = tmax;
+    }
 
     /* Set first point to step to */
-    istep = 1;
+    r->istep = 1;
 
     /* Set first logging point */
-    ilog = 0;
-    tlog = tmin + (double)ilog * log_interval;
+    r->ilog = 0;
+    r->tlog = tmin + (double)r->ilog * log_interval;
 
     /* Done! */
-    Py_RETURN_NONE;
+    return capsule;
+
+error:
+    sim_clean_run(r);
+    Py_DECREF(capsule);
+    return 0;
 }
 
 /*
- * Takes the next steps in a simulation run
+ * Adds the current values of all logged variables to the log buffer. Does not
+ * use the Python API. Returns 0 if successful.
  */
-static PyObject*
-sim_step(PyObject *self, PyObject *args)
+static int
+sim_log_point(SimRun* r)
+{
+    int i;
+    double* buffer;
+    if (r->n_log_buffer == r->c_log_buffer) {
+        r->c_log_buffer = (r->c_log_buffer < 64) ? 64 : 2 * r->c_log_buffer;
+        buffer = (double*)realloc(r->log_buffer, sizeof(double) * r->c_log_buffer * (r->nvars > 0 ? r->nvars : 1));
+        if (buffer == NULL) return -1;
+        r->log_buffer = buffer;
+    }
+    buffer = r->log_buffer + r->n_log_buffer * r->nvars;
+    for (i=0; i<r->nvars; i++) {
+        buffer[i] = *r->vars[i];
+    }
+    r->n_log_buffer++;
+    return 0;
+}
+
+/*
+ * Moves all buffered log points to the bytearray log buffers. Must be called
+ * while holding the GIL. Returns 0 if successful, or -1 (with a Python
+ * exception set) if not.
+ */
+static int
+sim_flush(SimRun* r)
+{
+    int i;
+    for (i=0; i<r->nvars; i++) {
+        if (log_extend(r->logs[i], r->log_buffer + i, r->n_log_buffer, r->nvars)) {
+            r->n_log_buffer = 0;
+            return -1;
+        }
+    }
+    r->n_log_buffer = 0;
+    return 0;
+}
+
+/*
+ * Takes up to max_steps steps, logging to the log buffer. This function does
+ * not use the Python API, so that it can be called without holding the GIL.
+ *
+ * Returns 1 if the simulation finished, 0 if it should be continued, -1 if
+ * the pacing system failed (in which case r->flag_pacing is set), or -2 if
+ * memory allocation failed.
+ */
+static int
+sim_advance(SimRun* r, int max_steps)
 {
-    ESys_Flag flag_pacing;
     int icell;
     Cell* cell;
     int steps_taken = 0;
-    double d;
-
-    #ifdef MYOKIT_DEBUG
-    printf("Entering sim_step.\n");
-    #endif
+    int intermediary_step;
+    double dt, d;
 
-    /* Start simulation */
     while(1) {
 
         /* Log if we've reached or passed a logging point */
         /* Note: rhs has already been calculated by init or previous step */
-        if (engine_time >= tlog) {
-            for(ivars = 0; ivars<nvars; ivars++) {
-                flt = PyFloat_FromDouble(*vars[ivars]);
-                ret = PyObject_CallMethodObjArgs(logs[ivars], list_update_str, flt, NULL);
-                Py_DECREF(flt); flt = NULL;
-                Py_XDECREF(ret);
-                if (ret == NULL) {
-                    PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                    return sim_clean();
-                }
-            }
-            ret = NULL;
+        if (r->time >= r->tlog) {
+            if (sim_log_point(r)) return -2;
 
             /* Set next logging point */
-            ilog++;
-            tlog = tmin + (double)ilog * log_interval;
+            r->ilog++;
+            r->tlog = r->tmin + (double)r->ilog * r->log_interval;
         }
 
         /* Determine appropriate time step */
-        dt = tmin + (double)istep * default_dt - engine_time;
+        dt = r->tmin + (double)r->istep * r->default_dt - r->time;
         intermediary_step = 0;
-        d = tpace - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
-        d = tmax - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
-        d = tlog - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
-        if (!intermediary_step) istep++;
+        d = r->tpace - r->time; if (d > r->dt_min && d < dt) {dt = d; intermediary_step = 1; }
+        d = r->tmax - r->time; if (d > r->dt_min && d < dt) {dt = d; intermediary_step = 1; }
+        d = r->tlog - r->time; if (d > r->dt_min && d < dt) {dt = d; intermediary_step = 1; }
+        d = r->tbeat - r->time; if (d > r->dt_min && d < dt) {dt = d; intermediary_step = 1; }
+        if (!intermediary_step) r->istep++;
+        r->dt = dt;
 
         /* Move to next time (1) Update the time variable */
-        engine_time += dt;
+        r->time += dt;
         #ifdef MYOKIT_DEBUG
-        printf("t=%f, dt=%f\n", engine_time, dt);
+        printf("t=%f, dt=%f\n", r->time, dt);
         #endif
 
         /* Move to next time (2) Update the pacing variable */
-        flag_pacing = ESys_AdvanceTime(pacing, engine_time);
-        if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-        tpace = ESys_GetNextTime(pacing, NULL);
-        engine_pace = ESys_GetLevel(pacing, NULL);
+        r->flag_pacing = ESys_AdvanceTime(r->pacing, r->time);
+        if (r->flag_pacing!=ESys_OK) return -1;
+        r->tpace = ESys_GetNextTime(r->pacing, NULL);
+        r->pace = ESys_GetLevel(r->pacing, NULL);
 
         /* Move to next time (3) Update the states */
-        cell = cells;
-        for(icell=0; icell<ncells; icell++) {
+        cell = r->cells;
+        for(icell=0; icell<r->ncells; icell++) {
 <?
 for var in model.states():
     if var in rl_states:
@@ -532,7 +728,15 @@ for var in model.states():
         }
 
         /* Move to next time (4) Calculate the new derivatives, intermediaries etc. */
-        rhs();
+        rhs(r);
+
+        /* Start of a new beat? Then stop if a steady state was reached */
+        if (r->beat_period > 0 && r->time >= r->tbeat) {
+            r->beats++;
+            r->tbeat = r->tmin + (double)(r->beats + 1) * r->beat_period;
+            r->converged = sim_check_beat(r);
+            if (r->converged) return 1;
+        }
 
         /*
          * Are we done?
@@ -540,46 +744,95 @@ for var in model.states():
          * logged (half-open convention for fixed interval logging!)
          */
         #ifdef MYOKIT_DEBUG
-        printf("t=%f, tmax=%f, t>=tmax %d\n", engine_time, tmax, engine_time>=tmax);
+        printf("t=%f, tmax=%f, t>=tmax %d\n", r->time, r->tmax, r->time>=r->tmax);
         #endif
-        if (engine_time >= tmax) break;
-
-        /* Perform any Python signal handling */
-        if (PyErr_CheckSignals() != 0) {
-            /* Exception (e.g. timeout or keyboard interrupt) occurred?
-               Then cancel everything! */
-            return sim_clean();
-        }
+        if (r->time >= r->tmax) return 1;
 
         /* Report back to python after every x steps */
         steps_taken++;
-        if (steps_taken > 100) {
-            steps_taken = 0;
-            if(engine_time < tmax) {
-                return PyFloat_FromDouble(engine_time);
-            }
-        }
+        if (steps_taken > max_steps) return 0;
+    }
+}
+
+/*
+ * Takes the next steps in a simulation run
+ */
+static PyObject*
+sim_step(PyObject *self, PyObject *args)
+{
+    int icell;
+    Cell* cell;
+    int status;
+    SimRun* r;
+
+    #ifdef MYOKIT_DEBUG
+    printf("Entering sim_step.\n");
+    #endif
+
+    /* Get run */
+    r = sim_get_run(args);
+    if (r == NULL) return 0;
+    if (r->running == 0) {
+        PyErr_SetString(PyExc_Exception, "Simulation not initialized.");
+        return 0;
+    }
+
+    /* Take the next steps, without holding the GIL */
+    Py_BEGIN_ALLOW_THREADS
+    status = sim_advance(r, 100);
+    Py_END_ALLOW_THREADS
+
+    /* Move logged points to log buffers */
+    if (sim_flush(r)) return sim_clean_run(r);
+
+    /* Handle errors */
+    if (status == -1) {
+        ESys_SetPyErr(r->flag_pacing);
+        return sim_clean_run(r);
+    } else if (status == -2) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for logging.");
+        return sim_clean_run(r);
+    }
+
+    /* Perform any Python signal handling */
+    if (PyErr_CheckSignals() != 0) {
+        /* Exception (e.g. timeout or keyboard interrupt) occurred?
+           Then cancel everything! */
+        return sim_clean_run(r);
+    }
+
+    /* Not finished? Then report back to python */
+    if (status == 0) {
+        return PyFloat_FromDouble(r->time);
     }
 
     /* Set final state */
     #ifdef MYOKIT_DEBUG
     printf("Setting final state.\n");
     #endif
-    cell = cells;
-    for(icell=0; icell<ncells; icell++) {
+    cell = r->cells;
+    for(icell=0; icell<r->ncells; icell++) {
 <?
 for var in model.states():
-    print(tab*2 + 'PyList_SetItem(state_out, icell * N_STATE + ' + str(var.indice()) + ', PyFloat_FromDouble(' + v(var) + '));')
+    print(tab*2 + 'PyList_SetItem(r->state_out, icell * N_STATE + ' + str(var.indice()) + ', PyFloat_FromDouble(' + v(var) + '));')
 ?>
         cell++;
     }
 
+    /* Set number of beats used in steady-state detection */
+    if (r->steady != Py_None) {
+        PyList_SetItem(r->steady, 2, PyLong_FromLong(r->beats));
+        PyList_SetItem(r->steady, 3, PyBool_FromLong(r->converged));
+    }
+
     #ifdef MYOKIT_DEBUG
     printf("Done, tidying up and returning.\n");
     #endif
 
-    sim_clean();    /* Ignore return value */
-    return PyFloat_FromDouble(engine_time);
+    /* Return tmax, even if the run was stopped early because a steady state
+       was reached, so that the calling loop ends */
+    sim_clean_run(r);    /* Ignore return value */
+    return PyFloat_FromDouble(r->tmax);
 }
 
 /* Methods in this module */
@@ -7,6 +7,7 @@
 from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
+import logging
 import os
 import myokit
 import platform
@@ -31,6 +32,10 @@ class Simulation1d(myokit.CModule):
     ``rl``
         Use Rush-Larsen updates instead of forward-Euler for any Hodgkin-Huxley
         gating variables (default=False).
+    ``profile``
+        The optimisation profile to compile the simulation with, for example
+        ``'native'`` (see ``myokit.OPTIMISATION_PROFILES``). If not set,
+        the value of ``myokit.OPTIMISATION_PROFILE`` is used.
 
     This simulation provides the following inputs variables can bind to:
 
@@ -100,7 +105,8 @@ class Simulation1d(myokit.CModule):
     """
     _index = 0      # Unique id for generated module
 
-    def __init__(self, model, protocol=None, ncells=50, rl=False):
+    def __init__(
+            self, model, protocol=None, ncells=50, rl=False, profile=None):
         super(Simulation1d, self).__init__()
 
         # Require a valid model
@@ -209,7 +215,8 @@ class Simulation1d(myokit.CModule):
         # Create simulation
         libd = None
         incd = [myokit.DIR_CFUNC]
-        self._sim = self._compile(module_name, fname, args, libs, libd, incd)
+        self._sim = self._compile(
+            module_name, fname, args, libs, libd, incd, profile=profile)
 
     def conductance(self):
         """
@@ -239,7 +246,8 @@ class Simulation1d(myokit.CModule):
         """
         return self._npaced
 
-    def pre(self, duration, progress=None, msg='Pre-pacing Simulation1d'):
+    def pre(self, duration, progress=None, msg='Pre-pacing Simulation1d',
+            period=None, tolerance=1e-6):
         """
         This method can be used to perform an unlogged simulation, typically to
         pre-pace to a (semi-)stable orbit.
@@ -257,9 +265,35 @@ class Simulation1d(myokit.CModule):
         the :class:`myokit.ProgressReporter` interface can be passed in.
         passed in as ``progress``. An optional description of the current
         simulation to use in the ProgressReporter can be passed in as `msg`.
-        """
-        self._run(duration, myokit.LOG_NONE, 1, progress, msg)
+
+        If a beat ``period`` is given, the simulation stops as soon as a
+        periodic steady state is reached, and ``duration`` is used as the
+        maximum pre-pacing time. The states of all cells at the start of each
+        beat are compared with those at the start of the previous beat, and
+        a steady state is reached when every state ``x`` satisfies
+        ``|x_n - x_{n-1}| <= tolerance * (1 + |x_n|)``. In this case the
+        method returns the number of beats simulated. If no steady state is
+        reached within ``duration``, a warning is logged and the number of
+        completed beats is returned.
+        """
+        steady = None
+        if period is not None:
+            period = float(period)
+            if period <= 0:
+                raise ValueError('The period must be greater than zero.')
+            tolerance = float(tolerance)
+            if tolerance < 0:
+                raise ValueError('The tolerance cannot be negative.')
+            steady = [period, tolerance, 0, False]
+        self._run(duration, myokit.LOG_NONE, 1, progress, msg, steady)
         self._default_state = list(self._state)
+        if steady is not None:
+            if not steady[3]:
+                log = logging.getLogger(__name__)
+                log.warning(
+                    'No steady state reached after ' + str(steady[2])
+                    + ' beats.')
+            return steady[2]
 
     def reset(self):
         """
@@ -274,7 +308,7 @@ class Simulation1d(myokit.CModule):
 
     def run(
             self, duration, log=None, log_interval=1.0, progress=None,
-            msg='Running Simulation1d'):
+            msg='Running Simulation1d', log_sink=None):
         """
         Runs a simulation and returns the logged results. Running a simulation
         has the following effects:
@@ -319,16 +353,25 @@ class Simulation1d(myokit.CModule):
         A log entry is created every time *at least* ``log_interval`` time
         units have passed.
 
+        To avoid storing all logged data in memory, an object with a
+        ``write(log)`` method (for example a :class:`myokit.DataLogWriter`)
+        can be passed in as ``log_sink``. The logged data will then be passed
+        to the sink in fixed-size chunks during the simulation, and the
+        returned log will not contain any new data.
+
         To obtain feedback on the simulation progress, an object implementing
         the :class:`myokit.ProgressReporter` interface can be passed in.
         passed in as ``progress``. An optional description of the current
         simulation to use in the ProgressReporter can be passed in as `msg`.
         """
-        r = self._run(duration, log, log_interval, progress, msg)
+        r = self._run(
+            duration, log, log_interval, progress, msg, log_sink=log_sink)
         self._time += duration
         return r
 
-    def _run(self, duration, log, log_interval, progress, msg):
+    def _run(
+            self, duration, log, log_interval, progress, msg, steady=None,
+            log_sink=None):
         # Simulation times
         if duration < 0:
             raise ValueError('Simulation time can\'t be negative.')
@@ -367,7 +410,8 @@ class Simulation1d(myokit.CModule):
             # Initialize
             state_in = self._state
             state_out = list(state_in)
-            self._sim.sim_init(
+            buffers = self._log_buffers(log)
+            run = self._sim.sim_init(
                 self._ncells,
                 self._conductance,
                 tmin,
@@ -377,8 +421,9 @@ class Simulation1d(myokit.CModule):
                 state_out,
                 self._protocol,
                 min(self._npaced, self._ncells),
-                log,
-                log_interval)
+                buffers,
+                log_interval,
+                steady)
             t = tmin
             try:
                 if progress:
@@ -386,19 +431,34 @@ class Simulation1d(myokit.CModule):
                     with progress.job(msg):
                         r = 1.0 / duration if duration != 0 else 1
                         while t < tmax:
-                            t = self._sim.sim_step()
+                            t = self._sim.sim_step(run)
+                            if log_sink is not None:
+                                self._flush_log_buffers(
+                                    log, buffers, log_sink)
                             if not progress.update(min((t - tmin) * r, 1)):
                                 raise myokit.SimulationCancelledError()
                 else:
                     # Loop without feedback
                     while t < tmax:
-                        t = self._sim.sim_step()
+                        t = self._sim.sim_step(run)
+                        if log_sink is not None:
+                            self._flush_log_buffers(log, buffers, log_sink)
             finally:
                 # Clean even after keyboardinterrupt or exception
-                self._sim.sim_clean()
+                self._sim.sim_clean(run)
+
+                # Add logged data, even if the run didn't complete
+                if log_sink is None:
+                    self._merge_log_buffers(log, buffers)
+                else:
+                    self._flush_log_buffers(log, buffers, log_sink, True)
 
             # Update state
             self._state = state_out
+        elif log_sink is not None:
+            # Nothing to log, but tell the sink which keys to expect
+            self._flush_log_buffers(
+                log, self._log_buffers(log), log_sink, True)
 
         # Return log
         return log
@@ -0,0 +1,330 @@
+#
+# On-disk cache of compiled back-end modules
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import sysconfig
+import tempfile
+import time
+
+import myokit
+
+# Name of the file storing information about a cached module
+INFO_FILE = 'info.json'
+
+# Temporary directories older than this (in seconds) are removed by clear()
+TEMP_AGE = 3600
+
+
+class ModuleCache(object):
+    """
+    A content-addressed on-disk cache of compiled back-end modules.
+
+    Each :class:`CModule` generates source code, compiles it into a Python
+    extension, and loads the result. Because compilation typically takes
+    several seconds, the extensions built this way are stored in a cache
+    directory, indexed by a ``key`` that is derived from the generated source
+    code, the compiler and compilation flags, the Python version and ABI, the
+    Sundials version, and the Myokit version. When a module with the same key
+    is requested again (in the same or in a different process), the stored
+    extension is reused instead of compiled.
+
+    The cache is limited in size: whenever a module is added, the least
+    recently used modules are removed until the total size is below
+    ``max_size``.
+
+    Arguments:
+
+    ``path``
+        The directory to store compiled modules in. If not set, the value of
+        ``myokit.DIR_CACHE`` is used.
+    ``max_size``
+        The maximum size of the cache, in megabytes. If not set, the value of
+        ``myokit.CACHE_SIZE`` is used.
+
+    Caching can be disabled globally by setting
+    ``myokit.CACHE_COMPILED_MODULES = False``, or by editing the
+    ``[compilation]`` section of ``myokit.ini``.
+    """
+    def __init__(self, path=None, max_size=None):
+        super(ModuleCache, self).__init__()
+
+        self._path = myokit.DIR_CACHE if path is None else path
+        self._path = os.path.abspath(self._path)
+
+        if max_size is None:
+            max_size = myokit.CACHE_SIZE
+        max_size = float(max_size)
+        if max_size < 0:
+            raise ValueError('Maximum cache size cannot be negative.')
+        self._max_size = int(max_size * 1024 * 1024)
+
+    def clear(self):
+        """
+        Removes all modules from the cache, and returns the number of modules
+        removed.
+        """
+        n = 0
+        for key in self._keys():
+            if self._remove(key):
+                n += 1
+
+        # Remove temporary directories left behind by crashed processes
+        now = time.time()
+        for path in glob.glob(os.path.join(self._path, 'tmp-*')):
+            try:
+                if now - os.path.getmtime(path) > TEMP_AGE:
+                    myokit._rmtree(path)
+            except (IOError, OSError):  # pragma: no cover
+                pass
+
+        return n
+
+    def entries(self):
+        """
+        Returns a list of tuples ``(key, name, size, last_used)``, where
+        ``key`` is the module's cache key, ``name`` is the name it was compiled
+        with, ``size`` is the disk space used (in bytes), and ``last_used`` is
+        the time it was last stored or retrieved (in seconds since the epoch).
+
+        The list is ordered from most to least recently used.
+        """
+        entries = []
+        for key in self._keys():
+            path = os.path.join(self._path, key)
+            info = self._info(path)
+            if info is None:
+                continue
+            try:
+                entries.append((
+                    key, info['name'], _size(path), os.path.getmtime(path)))
+            except (IOError, OSError):  # pragma: no cover
+                # Removed by another process
+                pass
+        entries.sort(key=lambda x: -x[3])
+        return entries
+
+    def fetch(self, key, directory):
+        """
+        Copies the module stored under ``key`` into ``directory``, and returns
+        the module's name. If no module is found, ``None`` is returned.
+
+        A copy is made, rather than loading the stored file directly, so that
+        every module loaded from the cache has its own (static) memory.
+        """
+        path = os.path.join(self._path, key)
+        info = self._info(path)
+        if info is None:
+            return None
+        try:
+            shutil.copy(os.path.join(path, info['filename']), directory)
+            # Mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            # Removed by another process, or corrupted
+            return None
+        return info['name']
+
+    def key(self, name, source, source_file, libs=None, libd=None, incd=None,
+            carg=None, larg=None):
+        """
+        Returns a key for a module named ``name``, created from the source
+        code ``source``, which will be stored in a file with the name
+        ``source_file``, and compiled using the libraries, library directories,
+        include directories, compiler arguments, and linker arguments given by
+        ``libs``, ``libd``, ``incd``, ``carg``, and ``larg``.
+
+        The module name is not included in the key, so that two modules with
+        identical source code but different names share the same key.
+        """
+        h = hashlib.sha256()
+
+        def add(x):
+            h.update(repr(x).encode('utf-8'))
+            h.update(b'\0')
+
+        # Source code, with the module name removed
+        add(source.replace(name, '<module_name>'))
+        add(os.path.splitext(source_file)[1])
+
+        # Header files in the myokit/_sim directory
+        for path in sorted(glob.glob(os.path.join(myokit.DIR_CFUNC, '*.h*'))):
+            with open(path, 'rb') as f:
+                h.update(f.read())
+
+        # Compilation arguments
+        add(libs)
+        add(libd)
+        add(incd)
+        add(carg)
+        add(larg)
+
+        # Compiler and compiler flags, as used by distutils/setuptools
+        for var in ('CC', 'CXX', 'CFLAGS', 'LDSHARED', 'CCSHARED'):
+            add(sysconfig.get_config_var(var))
+            add(os.environ.get(var))
+        for var in ('CPPFLAGS', 'LDFLAGS'):
+            add(os.environ.get(var))
+
+        # Python version and ABI
+        add(sys.version)
+        add(sysconfig.get_config_var('EXT_SUFFIX'))
+        add(sysconfig.get_config_var('SOABI'))
+        add(platform.machine())
+        add(platform.system())
+
+        # Library versions
+        add(myokit.SUNDIALS_VERSION)
+        add(myokit.__version__)
+
+        return h.hexdigest()
+
+    def path(self):
+        """
+        Returns the directory this cache stores its modules in.
+        """
+        return self._path
+
+    def prune(self, max_size=None):
+        """
+        Removes the least recently used modules until the cache size is less
+        than or equal to ``max_size`` (in megabytes). If no size is given, the
+        cache's maximum size is used.
+
+        Returns the number of modules removed.
+        """
+        if max_size is None:
+            max_size = self._max_size
+        else:
+            max_size = int(float(max_size) * 1024 * 1024)
+
+        entries = self.entries()
+        total = sum([x[2] for x in entries])
+        n = 0
+        while total > max_size and entries:
+            key, name, size, last_used = entries.pop()
+            if self._remove(key):
+                total -= size
+                n += 1
+        return n
+
+    def size(self):
+        """
+        Returns the total size of the cached modules, in bytes.
+        """
+        return sum([x[2] for x in self.entries()])
+
+    def store(self, key, name, directory):
+        """
+        Stores the compiled module ``name``, found in ``directory``, under the
+        given ``key``.
+
+        Returns ``True`` if the module was stored, or ``False`` if an existing
+        module with the same key was found.
+        """
+        # Find compiled module
+        filename = None
+        for path in os.listdir(directory):
+            if path.startswith(name + '.'):
+                if os.path.isfile(os.path.join(directory, path)):
+                    filename = path
+                    break
+        if filename is None:
+            raise ValueError(
+                'No compiled module <' + name + '> found in '
+                + myokit.format_path(directory))
+
+        # Already stored? Then mark as recently used and return
+        entry = os.path.join(self._path, key)
+        if os.path.isdir(entry):
+            try:
+                os.utime(entry, None)
+            except (IOError, OSError):  # pragma: no cover
+                pass
+            return False
+
+        # Create a temporary directory inside the cache, so that it can be
+        # moved into place in a single (atomic) operation
+        if not os.path.isdir(self._path):
+            try:
+                os.makedirs(self._path)
+            except OSError:     # pragma: no cover
+                # Created by another process
+                if not os.path.isdir(self._path):
+                    raise
+        temp = tempfile.mkdtemp(prefix='tmp-', dir=self._path)
+        try:
+            shutil.copy(os.path.join(directory, filename), temp)
+            with open(os.path.join(temp, INFO_FILE), 'w') as f:
+                json.dump({'name': name, 'filename': filename}, f)
+            try:
+                os.rename(temp, entry)
+            except OSError:
+                # Stored by another process in the meantime
+                return False
+        finally:
+            if os.path.isdir(temp):
+                myokit._rmtree(temp)
+
+        # Remove least recently used entries
+        self.prune()
+        return True
+
+    def _info(self, path):
+        """
+        Returns the information dict stored in the given cache entry, or
+        ``None`` if the entry doesn't exist or can't be read.
+        """
+        try:
+            with open(os.path.join(path, INFO_FILE), 'r') as f:
+                info = json.load(f)
+            info['name'] = str(info['name'])
+            info['filename'] = str(info['filename'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        return info
+
+    def _keys(self):
+        """
+        Returns a list of the keys found in the cache directory.
+        """
+        try:
+            paths = os.listdir(self._path)
+        except (IOError, OSError):
+            return []
+        return [x for x in paths if len(x) == 64 and not x.startswith('tmp-')]
+
+    def _remove(self, key):
+        """
+        Removes the entry with the given key, returns ``True`` if succesful.
+        """
+        try:
+            myokit._rmtree(os.path.join(self._path, key))
+        except (IOError, OSError):  # pragma: no cover
+            log = logging.getLogger(__name__)
+            log.warning('Unable to remove cached module ' + str(key))
+            return False
+        return True
+
+
+def _size(path):
+    """
+    Returns the combined size of all files in a directory.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
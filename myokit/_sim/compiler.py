@@ -49,7 +49,7 @@ class Compiler(myokit.CModule):
         args = {'module_name': mname}
         try:
             Compiler._instance = self._compile(
-                mname, fname, args, libs, libd, incd)
+                mname, fname, args, libs, libd, incd, cache=False)
         except myokit.CompilationError as e:  # pragma: no cover
             Compiler._instance = False
             Compiler._message = str(e)
@@ -8,6 +8,14 @@
 # module_name A module name
 # model       A myokit model
 # potential   A variable from the model used to track threshold crossings
+# linear_solver The linear solver to use: 'dense', 'band', or 'sparse'
+# bandwidth   A tuple (upper, lower) with the Jacobian bandwidths (band only)
+# sparsity    A tuple (colptr, rowind, groups) describing the Jacobian's
+#             sparsity pattern and column grouping (sparse only)
+# jacobian    A list of columns for an analytic Jacobian, or None (see
+#             cvodesim._jacobian_columns)
+# sensitivities A list of sensitivity equations, or None (see
+#             cvodesim._sensitivity_equations)
 # -----------------------------------------------------------------------------
 #
 # This file is part of Myokit.
@@ -23,6 +31,13 @@ model.create_unique_names()
 # Get expression writer
 w = ansic.AnsiCExpressionWriter()
 
+# Define name of the field used to store a variable in the ModelData struct
+def field(var):
+    if var.is_constant():
+        return 'AC_' + var.uname()
+    else:
+        return 'AV_' + var.uname()
+
 # Define lhs function
 def v(var):
     # Explicitly asking for derivative?
@@ -31,14 +46,14 @@ def v(var):
     # Name given? get variable object from name
     if isinstance(var, myokit.Name):
         var = var.var()
+    # Temporary variables used in the Jacobian are given as strings
+    if not isinstance(var, myokit.Variable):
+        return str(var)
     # Handle states
     if var.is_state():
         return 'NV_Ith_S(y, ' + str(var.indice()) + ')'
     # Handle constants and intermediary variables
-    if var.is_constant():
-        return 'AC_' + var.uname()
-    else:
-        return 'AV_' + var.uname()
+    return 'd->' + field(var)
 w.set_lhs_function(v)
 
 # Tab
@@ -48,9 +63,9 @@ tab = '    '
 # to zero and remove any unsupported bindings.
 bound_variables = model.prepare_bindings({
     'time'        : 't',
-    'pace'        : 'engine_pace',
-    'realtime'    : 'engine_realtime',
-    'evaluations' : 'engine_evaluations',
+    'pace'        : 'd->pace',
+    'realtime'    : 'd->realtime',
+    'evaluations' : 'd->evaluations',
     })
 #
 # About the bindings:
@@ -58,42 +73,86 @@ bound_variables = model.prepare_bindings({
 # Time is bound to "t", the time variable used in the function. This is
 #  required for periodic logging and point-list logging, when "tlog" increases
 #  while engine_time stays fixed at the current solver time.
-# Pace is bound to engine_pace, since the solver always visits the points where
+# Pace is bound to the pace field in ModelData, since the solver always visits the points where
 #  its value changes the same problem as with logging "engine_time" doesn't
 #  occur.
 # Realtime is only useful without variable logging, so again binding to global
 #  is ok.
 # Evaluations may increase during interpolation, but this evaluation will be
-#  taken into account in the global variable "engine_evaluations", so this is
-#  fine.
+#  taken into account in the evaluations field in ModelData, so this is fine.
 #
 
 # Get equations
 equations = model.solvable_order()
 ?>
 #include <Python.h>
+#include <stddef.h>
 #include <stdio.h>
 #include <math.h>
 #include <string.h>
-#include <cvode/cvode.h>
-#include <nvector/nvector_serial.h>
+#ifdef _WIN32
+    #include <windows.h>
+#else
+    #include <pthread.h>
+#endif
 #define MYOKIT_SUNDIALS_VERSION <?= myokit.SUNDIALS_VERSION ?>
+
+/* Forward sensitivities require CVODES, which includes all of CVODE */
+#define USE_CVODES <?= 1 if sensitivities and model.count_states() > 0 else 0 ?>
+#if USE_CVODES
+    #include <cvodes/cvodes.h>
+#else
+    #include <cvode/cvode.h>
+#endif
+#include <nvector/nvector_serial.h>
+
+/* Linear solver selection */
+#define LINSOL_DENSE 0
+#define LINSOL_BAND 1
+#define LINSOL_SPARSE 2
+#define LINEAR_SOLVER <?= ('dense', 'band', 'sparse').index(linear_solver) ?>
+
 #if MYOKIT_SUNDIALS_VERSION >= 30000
-    #include <sunmatrix/sunmatrix_dense.h>
-    #include <sunlinsol/sunlinsol_dense.h>
-    #include <cvode/cvode_direct.h>
+    #if LINEAR_SOLVER == LINSOL_SPARSE
+        #include <sunmatrix/sunmatrix_sparse.h>
+        #include <sunlinsol/sunlinsol_klu.h>
+    #elif LINEAR_SOLVER == LINSOL_BAND
+        #include <sunmatrix/sunmatrix_band.h>
+        #include <sunlinsol/sunlinsol_band.h>
+    #else
+        #include <sunmatrix/sunmatrix_dense.h>
+        #include <sunlinsol/sunlinsol_dense.h>
+    #endif
+    #if USE_CVODES
+        #include <cvodes/cvodes_direct.h>
+    #else
+        #include <cvode/cvode_direct.h>
+    #endif
 #else
-    #include <cvode/cvode_dense.h>
+    #if LINEAR_SOLVER == LINSOL_BAND && USE_CVODES
+        #include <cvodes/cvodes_band.h>
+    #elif LINEAR_SOLVER == LINSOL_BAND
+        #include <cvode/cvode_band.h>
+    #elif USE_CVODES
+        #include <cvodes/cvodes_dense.h>
+    #else
+        #include <cvode/cvode_dense.h>
+    #endif
 #endif
 #include <sundials/sundials_types.h>
 #include "pacing.h"
 
 #define N_STATE <?= model.count_states() ?>
 #define USE_CVODE <?= 1 if model.count_states() > 0 else 0 ?>
-
-/* Pacing */
-ESys epacing;               /* Event-based pacing system */
-FSys fpacing;               /* Fixed-form pacing system */
+#define ANALYTIC_JACOBIAN <?= 0 if jacobian is None else 1 ?>
+<?
+n_sens_dep = n_sens_indep = 0
+if sensitivities:
+    n_sens_indep = len(sensitivities)
+    n_sens_dep = len(sensitivities[0][4])
+?>
+#define N_SENS_DEP <?= n_sens_dep ?>
+#define N_SENS_INDEP <?= n_sens_indep ?>
 
 /*
  * Check sundials flags, set python error
@@ -198,28 +257,61 @@ check_cvode_flag(void *flagvalue, char *funcname, int opt)
 }
 
 /*
- * Declare intermediary, temporary and system variables
+ * Model variables and simulation inputs.
+ *
+ * These are stored in a struct that is passed to the rhs function, so that
+ * several copies of the model can be simulated at the same time (see
+ * sim_ensemble).
+ */
+typedef struct {
+    realtype pace;          /* Pacing level */
+    realtype realtime;      /* Elapsed system time */
+    long evaluations;       /* Number of rhs evaluations */
+    FSys fpacing;           /* Fixed-form pacing system, or NULL */
+    realtype rootfinding_threshold; /* Threshold used in root finding */
+    int n_conditions;               /* Number of threshold conditions used in root finding */
+    int condition_offset;           /* Index of the first condition in the root function output */
+    int condition_rhs;              /* True if the rhs is needed to evaluate the conditions */
+    int* condition_state;           /* The state used by each condition, or -1 */
+    realtype** condition_var;       /* The non-state variable used by each condition */
+    realtype* condition_threshold;  /* The threshold used by each condition */
+    N_Vector condition_dy;          /* Used to store derivatives when evaluating conditions */
+    realtype abs_tol;               /* Absolute tolerance, used in finite difference Jacobians */
+<?
+for var in model.variables(state=False, deep=True):
+    print(tab + 'realtype ' + field(var) + ';')
+?>} ModelData;
+
+/*
+ * Set the initial values of all model variables with a literal value
  */
-static realtype engine_time = 0;        /* Engine time */
-static realtype engine_time_last = 0;   /* Previous engine time */
-static realtype engine_pace = 0;
-static realtype engine_realtime = 0;
-static realtype engine_starttime = 0;
-static realtype rootfinding_threshold = 0;
-static long engine_evaluations = 0;
-static long engine_steps = 0;
+static void
+initLiterals(ModelData* d)
+{
+    d->pace = 0;
+    d->realtime = 0;
+    d->evaluations = 0;
+    d->fpacing = NULL;
+    d->rootfinding_threshold = 0;
+    d->n_conditions = 0;
+    d->condition_offset = 0;
+    d->condition_rhs = 0;
+    d->condition_state = NULL;
+    d->condition_var = NULL;
+    d->condition_threshold = NULL;
+    d->condition_dy = NULL;
+    d->abs_tol = 1e-6;
 <?
 for var in model.variables(state=False, deep=True):
     if var.is_literal():
-        print('static realtype ' + v(var) + ' = ' + myokit.strfloat(var.rhs().eval()) + ';')
-    else:
-        print('static realtype ' + v(var) + ';')
-?>
+        print(tab + v(var) + ' = ' + myokit.strfloat(var.rhs().eval()) + ';')
+?>}
+
 /*
  * Set values of calculated constants
  */
 static void
-updateConstants(void)
+updateConstants(ModelData* d)
 {
 <?
 for label, eqs in equations.items():
@@ -234,12 +326,15 @@ for label, eqs in equations.items():
 static int
 rhs(realtype t, N_Vector y, N_Vector ydot, void *f_data)
 {
+    ModelData* d = (ModelData*)f_data;
+
     /* Fixed-form pacing? Then look-up correct value of pacing variable! */
     FSys_Flag flag_fpacing;
-    if (fpacing != NULL) {
-        engine_pace = FSys_GetLevel(fpacing, t, &flag_fpacing);
+    if (d->fpacing != NULL) {
+        d->pace = FSys_GetLevel(d->fpacing, t, &flag_fpacing);
         if (flag_fpacing != FSys_OK) { /* This should never happen */
-            FSys_SetPyErr(flag_fpacing);
+            /* No Python error is set here, as this function may be called
+               without holding the GIL. */
             return -1;  /* Negative value signals irrecoverable error to CVODE */
         }
     }
@@ -255,7 +350,7 @@ for label, eqs in equations.items():
                 print(tab + w.eq(eq) + ';')
         print(tab)
 ?>
-    engine_evaluations++;
+    d->evaluations++;
     return 0;
 }
 
@@ -265,6 +360,7 @@ for label, eqs in equations.items():
 static int
 update_bindings(realtype t, N_Vector y, N_Vector ydot, void *f_data)
 {
+    ModelData* d = (ModelData*)f_data;
 <?
 for var, internal in bound_variables.items():
     print(tab + v(var) + ' = ' + internal + ';')
@@ -278,33 +374,445 @@ for var, internal in bound_variables.items():
 static int
 update_realtime_bindings(realtype t, N_Vector y, N_Vector ydot, void *f_data)
 {
+    ModelData* d = (ModelData*)f_data;
 <?
 var = model.binding('realtime')
 if var is not None:
-    print(tab + v(var) + ' = engine_realtime;')
+    print(tab + v(var) + ' = d->realtime;')
 ?>
     return 0;
 }
 
 /*
- * Root finding function
+ * Error handler for CVODE.
+ *
+ * By default, CVODE prints error and warning messages to stderr. Errors are
+ * already reported through the returned flags, so the messages are ignored
+ * here. Doing this per solver (instead of redirecting the process's output
+ * from Python) means that simulations can safely run in parallel threads.
+ */
+static void
+cvode_error_handler(int error_code, const char *module, const char *function, char *msg, void *eh_data)
+{
+}
+
+/*
+ * Root finding function. The first component (if used) is the apd variable
+ * minus the apd threshold, and is followed by one component for every
+ * threshold condition.
  */<?
 root_finding_indice = potential.indice() if potential is not None else 0
 ?>
 static int
 root_finding(realtype t, N_Vector y, realtype *gout, void *f_data)
 {
-    gout[0] = NV_Ith_S(y, <?=root_finding_indice?>) - rootfinding_threshold;
+    int i;
+    ModelData* d = (ModelData*)f_data;
+    if (d->condition_offset > 0) {
+        gout[0] = NV_Ith_S(y, <?=root_finding_indice?>) - d->rootfinding_threshold;
+    }
+    if (d->condition_rhs) {
+        if (rhs(t, y, d->condition_dy, d)) return -1;
+    }
+    for (i=0; i<d->n_conditions; i++) {
+        if (d->condition_state[i] >= 0) {
+            gout[d->condition_offset + i] = NV_Ith_S(y, d->condition_state[i]) - d->condition_threshold[i];
+        } else {
+            gout[d->condition_offset + i] = *(d->condition_var[i]) - d->condition_threshold[i];
+        }
+    }
+    return 0;
+}
+
+/*
+ * Simulation instance
+ *
+ * The settings, changed constants, and statistics of a single Simulation
+ * object are stored in a SimInstance struct, which is created by sim_create
+ * and passed back to Python as a capsule. All other functions in this module
+ * (except sim_step and sim_clean, which take a run) take this capsule as
+ * their first argument, so that the module itself holds no state.
+ *
+ * Solver objects are kept between runs: when a run is cleaned up, its CVODE
+ * memory, matrix and linear solver are stored in the instance (unless
+ * another run's objects are already stored), so that the next run can
+ * re-initialise them with CVodeReInit instead of creating new ones. Only
+ * accessed while holding the GIL.
+ */
+typedef struct {
+    ModelData data;             /* Model variables, including any constants changed with sim_set_constant */
+    double abs_tol;             /* The absolute tolerance */
+    double rel_tol;             /* The relative tolerance */
+    double dt_max;              /* The maximum step size (0.0 for none) */
+    double dt_min;              /* The minimum step size (0.0 for none) */
+    long last_steps;            /* Number of steps taken in the last run */
+    long last_evaluations;      /* Number of rhs evaluations in the last run */
+    long solvers_created;       /* Number of times new solver memory was created */
+    #if USE_CVODE
+    void* cvode_mem;            /* Solver memory kept for reuse, or NULL */
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    SUNMatrix sunmatrix;        /* Matrix kept for reuse, or NULL */
+    SUNLinearSolver sunsolver;  /* Linear solver kept for reuse, or NULL */
+    #endif
+    #endif
+} SimInstance;
+
+#define SIM_INSTANCE_CAPSULE_NAME "myokit.Simulation.instance"
+
+/*
+ * Frees any solver objects kept for reuse between runs
+ */
+static void
+sim_free_cached_solver(SimInstance* s)
+{
+    #if USE_CVODE
+    if (s->cvode_mem != NULL) { CVodeFree(&s->cvode_mem); s->cvode_mem = NULL; }
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    if (s->sunsolver != NULL) { SUNLinSolFree(s->sunsolver); s->sunsolver = NULL; }
+    if (s->sunmatrix != NULL) { SUNMatDestroy(s->sunmatrix); s->sunmatrix = NULL; }
+    #endif
+    #endif
+}
+
+/*
+ * Frees a SimInstance when its capsule is garbage collected
+ */
+static void
+sim_instance_destructor(PyObject* capsule)
+{
+    SimInstance* s = (SimInstance*)PyCapsule_GetPointer(capsule, SIM_INSTANCE_CAPSULE_NAME);
+    if (s != NULL) {
+        sim_free_cached_solver(s);
+        free(s);
+    }
+}
+
+/*
+ * Returns the SimInstance stored in the given capsule, or NULL (with a Python
+ * exception set) if the object is not a valid instance capsule.
+ */
+static SimInstance*
+sim_get_instance(PyObject* capsule)
+{
+    return (SimInstance*)PyCapsule_GetPointer(capsule, SIM_INSTANCE_CAPSULE_NAME);
+}
+
+/*
+ * Returns the SimInstance stored in the capsule passed as only argument in
+ * args, or NULL (with a Python exception set) if no valid capsule was passed.
+ */
+static SimInstance*
+sim_get_instance_arg(PyObject *args)
+{
+    PyObject* capsule;
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(PyExc_Exception, "Expected input argument: instance (capsule).");
+        return NULL;
+    }
+    return sim_get_instance(capsule);
+}
+
+/*
+ * Creates a new SimInstance, with default settings, and returns it as a
+ * capsule.
+ */
+static PyObject*
+sim_create(PyObject *self, PyObject *args)
+{
+    PyObject* capsule;
+    SimInstance* s = (SimInstance*)calloc(1, sizeof(SimInstance));
+    if (s == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for simulation.");
+        return 0;
+    }
+    initLiterals(&s->data);
+    s->abs_tol = 1e-6;
+    s->rel_tol = 1e-4;
+    s->dt_max = 0;
+    s->dt_min = 0;
+    capsule = PyCapsule_New((void*)s, SIM_INSTANCE_CAPSULE_NAME, sim_instance_destructor);
+    if (capsule == NULL) free(s);
+    return capsule;
+}
+
+#if USE_CVODE
+#if LINEAR_SOLVER == LINSOL_SPARSE
+/*
+ * Sparsity pattern of the Jacobian, in compressed sparse column format, and a
+ * grouping of the columns such that no two columns in the same group have a
+ * non-zero in the same row.
+ */<?
+if linear_solver == 'sparse':
+    colptr, rowind, groups = sparsity
+    print('#define JAC_NNZ ' + str(len(rowind)))
+    print('#define JAC_NGROUPS ' + str(1 + max(groups)))
+    print('static const sunindextype jac_colptr[] = {'
+          + ', '.join([str(x) for x in colptr]) + '};')
+    print('static const sunindextype jac_rowind[] = {'
+          + ', '.join([str(x) for x in rowind]) + '};')
+    print('static const int jac_group[] = {'
+          + ', '.join([str(x) for x in groups]) + '};')
+?>
+#if !ANALYTIC_JACOBIAN
+/*
+ * Jacobian function for the sparse linear solver.
+ *
+ * CVODE can only approximate dense and banded Jacobians itself, so for the
+ * sparse solver a finite difference approximation is made here. Columns that
+ * don't share any non-zero rows are perturbed simultaneously, so that the
+ * number of rhs evaluations equals the number of column groups instead of the
+ * number of states.
+ */
+static int
+jac_sparse(realtype t, N_Vector y, N_Vector fy, SUNMatrix J, void *user_data,
+           N_Vector tmp1, N_Vector tmp2, N_Vector tmp3)
+{
+    int g, j, k;
+    realtype yj, srur;
+    realtype* inc = NV_DATA_S(tmp3);
+    sunindextype* colptr = SM_INDEXPTRS_S(J);
+    sunindextype* rowind = SM_INDEXVALS_S(J);
+    realtype* data = SM_DATA_S(J);
+
+    /* Set sparsity pattern */
+    for (j=0; j<=N_STATE; j++) colptr[j] = jac_colptr[j];
+    for (k=0; k<JAC_NNZ; k++) rowind[k] = jac_rowind[k];
+
+    /* Perturb each group of columns in turn */
+    srur = sqrt(UNIT_ROUNDOFF);
+    N_VScale(RCONST(1.0), y, tmp1);
+    for (g=0; g<JAC_NGROUPS; g++) {
+        for (j=0; j<N_STATE; j++) {
+            if (jac_group[j] == g) {
+                yj = NV_Ith_S(y, j);
+                inc[j] = srur * (fabs(yj) > ((ModelData*)user_data)->abs_tol ? fabs(yj) : ((ModelData*)user_data)->abs_tol);
+                NV_Ith_S(tmp1, j) = yj + inc[j];
+            }
+        }
+        if (rhs(t, tmp1, tmp2, user_data) != 0) return -1;
+        for (j=0; j<N_STATE; j++) {
+            if (jac_group[j] == g) {
+                for (k=jac_colptr[j]; k<jac_colptr[j + 1]; k++) {
+                    data[k] = (NV_Ith_S(tmp2, jac_rowind[k]) - NV_Ith_S(fy, jac_rowind[k])) / inc[j];
+                }
+                NV_Ith_S(tmp1, j) = NV_Ith_S(y, j);
+            }
+        }
+    }
+    return 0;
+}
+#endif
+#endif
+
+#if ANALYTIC_JACOBIAN
+/*
+ * Analytic Jacobian function.
+ *
+ * The intermediary variables are first evaluated at the given state, after
+ * which the derivatives with respect to each state are calculated using the
+ * chain rule. Only the structurally non-zero entries are set.
+ */
+static int
+jac_analytic(realtype t, N_Vector y, N_Vector fy, SUNMatrix J, void *user_data,
+             N_Vector tmp1, N_Vector tmp2, N_Vector tmp3)
+{
+    ModelData* d = (ModelData*)user_data;
+    N_Vector ydot = tmp1;
+    #if LINEAR_SOLVER == LINSOL_SPARSE
+    int k;
+    sunindextype* colptr = SM_INDEXPTRS_S(J);
+    sunindextype* rowind = SM_INDEXVALS_S(J);
+    realtype* data = SM_DATA_S(J);
+    #endif
+
+    /* Fixed-form pacing? Then look-up correct value of pacing variable! */
+    FSys_Flag flag_fpacing;
+    if (d->fpacing != NULL) {
+        d->pace = FSys_GetLevel(d->fpacing, t, &flag_fpacing);
+        if (flag_fpacing != FSys_OK) return -1;
+    }
+<?
+if jacobian is not None:
+    for label, eqs in equations.items():
+        if eqs.has_equations(const=False):
+            print(tab + '/* ' + label + ' */')
+            for eq in eqs.equations(const=False):
+                var = eq.lhs.var()
+                try:
+                    print(tab + v(var) + ' = ' + bound_variables[var] + ';')
+                except KeyError:
+                    print(tab + w.eq(eq) + ';')
+            print(tab)
+?>
+    #if LINEAR_SOLVER == LINSOL_SPARSE
+    /* Set sparsity pattern, and clear entries not set below */
+    for (k=0; k<=N_STATE; k++) colptr[k] = jac_colptr[k];
+    for (k=0; k<JAC_NNZ; k++) {
+        rowind[k] = jac_rowind[k];
+        data[k] = 0;
+    }
+    #endif
+<?
+if jacobian is not None:
+    states = list(model.states())
+    if linear_solver == 'sparse':
+        colptr, rowind, groups = sparsity
+    for j, temporaries, entries in jacobian:
+        if not entries:
+            continue
+        print(tab + '/* Derivatives with respect to ' + states[j].qname() + ' */')
+        print(tab + '{')
+        for name, expr in temporaries:
+            print(2 * tab + 'const realtype ' + name + ' = ' + w.ex(expr) + ';')
+        for i, name in entries:
+            if linear_solver == 'sparse':
+                k = colptr[j] + rowind[colptr[j]:colptr[j + 1]].index(i)
+                print(2 * tab + 'data[' + str(k) + '] = ' + name + ';')
+            elif linear_solver == 'band':
+                print(2 * tab + 'SM_ELEMENT_B(J, ' + str(i) + ', ' + str(j) + ') = ' + name + ';')
+            else:
+                print(2 * tab + 'SM_ELEMENT_D(J, ' + str(i) + ', ' + str(j) + ') = ' + name + ';')
+        print(tab + '}')
+?>
+    return 0;
+}
+#endif
+
+/*
+ * Creates the matrix and linear solver selected for this module, and attaches
+ * them to the CVODE memory. On failure, the name of the failing function is
+ * stored in ``fname`` and a non-zero value is returned.
+ *
+ * This function may be called without holding the GIL.
+ */
+#if MYOKIT_SUNDIALS_VERSION >= 30000
+static int
+create_linear_solver(void* cvode_mem, N_Vector y, SUNMatrix* matrix, SUNLinearSolver* solver, char** fname)
+{
+    #if LINEAR_SOLVER == LINSOL_SPARSE
+    *fname = "SUNSparseMatrix";
+    *matrix = SUNSparseMatrix(N_STATE, N_STATE, JAC_NNZ, CSC_MAT);
+    if (*matrix == NULL) return 1;
+    *fname = "SUNKLU";
+    *solver = SUNKLU(y, *matrix);
+    #elif LINEAR_SOLVER == LINSOL_BAND
+    *fname = "SUNBandMatrix";
+    #if MYOKIT_SUNDIALS_VERSION >= 40000
+    *matrix = SUNBandMatrix(N_STATE, <?= bandwidth[0] ?>, <?= bandwidth[1] ?>);
+    #else
+    *matrix = SUNBandMatrix(N_STATE, <?= bandwidth[0] ?>, <?= bandwidth[1] ?>, <?= min(bandwidth[0] + bandwidth[1], model.count_states() - 1) ?>);
+    #endif
+    if (*matrix == NULL) return 1;
+    *fname = "SUNBandLinearSolver";
+    *solver = SUNBandLinearSolver(y, *matrix);
+    #else
+    *fname = "SUNDenseMatrix";
+    *matrix = SUNDenseMatrix(N_STATE, N_STATE);
+    if (*matrix == NULL) return 1;
+    *fname = "SUNDenseLinearSolver";
+    *solver = SUNDenseLinearSolver(y, *matrix);
+    #endif
+    if (*solver == NULL) return 1;
+
+    *fname = "CVDlsSetLinearSolver";
+    if (CVDlsSetLinearSolver(cvode_mem, *solver, *matrix) < 0) return 1;
+    #if ANALYTIC_JACOBIAN
+    *fname = "CVDlsSetJacFn";
+    if (CVDlsSetJacFn(cvode_mem, jac_analytic) < 0) return 1;
+    #elif LINEAR_SOLVER == LINSOL_SPARSE
+    *fname = "CVDlsSetJacFn";
+    if (CVDlsSetJacFn(cvode_mem, jac_sparse) < 0) return 1;
+    #endif
+    return 0;
+}
+#else
+static int
+create_linear_solver(void* cvode_mem, char** fname)
+{
+    #if LINEAR_SOLVER == LINSOL_BAND
+    *fname = "CVBand";
+    return CVBand(cvode_mem, N_STATE, <?= bandwidth[0] ?>, <?= bandwidth[1] ?>) < 0;
+    #else
+    *fname = "CVDense";
+    return CVDense(cvode_mem, N_STATE) < 0;
+    #endif
+}
+#endif
+#endif
+
+#if USE_CVODES
+/*
+ * Right-hand-side function of the sensitivity equations.
+ *
+ * The intermediary variables are first evaluated at the given state, after
+ * which the derivatives of the state derivatives with respect to each
+ * independent are calculated using the chain rule.
+ */
+static int
+rhs_sens(int ns, realtype t, N_Vector y, N_Vector ydot, N_Vector* yS,
+         N_Vector* ySdot, void *user_data, N_Vector tmp1, N_Vector tmp2)
+{
+    ModelData* d = (ModelData*)user_data;
+
+    /* Fixed-form pacing? Then look-up correct value of pacing variable! */
+    FSys_Flag flag_fpacing;
+    if (d->fpacing != NULL) {
+        d->pace = FSys_GetLevel(d->fpacing, t, &flag_fpacing);
+        if (flag_fpacing != FSys_OK) return -1;
+    }
+<?
+if sensitivities and model.count_states() > 0:
+    for label, eqs in equations.items():
+        if eqs.has_equations(const=False):
+            print(tab + '/* ' + label + ' */')
+            for eq in eqs.equations(const=False):
+                var = eq.lhs.var()
+                try:
+                    print(tab + v(var) + ' = ' + bound_variables[var] + ';')
+                except KeyError:
+                    print(tab + w.eq(eq) + ';')
+            print(tab)
+    for k, seeds, temporaries, states, outputs in sensitivities:
+        print(tab + '/* Derivatives with respect to independent ' + str(k) + ' */')
+        print(tab + '{')
+        for name, i in seeds:
+            print(2 * tab + 'const realtype ' + name + ' = NV_Ith_S(yS[' + str(k) + '], ' + str(i) + ');')
+        for name, expr in temporaries:
+            print(2 * tab + 'const realtype ' + name + ' = ' + w.ex(expr) + ';')
+        for i, expr in states:
+            print(2 * tab + 'NV_Ith_S(ySdot[' + str(k) + '], ' + str(i) + ') = ' + w.ex(expr) + ';')
+        print(tab + '}')
+?>
     return 0;
 }
+#endif
 
+#if N_SENS_INDEP > 0
 /*
- * Settings
+ * Calculates the sensitivities of the dependent variables with respect to the
+ * independents, from the state sensitivities ``yS``, and stores them in
+ * ``s`` (ordered by dependent, then independent).
+ *
+ * The intermediary variables and state derivatives must already have been
+ * evaluated at the given state. Does not use the Python API.
  */
-static double abs_tol = 1e-6; /* The absolute tolerance */
-static double rel_tol = 1e-4; /* The relative tolerance */
-static double dt_max = 0;     /* The maximum step size (0.0 for none) */
-static double dt_min = 0;     /* The minimum step size (0.0 for none) */
+static void
+sens_outputs(N_Vector y, N_Vector ydot, N_Vector* yS, ModelData* d, realtype* s)
+{
+<?
+if sensitivities:
+    for k, seeds, temporaries, states, outputs in sensitivities:
+        print(tab + '/* Derivatives with respect to independent ' + str(k) + ' */')
+        print(tab + '{')
+        for name, i in seeds:
+            print(2 * tab + 'const realtype ' + name + ' = NV_Ith_S(yS[' + str(k) + '], ' + str(i) + ');')
+        for name, expr in temporaries:
+            print(2 * tab + 'const realtype ' + name + ' = ' + w.ex(expr) + ';')
+        for m, expr in outputs:
+            print(2 * tab + 's[' + str(m * n_sens_indep + k) + '] = ' + w.ex(expr) + ';')
+        print(tab + '}')
+?>}
+#endif
 
 /*
  * Change the tolerance settings
@@ -313,13 +821,17 @@ static PyObject*
 sim_set_tolerance(PyObject *self, PyObject *args)
 {
     /* Check input arguments */
+    PyObject* capsule;
+    SimInstance* s;
     double tabs, trel;
-    if (!PyArg_ParseTuple(args, "dd", &tabs, &trel)) {
-        PyErr_SetString(PyExc_Exception, "Expected input arguments: abs_tol(float), rel_tol(float).");
+    if (!PyArg_ParseTuple(args, "Odd", &capsule, &tabs, &trel)) {
+        PyErr_SetString(PyExc_Exception, "Expected input arguments: instance (capsule), abs_tol(float), rel_tol(float).");
         return 0;
     }
-    abs_tol = tabs;
-    rel_tol = trel;
+    s = sim_get_instance(capsule);
+    if (s == NULL) return 0;
+    s->abs_tol = tabs;
+    s->rel_tol = trel;
     Py_RETURN_NONE;
 }
 
@@ -330,12 +842,16 @@ static PyObject*
 sim_set_max_step_size(PyObject *self, PyObject *args)
 {
     /* Check input arguments */
+    PyObject* capsule;
+    SimInstance* s;
     double tmax;
-    if (!PyArg_ParseTuple(args, "d", &tmax)) {
-        PyErr_SetString(PyExc_Exception, "Expected input argument: tmax(float).");
+    if (!PyArg_ParseTuple(args, "Od", &capsule, &tmax)) {
+        PyErr_SetString(PyExc_Exception, "Expected input arguments: instance (capsule), tmax(float).");
         return 0;
     }
-    dt_max = tmax;
+    s = sim_get_instance(capsule);
+    if (s == NULL) return 0;
+    s->dt_max = tmax;
     Py_RETURN_NONE;
 }
 
@@ -346,12 +862,16 @@ static PyObject*
 sim_set_min_step_size(PyObject *self, PyObject *args)
 {
     /* Check input arguments */
+    PyObject* capsule;
+    SimInstance* s;
     double tmin;
-    if (!PyArg_ParseTuple(args, "d", &tmin)) {
-        PyErr_SetString(PyExc_Exception, "Expected input argument: tmin(float).");
+    if (!PyArg_ParseTuple(args, "Od", &capsule, &tmin)) {
+        PyErr_SetString(PyExc_Exception, "Expected input arguments: instance (capsule), tmin(float).");
         return 0;
     }
-    dt_min = tmin;
+    s = sim_get_instance(capsule);
+    if (s == NULL) return 0;
+    s->dt_min = tmin;
     Py_RETURN_NONE;
 }
 
@@ -374,157 +894,855 @@ log_add(PyObject* log_dict, PyObject** logs, realtype** vars, int i, const char*
 }
 
 /*
- * Simulation variables
+ * Sets the variable used by every threshold condition listed for the given
+ * name in the dict of condition names.
  */
+static void
+condition_add(PyObject* names, realtype** vars, int n, const char* name, realtype* var)
+{
+    Py_ssize_t i;
+    long k;
+    PyObject* key = PyUnicode_FromString(name);
+    PyObject* list = PyDict_GetItem(names, key);    /* Borrowed reference */
+    Py_DECREF(key);
+    if (list == NULL || !PyList_Check(list)) return;
+    for (i=0; i<PyList_Size(list); i++) {
+        k = PyLong_AsLong(PyList_GetItem(list, i));
+        if (k >= 0 && k < n) vars[k] = var;
+    }
+}
 
-int running = 0;        /* Running yes or no */
-
-/* Input arguments */
-double tmin;            /* The initial simulation time */
-double tmax;            /* The final simulation time */
-PyObject* state_in;     /* The initial state */
-PyObject* state_out;    /* The final state */
-PyObject* inputs;       /* A vector used to return the binding inputs` values */
-PyObject* eprotocol;    /* An event-based pacing protocol */
-PyObject* fprotocol;    /* A fixed-form pacing protocol */
-PyObject* log_dict;     /* The log dict */
-double log_interval;    /* Periodic logging: The log interval (0 to disable) */
-PyObject* log_times;    /* Point-list logging: List of points (None to disable) */
-PyObject* root_list;    /* Empty list if root finding should be used */
-double root_threshold;  /* Threshold to use for root finding */
-PyObject* benchtime;    /* Callable time() function or None */
-
-/* Next simulation halting point */
-double tnext;
+/*
+ * Appends n values, read from values with the given stride, to a bytearray
+ * used as a growable buffer of doubles. Must be called while holding the GIL.
+ * Returns 0 if successful, or -1 (with a Python exception set) if not.
+ */
+static int
+log_extend(PyObject* buffer, const double* values, Py_ssize_t n, Py_ssize_t stride)
+{
+    Py_ssize_t i;
+    Py_ssize_t size = PyByteArray_Size(buffer);
+    double* data;
+    if (n == 0) return 0;
+    if (PyByteArray_Resize(buffer, size + n * (Py_ssize_t)sizeof(double))) return -1;
+    data = (double*)(PyByteArray_AsString(buffer) + size);
+    for (i=0; i<n; i++) {
+        data[i] = values[i * stride];
+    }
+    return 0;
+}
 
 /* Checking for repeated zero size steps */
-int zero_step_count;
-int max_zero_step_count = 500;   /* Increased this from 50 */
-
-/* CVode objects */
-void *cvode_mem;     /* The memory used by the solver */
-N_Vector y;          /* Stores the current position y */
-N_Vector y_log;      /* Used to store y when logging */
-N_Vector dy_log;     /* Used to store dy when logging */
-N_Vector y_last;     /* Used to store previous value of y for error handling */
-#if MYOKIT_SUNDIALS_VERSION >= 30000
-SUNMatrix sundense_matrix;          /* Dense matrix for linear solves */
-SUNLinearSolver sundense_solver;    /* Linear solver object */
-#endif
+static int max_zero_step_count = 500;   /* Increased this from 50 */
+
+/*
+ * Errors that can occur while stepping without holding the GIL. These are
+ * stored in the run struct, and converted to Python exceptions afterwards.
+ */
+#define SIM_OK              0
+#define SIM_ERR_PYTHON      1   /* A Python exception has already been set */
+#define SIM_ERR_CVODE       2   /* A CVODE function returned an error flag */
+#define SIM_ERR_EPACING     3   /* The event-based pacing system failed */
+#define SIM_ERR_ZERO_STEP   4   /* Too many consecutive zero-length steps */
+#define SIM_ERR_OVERFLOW    5   /* Overflow in logged step count */
+#define SIM_ERR_MEMORY      6   /* Memory allocation failed */
 
-/* Root finding */
-int* rootsfound;     /* Used to store found roots */
+/*
+ * Dense output: for every step, a record is stored containing the start and
+ * end of the step, the time tn, step size h, and order q used by CVODE, and
+ * the Nordsieck array z[k] = h^k / k! * y^(k)(tn), for k = 0..DN_QMAX (with
+ * zeros for k > q).
+ */
+#define DN_QMAX 5
+#define DN_RECORD_SIZE (5 + (DN_QMAX + 1) * N_STATE)
 
-/* Logging */
-PyObject** logs;            /* An array of pointers to a PyObject */
-realtype** vars;            /* An array of pointers to realtype */
-int n_vars;                 /* Number of logging variables */
-int log_bound;              /* True if logging bound variables */
-int log_inter;              /* True if logging intermediary variables */
-int log_deriv;              /* True if logging derivatives */
-PyObject* list_update_str;  /* PyUnicode, used to call "append" method */
-Py_ssize_t ilog;            /* Periodic/point-list logging: Index of next point */
-double tlog;                /* Periodic/point-list logging: Next point */
-int dynamic_logging;        /* True if logging every point. */
+/*
+ * Simulation run
+ *
+ * All the state of a single simulation run is stored in a SimRun struct,
+ * which is created by sim_init and passed back to Python as a capsule. This
+ * allows several runs to be active at the same time, and lets sim_step
+ * release the GIL while CVODE is stepping.
+ */
+typedef struct {
+    int running;                /* True if the run is initialised */
+
+    /* The simulation instance (a new reference, released in sim_clean) */
+    PyObject* inst_capsule;     /* The capsule holding the instance */
+    SimInstance* inst;          /* The instance this run belongs to */
+
+    /* Input arguments (new references, released in sim_clean) */
+    double tmin;                /* The initial simulation time */
+    double tmax;                /* The final simulation time */
+    PyObject* state_out;        /* The final state */
+    PyObject* inputs;           /* A vector used to return the binding inputs` values */
+    PyObject* log_dict;         /* The log dict */
+    double log_interval;        /* Periodic logging: The log interval (0 to disable) */
+    PyObject* root_list;        /* Empty list if root finding should be used, None otherwise */
+    PyObject* benchtime;        /* Callable time() function or None */
+
+    /* Model variables and simulation inputs */
+    ModelData data;
+
+    /* Simulation time and progress */
+    realtype time;              /* Engine time */
+    realtype time_last;         /* Previous engine time */
+    realtype starttime;         /* System time at the start of the run */
+    double tnext;               /* Next simulation halting point */
+    long steps;                 /* Number of steps taken */
+    int zero_step_count;        /* Number of consecutive zero-length steps */
+
+    /* CVode objects */
+    void *cvode_mem;            /* The memory used by the solver */
+    int solver_ready;           /* True once the solver has been fully set up */
+    N_Vector y;                 /* Stores the current position y */
+    N_Vector y_log;             /* Used to store y when logging */
+    N_Vector dy_log;            /* Used to store dy when logging */
+    N_Vector y_last;            /* Used to store previous value of y for error handling */
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    SUNMatrix sunmatrix;        /* Matrix for linear solves */
+    SUNLinearSolver sunsolver;  /* Linear solver object */
+    #endif
+    int* rootsfound;            /* Used to store found roots */
+
+    /* Pacing */
+    ESys epacing;               /* Event-based pacing system */
+    FSys fpacing;               /* Fixed-form pacing system */
+
+    /* Logging */
+    PyObject** logs;            /* An array of pointers to a PyObject */
+    realtype** vars;            /* An array of pointers to realtype */
+    int n_vars;                 /* Number of logging variables */
+    int log_bound;              /* True if logging bound variables */
+    int log_inter;              /* True if logging intermediary variables */
+    int log_deriv;              /* True if logging derivatives */
+    int dynamic_logging;        /* True if logging every point. */
+    PyObject* list_update_str;  /* PyUnicode, used to call "append" method */
+    Py_ssize_t ilog;            /* Periodic/point-list logging: Index of next point */
+    double tlog;                /* Periodic/point-list logging: Next point */
+    double* log_times;          /* Point-list logging: Logging times, or NULL */
+    Py_ssize_t n_log_times;     /* Point-list logging: Number of logging times */
+    double* log_atol;           /* Change-driven logging: Absolute thresholds (negative to ignore a variable), or NULL */
+    double* log_rtol;           /* Change-driven logging: Relative thresholds */
+    double* log_last;           /* Change-driven logging: Values at the last logged point */
+    int log_last_set;           /* Change-driven logging: True if log_last has been set */
+
+    /* Sensitivities */
+    N_Vector* yS;               /* Stores the current state sensitivities */
+    N_Vector* yS_log;           /* Used to store state sensitivities when logging */
+    PyObject* s_state_out;      /* The final state sensitivities */
+    PyObject* s_buffer;         /* The buffer to log sensitivities in, or None */
+    realtype* s_values;         /* The logged sensitivities of the dependents */
+    realtype* s_scale;          /* Scaling factors for the independents */
+    int n_sens;                 /* Number of logged sensitivities per point */
+
+    /* Steady-state detection */
+    PyObject* steady;           /* List [period, tolerance, beats, converged] or None */
+    double beat_period;         /* The beat period (0 to disable detection) */
+    double beat_tol;            /* The tolerance for beat-to-beat changes */
+    double tbeat;               /* The start of the next beat */
+    long beats;                 /* Number of beats completed */
+    int converged;              /* True if a steady state was detected */
+    N_Vector y_beat;            /* The state at the start of the current beat */
+    N_Vector y_check;           /* Used to store y at the start of the next beat */
+
+    /* Online biomarkers */
+    PyObject* mk_out;           /* Bytearray to write per-beat records to, or NULL */
+    double mk_period;           /* The beat period (0 to disable biomarkers) */
+    double mk_tbeat;            /* The end of the current beat */
+    double mk_tstart;           /* The start of the current beat */
+    double mk_tprev;            /* The time of the previous point */
+    long mk_beats;              /* Number of beats completed */
+    int mk_n_traces;            /* Number of traces (states) analysed */
+    int* mk_index;              /* The state index of each trace */
+    double* mk_trace;           /* Per trace: rest, peak, time of peak, max slope, time of max slope, previous value */
+    int mk_n_levels;            /* Number of repolarisation levels */
+    int* mk_level_trace;        /* The trace each level belongs to */
+    double* mk_level;           /* Levels, as fractions of the amplitude (e.g. 0.9 for APD90) */
+    double* mk_cross;           /* The time each level was crossed in the current beat, or NaN */
+    double* mk_buffer;          /* Completed per-beat records */
+    Py_ssize_t n_mk_buffer;     /* Number of records in the buffer */
+    Py_ssize_t c_mk_buffer;     /* Capacity of the buffer, in records */
+    N_Vector y_mk;              /* Used to store the interpolated state at the end of a beat */
+    N_Vector y_mk_bisect;       /* Used to store interpolated states while locating level crossings */
+
+    /* Threshold conditions */
+    PyObject* cd_spec;          /* Condition specification list, or None */
+    PyObject* cd_out;           /* Bytearray to write crossings to, or NULL */
+    int* cd_state;              /* The state used by each condition, or -1 */
+    realtype** cd_var;          /* The non-state variable used by each condition */
+    double* cd_threshold;       /* The threshold used by each condition */
+    int* cd_stop;               /* True for each condition that ends the run */
+    int* cd_direction;          /* The direction of each root function component */
+    int cd_stopped;             /* True if the run was ended by a condition */
+    double* cd_buffer;          /* Found crossings, as (time, index, direction) triples */
+    Py_ssize_t n_cd_buffer;     /* Number of crossings in the buffer */
+    Py_ssize_t c_cd_buffer;     /* Capacity of the buffer, in crossings */
+    N_Vector dy_cd;             /* Used to store derivatives when evaluating conditions */
+
+    /* Dense output */
+    PyObject* dn_out;           /* Bytearray to write step records to, or NULL */
+    double* dn_buffer;          /* Step records, DN_RECORD_SIZE values each */
+    Py_ssize_t n_dn_buffer;     /* Number of records in the buffer */
+    Py_ssize_t c_dn_buffer;     /* Capacity of the buffer, in records */
+    N_Vector y_dn;              /* Used to store derivatives of the interpolating polynomial */
+
+    /* Buffers for logged points and found roots, filled without the GIL and
+       emptied into the log buffers by sim_flush */
+    double* log_buffer;         /* Logged values, n_vars + n_sens per point */
+    Py_ssize_t n_log_buffer;    /* Number of points in the buffer */
+    Py_ssize_t c_log_buffer;    /* Capacity of the buffer, in points */
+    double* root_buffer;        /* Found roots, as (time, direction) pairs */
+    Py_ssize_t n_root_buffer;   /* Number of roots in the buffer */
+    Py_ssize_t c_root_buffer;   /* Capacity of the buffer, in roots */
+
+    /* Error set during stepping */
+    int error;                  /* One of the SIM_ERR constants */
+    int error_flag;             /* Flag returned by CVODE or pacing system */
+    char* error_func;           /* Name of the CVODE function that failed */
+} SimRun;
+
+#define SIM_CAPSULE_NAME "myokit.Simulation.run"
 
 /*
- * Cleans up after a simulation
+ * Cleans up after a simulation run, can safely be called more than once
  */
 static PyObject*
-sim_clean()
+sim_clean_run(SimRun* r)
 {
-    if (running != 0) {
+    if (r->running != 0) {
+        /* Store statistics */
+        r->inst->last_steps = r->steps;
+        r->inst->last_evaluations = r->data.evaluations;
+
         /* Done with str="append", decref it */
-        Py_XDECREF(list_update_str); list_update_str = NULL;
+        Py_XDECREF(r->list_update_str); r->list_update_str = NULL;
+
+        /* Release input arguments */
+        Py_XDECREF(r->state_out); r->state_out = NULL;
+        Py_XDECREF(r->inputs); r->inputs = NULL;
+        Py_XDECREF(r->log_dict); r->log_dict = NULL;
+        Py_XDECREF(r->root_list); r->root_list = NULL;
+        Py_XDECREF(r->benchtime); r->benchtime = NULL;
+        Py_XDECREF(r->s_state_out); r->s_state_out = NULL;
+        Py_XDECREF(r->s_buffer); r->s_buffer = NULL;
+        Py_XDECREF(r->steady); r->steady = NULL;
+        Py_XDECREF(r->mk_out); r->mk_out = NULL;
+        Py_XDECREF(r->cd_spec); r->cd_spec = NULL;
+        Py_XDECREF(r->cd_out); r->cd_out = NULL;
+        Py_XDECREF(r->dn_out); r->dn_out = NULL;
 
         /* Free allocated space */
-        free(vars); vars = NULL;
-        free(logs); logs = NULL;
-        free(rootsfound); rootsfound = NULL;
+        free(r->vars); r->vars = NULL;
+        free(r->logs); r->logs = NULL;
+        free(r->rootsfound); r->rootsfound = NULL;
+        free(r->log_times); r->log_times = NULL;
+        free(r->log_atol); r->log_atol = NULL;
+        free(r->log_rtol); r->log_rtol = NULL;
+        free(r->log_last); r->log_last = NULL;
+        free(r->log_buffer); r->log_buffer = NULL;
+        free(r->root_buffer); r->root_buffer = NULL;
+        free(r->s_values); r->s_values = NULL;
+        free(r->s_scale); r->s_scale = NULL;
+        free(r->mk_index); r->mk_index = NULL;
+        free(r->mk_trace); r->mk_trace = NULL;
+        free(r->mk_level_trace); r->mk_level_trace = NULL;
+        free(r->mk_level); r->mk_level = NULL;
+        free(r->mk_cross); r->mk_cross = NULL;
+        free(r->mk_buffer); r->mk_buffer = NULL;
+        free(r->cd_state); r->cd_state = NULL;
+        free(r->cd_var); r->cd_var = NULL;
+        free(r->cd_threshold); r->cd_threshold = NULL;
+        free(r->cd_stop); r->cd_stop = NULL;
+        free(r->cd_direction); r->cd_direction = NULL;
+        free(r->cd_buffer); r->cd_buffer = NULL;
+        free(r->dn_buffer); r->dn_buffer = NULL;
 
         /* Free CVode space */
-        N_VDestroy_Serial(y); y = NULL;
-        N_VDestroy_Serial(dy_log); dy_log = NULL;
-        if (USE_CVODE && !dynamic_logging) {
-            N_VDestroy_Serial(y_log);
-            y_log = NULL;
+        #if USE_CVODES
+        if (r->yS_log != NULL && r->yS_log != r->yS) N_VDestroyVectorArray(r->yS_log, N_SENS_INDEP);
+        r->yS_log = NULL;
+        if (r->yS != NULL) { N_VDestroyVectorArray(r->yS, N_SENS_INDEP); r->yS = NULL; }
+        #endif
+        if (r->y_log != NULL && r->y_log != r->y) N_VDestroy_Serial(r->y_log);
+        r->y_log = NULL;
+        if (r->y != NULL) { N_VDestroy_Serial(r->y); r->y = NULL; }
+        if (r->y_last != NULL) { N_VDestroy_Serial(r->y_last); r->y_last = NULL; }
+        if (r->dy_log != NULL) { N_VDestroy_Serial(r->dy_log); r->dy_log = NULL; }
+        if (r->y_beat != NULL) { N_VDestroy_Serial(r->y_beat); r->y_beat = NULL; }
+        if (r->y_check != NULL) { N_VDestroy_Serial(r->y_check); r->y_check = NULL; }
+        if (r->y_mk != NULL) { N_VDestroy_Serial(r->y_mk); r->y_mk = NULL; }
+        if (r->y_mk_bisect != NULL) { N_VDestroy_Serial(r->y_mk_bisect); r->y_mk_bisect = NULL; }
+        if (r->dy_cd != NULL) { N_VDestroy_Serial(r->dy_cd); r->dy_cd = NULL; }
+        if (r->y_dn != NULL) { N_VDestroy_Serial(r->y_dn); r->y_dn = NULL; }
+        #if USE_CVODE
+        if (r->solver_ready && r->inst->cvode_mem == NULL) {
+            /* Keep the solver for the next run */
+            r->inst->cvode_mem = r->cvode_mem; r->cvode_mem = NULL;
+            #if MYOKIT_SUNDIALS_VERSION >= 30000
+            r->inst->sunmatrix = r->sunmatrix; r->sunmatrix = NULL;
+            r->inst->sunsolver = r->sunsolver; r->sunsolver = NULL;
+            #endif
         }
-        CVodeFree(&cvode_mem); cvode_mem = NULL;
+        r->solver_ready = 0;
+        #endif
+        if (r->cvode_mem != NULL) { CVodeFree(&r->cvode_mem); r->cvode_mem = NULL; }
         #if MYOKIT_SUNDIALS_VERSION >= 30000
-        SUNLinSolFree(sundense_solver); sundense_solver = NULL;
-        SUNMatDestroy(sundense_matrix); sundense_matrix = NULL;
+        if (r->sunsolver != NULL) { SUNLinSolFree(r->sunsolver); r->sunsolver = NULL; }
+        if (r->sunmatrix != NULL) { SUNMatDestroy(r->sunmatrix); r->sunmatrix = NULL; }
         #endif
 
         /* Free pacing system space */
-        ESys_Destroy(epacing); epacing = NULL;
-        FSys_Destroy(fpacing); fpacing = NULL;
+        if (r->epacing != NULL) { ESys_Destroy(r->epacing); r->epacing = NULL; }
+        if (r->fpacing != NULL) { FSys_Destroy(r->fpacing); r->fpacing = NULL; }
+        r->data.fpacing = NULL;
+
+        /* Release instance */
+        r->inst = NULL;
+        Py_XDECREF(r->inst_capsule); r->inst_capsule = NULL;
 
         /* No longer running */
-        running = 0;
+        r->running = 0;
     }
 
     /* Return 0, allowing the construct
         PyErr_SetString(PyExc_Exception, "Oh noes!");
-        return sim_clean()
+        return sim_clean_run(r)
        to terminate a python function. */
     return 0;
 }
+
+/*
+ * Frees a SimRun when its capsule is garbage collected
+ */
+static void
+sim_run_destructor(PyObject* capsule)
+{
+    SimRun* r = (SimRun*)PyCapsule_GetPointer(capsule, SIM_CAPSULE_NAME);
+    if (r != NULL) {
+        sim_clean_run(r);
+        free(r);
+    }
+}
+
+/*
+ * Returns the SimRun stored in the capsule passed as first argument in args,
+ * or NULL (with a Python exception set) if no valid capsule was passed in.
+ */
+static SimRun*
+sim_get_run(PyObject *args)
+{
+    PyObject* capsule;
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(PyExc_Exception, "Expected input argument: run (capsule).");
+        return NULL;
+    }
+    return (SimRun*)PyCapsule_GetPointer(capsule, SIM_CAPSULE_NAME);
+}
+
+/*
+ * Cleans up after an aborted simulation run
+ */
 static PyObject*
 py_sim_clean(PyObject *self, PyObject *args)
 {
-    sim_clean();
+    SimRun* r = sim_get_run(args);
+    if (r == NULL) return 0;
+    sim_clean_run(r);
     Py_RETURN_NONE;
 }
 
 /*
- * Initialise a run
+ * Frees any solver objects kept for reuse between runs
  */
 static PyObject*
-sim_init(PyObject *self, PyObject *args)
+sim_free_solver(PyObject *self, PyObject *args)
 {
-    int i, j;
-    int flag_cvode;
-    int log_first_point;
-    ESys_Flag flag_epacing;
-    FSys_Flag flag_fpacing;
-    Py_ssize_t pos;
-    PyObject *flt;
-    PyObject *key;
-    PyObject* ret;
-    PyObject *value;
-
-    #ifndef SUNDIALS_DOUBLE_PRECISION
-    PyErr_SetString(PyExc_Exception, "Sundials must be compiled with double precision.");
-    /* No memory freeing is needed here, return directly */
-    return 0;
-    #endif
+    SimInstance* s = sim_get_instance_arg(args);
+    if (s == NULL) return 0;
+    sim_free_cached_solver(s);
+    Py_RETURN_NONE;
+}
 
-    /* Check if already running */
-    if (running != 0) {
-        PyErr_SetString(PyExc_Exception, "Simulation already initialized.");
-        return 0;
+/*
+ * Adds the current values of all logged variables, and any logged
+ * sensitivities, to the log buffer. Does not use the Python API. Returns 0 if
+ * successful.
+ */
+static int
+sim_log_point(SimRun* r)
+{
+    int i;
+    int n = r->n_vars + r->n_sens;
+    double* buffer;
+    if (r->n_log_buffer == r->c_log_buffer) {
+        r->c_log_buffer = (r->c_log_buffer < 64) ? 64 : 2 * r->c_log_buffer;
+        buffer = (double*)realloc(r->log_buffer, sizeof(double) * r->c_log_buffer * (n > 0 ? n : 1));
+        if (buffer == NULL) {
+            r->error = SIM_ERR_MEMORY;
+            return -1;
+        }
+        r->log_buffer = buffer;
+    }
+    buffer = r->log_buffer + r->n_log_buffer * n;
+    for (i=0; i<r->n_vars; i++) {
+        buffer[i] = *r->vars[i];
+    }
+    for (i=0; i<r->n_sens; i++) {
+        buffer[r->n_vars + i] = r->s_values[i];
     }
+    r->n_log_buffer++;
 
-    /* Set all pointers used in sim_clean to null */
-    list_update_str = NULL;
-    vars = NULL;
-    logs = NULL;
-    rootsfound = NULL;
-    y = NULL;
-    dy_log = NULL;
-    y_log = NULL;
-    cvode_mem = NULL;
-    epacing = NULL;
-    fpacing = NULL;
-    log_times = NULL;
-    #if MYOKIT_SUNDIALS_VERSION >= 30000
-    sundense_matrix = NULL;
-    sundense_solver = NULL;
-    #endif
+    /* Change-driven logging: Store the logged values */
+    if (r->log_last != NULL) {
+        for (i=0; i<r->n_vars; i++) {
+            r->log_last[i] = *r->vars[i];
+        }
+        r->log_last_set = 1;
+    }
+    return 0;
+}
 
-    /* Check input arguments */
-    if (!PyArg_ParseTuple(args, "ddOOOOOOdOOdO",
-            &tmin,
+/*
+ * Change-driven logging: Returns 1 if any variable with a threshold has
+ * changed by more than that threshold since the last logged point (or if no
+ * point has been logged yet), and 0 otherwise. The negated comparison ensures
+ * that NaNs always cause a point to be logged.
+ */
+static int
+sim_log_changed(SimRun* r)
+{
+    int i;
+    double last;
+    if (!r->log_last_set) return 1;
+    for (i=0; i<r->n_vars; i++) {
+        if (r->log_atol[i] >= 0) {
+            last = r->log_last[i];
+            if (!(fabs(*r->vars[i] - last) <= r->log_atol[i] + r->log_rtol[i] * fabs(last))) {
+                return 1;
+            }
+        }
+    }
+    return 0;
+}
+
+/*
+ * Adds a found root to the root buffer. Does not use the Python API. Returns
+ * 0 if successful.
+ */
+static int
+sim_log_root(SimRun* r, double time, int direction)
+{
+    double* buffer;
+    if (r->n_root_buffer == r->c_root_buffer) {
+        r->c_root_buffer = (r->c_root_buffer < 16) ? 16 : 2 * r->c_root_buffer;
+        buffer = (double*)realloc(r->root_buffer, sizeof(double) * 2 * r->c_root_buffer);
+        if (buffer == NULL) {
+            r->error = SIM_ERR_MEMORY;
+            return -1;
+        }
+        r->root_buffer = buffer;
+    }
+    r->root_buffer[2 * r->n_root_buffer] = time;
+    r->root_buffer[2 * r->n_root_buffer + 1] = (double)direction;
+    r->n_root_buffer++;
+    return 0;
+}
+
+/*
+ * Adds a threshold crossing to the crossing buffer. Does not use the Python
+ * API. Returns 0 if successful, or -1 (with r->error set) if not.
+ */
+static int
+sim_log_crossing(SimRun* r, double time, int index, int direction)
+{
+    double* buffer;
+    if (r->n_cd_buffer == r->c_cd_buffer) {
+        r->c_cd_buffer = (r->c_cd_buffer < 16) ? 16 : 2 * r->c_cd_buffer;
+        buffer = (double*)realloc(r->cd_buffer, sizeof(double) * 3 * r->c_cd_buffer);
+        if (buffer == NULL) {
+            r->error = SIM_ERR_MEMORY;
+            return -1;
+        }
+        r->cd_buffer = buffer;
+    }
+    r->cd_buffer[3 * r->n_cd_buffer] = time;
+    r->cd_buffer[3 * r->n_cd_buffer + 1] = (double)index;
+    r->cd_buffer[3 * r->n_cd_buffer + 2] = (double)direction;
+    r->n_cd_buffer++;
+    return 0;
+}
+
+/*
+ * Adds a dense output record for the step that ended at r->time to the dense
+ * output buffer. Does not use the Python API. Returns 0 if successful, or -1
+ * (with r->error set) if not.
+ */
+#if USE_CVODE
+static int
+sim_log_dense(SimRun* r)
+{
+    int i, k, q, flag_cvode;
+    realtype tn, h, c;
+    double* buffer;
+    double* record;
+
+    /* Skip zero-length steps */
+    if (!(r->time > r->time_last)) return 0;
+
+    if (r->n_dn_buffer == r->c_dn_buffer) {
+        r->c_dn_buffer = (r->c_dn_buffer < 16) ? 16 : 2 * r->c_dn_buffer;
+        buffer = (double*)realloc(r->dn_buffer, sizeof(double) * DN_RECORD_SIZE * r->c_dn_buffer);
+        if (buffer == NULL) {
+            r->error = SIM_ERR_MEMORY;
+            return -1;
+        }
+        r->dn_buffer = buffer;
+    }
+
+    /* Get time, step size, and order of the last internal step */
+    flag_cvode = CVodeGetCurrentTime(r->cvode_mem, &tn);
+    if (flag_cvode >= 0) flag_cvode = CVodeGetLastStep(r->cvode_mem, &h);
+    if (flag_cvode >= 0) flag_cvode = CVodeGetLastOrder(r->cvode_mem, &q);
+    if (flag_cvode < 0) {
+        r->error = SIM_ERR_CVODE;
+        r->error_flag = flag_cvode;
+        r->error_func = "CVodeGetLastStep";
+        return -1;
+    }
+    if (q > DN_QMAX) q = DN_QMAX;
+
+    record = r->dn_buffer + r->n_dn_buffer * DN_RECORD_SIZE;
+    record[0] = r->time_last;
+    record[1] = r->time;
+    record[2] = tn;
+    record[3] = h;
+    record[4] = (double)q;
+
+    /* Reconstruct the Nordsieck array from the derivatives at tn */
+    c = 1;
+    for (k=0; k<=DN_QMAX; k++) {
+        if (k <= q) {
+            flag_cvode = CVodeGetDky(r->cvode_mem, tn, k, r->y_dn);
+            if (flag_cvode < 0) {
+                r->error = SIM_ERR_CVODE;
+                r->error_flag = flag_cvode;
+                r->error_func = "CVodeGetDky";
+                return -1;
+            }
+            if (k > 0) c *= h / k;
+            for (i=0; i<N_STATE; i++) {
+                record[5 + k * N_STATE + i] = c * NV_Ith_S(r->y_dn, i);
+            }
+        } else {
+            for (i=0; i<N_STATE; i++) {
+                record[5 + k * N_STATE + i] = 0;
+            }
+        }
+    }
+    r->n_dn_buffer++;
+    return 0;
+}
+#endif
+
+/*
+ * Biomarkers: Starts a new beat at time t, with state y.
+ */
+static void
+mk_start_beat(SimRun* r, double t, N_Vector y)
+{
+    int i;
+    double x;
+    double* trace;
+    r->mk_tstart = t;
+    r->mk_tprev = t;
+    for (i=0; i<r->mk_n_traces; i++) {
+        trace = r->mk_trace + 6 * i;
+        x = NV_Ith_S(y, r->mk_index[i]);
+        trace[0] = x;           /* Rest */
+        trace[1] = x;           /* Peak */
+        trace[2] = t;           /* Time of peak */
+        trace[3] = -HUGE_VAL;   /* Maximum slope */
+        trace[4] = t;           /* Time of maximum slope */
+        trace[5] = x;           /* Previous value */
+    }
+    for (i=0; i<r->mk_n_levels; i++) {
+        r->mk_cross[i] = Py_NAN;
+    }
+}
+
+/*
+ * Biomarkers: Updates the running extrema and level crossings for the
+ * current beat, using the state y and (optionally) its derivatives dy at time
+ * t. Level crossings are located by bisection on the solver's interpolating
+ * polynomial between the previous and the current point, using r->y_mk_bisect
+ * as scratch space (so that y can be r->y_mk). Does not use the Python API.
+ * Returns 0 if successful.
+ */
+static int
+mk_update(SimRun* r, double t, N_Vector y, N_Vector dy)
+{
+    int i, j;
+    double x, level, ta, tb;
+    double* trace;
+    #if USE_CVODE
+    int k, flag_cvode;
+    double tc;
+    #endif
+
+    for (i=0; i<r->mk_n_traces; i++) {
+        trace = r->mk_trace + 6 * i;
+        x = NV_Ith_S(y, r->mk_index[i]);
+
+        /* Maximum slope */
+        if (dy != NULL && NV_Ith_S(dy, r->mk_index[i]) > trace[3]) {
+            trace[3] = NV_Ith_S(dy, r->mk_index[i]);
+            trace[4] = t;
+        }
+
+        if (x > trace[1]) {
+            /* New peak: any earlier crossings are no longer valid */
+            trace[1] = x;
+            trace[2] = t;
+            for (j=0; j<r->mk_n_levels; j++) {
+                if (r->mk_level_trace[j] == i) r->mk_cross[j] = Py_NAN;
+            }
+        } else {
+            /* Check for downward crossings of levels not yet crossed */
+            for (j=0; j<r->mk_n_levels; j++) {
+                if (r->mk_level_trace[j] != i || !isnan(r->mk_cross[j])) continue;
+                level = trace[1] - r->mk_level[j] * (trace[1] - trace[0]);
+                if (trace[5] > level && x <= level) {
+                    ta = r->mk_tprev;
+                    tb = t;
+                    #if USE_CVODE
+                    for (k=0; k<50 && ta < tb; k++) {
+                        tc = 0.5 * (ta + tb);
+                        if (tc <= ta || tc >= tb) break;
+                        flag_cvode = CVodeGetDky(r->cvode_mem, tc, 0, r->y_mk_bisect);
+                        if (flag_cvode < 0) {
+                            r->error = SIM_ERR_CVODE;
+                            r->error_flag = flag_cvode;
+                            r->error_func = "CVodeGetDky";
+                            return -1;
+                        }
+                        if (NV_Ith_S(r->y_mk_bisect, r->mk_index[i]) > level) {
+                            ta = tc;
+                        } else {
+                            tb = tc;
+                        }
+                    }
+                    #endif
+                    r->mk_cross[j] = tb;
+                }
+            }
+        }
+        trace[5] = x;
+    }
+    r->mk_tprev = t;
+    return 0;
+}
+
+/*
+ * Biomarkers: Adds a record for the current beat to the biomarker buffer.
+ * Each record contains the start time of the beat, then the rest value, peak
+ * value, and maximum slope of each trace, and finally the time from the
+ * maximum slope to the crossing of each level. Does not use the Python API.
+ * Returns 0 if successful.
+ */
+static int
+mk_end_beat(SimRun* r)
+{
+    int i;
+    int n = 1 + 3 * r->mk_n_traces + r->mk_n_levels;
+    double* buffer;
+    double* trace;
+    if (r->n_mk_buffer == r->c_mk_buffer) {
+        r->c_mk_buffer = (r->c_mk_buffer < 16) ? 16 : 2 * r->c_mk_buffer;
+        buffer = (double*)realloc(r->mk_buffer, sizeof(double) * n * r->c_mk_buffer);
+        if (buffer == NULL) {
+            r->error = SIM_ERR_MEMORY;
+            return -1;
+        }
+        r->mk_buffer = buffer;
+    }
+    buffer = r->mk_buffer + n * r->n_mk_buffer;
+    buffer[0] = r->mk_tstart;
+    for (i=0; i<r->mk_n_traces; i++) {
+        trace = r->mk_trace + 6 * i;
+        buffer[1 + 3 * i] = trace[0];
+        buffer[2 + 3 * i] = trace[1];
+        buffer[3 + 3 * i] = (trace[3] > -HUGE_VAL) ? trace[3] : Py_NAN;
+    }
+    for (i=0; i<r->mk_n_levels; i++) {
+        trace = r->mk_trace + 6 * r->mk_level_trace[i];
+        buffer[1 + 3 * r->mk_n_traces + i] = r->mk_cross[i] - trace[4];
+    }
+    r->n_mk_buffer++;
+    return 0;
+}
+
+/*
+ * Moves all buffered log points to the log buffers, all roots to the Python
+ * root list, and all threshold crossings to the crossings bytearray. Must be called while holding the GIL. Returns 0 if successful, or -1 (with
+ * a Python exception set) if not.
+ */
+static int
+sim_flush(SimRun* r)
+{
+    int i;
+    int n = r->n_vars + r->n_sens;
+    Py_ssize_t j;
+    PyObject *flt, *ret;
+
+    /* Logged points */
+    for (i=0; i<r->n_vars; i++) {
+        if (log_extend(r->logs[i], r->log_buffer + i, r->n_log_buffer, n)) {
+            r->n_log_buffer = 0;
+            return -1;
+        }
+    }
+
+    /* Logged sensitivities, stored point by point */
+    if (r->n_sens > 0) {
+        for (j=0; j<r->n_log_buffer; j++) {
+            if (log_extend(r->s_buffer, r->log_buffer + j * n + r->n_vars, r->n_sens, 1)) {
+                r->n_log_buffer = 0;
+                return -1;
+            }
+        }
+    }
+    r->n_log_buffer = 0;
+
+    /* Found roots */
+    for (j=0; j<r->n_root_buffer; j++) {
+        flt = PyTuple_New(2);
+        PyTuple_SetItem(flt, 0, PyFloat_FromDouble(r->root_buffer[2 * j])); /* Steals reference, so this is ok */
+        PyTuple_SetItem(flt, 1, PyLong_FromLong((long)r->root_buffer[2 * j + 1]));
+        ret = PyObject_CallMethodObjArgs(r->root_list, r->list_update_str, flt, NULL);
+        Py_DECREF(flt);
+        Py_XDECREF(ret);
+        if (ret == NULL) {
+            r->n_root_buffer = 0;
+            PyErr_SetString(PyExc_Exception, "Call to append() failed on root finding list.");
+            return -1;
+        }
+    }
+    r->n_root_buffer = 0;
+
+    /* Biomarker records */
+    if (r->n_mk_buffer > 0) {
+        if (log_extend(r->mk_out, r->mk_buffer, r->n_mk_buffer * (1 + 3 * r->mk_n_traces + r->mk_n_levels), 1)) {
+            r->n_mk_buffer = 0;
+            return -1;
+        }
+        r->n_mk_buffer = 0;
+    }
+
+    /* Threshold crossings */
+    if (r->n_cd_buffer > 0) {
+        if (log_extend(r->cd_out, r->cd_buffer, 3 * r->n_cd_buffer, 1)) {
+            r->n_cd_buffer = 0;
+            return -1;
+        }
+        r->n_cd_buffer = 0;
+    }
+
+    /* Dense output records */
+    if (r->n_dn_buffer > 0) {
+        if (log_extend(r->dn_out, r->dn_buffer, r->n_dn_buffer * DN_RECORD_SIZE, 1)) {
+            r->n_dn_buffer = 0;
+            return -1;
+        }
+        r->n_dn_buffer = 0;
+    }
+
+    return 0;
+}
+
+/*
+ * Calls the benchmarking time function and updates realtime. Must be called
+ * while holding the GIL. Returns 0 if successful.
+ */
+static int
+sim_update_realtime(SimRun* r, N_Vector y)
+{
+    double t;
+    PyObject* flt = PyObject_CallFunction(r->benchtime, "");
+    if (flt == NULL || !PyFloat_Check(flt)) {
+        Py_XDECREF(flt);
+        PyErr_SetString(PyExc_Exception, "Call to benchmark time function didn't return float.");
+        r->error = SIM_ERR_PYTHON;
+        return -1;
+    }
+    t = PyFloat_AsDouble(flt);
+    Py_DECREF(flt);
+    if (r->starttime < 0) {
+        r->starttime = t;
+    }
+    r->data.realtime = t - r->starttime;
+    /* Update any variables bound to realtime */
+    update_realtime_bindings(r->time, y, r->dy_log, &r->data);
+    return 0;
+}
+
+/*
+ * Initialise a run, and return a capsule containing its state
+ */
+static PyObject*
+sim_init(PyObject *self, PyObject *args)
+{
+    int i, j;
+    int flag_cvode;
+    ESys_Flag flag_epacing;
+    FSys_Flag flag_fpacing;
+    Py_ssize_t pos;
+    PyObject *flt, *key, *val;
+    PyObject *capsule;
+    SimRun* r;
+    SimInstance* inst;
+    ModelData* d;   /* Used when setting up logging */
+    char* fname;    /* Name of a failing sundials function */
+    #if USE_CVODE
+    int reused = 0; /* True if the solver of a previous run is reused */
+    #endif
+
+    /* Input arguments */
+    PyObject* inst_capsule; /* The simulation instance */
+    double tmin;            /* The initial simulation time */
+    double tmax;            /* The final simulation time */
+    PyObject* state_in;     /* The initial state */
+    PyObject* state_out;    /* The final state */
+    PyObject* inputs;       /* A vector used to return the binding inputs` values */
+    PyObject* eprotocol;    /* An event-based pacing protocol */
+    PyObject* fprotocol;    /* A fixed-form pacing protocol */
+    PyObject* log_dict;     /* The log dict, mapping names to bytearray buffers */
+    int log_append;         /* True if appending to a non-empty log */
+    double log_interval;    /* Periodic logging: The log interval (0 to disable) */
+    PyObject* log_times;    /* Point-list logging: List of points (None to disable) */
+    PyObject* log_changes;  /* Change-driven logging: Dict mapping names to (atol, rtol) tuples (None to disable) */
+    PyObject* root_list;    /* Empty list if root finding should be used */
+    double root_threshold;  /* Threshold to use for root finding */
+    PyObject* benchtime;    /* Callable time() function or None */
+    PyObject* s_state_in;   /* The initial state sensitivities (or None) */
+    PyObject* s_state_out;  /* The final state sensitivities (or None) */
+    PyObject* s_buffer;     /* Buffer to log sensitivities in (or None to disable) */
+    PyObject* s_scale;      /* Scaling factors for the independents (or None) */
+    PyObject* steady;       /* Steady-state detection list (or None) */
+    PyObject* markers;      /* Biomarker specification list (or None) */
+    PyObject* conditions;   /* Threshold condition specification list (or None) */
+    PyObject* dense;        /* Bytearray to write dense output records to (or None) */
+
+    #ifndef SUNDIALS_DOUBLE_PRECISION
+    PyErr_SetString(PyExc_Exception, "Sundials must be compiled with double precision.");
+    /* No memory freeing is needed here, return directly */
+    return 0;
+    #endif
+
+    /* Check input arguments */
+    if (!PyArg_ParseTuple(args, "OddOOOOOOidOOOdOOOOOOOOO",
+            &inst_capsule,
+            &tmin,
             &tmax,
             &state_in,
             &state_out,
@@ -532,25 +1750,53 @@ sim_init(PyObject *self, PyObject *args)
             &eprotocol,
             &fprotocol,
             &log_dict,
+            &log_append,
             &log_interval,
             &log_times,
+            &log_changes,
             &root_list,
             &root_threshold,
-            &benchtime)) {
+            &benchtime,
+            &s_state_in,
+            &s_state_out,
+            &s_buffer,
+            &s_scale,
+            &steady,
+            &markers,
+            &conditions,
+            &dense)) {
         PyErr_SetString(PyExc_Exception, "Incorrect input arguments.");
         /* Nothing allocated yet, no pyobjects _created_, return directly */
         return 0;
     }
+    inst = sim_get_instance(inst_capsule);
+    if (inst == NULL) return 0;
+
+    /* Create run struct, with all pointers used in sim_clean_run set to null */
+    r = (SimRun*)calloc(1, sizeof(SimRun));
+    if (r == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for simulation run.");
+        return 0;
+    }
+    capsule = PyCapsule_New((void*)r, SIM_CAPSULE_NAME, sim_run_destructor);
+    if (capsule == NULL) {
+        free(r);
+        return 0;
+    }
 
     /* Now officialy running :) */
-    running = 1;
+    r->running = 1;
+    Py_INCREF(inst_capsule); r->inst_capsule = inst_capsule;
+    r->inst = inst;
 
     /*************************************************************************
-    From this point on, no more direct returning! Use sim_clean()
+    From this point on, no more direct returning! Use sim_clean_run() and
+    decref the capsule: the capsule destructor will free the run struct.
 
     To check if this list is still up to date manually search for cvode
     and python stuff. To find what to free() search for "alloc("
-    Initialize all to NULL so that free() will work without errors.
+    The run struct is initialized with zeros, so that free() will work
+    without errors.
 
     Notes:
     1. Functions like PyList_New and PyDict_New create a new object with a
@@ -583,8 +1829,9 @@ sim_init(PyObject *self, PyObject *args)
        function runs.
 
     Result:
-    A. The log and protocol objects passed to this function are borrowed
-       references: no need to change the reference count.
+    A. The log, output, and benchmarking objects passed to this function are
+       borrowed references, but they are used in later calls to sim_step. So
+       new references are created here, and released in sim_clean_run.
     B. The PyFloat objects that are created have refcount 1. They're added to
        the lists using append, which increases their refcount. So they should
        be decref'd after appending.
@@ -594,52 +1841,68 @@ sim_init(PyObject *self, PyObject *args)
        steals ownership: No need to decref.
     */
 
+    /* Store input arguments */
+    r->tmin = tmin;
+    r->tmax = tmax;
+    r->log_interval = log_interval;
+    Py_INCREF(state_out); r->state_out = state_out;
+    Py_INCREF(inputs); r->inputs = inputs;
+    Py_INCREF(log_dict); r->log_dict = log_dict;
+    Py_INCREF(root_list); r->root_list = root_list;
+    Py_INCREF(benchtime); r->benchtime = benchtime;
+
+    /* Copy model variables, including any changed constants */
+    r->data = inst->data;
+    r->data.fpacing = NULL;
+    r->data.abs_tol = inst->abs_tol;
+    d = &r->data;
+
     /* Create state vector */
-    y = N_VNew_Serial(N_STATE);
-    if (check_cvode_flag((void*)y, "N_VNew_Serial", 0)) {
+    r->y = N_VNew_Serial(N_STATE);
+    if (check_cvode_flag((void*)r->y, "N_VNew_Serial", 0)) {
         PyErr_SetString(PyExc_Exception, "Failed to create state vector.");
-        return sim_clean();
+        goto error;
     }
 
     /* Create state vector copy for error handling */
-    y_last = N_VNew_Serial(N_STATE);
-    if (check_cvode_flag((void*)y_last, "N_VNew_Serial", 0)) {
+    r->y_last = N_VNew_Serial(N_STATE);
+    if (check_cvode_flag((void*)r->y_last, "N_VNew_Serial", 0)) {
         PyErr_SetString(PyExc_Exception, "Failed to create last-state vector.");
-        return sim_clean();
+        goto error;
     }
 
     /* Determine if dynamic logging is being used (or if it's periodic/point-list logging) */
-    dynamic_logging = (log_interval <= 0 && log_times == Py_None);
+    r->dynamic_logging = (log_interval <= 0 && log_times == Py_None);
 
     /* Create state vector for logging */
-    if (dynamic_logging || !USE_CVODE) {
+    if (r->dynamic_logging || !USE_CVODE) {
         /* Dynamic logging or cvode-free mode: don't interpolate,
            so let y_log point to y */
-        y_log = y;
+        r->y_log = r->y;
     } else {
         /* Logging at fixed points:
            Keep y_log as a separate N_Vector for cvode interpolation */
-        y_log = N_VNew_Serial(N_STATE);
-        if (check_cvode_flag((void*)y_log, "N_VNew_Serial", 0)) {
+        r->y_log = N_VNew_Serial(N_STATE);
+        if (check_cvode_flag((void*)r->y_log, "N_VNew_Serial", 0)) {
             PyErr_SetString(PyExc_Exception, "Failed to create logging state vector.");
-            return sim_clean();
+            goto error;
         }
     }
 
     /* Create derivative vector for logging */
-    dy_log = N_VNew_Serial(N_STATE);
-    if (check_cvode_flag((void*)dy_log, "N_VNew_Serial", 0)) {
+    r->dy_log = N_VNew_Serial(N_STATE);
+    if (check_cvode_flag((void*)r->dy_log, "N_VNew_Serial", 0)) {
         PyErr_SetString(PyExc_Exception, "Failed to create logging state derivatives vector.");
-        return sim_clean();
+        goto error;
     }
 
     /* Set calculated constants */
-    updateConstants();
+    updateConstants(d);
 
     /* Set initial values */
     if (!PyList_Check(state_in)) {
         PyErr_SetString(PyExc_Exception, "'state_in' must be a list.");
-        return sim_clean();
+        goto error;
     }
     for(i=0; i<N_STATE; i++) {
         flt = PyList_GetItem(state_in, i);    /* Don't decref! */
@@ -647,54 +1910,298 @@ sim_init(PyObject *self, PyObject *args)
             char errstr[200];
             sprintf(errstr, "Item %d in state vector is not a float.", i);
             PyErr_SetString(PyExc_Exception, errstr);
-            return sim_clean();
+            goto error;
         }
-        NV_Ith_S(y, i) = PyFloat_AsDouble(flt);
-        NV_Ith_S(y_last, i) = NV_Ith_S(y, i);
+        NV_Ith_S(r->y, i) = PyFloat_AsDouble(flt);
+        NV_Ith_S(r->y_last, i) = NV_Ith_S(r->y, i);
     }
 
     /* Periodic or point-list logging? Then set init state in y_log as well */
     #if USE_CVODE
-    if (!dynamic_logging) {
+    if (!r->dynamic_logging) {
         for(i=0; i<N_STATE; i++) {
-            NV_Ith_S(y_log, i) = NV_Ith_S(y, i);
+            NV_Ith_S(r->y_log, i) = NV_Ith_S(r->y, i);
         }
     }
     #endif
     /* In cvode-free mode, y_log points to y, so no need */
 
-    /* Root finding list of integers (only contains 1 int...) */
-    rootsfound = (int*)malloc(sizeof(int)*1);
+    /* Set up sensitivities */
+    #if N_SENS_INDEP > 0
+    if (!PyList_Check(s_state_in) || !PyList_Check(s_state_out)) {
+        PyErr_SetString(PyExc_Exception, "'s_state_in' and 's_state_out' must be lists.");
+        goto error;
+    }
+    if (s_buffer != Py_None && !PyByteArray_Check(s_buffer)) {
+        PyErr_SetString(PyExc_Exception, "'s_buffer' must be a bytearray or None.");
+        goto error;
+    }
+    if (!PyList_Check(s_scale)) {
+        PyErr_SetString(PyExc_Exception, "'s_scale' must be a list.");
+        goto error;
+    }
+    Py_INCREF(s_state_out); r->s_state_out = s_state_out;
+    Py_INCREF(s_buffer); r->s_buffer = s_buffer;
+    /* Only log sensitivities if a buffer was given */
+    r->n_sens = (s_buffer == Py_None) ? 0 : N_SENS_DEP * N_SENS_INDEP;
+    r->s_values = (realtype*)calloc(r->n_sens > 0 ? r->n_sens : 1, sizeof(realtype));
+    r->s_scale = (realtype*)malloc(sizeof(realtype) * N_SENS_INDEP);
+    if (r->s_values == NULL || r->s_scale == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for sensitivities.");
+        goto error;
+    }
+    for (j=0; j<N_SENS_INDEP; j++) {
+        flt = PyList_GetItem(s_scale, j);    /* Don't decref! */
+        if (flt == NULL || !PyFloat_Check(flt)) {
+            PyErr_SetString(PyExc_Exception, "Entries in 's_scale' must be floats.");
+            goto error;
+        }
+        r->s_scale[j] = PyFloat_AsDouble(flt);
+    }
+    #if USE_CVODES
+    /* Create state sensitivity vectors, and set their initial values */
+    r->yS = N_VCloneVectorArray(N_SENS_INDEP, r->y);
+    if (check_cvode_flag((void*)r->yS, "N_VCloneVectorArray", 0)) {
+        PyErr_SetString(PyExc_Exception, "Failed to create state sensitivity vectors.");
+        goto error;
+    }
+    for (i=0; i<N_STATE; i++) {
+        for (j=0; j<N_SENS_INDEP; j++) {
+            flt = PyList_GetItem(s_state_in, i * N_SENS_INDEP + j);    /* Don't decref! */
+            if (flt == NULL || !PyFloat_Check(flt)) {
+                PyErr_SetString(PyExc_Exception, "Entries in 's_state_in' must be floats.");
+                goto error;
+            }
+            NV_Ith_S(r->yS[j], i) = PyFloat_AsDouble(flt);
+        }
+    }
+
+    /* Create state sensitivity vectors for logging */
+    if (r->dynamic_logging) {
+        r->yS_log = r->yS;
+    } else {
+        r->yS_log = N_VCloneVectorArray(N_SENS_INDEP, r->y);
+        if (check_cvode_flag((void*)r->yS_log, "N_VCloneVectorArray", 0)) {
+            PyErr_SetString(PyExc_Exception, "Failed to create logging state sensitivity vectors.");
+            goto error;
+        }
+    }
+    #endif
+    #endif
+
+    /* Set up steady-state detection */
+    Py_INCREF(steady); r->steady = steady;
+    if (steady != Py_None) {
+        if (!PyList_Check(steady) || PyList_Size(steady) != 4) {
+            PyErr_SetString(PyExc_Exception, "'steady' must be a list of size 4 or None.");
+            goto error;
+        }
+        r->beat_period = PyFloat_AsDouble(PyList_GetItem(steady, 0));
+        r->beat_tol = PyFloat_AsDouble(PyList_GetItem(steady, 1));
+        if (PyErr_Occurred()) goto error;
+        if (r->beat_period <= 0) {
+            PyErr_SetString(PyExc_Exception, "Beat period must be greater than zero.");
+            goto error;
+        }
+        r->tbeat = tmin + r->beat_period;
+        r->y_beat = N_VNew_Serial(N_STATE);
+        r->y_check = N_VNew_Serial(N_STATE);
+        if (check_cvode_flag((void*)r->y_beat, "N_VNew_Serial", 0)
+                || check_cvode_flag((void*)r->y_check, "N_VNew_Serial", 0)) {
+            PyErr_SetString(PyExc_Exception, "Failed to create steady-state detection vectors.");
+            goto error;
+        }
+        for(i=0; i<N_STATE; i++) {
+            NV_Ith_S(r->y_beat, i) = NV_Ith_S(r->y, i);
+        }
+    }
+
+    /* Set up biomarker calculation. The specification is a list
+       [period, state indices, level traces, levels, output bytearray]. */
+    if (markers != Py_None) {
+        if (!PyList_Check(markers) || PyList_Size(markers) != 5) {
+            PyErr_SetString(PyExc_Exception, "'markers' must be a list of size 5 or None.");
+            goto error;
+        }
+        r->mk_period = PyFloat_AsDouble(PyList_GetItem(markers, 0));
+        if (PyErr_Occurred()) goto error;
+        if (r->mk_period <= 0) {
+            PyErr_SetString(PyExc_Exception, "Biomarker period must be greater than zero.");
+            goto error;
+        }
+        flt = PyList_GetItem(markers, 1);
+        val = PyList_GetItem(markers, 3);
+        key = PyList_GetItem(markers, 2);
+        if (!PyList_Check(flt) || !PyList_Check(val) || !PyList_Check(key) || PyList_Size(val) != PyList_Size(key)) {
+            PyErr_SetString(PyExc_Exception, "Invalid biomarker specification.");
+            goto error;
+        }
+        r->mk_n_traces = (int)PyList_Size(flt);
+        r->mk_n_levels = (int)PyList_Size(val);
+        r->mk_index = (int*)malloc(sizeof(int) * (r->mk_n_traces + 1));
+        r->mk_trace = (double*)malloc(sizeof(double) * 6 * (r->mk_n_traces + 1));
+        r->mk_level_trace = (int*)malloc(sizeof(int) * (r->mk_n_levels + 1));
+        r->mk_level = (double*)malloc(sizeof(double) * (r->mk_n_levels + 1));
+        r->mk_cross = (double*)malloc(sizeof(double) * (r->mk_n_levels + 1));
+        if (r->mk_index == NULL || r->mk_trace == NULL || r->mk_level_trace == NULL || r->mk_level == NULL || r->mk_cross == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for biomarker calculation.");
+            goto error;
+        }
+        for (i=0; i<r->mk_n_traces; i++) {
+            r->mk_index[i] = (int)PyLong_AsLong(PyList_GetItem(flt, i));
+            if (r->mk_index[i] < 0 || r->mk_index[i] >= N_STATE) {
+                if (!PyErr_Occurred()) PyErr_SetString(PyExc_Exception, "Invalid state index in biomarker specification.");
+                goto error;
+            }
+        }
+        for (i=0; i<r->mk_n_levels; i++) {
+            r->mk_level_trace[i] = (int)PyLong_AsLong(PyList_GetItem(key, i));
+            r->mk_level[i] = PyFloat_AsDouble(PyList_GetItem(val, i));
+            if (PyErr_Occurred()) goto error;
+            if (r->mk_level_trace[i] < 0 || r->mk_level_trace[i] >= r->mk_n_traces) {
+                PyErr_SetString(PyExc_Exception, "Invalid trace index in biomarker specification.");
+                goto error;
+            }
+        }
+        flt = PyList_GetItem(markers, 4);
+        if (!PyByteArray_Check(flt)) {
+            PyErr_SetString(PyExc_Exception, "Biomarkers must be written to a bytearray.");
+            goto error;
+        }
+        Py_INCREF(flt); r->mk_out = flt;
+        r->y_mk = N_VNew_Serial(N_STATE);
+        if (check_cvode_flag((void*)r->y_mk, "N_VNew_Serial", 0)) {
+            PyErr_SetString(PyExc_Exception, "Failed to create biomarker state vector.");
+            goto error;
+        }
+        r->y_mk_bisect = N_VNew_Serial(N_STATE);
+        if (check_cvode_flag((void*)r->y_mk_bisect, "N_VNew_Serial", 0)) {
+            PyErr_SetString(PyExc_Exception, "Failed to create biomarker state vector.");
+            goto error;
+        }
+        r->mk_beats = 0;
+        r->mk_tbeat = tmin + r->mk_period;
+        mk_start_beat(r, tmin, r->y);
+    }
+
+    /* Set up threshold conditions. The specification is a list
+       [state indices (or -1), dict mapping names of non-state variables to
+       lists of condition indices, thresholds, directions, stop flags,
+       output bytearray, stopped flag]. */
+    Py_INCREF(conditions); r->cd_spec = conditions;
+    if (conditions != Py_None) {
+        if (!PyList_Check(conditions) || PyList_Size(conditions) != 7) {
+            PyErr_SetString(PyExc_Exception, "'conditions' must be a list of size 7 or None.");
+            goto error;
+        }
+        flt = PyList_GetItem(conditions, 0);
+        key = PyList_GetItem(conditions, 1);
+        if (!PyList_Check(flt) || !PyDict_Check(key)) {
+            PyErr_SetString(PyExc_Exception, "Invalid threshold condition specification.");
+            goto error;
+        }
+        d->n_conditions = (int)PyList_Size(flt);
+        for (i=2; i<5; i++) {
+            val = PyList_GetItem(conditions, i);
+            if (!PyList_Check(val) || PyList_Size(val) != d->n_conditions) {
+                PyErr_SetString(PyExc_Exception, "Invalid threshold condition specification.");
+                goto error;
+            }
+        }
+        r->cd_state = (int*)malloc(sizeof(int) * (d->n_conditions + 1));
+        r->cd_var = (realtype**)calloc(d->n_conditions + 1, sizeof(realtype*));
+        r->cd_threshold = (double*)malloc(sizeof(double) * (d->n_conditions + 1));
+        r->cd_stop = (int*)malloc(sizeof(int) * (d->n_conditions + 1));
+        r->cd_direction = (int*)malloc(sizeof(int) * (d->n_conditions + 1));
+        if (r->cd_state == NULL || r->cd_var == NULL || r->cd_threshold == NULL || r->cd_stop == NULL || r->cd_direction == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for threshold conditions.");
+            goto error;
+        }
+        r->dy_cd = N_VNew_Serial(N_STATE);
+        if (check_cvode_flag((void*)r->dy_cd, "N_VNew_Serial", 0)) {
+            PyErr_SetString(PyExc_Exception, "Failed to create threshold condition derivatives vector.");
+            goto error;
+        }
+
+        /* Get pointers to non-state variables and derivatives */
+<?
+for var in model.states():
+    print(tab + tab + 'condition_add(key, r->cd_var, d->n_conditions, "dot(' + var.qname() + ')", &NV_Ith_S(r->dy_cd, ' + str(var.indice()) + '));')
+for var in model.variables(deep=True, state=False, const=False):
+    print(tab + tab + 'condition_add(key, r->cd_var, d->n_conditions, "' + var.qname() + '", &' + v(var) + ');')
+?>
+        for (i=0; i<d->n_conditions; i++) {
+            r->cd_state[i] = (int)PyLong_AsLong(PyList_GetItem(flt, i));
+            r->cd_threshold[i] = PyFloat_AsDouble(PyList_GetItem(PyList_GetItem(conditions, 2), i));
+            r->cd_direction[i] = (int)PyLong_AsLong(PyList_GetItem(PyList_GetItem(conditions, 3), i));
+            r->cd_stop[i] = PyObject_IsTrue(PyList_GetItem(PyList_GetItem(conditions, 4), i));
+            if (PyErr_Occurred()) goto error;
+            if (r->cd_state[i] >= N_STATE || (r->cd_state[i] < 0 && r->cd_var[i] == NULL)) {
+                PyErr_SetString(PyExc_Exception, "Unknown variable in threshold condition specification.");
+                goto error;
+            }
+            if (r->cd_state[i] < 0) d->condition_rhs = 1;
+        }
+        flt = PyList_GetItem(conditions, 5);
+        if (!PyByteArray_Check(flt)) {
+            PyErr_SetString(PyExc_Exception, "Threshold crossings must be written to a bytearray.");
+            goto error;
+        }
+        Py_INCREF(flt); r->cd_out = flt;
+        d->condition_state = r->cd_state;
+        d->condition_var = r->cd_var;
+        d->condition_threshold = r->cd_threshold;
+        d->condition_dy = r->dy_cd;
+    }
+    r->cd_stopped = 0;
+
+    /* Set up dense output */
+    if (dense != Py_None) {
+        if (!PyByteArray_Check(dense)) {
+            PyErr_SetString(PyExc_Exception, "Dense output must be written to a bytearray.");
+            goto error;
+        }
+        Py_INCREF(dense); r->dn_out = dense;
+        r->y_dn = N_VNew_Serial(N_STATE);
+        if (check_cvode_flag((void*)r->y_dn, "N_VNew_Serial", 0)) {
+            PyErr_SetString(PyExc_Exception, "Failed to create dense output vector.");
+            goto error;
+        }
+    }
+
+    /* Root finding list of integers (one for the apd variable and one for
+       each threshold condition) */
+    r->rootsfound = (int*)malloc(sizeof(int) * (d->n_conditions + 1));
 
     /* Reset evaluation count */
-    engine_evaluations = 0;
+    d->evaluations = 0;
 
     /* Reset step count */
-    engine_steps = 0;
+    r->steps = 0;
 
     /* Zero step tracking */
-    zero_step_count = 0;
+    r->zero_step_count = 0;
 
     /* Check output list */
     if (!PyList_Check(state_out)) {
         PyErr_SetString(PyExc_Exception, "'state_out' must be a list.");
-        return sim_clean();
+        goto error;
     }
 
     /* Check for loss-of-precision issue in periodic logging */
     if (log_interval > 0) {
         if (tmax + log_interval == tmax) {
             PyErr_SetString(PyExc_Exception, "Log interval is too small compared to tmax; issue with numerical precision: float(tmax + log_interval) = float(tmax).");
-            return sim_clean();
+            goto error;
         }
     }
 
     /* Set up logging */
-    log_inter = 0;
-    log_bound = 0;
-    n_vars = PyDict_Size(log_dict);
-    logs = (PyObject**)malloc(sizeof(PyObject*)*n_vars);
-    vars = (realtype**)malloc(sizeof(realtype*)*n_vars);
+    r->log_inter = 0;
+    r->log_bound = 0;
+    r->n_vars = PyDict_Size(log_dict);
+    r->logs = (PyObject**)malloc(sizeof(PyObject*)*r->n_vars);
+    r->vars = (realtype**)malloc(sizeof(realtype*)*r->n_vars);
     i = 0;
 
     /* Note: The variable names are all ascii compatible
@@ -708,53 +2215,101 @@ sim_init(PyObject *self, PyObject *args)
     /* Check states */
 <?
 for var in model.states():
-    print(tab + 'i += log_add(log_dict, logs, vars, i, "' + var.qname() + '", &NV_Ith_S(y_log, ' + str(var.indice())  + '));')
+    print(tab + 'i += log_add(log_dict, r->logs, r->vars, i, "' + var.qname() + '", &NV_Ith_S(r->y_log, ' + str(var.indice())  + '));')
 ?>
 
     /* Check derivatives */
     j = i;
 <?
 for var in model.states():
-    print(tab + 'i += log_add(log_dict, logs, vars, i, "dot(' + var.qname() + ')", &NV_Ith_S(dy_log, ' + str(var.indice())  + '));')
+    print(tab + 'i += log_add(log_dict, r->logs, r->vars, i, "dot(' + var.qname() + ')", &NV_Ith_S(r->dy_log, ' + str(var.indice())  + '));')
 ?>
-    log_deriv = (i > j);
+    r->log_deriv = (i > j);
 
     /* Check bound variables */
     j = i;
 <?
 for var, internal in bound_variables.items():
-    print(tab + 'i += log_add(log_dict, logs, vars, i, "' + var.qname() + '", &' + v(var)  + ');')
+    print(tab + 'i += log_add(log_dict, r->logs, r->vars, i, "' + var.qname() + '", &' + v(var)  + ');')
 ?>
-    log_bound = (i > j);
+    r->log_bound = (i > j);
 
     /* Remaining variables will require an extra rhs() call to evaluate their
        values at every log point */
     j = i;
 <?
 for var in model.variables(deep=True, state=False, bound=False, const=False):
-    print(tab + 'i += log_add(log_dict, logs, vars, i, "' + var.qname() + '", &' + v(var)  + ');')
+    print(tab + 'i += log_add(log_dict, r->logs, r->vars, i, "' + var.qname() + '", &' + v(var)  + ');')
 ?>
-    log_inter = (i > j);
+    r->log_inter = (i > j);
 
     /* Check if log contained extra variables */
-    if (i != n_vars) {
+    if (i != r->n_vars) {
         PyErr_SetString(PyExc_Exception, "Unknown variables found in logging dictionary.");
-        return sim_clean();
+        goto error;
+    }
+    for (i=0; i<r->n_vars; i++) {
+        if (!PyByteArray_Check(r->logs[i])) {
+            PyErr_SetString(PyExc_Exception, "Logging dictionary must contain bytearray buffers.");
+            goto error;
+        }
     }
 
-    /* Set up event-based pacing */
-    if (eprotocol != Py_None) {
-        epacing = ESys_Create(&flag_epacing);
-        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); return sim_clean(); }
-        flag_epacing = ESys_Populate(epacing, eprotocol);
-        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); return sim_clean(); }
-        flag_epacing = ESys_AdvanceTime(epacing, tmin);
-        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); return sim_clean(); }
-        tnext = ESys_GetNextTime(epacing, &flag_epacing);
-        engine_pace = ESys_GetLevel(epacing, &flag_epacing);
-        tnext = (tnext < tmax) ? tnext : tmax;
+    /* Set up change-driven logging */
+    if (log_changes != Py_None) {
+        if (!r->dynamic_logging) {
+            PyErr_SetString(PyExc_Exception, "Change-driven logging can only be used with dynamic logging.");
+            goto error;
+        }
+        if (!PyDict_Check(log_changes)) {
+            PyErr_SetString(PyExc_Exception, "'log_changes' must be a dict or None.");
+            goto error;
+        }
+        r->log_atol = (double*)malloc(sizeof(double) * (r->n_vars > 0 ? r->n_vars : 1));
+        r->log_rtol = (double*)malloc(sizeof(double) * (r->n_vars > 0 ? r->n_vars : 1));
+        r->log_last = (double*)malloc(sizeof(double) * (r->n_vars > 0 ? r->n_vars : 1));
+        if (r->log_atol == NULL || r->log_rtol == NULL || r->log_last == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for change-driven logging.");
+            goto error;
+        }
+        for (i=0; i<r->n_vars; i++) {
+            r->log_atol[i] = -1;
+            r->log_rtol[i] = 0;
+        }
+        pos = 0;
+        while (PyDict_Next(log_changes, &pos, &key, &val)) {
+            /* Find the variable by comparing its buffer */
+            flt = PyDict_GetItem(log_dict, key); /* Borrowed */
+            for (i=0; i<r->n_vars; i++) {
+                if (flt != NULL && r->logs[i] == flt) break;
+            }
+            if (i == r->n_vars) {
+                PyErr_SetString(PyExc_Exception, "Unknown variable found in 'log_changes'.");
+                goto error;
+            }
+            if (!PyTuple_Check(val) || PyTuple_Size(val) != 2) {
+                PyErr_SetString(PyExc_Exception, "Entries in 'log_changes' must be tuples (atol, rtol).");
+                goto error;
+            }
+            r->log_atol[i] = PyFloat_AsDouble(PyTuple_GetItem(val, 0));
+            r->log_rtol[i] = PyFloat_AsDouble(PyTuple_GetItem(val, 1));
+            if (PyErr_Occurred()) goto error;
+        }
+    }
+
+    /* Set up event-based pacing */
+    if (eprotocol != Py_None) {
+        r->epacing = ESys_Create(&flag_epacing);
+        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto error; }
+        flag_epacing = ESys_Populate(r->epacing, eprotocol);
+        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto error; }
+        flag_epacing = ESys_AdvanceTime(r->epacing, tmin);
+        if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto error; }
+        r->tnext = ESys_GetNextTime(r->epacing, &flag_epacing);
+        d->pace = ESys_GetLevel(r->epacing, &flag_epacing);
+        r->tnext = (r->tnext < tmax) ? r->tnext : tmax;
     } else {
-        tnext = tmax;
+        r->tnext = tmax;
     }
 
     /* Set up fixed-form pacing */
@@ -762,119 +2317,165 @@ for var in model.variables(deep=True, state=False, bound=False, const=False):
         /* Check 'protocol' is tuple (times, values) */
         if (!PyTuple_Check(fprotocol)) {
             PyErr_SetString(PyExc_Exception, "Fixed-form pacing protocol should be tuple or None.");
-            return sim_clean();
+            goto error;
         }
         if (PyTuple_Size(fprotocol) != 2) {
             PyErr_SetString(PyExc_Exception, "Fixed-form pacing protocol tuple should have size 2.");
-            return sim_clean();
+            goto error;
         }
         /* Create fixed-form pacing object and populate */
-        fpacing = FSys_Create(&flag_fpacing);
-        if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); return sim_clean(); }
-        flag_fpacing = FSys_Populate(fpacing,
+        r->fpacing = FSys_Create(&flag_fpacing);
+        if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); goto error; }
+        flag_fpacing = FSys_Populate(r->fpacing,
             PyTuple_GetItem(fprotocol, 0),  /* Borrowed, no decref */
             PyTuple_GetItem(fprotocol, 1));
-        if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); return sim_clean(); }
+        if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); goto error; }
+        d->fpacing = r->fpacing;
     }
 
     /* Set simulation starting time */
-    engine_time = tmin;
-
-    /* Check dt_max and dt_min */
-    if (dt_max < 0) dt_max = 0.0;
-    if (dt_min < 0) dt_min = 0.0;
+    r->time = tmin;
 
     /* Create solver
      * Using Backward differentiation and Newton iteration */
     #if USE_CVODE > 0
-    #if MYOKIT_SUNDIALS_VERSION >= 40000
-        cvode_mem = CVodeCreate(CV_BDF);
-    #else
-        cvode_mem = CVodeCreate(CV_BDF, CV_NEWTON);
-    #endif
-    if (check_cvode_flag((void*)cvode_mem, "CVodeCreate", 0)) return sim_clean();
+    if (inst->cvode_mem != NULL) {
+        /* Reuse the solver objects from a previous run, and re-initialise
+           them with the new time and state. The matrix and linear solver
+           remain attached to the CVODE memory. */
+        reused = 1;
+        r->cvode_mem = inst->cvode_mem; inst->cvode_mem = NULL;
+        #if MYOKIT_SUNDIALS_VERSION >= 30000
+        r->sunmatrix = inst->sunmatrix; inst->sunmatrix = NULL;
+        r->sunsolver = inst->sunsolver; inst->sunsolver = NULL;
+        #endif
+        flag_cvode = CVodeReInit(r->cvode_mem, r->time, r->y);
+        if (check_cvode_flag(&flag_cvode, "CVodeReInit", 1)) goto error;
+    } else {
+        #if MYOKIT_SUNDIALS_VERSION >= 40000
+            r->cvode_mem = CVodeCreate(CV_BDF);
+        #else
+            r->cvode_mem = CVodeCreate(CV_BDF, CV_NEWTON);
+        #endif
+        if (check_cvode_flag((void*)r->cvode_mem, "CVodeCreate", 0)) goto error;
+        inst->solvers_created++;
+
+        /* Don't let CVODE print errors and warnings */
+        flag_cvode = CVodeSetErrHandlerFn(r->cvode_mem, cvode_error_handler, NULL);
+        if (check_cvode_flag(&flag_cvode, "CVodeSetErrHandlerFn", 1)) goto error;
 
-    /* Initialise solver memory, specify the rhs */
-    flag_cvode = CVodeInit(cvode_mem, rhs, engine_time, y);
-    if (check_cvode_flag(&flag_cvode, "CVodeInit", 1)) return sim_clean();
+        /* Initialise solver memory, specify the rhs */
+        flag_cvode = CVodeInit(r->cvode_mem, rhs, r->time, r->y);
+        if (check_cvode_flag(&flag_cvode, "CVodeInit", 1)) goto error;
+    }
+
+    /* Pass the model variables to the rhs function */
+    flag_cvode = CVodeSetUserData(r->cvode_mem, d);
+    if (check_cvode_flag(&flag_cvode, "CVodeSetUserData", 1)) goto error;
 
     /* Set absolute and relative tolerances */
-    flag_cvode = CVodeSStolerances(cvode_mem, RCONST(rel_tol), RCONST(abs_tol));
-    if (check_cvode_flag(&flag_cvode, "CVodeSStolerances", 1)) return sim_clean();
+    flag_cvode = CVodeSStolerances(r->cvode_mem, RCONST(inst->rel_tol), RCONST(inst->abs_tol));
+    if (check_cvode_flag(&flag_cvode, "CVodeSStolerances", 1)) goto error;
 
     /* Set a maximum step size (or 0.0 for none) */
-
-    flag_cvode = CVodeSetMaxStep(cvode_mem, dt_max);
-    if (check_cvode_flag(&flag_cvode, "CVodeSetmaxStep", 1)) return sim_clean();
+    flag_cvode = CVodeSetMaxStep(r->cvode_mem, inst->dt_max < 0 ? 0 : inst->dt_max);
+    if (check_cvode_flag(&flag_cvode, "CVodeSetmaxStep", 1)) goto error;
 
     /* Set a minimum step size (or 0.0 for none) */
-    flag_cvode = CVodeSetMinStep(cvode_mem, dt_min);
-    if (check_cvode_flag(&flag_cvode, "CVodeSetminStep", 1)) return sim_clean();
+    flag_cvode = CVodeSetMinStep(r->cvode_mem, inst->dt_min < 0 ? 0 : inst->dt_min);
+    if (check_cvode_flag(&flag_cvode, "CVodeSetminStep", 1)) goto error;
 
-    #if MYOKIT_SUNDIALS_VERSION >= 30000
-        /* Create dense matrix for use in linear solves */
-        sundense_matrix = SUNDenseMatrix(N_STATE, N_STATE);
-        if(check_cvode_flag((void *)sundense_matrix, "SUNDenseMatrix", 0)) return sim_clean();
+    /* Create matrix and linear solver, and attach them to cvode */
+    if (!reused) {
+        #if MYOKIT_SUNDIALS_VERSION >= 30000
+        if (create_linear_solver(r->cvode_mem, r->y, &r->sunmatrix, &r->sunsolver, &fname)) {
+        #else
+        if (create_linear_solver(r->cvode_mem, &fname)) {
+        #endif
+            char errstr[200];
+            sprintf(errstr, "Function %s() failed while creating linear solver.", fname);
+            PyErr_SetString(PyExc_Exception, errstr);
+            goto error;
+        }
+    }
 
-        /* Create dense linear solver object with matrix */
-        sundense_solver = SUNDenseLinearSolver(y, sundense_matrix);
-        if(check_cvode_flag((void *)sundense_solver, "SUNDenseLinearSolver", 0)) return sim_clean();
+    /* Activate forward sensitivity analysis, using the staggered corrector
+       method and the generated sensitivity rhs */
+    #if USE_CVODES
+    if (reused) {
+        flag_cvode = CVodeSensReInit(r->cvode_mem, CV_STAGGERED, r->yS);
+        if (check_cvode_flag(&flag_cvode, "CVodeSensReInit", 1)) goto error;
+    } else {
+        flag_cvode = CVodeSensInit(r->cvode_mem, N_SENS_INDEP, CV_STAGGERED, rhs_sens, r->yS);
+        if (check_cvode_flag(&flag_cvode, "CVodeSensInit", 1)) goto error;
+    }
 
-        /* Attach the matrix and solver to cvode */
-        flag_cvode = CVDlsSetLinearSolver(cvode_mem, sundense_solver, sundense_matrix);
-        if(check_cvode_flag(&flag_cvode, "CVDlsSetLinearSolver", 1)) return sim_clean();
-    #else
-        /* Create dense matrix for use in linear solves */
-        flag_cvode = CVDense(cvode_mem, N_STATE);
-        if (check_cvode_flag(&flag_cvode, "CVDense", 1)) return sim_clean();
+    /* Scale the sensitivity error weights using the independents' values */
+    flag_cvode = CVodeSetSensParams(r->cvode_mem, NULL, r->s_scale, NULL);
+    if (check_cvode_flag(&flag_cvode, "CVodeSetSensParams", 1)) goto error;
+
+    /* Estimate sensitivity tolerances from the state tolerances, and include
+       the sensitivities in the error control */
+    flag_cvode = CVodeSensEEtolerances(r->cvode_mem);
+    if (check_cvode_flag(&flag_cvode, "CVodeSensEEtolerances", 1)) goto error;
+    flag_cvode = CVodeSetSensErrCon(r->cvode_mem, 1);
+    if (check_cvode_flag(&flag_cvode, "CVodeSetSensErrCon", 1)) goto error;
     #endif
+
+    /* The solver can now be kept for reuse by the next run */
+    r->solver_ready = 1;
     #endif
 
-    /* Benchmarking? Then set engine_realtime to 0.0 */
+    /* Benchmarking? Then set realtime to 0.0 */
     if (benchtime != Py_None) {
         /* Store initial time as 0 */
-        engine_realtime = 0.0;
-        /* Tell sim_step to set engine_starttime */
-        engine_starttime = -1;
+        d->realtime = 0.0;
+        /* Tell sim_step to set starttime */
+        r->starttime = -1;
     }
 
     /* Set string for updating lists/arrays using Python interface. */
-    list_update_str = PyUnicode_FromString("append");
+    r->list_update_str = PyUnicode_FromString("append");
 
     /* Set logging points */
     if (log_interval > 0) {
 
         /* Periodic logging */
-        ilog = 0;
-        tlog = tmin;
+        r->ilog = 0;
+        r->tlog = tmin;
 
     } else if (log_times != Py_None) {
 
         /* Point-list logging */
 
-        /* Check the log_times list */
+        /* Check the log_times list, and copy it so that it can be read
+           without holding the GIL */
         if (!PyList_Check(log_times)) {
             PyErr_SetString(PyExc_Exception, "'log_times' must be a list.");
-            return sim_clean();
+            goto error;
         }
-
-        /* Read next log point off the list */
-        ilog = 0;
-        tlog = engine_time - 1;
-        while(ilog < PyList_Size(log_times) && tlog < engine_time) {
-            flt = PyList_GetItem(log_times, ilog); /* Borrowed */
+        r->n_log_times = PyList_Size(log_times);
+        r->log_times = (double*)malloc(sizeof(double) * (r->n_log_times + 1));
+        for (pos=0; pos<r->n_log_times; pos++) {
+            flt = PyList_GetItem(log_times, pos); /* Borrowed */
             if (!PyFloat_Check(flt)) {
                 PyErr_SetString(PyExc_Exception, "Entries in 'log_times' must be floats.");
-                return sim_clean();
+                goto error;
             }
-            tlog = PyFloat_AsDouble(flt);
-            ilog++;
-            flt = NULL;
+            r->log_times[pos] = PyFloat_AsDouble(flt);
+        }
+
+        /* Read next log point off the list */
+        r->ilog = 0;
+        r->tlog = r->time - 1;
+        while(r->ilog < r->n_log_times && r->tlog < r->time) {
+            r->tlog = r->log_times[r->ilog];
+            r->ilog++;
         }
 
-        /* No points beyond engine_time? Then don't log any future points. */
-        if(tlog < engine_time) {
-            tlog = tmax + 1;
+        /* No points beyond time? Then don't log any future points. */
+        if(r->tlog < r->time) {
+            r->tlog = tmax + 1;
         }
 
     } else {
@@ -887,33 +2488,20 @@ for var in model.variables(deep=True, state=False, bound=False, const=False):
          * dynamic logging is stopped and started.
          */
 
-        /*  Check if the log is empty */
-        log_first_point = 1;
-        pos = 0;
-        if(PyDict_Next(log_dict, &pos, &key, &value)) {
-            /* Items found in dict, randomly selected list now in "value" */
-            /* Both key and value are borrowed references, no need to decref */
-            log_first_point = (PyObject_Size(value) <= 0);
-        }
-
-        /* If so, log the first point! */
-        if (log_first_point) {
-            rhs(engine_time, y, dy_log, 0);
+        /* Not appending? Then log the first point! */
+        if (!log_append) {
+            rhs(r->time, r->y, r->dy_log, d);
             /* At this point, we have y(t), inter(t) and dy(t) */
             /* We've also loaded time(t) and pace(t) */
-            for(i=0; i<n_vars; i++) {
-                flt = PyFloat_FromDouble(*vars[i]);
-                ret = PyObject_CallMethodObjArgs(logs[i], list_update_str, flt, NULL);
-                Py_DECREF(flt);
-                Py_XDECREF(ret);
-                if (ret == NULL) {
-                    flt = NULL;
-                    PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                    return sim_clean();
+            #if N_SENS_INDEP > 0
+            if (r->n_sens > 0) sens_outputs(r->y, r->dy_log, r->yS, d, r->s_values);
+            #endif
+            if (sim_log_point(r) || sim_flush(r)) {
+                if (r->error == SIM_ERR_MEMORY) {
+                    PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for logging.");
                 }
+                goto error;
             }
-            flt = NULL;
-            ret = NULL;
         }
     }
 
@@ -921,22 +2509,56 @@ for var in model.variables(deep=True, state=False, bound=False, const=False):
     #if USE_CVODE
     if (PySequence_Check(root_list)) {
         /* Set threshold */
-        rootfinding_threshold = root_threshold;
-        /* Initialize root function with 1 component */
-        flag_cvode = CVodeRootInit(cvode_mem, 1, root_finding);
-        if (check_cvode_flag(&flag_cvode, "CVodeRootInit", 1)) return sim_clean();
+        d->rootfinding_threshold = root_threshold;
+        /* Add a component for the apd variable */
+        d->condition_offset = 1;
+    }
+    if (d->condition_offset + d->n_conditions > 0) {
+        /* Initialize root function with 1 component per condition */
+        flag_cvode = CVodeRootInit(r->cvode_mem, d->condition_offset + d->n_conditions, root_finding);
+        if (check_cvode_flag(&flag_cvode, "CVodeRootInit", 1)) goto error;
+        if (d->n_conditions > 0) {
+            /* Set directions: conditions are stored after the apd component,
+               which detects crossings in both directions */
+            for (i=d->n_conditions - 1; i>=0; i--) {
+                r->cd_direction[i + d->condition_offset] = r->cd_direction[i];
+            }
+            if (d->condition_offset > 0) r->cd_direction[0] = 0;
+            flag_cvode = CVodeSetRootDirection(r->cvode_mem, r->cd_direction);
+            if (check_cvode_flag(&flag_cvode, "CVodeSetRootDirection", 1)) goto error;
+        } else {
+            /* Detect apd crossings in both directions. This is set
+               explicitly, as the setting is kept when the solver is reused */
+            i = 0;
+            flag_cvode = CVodeSetRootDirection(r->cvode_mem, &i);
+            if (check_cvode_flag(&flag_cvode, "CVodeSetRootDirection", 1)) goto error;
+        }
+    } else if (reused) {
+        /* Disable any root finding used in a previous run */
+        flag_cvode = CVodeRootInit(r->cvode_mem, 0, NULL);
+        if (check_cvode_flag(&flag_cvode, "CVodeRootInit", 1)) goto error;
     }
     #endif
 
     /* Done! */
-    Py_RETURN_NONE;
+    return capsule;
+
+error:
+    sim_clean_run(r);
+    Py_DECREF(capsule);
+    return 0;
 }
 
 /*
- * Takes the next steps in a simulation run
+ * Takes up to max_steps integration steps, logging to the log buffer. This
+ * function does not use the Python API unless benchmarking, so that it can be
+ * called without holding the GIL.
+ *
+ * Returns 1 if the simulation finished, 0 if it should be continued, or -1 if
+ * an error occurred (in which case r->error is set).
  */
-static PyObject*
-sim_step(PyObject *self, PyObject *args)
+static int
+sim_advance(SimRun* r, int max_steps)
 {
     ESys_Flag flag_epacing;
     int i;
@@ -944,22 +2566,16 @@ sim_step(PyObject *self, PyObject *args)
     int flag_cvode;         /* CVode flag */
     int flag_root;          /* Root finding flag */
     int flag_reinit = 0;    /* Set if CVODE needs to be reset during a simulation step */
-    PyObject *flt, *ret;
+    int benchmarking = (r->benchtime != Py_None);
+    ModelData* d = &r->data;
 
     /*
      * Benchmarking? Then make sure start time is set.
      * This is handled here instead of in sim_init so it only includes time
      * taken performing steps, not time initialising memory etc.
      */
-    if (benchtime != Py_None && engine_starttime < 0) {
-        flt = PyObject_CallFunction(benchtime, "");
-        if (!PyFloat_Check(flt)) {
-            Py_XDECREF(flt); flt = NULL;
-            PyErr_SetString(PyExc_Exception, "Call to benchmark time function didn't return float.");
-            return sim_clean();
-        }
-        engine_starttime = PyFloat_AsDouble(flt);
-        Py_DECREF(flt); flt = NULL;
+    if (benchmarking && r->starttime < 0) {
+        if (sim_update_realtime(r, r->y)) return -1;
     }
 
     /* Go! */
@@ -967,29 +2583,23 @@ sim_step(PyObject *self, PyObject *args)
 
         /* Back-up current y (no allocation, this is fast) */
         for(i=0; i<N_STATE; i++) {
-            NV_Ith_S(y_last, i) = NV_Ith_S(y, i);
+            NV_Ith_S(r->y_last, i) = NV_Ith_S(r->y, i);
         }
 
         /* Store engine time before step */
-        engine_time_last = engine_time;
+        r->time_last = r->time;
 
         #if USE_CVODE
 
         /* Take a single ODE step */
-        flag_cvode = CVode(cvode_mem, tnext, y, &engine_time, CV_ONE_STEP);
+        flag_cvode = CVode(r->cvode_mem, r->tnext, r->y, &r->time, CV_ONE_STEP);
 
         /* Check for errors */
-        if (check_cvode_flag(&flag_cvode, "CVode", 1)) {
-            /* Something went wrong... Set outputs and return */
-            for(i=0; i<N_STATE; i++) {
-                PyList_SetItem(state_out, i, PyFloat_FromDouble(NV_Ith_S(y_last, i)));
-                /* PyList_SetItem steals a reference: no need to decref the double! */
-            }
-            PyList_SetItem(inputs, 0, PyFloat_FromDouble(engine_time));
-            PyList_SetItem(inputs, 1, PyFloat_FromDouble(engine_pace));
-            PyList_SetItem(inputs, 2, PyFloat_FromDouble(engine_realtime));
-            PyList_SetItem(inputs, 3, PyFloat_FromDouble(engine_evaluations));
-            return sim_clean();
+        if (flag_cvode < 0) {
+            r->error = SIM_ERR_CVODE;
+            r->error_flag = flag_cvode;
+            r->error_func = "CVode";
+            return -1;
         }
 
         #else
@@ -998,132 +2608,232 @@ sim_step(PyObject *self, PyObject *args)
         /* Note 1: To stay compatible with cvode-mode, don't jump to the
            next log time (if tlog < tnext) */
         /* Note 2: tnext can be infinity, so don't always jump there. */
-        engine_time = (tmax > tnext) ? tnext : tmax;
+        r->time = (r->tmax > r->tnext) ? r->tnext : r->tmax;
         flag_cvode = CV_SUCCESS;
 
         #endif
 
         /* Check if progress is being made */
-        if(engine_time == engine_time_last) {
-            if(++zero_step_count >= max_zero_step_count) {
-                char errstr[200];
-                sprintf(errstr, "ZERO_STEP %f", engine_time);
-                PyErr_SetString(PyExc_Exception, errstr);
-                return sim_clean();
+        if(r->time == r->time_last) {
+            if(++r->zero_step_count >= max_zero_step_count) {
+                r->error = SIM_ERR_ZERO_STEP;
+                return -1;
             }
         } else {
             /* Only count consecutive zero steps! */
-            zero_step_count = 0;
+            r->zero_step_count = 0;
         }
 
         /* Update step count */
-        engine_steps++;
+        r->steps++;
 
         /* If we got to this point without errors... */
         if ((flag_cvode == CV_SUCCESS) || (flag_cvode == CV_ROOT_RETURN)) {
 
             /* Next event time exceeded? (Can't happen in cvode-free mode) */
             #if USE_CVODE
-            if (engine_time > tnext) {
-
-                /* Go back to engine_time=tnext */
-                flag_cvode = CVodeGetDky(cvode_mem, tnext, 0, y);
-                if (check_cvode_flag(&flag_cvode, "CVodeGetDky", 1)) return sim_clean();
-                engine_time = tnext;
+            if (r->time > r->tnext) {
+
+                /* Go back to time=tnext */
+                flag_cvode = CVodeGetDky(r->cvode_mem, r->tnext, 0, r->y);
+                if (flag_cvode < 0) {
+                    r->error = SIM_ERR_CVODE;
+                    r->error_flag = flag_cvode;
+                    r->error_func = "CVodeGetDky";
+                    return -1;
+                }
+                r->time = r->tnext;
                 /* Require reinit (after logging) */
                 flag_reinit = 1;
 
             } else if (flag_cvode == CV_ROOT_RETURN) {
 
                 /* Store found roots */
-                flag_root = CVodeGetRootInfo(cvode_mem, rootsfound);
-                if (check_cvode_flag(&flag_root, "CVodeGetRootInfo", 1)) return sim_clean();
-                flt = PyTuple_New(2);
-                PyTuple_SetItem(flt, 0, PyFloat_FromDouble(engine_time)); /* Steals reference, so this is ok */
-                PyTuple_SetItem(flt, 1, PyLong_FromLong(rootsfound[0]));
-                ret = PyObject_CallMethodObjArgs(root_list, list_update_str, flt, NULL);
-                Py_DECREF(flt); flt = NULL;
-                Py_XDECREF(ret);
-                if (ret == NULL) {
-                    PyErr_SetString(PyExc_Exception, "Call to append() failed on root finding list.");
-                    return sim_clean();
+                flag_root = CVodeGetRootInfo(r->cvode_mem, r->rootsfound);
+                if (flag_root < 0) {
+                    r->error = SIM_ERR_CVODE;
+                    r->error_flag = flag_root;
+                    r->error_func = "CVodeGetRootInfo";
+                    return -1;
+                }
+                if (d->condition_offset > 0 && r->rootsfound[0] != 0) {
+                    if (sim_log_root(r, r->time, r->rootsfound[0])) return -1;
                 }
-                ret = NULL;
+                for (i=0; i<d->n_conditions; i++) {
+                    if (r->rootsfound[d->condition_offset + i] != 0) {
+                        if (sim_log_crossing(r, r->time, i, r->rootsfound[d->condition_offset + i])) return -1;
+                        if (r->cd_stop[i]) r->cd_stopped = 1;
+                    }
+                }
+            }
+            #endif
+
+            /* Get the state sensitivities at the current time */
+            #if USE_CVODES
+            flag_cvode = CVodeGetSensDky(r->cvode_mem, r->time, 0, r->yS);
+            if (flag_cvode < 0) {
+                r->error = SIM_ERR_CVODE;
+                r->error_flag = flag_cvode;
+                r->error_func = "CVodeGetSensDky";
+                return -1;
+            }
+            #endif
+
+            /* Dense output: store the interpolating polynomial */
+            #if USE_CVODE
+            if (r->dn_out != NULL) {
+                if (sim_log_dense(r)) return -1;
             }
             #endif
 
+            /* Biomarkers: Complete any beats that ended during this step,
+               using the interpolated state at the end of each beat, and
+               then update the current beat with the state and derivatives
+               at the current time. */
+            if (r->mk_period > 0) {
+                while (r->time >= r->mk_tbeat) {
+                    #if USE_CVODE
+                    flag_cvode = CVodeGetDky(r->cvode_mem, r->mk_tbeat, 0, r->y_mk);
+                    if (flag_cvode < 0) {
+                        r->error = SIM_ERR_CVODE;
+                        r->error_flag = flag_cvode;
+                        r->error_func = "CVodeGetDky";
+                        return -1;
+                    }
+                    #endif
+                    if (mk_update(r, r->mk_tbeat, r->y_mk, NULL)) return -1;
+                    if (mk_end_beat(r)) return -1;
+                    mk_start_beat(r, r->mk_tbeat, r->y_mk);
+                    r->mk_beats++;
+                    r->mk_tbeat = r->tmin + (double)(r->mk_beats + 1) * r->mk_period;
+                }
+                rhs(r->time, r->y, r->dy_log, d);
+                if (mk_update(r, r->time, r->y, r->dy_log)) return -1;
+            }
+
+            /* Steady-state detection: compare the state at the start of
+               each beat with the state at the start of the previous beat,
+               and stop as soon as the change is within tolerance. This
+               happens before logging, so that no points after the start of
+               the final beat are logged. */
+            while (r->beat_period > 0 && r->time >= r->tbeat) {
+
+                /* Get interpolated y(tbeat) */
+                #if USE_CVODE
+                flag_cvode = CVodeGetDky(r->cvode_mem, r->tbeat, 0, r->y_check);
+                if (flag_cvode < 0) {
+                    r->error = SIM_ERR_CVODE;
+                    r->error_flag = flag_cvode;
+                    r->error_func = "CVodeGetDky";
+                    return -1;
+                }
+                #endif
+                /* In cvode-free mode, there are no states to compare */
+
+                /* Check if the beat-to-beat change is within tolerance (the
+                   negated comparison ensures NaNs are never accepted) */
+                r->beats++;
+                r->converged = 1;
+                for(i=0; i<N_STATE; i++) {
+                    if (!(fabs(NV_Ith_S(r->y_check, i) - NV_Ith_S(r->y_beat, i))
+                            <= r->beat_tol * (1 + fabs(NV_Ith_S(r->y_check, i))))) {
+                        r->converged = 0;
+                        break;
+                    }
+                }
+
+                /* Steady state reached? Then end the run at tbeat */
+                if (r->converged) {
+                    for(i=0; i<N_STATE; i++) {
+                        NV_Ith_S(r->y, i) = NV_Ith_S(r->y_check, i);
+                    }
+                    r->time = r->tbeat;
+                    #if USE_CVODES
+                    flag_cvode = CVodeGetSensDky(r->cvode_mem, r->time, 0, r->yS);
+                    if (flag_cvode < 0) {
+                        r->error = SIM_ERR_CVODE;
+                        r->error_flag = flag_cvode;
+                        r->error_func = "CVodeGetSensDky";
+                        return -1;
+                    }
+                    #endif
+                    return 1;
+                }
+
+                /* Store state, and get start of next beat */
+                for(i=0; i<N_STATE; i++) {
+                    NV_Ith_S(r->y_beat, i) = NV_Ith_S(r->y_check, i);
+                }
+                r->tbeat = r->tmin + (double)(r->beats + 1) * r->beat_period;
+            }
+
             /* Periodic logging or point-list logging */
-            if (!dynamic_logging && engine_time > tlog) {
+            if (!r->dynamic_logging && r->time > r->tlog) {
                 /* Note: For periodic logging, the condition should be
                    `time > tlog` so that we log half-open intervals (i.e. the
                    final point should never be included). */
 
-                /* Benchmarking? Then set engine_realtime */
-                if (benchtime != Py_None) {
-                    flt = PyObject_CallFunction(benchtime, "");
-                    if (!PyFloat_Check(flt)) {
-                        Py_XDECREF(flt); flt = NULL;
-                        PyErr_SetString(PyExc_Exception, "Call to benchmark time function didn't return float.");
-                        return sim_clean();
-                    }
-                    engine_realtime = PyFloat_AsDouble(flt) - engine_starttime;
-                    Py_DECREF(flt); flt = NULL;
-                    /* Update any variables bound to realtime */
-                    update_realtime_bindings(engine_time, y, dy_log, 0);
+                /* Benchmarking? Then set realtime */
+                if (benchmarking) {
+                    if (sim_update_realtime(r, r->y)) return -1;
                 }
 
                 /* Log points */
-                while (engine_time > tlog) {
+                while (r->time > r->tlog) {
 
                     /* Get interpolated y(tlog) */
                     #if USE_CVODE
-                    flag_cvode = CVodeGetDky(cvode_mem, tlog, 0, y_log);
-                    if (check_cvode_flag(&flag_cvode, "CVodeGetDky", 1)) return sim_clean();
+                    flag_cvode = CVodeGetDky(r->cvode_mem, r->tlog, 0, r->y_log);
+                    if (flag_cvode < 0) {
+                        r->error = SIM_ERR_CVODE;
+                        r->error_flag = flag_cvode;
+                        r->error_func = "CVodeGetDky";
+                        return -1;
+                    }
                     #endif
                     /* If cvode-free mode, the state can't change so we don't
                        need to do anything here */
 
                     /* Calculate intermediate variables & derivatives */
-                    rhs(tlog, y_log, dy_log, 0);
-
-                    /* Write to log */
-                    for(i=0; i<n_vars; i++) {
-                        flt = PyFloat_FromDouble(*vars[i]);
-                        ret = PyObject_CallMethodObjArgs(logs[i], list_update_str, flt, NULL);
-                        Py_DECREF(flt);
-                        Py_XDECREF(ret);
-                        if (ret == NULL) {
-                            flt = NULL;
-                            PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                            return sim_clean();
+                    rhs(r->tlog, r->y_log, r->dy_log, d);
+
+                    /* Calculate sensitivities */
+                    #if N_SENS_INDEP > 0
+                    if (r->n_sens > 0) {
+                        #if USE_CVODES
+                        flag_cvode = CVodeGetSensDky(r->cvode_mem, r->tlog, 0, r->yS_log);
+                        if (flag_cvode < 0) {
+                            r->error = SIM_ERR_CVODE;
+                            r->error_flag = flag_cvode;
+                            r->error_func = "CVodeGetSensDky";
+                            return -1;
                         }
+                        #endif
+                        sens_outputs(r->y_log, r->dy_log, r->yS_log, d, r->s_values);
                     }
-                    ret = flt = NULL;
+                    #endif
+
+                    /* Write to log */
+                    if (sim_log_point(r)) return -1;
 
                     /* Get next logging point */
-                    if (log_interval > 0) {
+                    if (r->log_interval > 0) {
                         /* Periodic logging */
-                        ilog++;
-                        tlog = tmin + (double)ilog * log_interval;
-                        if (ilog == 0) {
+                        r->ilog++;
+                        r->tlog = r->tmin + (double)r->ilog * r->log_interval;
+                        if (r->ilog == 0) {
                             /* Unsigned int wraps around instead of overflowing, becomes zero again */
-                            PyErr_SetString(PyExc_Exception, "Overflow in logged step count: Simulation too long!");
-                            return sim_clean();
+                            r->error = SIM_ERR_OVERFLOW;
+                            return -1;
                         }
                     } else {
                         /* Point-list logging */
                         /* Read next log point off the list */
-                        if (ilog < PyList_Size(log_times)) {
-                            flt = PyList_GetItem(log_times, ilog); /* Borrowed */
-                            if (!PyFloat_Check(flt)) {
-                                PyErr_SetString(PyExc_Exception, "Entries in 'log_times' must be floats.");
-                                return sim_clean();
-                            }
-                            tlog = PyFloat_AsDouble(flt);
-                            ilog++;
-                            flt = NULL;
+                        if (r->ilog < r->n_log_times) {
+                            r->tlog = r->log_times[r->ilog];
+                            r->ilog++;
                         } else {
-                            tlog = tmax + 1;
+                            r->tlog = r->tmax + 1;
                         }
                     }
                 }
@@ -1131,57 +2841,48 @@ sim_step(PyObject *self, PyObject *args)
 
             /* Event-based pacing */
 
-            /* At this point we have logged everything _before_ engine_time, so
+            /* At this point we have logged everything _before_ time, so
                it's safe to update the pacing mechanism. */
-            if (epacing != NULL) {
-                flag_epacing = ESys_AdvanceTime(epacing, engine_time);
-                if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); return sim_clean(); }
-                tnext = ESys_GetNextTime(epacing, NULL);
-                engine_pace = ESys_GetLevel(epacing, NULL);
-                tnext = (tnext < tmax) ? tnext : tmax;
+            if (r->epacing != NULL) {
+                flag_epacing = ESys_AdvanceTime(r->epacing, r->time);
+                if (flag_epacing != ESys_OK) {
+                    r->error = SIM_ERR_EPACING;
+                    r->error_flag = flag_epacing;
+                    return -1;
+                }
+                r->tnext = ESys_GetNextTime(r->epacing, NULL);
+                d->pace = ESys_GetLevel(r->epacing, NULL);
+                r->tnext = (r->tnext < r->tmax) ? r->tnext : r->tmax;
             }
 
             /* Dynamic logging: Log every visited point */
-            if (dynamic_logging) {
+            if (r->dynamic_logging) {
 
                 /* Ensure the logged values are correct for the new time t */
-                if (log_deriv || log_inter) {
-                    /* If logging derivatives or intermediaries, calculate the
-                       values for the current time. */
-                    rhs(engine_time, y, dy_log, 0);
-                } else if (log_bound) {
+                if (r->log_deriv || r->log_inter || r->n_sens) {
+                    /* If logging derivatives, intermediaries, or
+                       sensitivities, calculate the values for the current
+                       time. */
+                    rhs(r->time, r->y, r->dy_log, d);
+                    #if N_SENS_INDEP > 0
+                    if (r->n_sens > 0) sens_outputs(r->y, r->dy_log, r->yS, d, r->s_values);
+                    #endif
+                } else if (r->log_bound) {
                     /* Logging bounds but not derivs or inters: No need to run
                        full rhs, just update bound variables */
-                    update_bindings(engine_time, y, dy_log, 0);
+                    update_bindings(r->time, r->y, r->dy_log, d);
                 }
 
-                /* Benchmarking? Then set engine_realtime */
-                if (benchtime != Py_None) {
-                    flt = PyObject_CallFunction(benchtime, "");
-                    if (!PyFloat_Check(flt)) {
-                        Py_XDECREF(flt); flt = NULL;
-                        PyErr_SetString(PyExc_Exception, "Call to benchmark time function didn't return float.");
-                        return sim_clean();
-                    }
-                    engine_realtime = PyFloat_AsDouble(flt) - engine_starttime;
-                    Py_DECREF(flt); flt = NULL;
-                    /* Update any variables bound to realtime */
-                    update_realtime_bindings(engine_time, y, dy_log, 0);
+                /* Benchmarking? Then set realtime */
+                if (benchmarking) {
+                    if (sim_update_realtime(r, r->y)) return -1;
                 }
 
-                /* Write to log */
-                for(i=0; i<n_vars; i++) {
-                    flt = PyFloat_FromDouble(*vars[i]);
-                    ret = PyObject_CallMethodObjArgs(logs[i], list_update_str, flt, NULL);
-                    Py_DECREF(flt); flt = NULL;
-                    Py_XDECREF(ret);
-                    if (ret == NULL) {
-                        PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                        return sim_clean();
-                    }
-                    ret = NULL;
+                /* Write to log. With change-driven logging, only write if
+                   any variable has changed enough, or at the final point */
+                if (r->log_atol == NULL || r->time >= r->tmax || r->cd_stopped || sim_log_changed(r)) {
+                    if (sim_log_point(r)) return -1;
                 }
-
             }
 
             /* Reinitialize if needed (cvode-mode only) */
@@ -1189,44 +2890,153 @@ sim_step(PyObject *self, PyObject *args)
             if (flag_reinit) {
                 flag_reinit = 0;
                 /* Re-init */
-                flag_cvode = CVodeReInit(cvode_mem, engine_time, y);
-                if (check_cvode_flag(&flag_cvode, "CVodeReInit", 1)) return sim_clean();
+                flag_cvode = CVodeReInit(r->cvode_mem, r->time, r->y);
+                if (flag_cvode < 0) {
+                    r->error = SIM_ERR_CVODE;
+                    r->error_flag = flag_cvode;
+                    r->error_func = "CVodeReInit";
+                    return -1;
+                }
+                #if USE_CVODES
+                flag_cvode = CVodeSensReInit(r->cvode_mem, CV_STAGGERED, r->yS);
+                if (flag_cvode < 0) {
+                    r->error = SIM_ERR_CVODE;
+                    r->error_flag = flag_cvode;
+                    r->error_func = "CVodeSensReInit";
+                    return -1;
+                }
+                #endif
             }
             #endif
         }
 
-        /* Check if we're finished */
-        if (ESys_eq(engine_time, tmax)) engine_time = tmax;
-        if (engine_time >= tmax) break;
-
-        /* Perform any Python signal handling */
-        if (PyErr_CheckSignals() != 0) {
-            /* Exception (e.g. timeout or keyboard interrupt) occurred?
-               Then cancel everything! */
-            return sim_clean();
-        }
+        /* Check if we're finished, or if a threshold condition ended the
+           run */
+        if (ESys_eq(r->time, r->tmax)) r->time = r->tmax;
+        if (r->time >= r->tmax || r->cd_stopped) return 1;
 
         /* Report back to python after every x steps */
         steps_taken++;
-        if (steps_taken >= 100) {
-            return PyFloat_FromDouble(engine_time);
-        }
+        if (steps_taken >= max_steps) return 0;
     }
+}
 
-    /* Set final state */
+/*
+ * Writes the current (or last) state, the state sensitivities, and the
+ * binding inputs to the output lists. Must be called while holding the GIL.
+ */
+static void
+sim_write_outputs(SimRun* r, N_Vector y)
+{
+    int i;
+    #if USE_CVODES
+    int j;
+    #endif
     for(i=0; i<N_STATE; i++) {
-        PyList_SetItem(state_out, i, PyFloat_FromDouble(NV_Ith_S(y, i)));
+        PyList_SetItem(r->state_out, i, PyFloat_FromDouble(NV_Ith_S(y, i)));
         /* PyList_SetItem steals a reference: no need to decref the double! */
     }
+    #if USE_CVODES
+    for(i=0; i<N_STATE; i++) {
+        for(j=0; j<N_SENS_INDEP; j++) {
+            PyList_SetItem(r->s_state_out, i * N_SENS_INDEP + j, PyFloat_FromDouble(NV_Ith_S(r->yS[j], i)));
+        }
+    }
+    #endif
+    PyList_SetItem(r->inputs, 0, PyFloat_FromDouble(r->time));
+    PyList_SetItem(r->inputs, 1, PyFloat_FromDouble(r->data.pace));
+    PyList_SetItem(r->inputs, 2, PyFloat_FromDouble(r->data.realtime));
+    PyList_SetItem(r->inputs, 3, PyFloat_FromDouble(r->data.evaluations));
+    if (r->steady != Py_None) {
+        PyList_SetItem(r->steady, 2, PyLong_FromLong(r->beats));
+        PyList_SetItem(r->steady, 3, PyBool_FromLong(r->converged));
+    }
+    if (r->cd_spec != Py_None) {
+        PyList_SetItem(r->cd_spec, 6, PyBool_FromLong(r->cd_stopped));
+    }
+}
 
-    /* Set state of inputs */
-    PyList_SetItem(inputs, 0, PyFloat_FromDouble(engine_time));
-    PyList_SetItem(inputs, 1, PyFloat_FromDouble(engine_pace));
-    PyList_SetItem(inputs, 2, PyFloat_FromDouble(engine_realtime));
-    PyList_SetItem(inputs, 3, PyFloat_FromDouble(engine_evaluations));
+/*
+ * Takes the next steps in a simulation run
+ */
+static PyObject*
+sim_step(PyObject *self, PyObject *args)
+{
+    int status;
+    SimRun* r;
+
+    /* Get run */
+    r = sim_get_run(args);
+    if (r == NULL) return 0;
+    if (r->running == 0) {
+        PyErr_SetString(PyExc_Exception, "Simulation not initialized.");
+        return 0;
+    }
+
+    /* Take up to 100 steps, then report back to Python. The GIL is released
+       while stepping, unless the realtime binding requires calls to the
+       Python benchmarking function. */
+    if (r->benchtime != Py_None) {
+        status = sim_advance(r, 100);
+    } else {
+        Py_BEGIN_ALLOW_THREADS
+        status = sim_advance(r, 100);
+        Py_END_ALLOW_THREADS
+    }
+
+    /* Move logged points to log buffers, even after errors */
+    if (sim_flush(r)) return sim_clean_run(r);
+
+    /* Handle errors */
+    if (status < 0) {
+        switch (r->error) {
+        case SIM_ERR_CVODE:
+            if (strcmp(r->error_func, "CVode") == 0) {
+                /* Something went wrong... Set outputs and return */
+                sim_write_outputs(r, r->y_last);
+            }
+            check_cvode_flag(&r->error_flag, r->error_func, 1);
+            break;
+        case SIM_ERR_EPACING:
+            ESys_SetPyErr(r->error_flag);
+            break;
+        case SIM_ERR_ZERO_STEP:
+            {
+                char errstr[200];
+                sprintf(errstr, "ZERO_STEP %f", r->time);
+                PyErr_SetString(PyExc_Exception, errstr);
+            }
+            break;
+        case SIM_ERR_OVERFLOW:
+            PyErr_SetString(PyExc_Exception, "Overflow in logged step count: Simulation too long!");
+            break;
+        case SIM_ERR_MEMORY:
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for logging.");
+            break;
+        }
+        return sim_clean_run(r);
+    }
+
+    /* Perform any Python signal handling */
+    if (PyErr_CheckSignals() != 0) {
+        /* Exception (e.g. timeout or keyboard interrupt) occurred?
+           Then cancel everything! */
+        return sim_clean_run(r);
+    }
+
+    /* Not finished? Then report back to python */
+    if (status == 0) {
+        return PyFloat_FromDouble(r->time);
+    }
+
+    /* Set final state and state of inputs */
+    sim_write_outputs(r, r->y);
 
-    sim_clean();    /* Ignore return value */
-    return PyFloat_FromDouble(engine_time);
+    /* Return tmax, even if the run was stopped early because a steady state
+       was reached or a threshold condition was met, so that the calling loop
+       ends */
+    sim_clean_run(r);    /* Ignore return value */
+    return PyFloat_FromDouble(r->tmax);
 }
 
 /*
@@ -1242,21 +3052,26 @@ sim_eval_derivatives(PyObject *self, PyObject *args)
     double time_in;
     double pace_in;
     char errstr[200];
+    PyObject *capsule;
     PyObject *state;
     PyObject *deriv;
     PyObject *flt;
     N_Vector y;
     N_Vector dy;
+    SimInstance* inst;
+    ModelData data;
 
     /* Start */
     success = 0;
 
     /* Check input arguments */
-    if (!PyArg_ParseTuple(args, "OOdd", &state, &deriv, &time_in, &pace_in)) {
-        PyErr_SetString(PyExc_Exception, "Expecting sequence arguments 'y' and 'dy' followed by floats 'time' and 'pace'.");
+    if (!PyArg_ParseTuple(args, "OOOdd", &capsule, &state, &deriv, &time_in, &pace_in)) {
+        PyErr_SetString(PyExc_Exception, "Expecting an instance (capsule), sequence arguments 'y' and 'dy', and floats 'time' and 'pace'.");
         /* Nothing allocated yet, no pyobjects _created_, return directly */
         return 0;
     }
+    inst = sim_get_instance(capsule);
+    if (inst == NULL) return 0;
     if (!PySequence_Check(state)) {
         PyErr_SetString(PyExc_Exception, "First argument must support the sequence interface.");
         return 0;
@@ -1269,10 +3084,6 @@ sim_eval_derivatives(PyObject *self, PyObject *args)
     /* From this point on, no more direct returning: use goto error */
     y = NULL;      /* A cvode SERIAL vector */
     dy = NULL;     /* A cvode SERIAL vector */
-    #if MYOKIT_SUNDIALS_VERSION >= 30000
-    sundense_matrix = NULL;     /* A matrix for linear solving */
-    sundense_solver = NULL;     /* A linear solver */
-    #endif
 
     /* Temporary object: decref before re-using for another var :) */
     /* (Unless you get them using PyList_GetItem...) */
@@ -1290,8 +3101,10 @@ sim_eval_derivatives(PyObject *self, PyObject *args)
         goto error;
     }
 
-    /* Set calculated constants */
-    updateConstants();
+    /* Set calculated constants, using a copy of the model variables */
+    data = inst->data;
+    data.fpacing = NULL;
+    updateConstants(&data);
 
     /* Set initial values */
     for (iState = 0; iState < N_STATE; iState++) {
@@ -1307,12 +3120,11 @@ sim_eval_derivatives(PyObject *self, PyObject *args)
     }
     flt = NULL;
 
-    /* Set simulation time and pacing variable */
-    engine_time = time_in;
-    engine_pace = pace_in;
+    /* Set pacing variable */
+    data.pace = pace_in;
 
     /* Evaluate derivatives */
-    rhs(engine_time, y, dy, 0);
+    rhs(time_in, y, dy, &data);
 
     /* Set output values */
     for(i=0; i<N_STATE; i++) {
@@ -1347,16 +3159,22 @@ error:
 static PyObject*
 sim_set_constant(PyObject *self, PyObject *args)
 {
+    PyObject* capsule;
+    SimInstance* inst;
     double value;
     char* name;
     char errstr[200];
+    ModelData* d;
 
     /* Check input arguments */
-    if (!PyArg_ParseTuple(args, "sd", &name, &value)) {
-        PyErr_SetString(PyExc_Exception, "Expected input arguments: name (str), value (Float).");
+    if (!PyArg_ParseTuple(args, "Osd", &capsule, &name, &value)) {
+        PyErr_SetString(PyExc_Exception, "Expected input arguments: instance (capsule), name (str), value (Float).");
         /* Nothing allocated yet, no pyobjects _created_, return directly */
         return 0;
     }
+    inst = sim_get_instance(capsule);
+    if (inst == NULL) return 0;
+    d = &inst->data;
 
 <?
 for var in model.variables(const=True, deep=True):
@@ -1377,7 +3195,9 @@ for var in model.variables(const=True, deep=True):
 static PyObject*
 sim_steps(PyObject *self, PyObject *args)
 {
-    return PyLong_FromLong(engine_steps);
+    SimInstance* s = sim_get_instance_arg(args);
+    if (s == NULL) return 0;
+    return PyLong_FromLong(s->last_steps);
 }
 
 /*
@@ -1386,23 +3206,680 @@ sim_steps(PyObject *self, PyObject *args)
 static PyObject*
 sim_evals(PyObject *self, PyObject *args)
 {
-    return PyLong_FromLong(engine_evaluations);
+    SimInstance* s = sim_get_instance_arg(args);
+    if (s == NULL) return 0;
+    return PyLong_FromLong(s->last_evaluations);
+}
+
+/*
+ * Returns the number of times new solver memory was created, instead of
+ * reusing the memory from a previous run
+ */
+static PyObject*
+sim_solvers_created(PyObject *self, PyObject *args)
+{
+    SimInstance* s = sim_get_instance_arg(args);
+    if (s == NULL) return 0;
+    return PyLong_FromLong(s->solvers_created);
+}
+
+/*
+ * Ensemble simulations
+ *
+ * An ensemble is a set of simulations of the same model, with the same
+ * protocol and initial state, but with different values for a set of literal
+ * constants. Each member of the ensemble is simulated independently using its
+ * own copy of the ModelData struct. Members are divided over a number of
+ * threads, each with its own CVODE memory and pacing systems. The GIL is
+ * released while the threads run, so no Python API calls can be made from
+ * the worker functions.
+ */
+
+/*
+ * Returns the offset in the ModelData struct of the literal constant with
+ * the given name, or -1 if no such constant exists.
+ */
+static Py_ssize_t
+ens_constant_offset(const char* name)
+{
+<?
+for var in model.variables(const=True, deep=True):
+    if var.is_literal():
+        print(tab + 'if (strcmp("' + var.qname() + '", name) == 0) return offsetof(ModelData, ' + field(var) + ');')
+?>    return -1;
+}
+
+/*
+ * Finds a variable to log in an ensemble simulation, and returns its type:
+ *  0 : A state, offset is set to its index in the state vector
+ *  1 : A state derivative, offset is set to its index in the state vector
+ *  2 : A bound or intermediary variable, offset is set to its offset in the
+ *      ModelData struct
+ * -1 : Unknown or constant variable
+ */
+static int
+ens_log_variable(const char* name, Py_ssize_t* offset)
+{
+<?
+for var in model.states():
+    print(tab + 'if (strcmp("' + var.qname() + '", name) == 0) { *offset = ' + str(var.indice()) + '; return 0; }')
+for var in model.states():
+    print(tab + 'if (strcmp("dot(' + var.qname() + ')", name) == 0) { *offset = ' + str(var.indice()) + '; return 1; }')
+for var in model.variables(deep=True, state=False, const=False):
+    print(tab + 'if (strcmp("' + var.qname() + '", name) == 0) { *offset = offsetof(ModelData, ' + field(var) + '); return 2; }')
+?>    return -1;
+}
+
+/*
+ * Ensemble job: describes the work shared by all threads
+ */
+typedef struct {
+    double tmin;                /* The initial simulation time */
+    double tmax;                /* The final simulation time */
+    double* state_in;           /* The initial state, size N_STATE */
+    ModelData data;             /* Model variables with their initial values */
+    double abs_tol;             /* The absolute tolerance */
+    double rel_tol;             /* The relative tolerance */
+    double dt_max;              /* The maximum step size (0.0 for none) */
+    double dt_min;              /* The minimum step size (0.0 for none) */
+    Py_ssize_t n_members;       /* The number of ensemble members */
+    Py_ssize_t n_params;        /* The number of varied constants */
+    Py_ssize_t* param_offsets;  /* ModelData offsets of the varied constants */
+    double* values;             /* Constant values, shape (n_members, n_params) */
+    Py_ssize_t n_logs;          /* The number of logged variables */
+    int* log_kinds;             /* The type of each logged variable */
+    Py_ssize_t* log_offsets;    /* The index or offset of each logged variable */
+    Py_ssize_t n_times;         /* The number of logging times */
+    double* log_times;          /* The logging times, non-decreasing */
+    double* logs;               /* Logs, shape (n_logs, n_members, n_times) */
+    double* states;             /* Final states, shape (n_members, N_STATE) */
+    int n_threads;              /* The number of threads */
+} EnsJob;
+
+/*
+ * Ensemble worker: the part of a job performed by a single thread
+ */
+typedef struct {
+    EnsJob* job;                /* The shared job */
+    int index;                  /* The index of this worker */
+    ESys epacing;               /* Event-based pacing system, or NULL */
+    FSys fpacing;               /* Fixed-form pacing system, or NULL */
+    Py_ssize_t n_failed;        /* The number of members that failed */
+} EnsWorker;
+
+/*
+ * Writes the logged variables of member k at log point ilog
+ */
+static void
+ens_log(EnsJob* job, ModelData* d, N_Vector y, N_Vector dy, Py_ssize_t k, Py_ssize_t ilog)
+{
+    Py_ssize_t i;
+    double x;
+    for (i=0; i<job->n_logs; i++) {
+        switch (job->log_kinds[i]) {
+        case 0:
+            x = NV_Ith_S(y, job->log_offsets[i]);
+            break;
+        case 1:
+            x = NV_Ith_S(dy, job->log_offsets[i]);
+            break;
+        default:
+            x = *(realtype*)((char*)d + job->log_offsets[i]);
+        }
+        job->logs[(i * job->n_members + k) * job->n_times + ilog] = x;
+    }
+}
+
+/*
+ * Simulates a single ensemble member. Returns 0 if successful.
+ */
+static int
+ens_run_member(EnsWorker* w, void* cvode_mem, N_Vector y, N_Vector y_log, N_Vector dy, Py_ssize_t k)
+{
+    EnsJob* job = w->job;
+    ModelData data;
+    ModelData* d = &data;
+    Py_ssize_t i, ilog;
+    double t, t_last, tnext;
+    int flag_cvode;
+    int flag_reinit = 0;
+    int zero_step_count = 0;
+
+    /* Set model variables and constants */
+    data = job->data;
+    for (i=0; i<job->n_params; i++) {
+        *(realtype*)((char*)d + job->param_offsets[i]) = job->values[k * job->n_params + i];
+    }
+    updateConstants(d);
+    data.fpacing = w->fpacing;
+
+    /* Set initial state */
+    for (i=0; i<N_STATE; i++) {
+        NV_Ith_S(y, i) = job->state_in[i];
+    }
+
+    /* Set up pacing */
+    t = job->tmin;
+    tnext = job->tmax;
+    if (w->epacing != NULL) {
+        if (ESys_Reset(w->epacing) != ESys_OK) return -1;
+        if (ESys_AdvanceTime(w->epacing, t) != ESys_OK) return -1;
+        tnext = ESys_GetNextTime(w->epacing, NULL);
+        tnext = (tnext < job->tmax) ? tnext : job->tmax;
+        data.pace = ESys_GetLevel(w->epacing, NULL);
+    }
+
+    /* Reset solver */
+    #if USE_CVODE
+    flag_cvode = CVodeReInit(cvode_mem, t, y);
+    if (flag_cvode < 0) return -1;
+    flag_cvode = CVodeSetUserData(cvode_mem, d);
+    if (flag_cvode < 0) return -1;
+    #endif
+
+    ilog = 0;
+    while (t < job->tmax) {
+        t_last = t;
+
+        #if USE_CVODE
+        flag_cvode = CVode(cvode_mem, tnext, y, &t, CV_ONE_STEP);
+        if (flag_cvode < 0) return -1;
+        if (t > tnext) {
+            /* Went past pacing event: go back and reinit after logging */
+            flag_cvode = CVodeGetDky(cvode_mem, tnext, 0, y);
+            if (flag_cvode < 0) return -1;
+            t = tnext;
+            flag_reinit = 1;
+        }
+        #else
+        t = tnext;
+        #endif
+
+        /* Check if progress is being made */
+        if (t == t_last) {
+            if (++zero_step_count >= max_zero_step_count) return -1;
+        } else {
+            zero_step_count = 0;
+        }
+
+        /* Log points in the half-open interval [t_last, t) */
+        while (ilog < job->n_times && t > job->log_times[ilog]) {
+            #if USE_CVODE
+            flag_cvode = CVodeGetDky(cvode_mem, job->log_times[ilog], 0, y_log);
+            if (flag_cvode < 0) return -1;
+            #else
+            for (i=0; i<N_STATE; i++) NV_Ith_S(y_log, i) = NV_Ith_S(y, i);
+            #endif
+            rhs(job->log_times[ilog], y_log, dy, d);
+            ens_log(job, d, y_log, dy, k, ilog);
+            ilog++;
+        }
+
+        /* Event-based pacing */
+        if (w->epacing != NULL) {
+            if (ESys_AdvanceTime(w->epacing, t) != ESys_OK) return -1;
+            tnext = ESys_GetNextTime(w->epacing, NULL);
+            tnext = (tnext < job->tmax) ? tnext : job->tmax;
+            data.pace = ESys_GetLevel(w->epacing, NULL);
+        }
+
+        #if USE_CVODE
+        if (flag_reinit) {
+            flag_reinit = 0;
+            flag_cvode = CVodeReInit(cvode_mem, t, y);
+            if (flag_cvode < 0) return -1;
+        }
+        #endif
+
+        /* Check if we're finished */
+        if (ESys_eq(t, job->tmax)) t = job->tmax;
+    }
+
+    /* Store final state */
+    for (i=0; i<N_STATE; i++) {
+        job->states[k * N_STATE + i] = NV_Ith_S(y, i);
+    }
+    return 0;
+}
+
+/*
+ * Runs all ensemble members assigned to a worker. This function is called
+ * without holding the GIL.
+ */
+static void
+ens_run_worker(EnsWorker* w)
+{
+    EnsJob* job = w->job;
+    Py_ssize_t i, j, k;
+    void* cvode_mem = NULL;
+    N_Vector y = NULL;
+    N_Vector y_log = NULL;
+    N_Vector dy = NULL;
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    SUNMatrix matrix = NULL;
+    SUNLinearSolver solver = NULL;
+    #endif
+    char* fname;
+    int ok = 0;
+
+    /* Create vectors and solver memory, shared by all members */
+    y = N_VNew_Serial(N_STATE);
+    y_log = N_VNew_Serial(N_STATE);
+    dy = N_VNew_Serial(N_STATE);
+    if (y == NULL || y_log == NULL || dy == NULL) goto finish;
+    for (i=0; i<N_STATE; i++) NV_Ith_S(y, i) = job->state_in[i];
+
+    #if USE_CVODE
+    #if MYOKIT_SUNDIALS_VERSION >= 40000
+        cvode_mem = CVodeCreate(CV_BDF);
+    #else
+        cvode_mem = CVodeCreate(CV_BDF, CV_NEWTON);
+    #endif
+    if (cvode_mem == NULL) goto finish;
+    if (CVodeSetErrHandlerFn(cvode_mem, cvode_error_handler, NULL) < 0) goto finish;
+    if (CVodeInit(cvode_mem, rhs, job->tmin, y) < 0) goto finish;
+    if (CVodeSStolerances(cvode_mem, RCONST(job->rel_tol), RCONST(job->abs_tol)) < 0) goto finish;
+    if (CVodeSetMaxStep(cvode_mem, job->dt_max > 0 ? job->dt_max : 0) < 0) goto finish;
+    if (CVodeSetMinStep(cvode_mem, job->dt_min > 0 ? job->dt_min : 0) < 0) goto finish;
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    if (create_linear_solver(cvode_mem, y, &matrix, &solver, &fname)) goto finish;
+    #else
+    if (create_linear_solver(cvode_mem, &fname)) goto finish;
+    #endif
+    #endif
+    ok = 1;
+
+finish:
+    /* Simulate every n_threads-th member, starting from this worker's index */
+    for (k=w->index; k<job->n_members; k+=job->n_threads) {
+        if (!ok || ens_run_member(w, cvode_mem, y, y_log, dy, k) != 0) {
+            /* Failed members are indicated by NaNs (logs are pre-filled) */
+            for (i=0; i<N_STATE; i++) job->states[k * N_STATE + i] = Py_NAN;
+            for (i=0; i<job->n_logs; i++) {
+                for (j=0; j<job->n_times; j++) {
+                    job->logs[(i * job->n_members + k) * job->n_times + j] = Py_NAN;
+                }
+            }
+            w->n_failed++;
+        }
+    }
+
+    /* Free memory */
+    #if USE_CVODE
+    if (cvode_mem != NULL) CVodeFree(&cvode_mem);
+    #if MYOKIT_SUNDIALS_VERSION >= 30000
+    if (solver != NULL) SUNLinSolFree(solver);
+    if (matrix != NULL) SUNMatDestroy(matrix);
+    #endif
+    #endif
+    if (y != NULL) N_VDestroy_Serial(y);
+    if (y_log != NULL) N_VDestroy_Serial(y_log);
+    if (dy != NULL) N_VDestroy_Serial(dy);
+}
+
+/*
+ * Thread entry points
+ */
+#ifdef _WIN32
+static DWORD WINAPI
+ens_thread(LPVOID arg)
+{
+    ens_run_worker((EnsWorker*)arg);
+    return 0;
+}
+#else
+static void*
+ens_thread(void* arg)
+{
+    ens_run_worker((EnsWorker*)arg);
+    return NULL;
+}
+#endif
+
+/*
+ * Runs an ensemble simulation, and returns the number of failed members.
+ */
+static PyObject*
+sim_ensemble(PyObject *self, PyObject *args)
+{
+    double tmin, tmax;
+    PyObject *capsule, *state_in, *eprotocol, *fprotocol;
+    PyObject *param_offsets, *log_names;
+    PyObject *values, *log_times, *logs, *states;
+    int n_threads;
+    Py_buffer b_param_offsets, b_values, b_log_times, b_logs, b_states;
+    int got_param_offsets = 0, got_values = 0, got_log_times = 0;
+    int got_logs = 0, got_states = 0;
+    EnsJob job;
+    EnsWorker* workers = NULL;
+    #ifdef _WIN32
+    HANDLE* threads = NULL;
+    #else
+    pthread_t* threads = NULL;
+    #endif
+    char* started = NULL;
+    double state[N_STATE > 0 ? N_STATE : 1];
+    Py_ssize_t i, n_members, n_failed;
+    SimInstance* inst;
+    PyObject *item, *bytes;
+    const char* name;
+    ESys_Flag flag_epacing;
+    FSys_Flag flag_fpacing;
+    int success = 0;
+
+    #ifndef SUNDIALS_DOUBLE_PRECISION
+    PyErr_SetString(PyExc_Exception, "Sundials must be compiled with double precision.");
+    return 0;
+    #endif
+
+    /* Check input arguments */
+    if (!PyArg_ParseTuple(args, "OddOOOOOnOOOOi",
+            &capsule, &tmin, &tmax, &state_in, &eprotocol, &fprotocol,
+            &param_offsets, &values, &n_members, &log_names, &log_times, &logs,
+            &states, &n_threads)) {
+        PyErr_SetString(PyExc_Exception, "Incorrect input arguments.");
+        return 0;
+    }
+    inst = sim_get_instance(capsule);
+    if (inst == NULL) return 0;
+    if (!PyList_Check(state_in) || PyList_Size(state_in) != N_STATE) {
+        PyErr_SetString(PyExc_Exception, "'state_in' must be a list of size N_STATE.");
+        return 0;
+    }
+    if (!PyList_Check(log_names)) {
+        PyErr_SetString(PyExc_Exception, "'log' must be a list.");
+        return 0;
+    }
+    if (n_threads < 1) n_threads = 1;
+
+    /* From this point on, no more direct returning: use goto finish */
+    job.log_kinds = NULL;
+    job.log_offsets = NULL;
+
+    /* Get buffers */
+    if (PyObject_GetBuffer(param_offsets, &b_param_offsets, PyBUF_C_CONTIGUOUS) < 0) goto finish;
+    got_param_offsets = 1;
+    if (PyObject_GetBuffer(values, &b_values, PyBUF_C_CONTIGUOUS) < 0) goto finish;
+    got_values = 1;
+    if (PyObject_GetBuffer(log_times, &b_log_times, PyBUF_C_CONTIGUOUS) < 0) goto finish;
+    got_log_times = 1;
+    if (PyObject_GetBuffer(logs, &b_logs, PyBUF_C_CONTIGUOUS | PyBUF_WRITABLE) < 0) goto finish;
+    got_logs = 1;
+    if (PyObject_GetBuffer(states, &b_states, PyBUF_C_CONTIGUOUS | PyBUF_WRITABLE) < 0) goto finish;
+    got_states = 1;
+
+    /* Set up job */
+    job.tmin = tmin;
+    job.tmax = tmax;
+    for (i=0; i<N_STATE; i++) {
+        item = PyList_GetItem(state_in, i); /* Borrowed */
+        if (!PyFloat_Check(item)) {
+            PyErr_SetString(PyExc_Exception, "Items in state vector must be floats.");
+            goto finish;
+        }
+        state[i] = PyFloat_AsDouble(item);
+    }
+    job.state_in = state;
+    job.data = inst->data;
+    job.data.abs_tol = inst->abs_tol;
+    job.abs_tol = inst->abs_tol;
+    job.rel_tol = inst->rel_tol;
+    job.dt_max = inst->dt_max;
+    job.dt_min = inst->dt_min;
+    job.data.pace = 0;
+    job.data.realtime = 0;
+    job.data.evaluations = 0;
+    job.data.fpacing = NULL;
+    job.n_threads = n_threads;
+    job.n_params = (Py_ssize_t)(b_param_offsets.len / sizeof(Py_ssize_t));
+    job.param_offsets = (Py_ssize_t*)b_param_offsets.buf;
+    job.n_logs = PyList_Size(log_names);
+    job.n_members = n_members;
+    job.n_times = (Py_ssize_t)(b_log_times.len / sizeof(double));
+    job.values = (double*)b_values.buf;
+    job.log_times = (double*)b_log_times.buf;
+    job.logs = (double*)b_logs.buf;
+    job.states = (double*)b_states.buf;
+    if ((Py_ssize_t)(b_values.len / sizeof(double)) != job.n_members * job.n_params
+            || (Py_ssize_t)(b_logs.len / sizeof(double)) != job.n_logs * job.n_members * job.n_times
+            || (Py_ssize_t)(b_states.len / sizeof(double)) != job.n_members * N_STATE) {
+        PyErr_SetString(PyExc_Exception, "Buffer sizes do not match ensemble size.");
+        goto finish;
+    }
+    for (i=0; i<job.n_params; i++) {
+        if (job.param_offsets[i] < 0 || job.param_offsets[i] > (Py_ssize_t)(sizeof(ModelData) - sizeof(realtype))) {
+            PyErr_SetString(PyExc_Exception, "Parameter offset out of bounds.");
+            goto finish;
+        }
+    }
+
+    /* Find variables to log */
+    job.log_kinds = (int*)malloc(sizeof(int) * (job.n_logs + 1));
+    job.log_offsets = (Py_ssize_t*)malloc(sizeof(Py_ssize_t) * (job.n_logs + 1));
+    for (i=0; i<job.n_logs; i++) {
+        item = PyList_GetItem(log_names, i); /* Borrowed */
+        bytes = PyUnicode_AsASCIIString(item); /* New ref */
+        if (bytes == NULL) goto finish;
+        name = PyBytes_AsString(bytes);
+        job.log_kinds[i] = ens_log_variable(name, &job.log_offsets[i]);
+        if (job.log_kinds[i] < 0) {
+            PyErr_Format(PyExc_Exception, "Unknown variable found in log: <%s>", name);
+            Py_DECREF(bytes);
+            goto finish;
+        }
+        Py_DECREF(bytes);
+    }
+
+    /* Create workers, each with their own pacing systems */
+    workers = (EnsWorker*)malloc(sizeof(EnsWorker) * n_threads);
+    threads = malloc(sizeof(*threads) * n_threads);
+    started = (char*)calloc(n_threads, sizeof(char));
+    if (workers != NULL) {
+        for (i=0; i<n_threads; i++) {
+            workers[i].job = &job;
+            workers[i].index = (int)i;
+            workers[i].epacing = NULL;
+            workers[i].fpacing = NULL;
+            workers[i].n_failed = 0;
+        }
+    }
+    if (workers == NULL || threads == NULL || started == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for ensemble workers.");
+        goto finish;
+    }
+    for (i=0; i<n_threads; i++) {
+        if (eprotocol != Py_None) {
+            workers[i].epacing = ESys_Create(&flag_epacing);
+            if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto finish; }
+            flag_epacing = ESys_Populate(workers[i].epacing, eprotocol);
+            if (flag_epacing != ESys_OK) { ESys_SetPyErr(flag_epacing); goto finish; }
+        } else if (fprotocol != Py_None) {
+            workers[i].fpacing = FSys_Create(&flag_fpacing);
+            if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); goto finish; }
+            flag_fpacing = FSys_Populate(workers[i].fpacing,
+                PyTuple_GetItem(fprotocol, 0),  /* Borrowed, no decref */
+                PyTuple_GetItem(fprotocol, 1));
+            if (flag_fpacing != FSys_OK) { FSys_SetPyErr(flag_fpacing); goto finish; }
+        }
+    }
+
+    /* Run, without holding the GIL. The first worker runs in this thread. */
+    Py_BEGIN_ALLOW_THREADS
+    for (i=1; i<n_threads; i++) {
+        #ifdef _WIN32
+        threads[i] = CreateThread(NULL, 0, ens_thread, &workers[i], 0, NULL);
+        started[i] = (threads[i] != NULL);
+        #else
+        started[i] = (pthread_create(&threads[i], NULL, ens_thread, &workers[i]) == 0);
+        #endif
+    }
+    ens_run_worker(&workers[0]);
+    for (i=1; i<n_threads; i++) {
+        if (started[i]) {
+            #ifdef _WIN32
+            WaitForSingleObject(threads[i], INFINITE);
+            CloseHandle(threads[i]);
+            #else
+            pthread_join(threads[i], NULL);
+            #endif
+        } else {
+            /* Thread couldn't be started: run its members here instead */
+            ens_run_worker(&workers[i]);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    success = 1;
+
+finish:
+    n_failed = 0;
+    if (workers != NULL) {
+        for (i=0; i<n_threads; i++) {
+            n_failed += workers[i].n_failed;
+            if (workers[i].epacing != NULL) ESys_Destroy(workers[i].epacing);
+            if (workers[i].fpacing != NULL) FSys_Destroy(workers[i].fpacing);
+        }
+    }
+    free(workers);
+    free(threads);
+    free(started);
+    free(job.log_kinds);
+    free(job.log_offsets);
+    if (got_param_offsets) PyBuffer_Release(&b_param_offsets);
+    if (got_values) PyBuffer_Release(&b_values);
+    if (got_log_times) PyBuffer_Release(&b_log_times);
+    if (got_logs) PyBuffer_Release(&b_logs);
+    if (got_states) PyBuffer_Release(&b_states);
+    if (!success) return 0;
+    return PyLong_FromSsize_t(n_failed);
+}
+
+/*
+ * Parameters
+ *
+ * A fixed list of literal constants can be declared as parameters, so that
+ * their values can all be changed with a single call. The ModelData offsets
+ * of the parameters are looked up once, after which sim_set_parameters only
+ * needs to copy the new values into place.
+ */
+
+/*
+ * Returns a list with the ModelData offset of every constant in a list of
+ * names.
+ */
+static PyObject*
+sim_parameter_offsets(PyObject *self, PyObject *args)
+{
+    PyObject *names, *offsets, *item, *bytes;
+    const char* name;
+    Py_ssize_t i, n, offset;
+
+    /* Check input arguments */
+    if (!PyArg_ParseTuple(args, "O", &names)) {
+        PyErr_SetString(PyExc_Exception, "Expected input argument: names (list).");
+        return 0;
+    }
+    if (!PyList_Check(names)) {
+        PyErr_SetString(PyExc_Exception, "'names' must be a list.");
+        return 0;
+    }
+
+    n = PyList_Size(names);
+    offsets = PyList_New(n); /* New ref */
+    if (offsets == NULL) return 0;
+    for (i=0; i<n; i++) {
+        item = PyList_GetItem(names, i); /* Borrowed */
+        bytes = PyUnicode_AsASCIIString(item); /* New ref */
+        if (bytes == NULL) {
+            Py_DECREF(offsets);
+            return 0;
+        }
+        name = PyBytes_AsString(bytes);
+        offset = ens_constant_offset(name);
+        if (offset < 0) {
+            PyErr_Format(PyExc_Exception, "Literal constant not found: <%s>", name);
+            Py_DECREF(bytes);
+            Py_DECREF(offsets);
+            return 0;
+        }
+        Py_DECREF(bytes);
+        PyList_SET_ITEM(offsets, i, PyLong_FromSsize_t(offset)); /* Steals ref */
+    }
+    return offsets;
+}
+
+/*
+ * Sets the values of the parameters, given a buffer of ModelData offsets (as
+ * returned by sim_parameter_offsets) and a buffer of values.
+ */
+static PyObject*
+sim_set_parameters(PyObject *self, PyObject *args)
+{
+    PyObject *capsule, *offsets, *values;
+    Py_buffer b_offsets, b_values;
+    Py_ssize_t i, n, *o;
+    SimInstance* inst;
+    double* x;
+    int success = 0;
+
+    /* Check input arguments */
+    if (!PyArg_ParseTuple(args, "OOO", &capsule, &offsets, &values)) {
+        PyErr_SetString(PyExc_Exception, "Expected input arguments: instance (capsule), offsets (buffer), values (buffer).");
+        return 0;
+    }
+    inst = sim_get_instance(capsule);
+    if (inst == NULL) return 0;
+    if (PyObject_GetBuffer(offsets, &b_offsets, PyBUF_C_CONTIGUOUS) < 0) return 0;
+    if (PyObject_GetBuffer(values, &b_values, PyBUF_C_CONTIGUOUS) < 0) {
+        PyBuffer_Release(&b_offsets);
+        return 0;
+    }
+
+    n = (Py_ssize_t)(b_offsets.len / sizeof(Py_ssize_t));
+    if ((Py_ssize_t)(b_values.len / sizeof(double)) != n) {
+        PyErr_SetString(PyExc_Exception, "Buffer sizes do not match number of parameters.");
+        goto finish;
+    }
+    o = (Py_ssize_t*)b_offsets.buf;
+    x = (double*)b_values.buf;
+    for (i=0; i<n; i++) {
+        if (o[i] < 0 || o[i] > (Py_ssize_t)(sizeof(ModelData) - sizeof(realtype))) {
+            PyErr_SetString(PyExc_Exception, "Parameter offset out of bounds.");
+            goto finish;
+        }
+    }
+    for (i=0; i<n; i++) {
+        *(realtype*)((char*)&inst->data + o[i]) = x[i];
+    }
+    success = 1;
+
+finish:
+    PyBuffer_Release(&b_offsets);
+    PyBuffer_Release(&b_values);
+    if (!success) return 0;
+    Py_RETURN_NONE;
 }
 
 /*
  * Methods in this module
  */
 static PyMethodDef SimMethods[] = {
+    {"sim_create", sim_create, METH_VARARGS, "Create a simulation instance."},
     {"sim_init", sim_init, METH_VARARGS, "Initialize the simulation."},
     {"sim_step", sim_step, METH_VARARGS, "Perform the next step in the simulation."},
     {"sim_clean", py_sim_clean, METH_VARARGS, "Clean up after an aborted simulation."},
+    {"free_solver", sim_free_solver, METH_VARARGS, "Free any solver memory kept for reuse between runs."},
+    {"sim_ensemble", sim_ensemble, METH_VARARGS, "Run an ensemble of simulations."},
     {"eval_derivatives", sim_eval_derivatives, METH_VARARGS, "Evaluate the state derivatives."},
     {"set_constant", sim_set_constant, METH_VARARGS, "Change a (literal) constant."},
+    {"parameter_offsets", sim_parameter_offsets, METH_VARARGS, "Return the offsets used to set a list of parameters."},
+    {"set_parameters", sim_set_parameters, METH_VARARGS, "Change the values of a list of parameters."},
     {"set_tolerance", sim_set_tolerance, METH_VARARGS, "Set the absolute and relative solver tolerance."},
     {"set_max_step_size", sim_set_max_step_size, METH_VARARGS, "Set the maximum solver step size (0 for none)."},
     {"set_min_step_size", sim_set_min_step_size, METH_VARARGS, "Set the minimum solver step size (0 for none)."},
     {"number_of_steps", sim_steps, METH_VARARGS, "Returns the number of steps taken in the last simulation."},
     {"number_of_evaluations", sim_evals, METH_VARARGS, "Returns the number of rhs evaluations performed during the last simulation."},
+    {"number_of_solvers_created", sim_solvers_created, METH_VARARGS, "Returns the number of times new solver memory was created."},
     {NULL},
 };
 
@@ -7,6 +7,7 @@
 from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
+import logging
 import os
 import myokit
 import platform
@@ -72,6 +73,69 @@ class Simulation(myokit.CModule):
 
     No variable labels are required for this simulation type.
 
+    The optimisation profile used to compile the simulation can be set with
+    ``profile``, for example ``profile='native'`` (see
+    ``myokit.OPTIMISATION_PROFILES``). If not set, the value of
+    ``myokit.OPTIMISATION_PROFILE`` is used.
+
+    The linear solver used by CVODE can be chosen with ``linear_solver``:
+
+    ``'dense'`` (default)
+        A dense linear solver, with a dense finite difference approximation of
+        the Jacobian. Memory use scales with the square of the number of
+        states, and factorisation time with the cube.
+    ``'band'``
+        A banded linear solver. The bandwidths are derived from the state
+        dependency matrix (see
+        :meth:`myokit.lib.deps.create_state_dependency_matrix`), so this works
+        best for models where each state depends mostly on states with a
+        nearby index, for example Markov models.
+    ``'sparse'``
+        A sparse direct solver (KLU), using the sparsity pattern from the state
+        dependency matrix. The Jacobian is approximated with finite
+        differences, perturbing groups of independent states simultaneously.
+        This requires Sundials 3.0.0 or newer, compiled with KLU support. If
+        KLU is not available, a warning is logged and the dense solver is used
+        instead.
+
+    The solver that was selected can be checked using :meth:`linear_solver`.
+
+    By default, CVODE approximates the Jacobian with finite differences, which
+    requires an extra evaluation of the model's right-hand side for every
+    state (or group of states, for the sparse solver) each time the Jacobian
+    is updated. Alternatively, an exact Jacobian can be used by setting
+    ``analytic_jacobian=True``. In this case the partial derivatives of each
+    state's right-hand side are derived symbolically (see
+    :meth:`myokit.Expression.diff`), and code is generated for the non-zero
+    entries only. This requires Sundials 3.0.0 or newer, and is ignored (with
+    a warning) for older versions.
+
+    Forward sensitivities can be calculated by passing in a tuple
+    ``sensitivities=(dependents, independents)``. Here ``dependents`` is a
+    list of variables or variable names ``y``, which can be states,
+    intermediary variables, or state derivatives (e.g. ``"dot(membrane.V)"``),
+    and ``independents`` is a list of variables or variable names ``p``, which
+    can be literal constants or initial values of states (e.g.
+    ``"init(membrane.V)"``). The sensitivities ``dy/dp`` are then calculated
+    alongside the state, using the staggered corrector method in CVODES, and
+    returned by :meth:`run` at every logged point. The sensitivity equations
+    are derived symbolically (see :meth:`myokit.Expression.diff`), so no
+    finite difference approximations are used. The state sensitivities are
+    stored internally, so that they are continued by each successive call to
+    :meth:`run` and updated by :meth:`pre` and :meth:`reset` in the same way
+    as the state. This requires Sundials to be compiled with CVODES.
+
+    When a simulation is run many times with different values for the same
+    set of literal constants (for example when fitting a model), these
+    constants can be declared as ``parameters`` when the simulation is
+    created. Their values can then all be changed at once using
+    :meth:`set_parameters`, which (unlike :meth:`set_constant`) does not need
+    to look up each variable by name.
+
+    To reduce the overhead of many short runs (for example in fitting loops),
+    the memory used by CVODE and its linear solver is kept after each run, and
+    re-initialised for the next run with the new time and state.
+
     [1] SUNDIALS: Suite of nonlinear and differential/algebraic equation
     solvers. Hindmarsh, Brown, Woodward, et al. (2005) ACM Transactions on
     Mathematical Software.
@@ -79,8 +143,11 @@ class Simulation(myokit.CModule):
     """
     _index = 0  # Simulation id
 
-    def __init__(self, model, protocol=None, apd_var=None):
+    def __init__(self, model, protocol=None, apd_var=None, profile=None,
+                 linear_solver='dense', analytic_jacobian=False,
+                 sensitivities=None, parameters=None):
         super(Simulation, self).__init__()
+        import numpy as np
 
         # Require a valid model
         if not model.is_valid():
@@ -118,12 +185,82 @@ class Simulation(myokit.CModule):
         module_name = 'myokit_sim_' + str(Simulation._index)
         module_name += '_' + str(myokit._pid_hash())
 
+        # Check linear solver
+        if linear_solver not in ('dense', 'band', 'sparse'):
+            raise ValueError(
+                'Unknown linear solver: ' + str(linear_solver) + '. Expecting'
+                ' "dense", "band", or "sparse".')
+        self._linear_solver = linear_solver
+        self._linear_solver_used = linear_solver
+        if self._model.count_states() == 0:
+            self._linear_solver_used = 'dense'
+        elif linear_solver == 'sparse' and myokit.SUNDIALS_VERSION < 30000:
+            log = logging.getLogger(__name__)
+            log.warning(
+                'Sparse linear solver requires Sundials 3.0.0 or newer, using'
+                ' dense linear solver instead.')
+            self._linear_solver_used = 'dense'
+
+        # Check analytic jacobian
+        self._analytic_jacobian = bool(analytic_jacobian)
+        jacobian = None
+        if self._analytic_jacobian and self._model.count_states() > 0:
+            if myokit.SUNDIALS_VERSION < 30000:
+                log = logging.getLogger(__name__)
+                log.warning(
+                    'Analytic Jacobian requires Sundials 3.0.0 or newer, using'
+                    ' finite difference approximation instead.')
+            else:
+                jacobian = _jacobian_columns(self._model)
+
+        # Check sensitivities
+        self._sensitivities = None
+        sensitivity_equations = None
+        if sensitivities is not None:
+            dependents, independents = self._check_sensitivities(
+                sensitivities)
+            sensitivity_equations = _sensitivity_equations(
+                self._model, dependents, independents)
+
+        # Default state sensitivities
+        self._s_state = self._default_s_state()
+        self._s_default_state = list(self._s_state)
+
+        # Check parameters
+        self._parameters = []
+        if parameters is not None:
+            for p in parameters:
+                if isinstance(p, myokit.Variable):
+                    p = p.qname()
+                p = self._model.get(p, myokit.Variable)
+                if not p.is_literal():
+                    raise ValueError(
+                        'Parameters must be literal constants, got <'
+                        + p.qname() + '>.')
+                if p in self._parameters:
+                    raise ValueError(
+                        'Duplicate parameter <' + p.qname() + '>.')
+                self._parameters.append(p)
+        self._parameter_values = np.array(
+            [p.rhs().eval() for p in self._parameters], dtype=float)
+        self._parameter_offsets = None
+        self._parameters_changed = False
+
         # Arguments
         args = {
             'module_name': module_name,
             'model': self._model,
             'potential': self._apd_var,
+            'linear_solver': self._linear_solver_used,
+            'bandwidth': (0, 0),
+            'sparsity': None,
+            'jacobian': jacobian,
+            'sensitivities': sensitivity_equations,
         }
+        if self._linear_solver_used != 'dense':
+            pattern = _jacobian_pattern(self._model)
+            args['bandwidth'] = _bandwidth(pattern)
+            args['sparsity'] = _sparsity(pattern)
         fname = os.path.join(myokit.DIR_CFUNC, SOURCE_FILE)
         # Debug
         if myokit.DEBUG:
@@ -133,10 +270,13 @@ class Simulation(myokit.CModule):
             sys.exit(1)
 
         # Define libraries
+        # Note: CVODES includes all functions provided by CVODE
         libs = [
             'sundials_cvode',
             'sundials_nvecserial',
         ]
+        if sensitivity_equations and self._model.count_states() > 0:
+            libs[0] = 'sundials_cvodes'
         if platform.system() != 'Windows':  # pragma: no windows cover
             libs.append('m')
 
@@ -147,7 +287,30 @@ class Simulation(myokit.CModule):
         incd.append(myokit.DIR_CFUNC)
 
         # Create extension
-        self._sim = self._compile(module_name, fname, args, libs, libd, incd)
+        self._profile = profile
+        if self._linear_solver_used == 'sparse':
+            try:
+                self._sim = self._compile(
+                    module_name, fname, args,
+                    libs + ['sundials_sunlinsolklu', 'klu'], libd, incd,
+                    profile=profile)
+            except myokit.CompilationError:
+                log = logging.getLogger(__name__)
+                log.warning(
+                    'Unable to compile simulation with sparse (KLU) linear'
+                    ' solver, using dense linear solver instead.')
+                self._linear_solver_used = args['linear_solver'] = 'dense'
+        if self._linear_solver_used != 'sparse':
+            self._sim = self._compile(
+                module_name, fname, args, libs, libd, incd, profile=profile)
+
+        # Create an instance of the compiled module, which stores this
+        # simulation's constants, settings, and statistics
+        self._instance = self._sim.sim_create()
+
+        # Get offsets used to set parameters in the compiled module
+        self._parameter_offsets = np.array(self._sim.parameter_offsets(
+            [p.qname() for p in self._parameters]), dtype=np.intp)
 
         # Set default tolerance values
         self._tolerance = None
@@ -156,6 +319,171 @@ class Simulation(myokit.CModule):
         # Set default min and max step size
         self._dtmax = self._dtmin = None
 
+    def _check_sensitivities(self, sensitivities):
+        """
+        Checks the ``sensitivities`` argument passed to the constructor and
+        stores it in ``self._sensitivities``.
+
+        Returns a tuple ``(dependents, independents)``, where ``dependents``
+        is a list of :class:`myokit.LhsExpression` objects and
+        ``independents`` is a list of variables, in the format used by
+        :meth:`_sensitivity_equations`.
+        """
+        try:
+            dependents, independents = sensitivities
+        except (TypeError, ValueError):
+            raise ValueError(
+                'The argument `sensitivities` must be None or a tuple'
+                ' (dependents, independents).')
+
+        # Check dependents
+        if len(dependents) != len(set(dependents)):
+            raise ValueError('Duplicate variable in sensitivity dependents.')
+        d_names = []
+        d_exprs = []
+        for x in dependents:
+            if isinstance(x, myokit.Variable):
+                x = x.qname()
+            deriv = x[:4] == 'dot(' and x[-1:] == ')'
+            var = self._model.get(x[4:-1] if deriv else x, myokit.Variable)
+            if deriv:
+                if not var.is_state():
+                    raise ValueError(
+                        'Sensitivity dependents can only include derivatives'
+                        ' of state variables, got <' + x + '>.')
+                d_names.append('dot(' + var.qname() + ')')
+                d_exprs.append(myokit.Derivative(myokit.Name(var)))
+            elif var.is_state() or var.is_intermediary():
+                d_names.append(var.qname())
+                d_exprs.append(myokit.Name(var))
+            elif var.is_bound():
+                raise ValueError(
+                    'Sensitivity dependents cannot be bound to external'
+                    ' inputs.')
+            else:
+                raise ValueError(
+                    'Sensitivity dependents cannot be constants.')
+
+        # Check independents
+        if len(independents) != len(set(independents)):
+            raise ValueError('Duplicate variable in sensitivity independents.')
+        i_names = []
+        i_vars = []
+        for x in independents:
+            if isinstance(x, myokit.Variable):
+                x = x.qname()
+            init = x[:5] == 'init(' and x[-1:] == ')'
+            var = self._model.get(x[5:-1] if init else x, myokit.Variable)
+            if init:
+                if not var.is_state():
+                    raise ValueError(
+                        'Initial values can only be used as sensitivity'
+                        ' independents for state variables, got <' + x
+                        + '>.')
+                i_names.append('init(' + var.qname() + ')')
+            elif var.is_literal() and not var.is_bound():
+                i_names.append(var.qname())
+            elif var.is_bound():
+                raise ValueError(
+                    'Sensitivity independents cannot be bound to external'
+                    ' inputs.')
+            else:
+                raise ValueError(
+                    'Sensitivity independents must be literal constants or'
+                    ' initial values, got <' + x + '>.')
+            i_vars.append(var)
+
+        self._sensitivities = (d_names, i_names)
+        return d_exprs, i_vars
+
+    def _default_s_state(self):
+        """
+        Returns the default state sensitivities, as a list of
+        ``n_states * n_independents`` floats, ordered by state: zero for all
+        parameters, and one for the derivative of each initial value with
+        respect to itself.
+        """
+        if self._sensitivities is None:
+            return []
+        ni = len(self._sensitivities[1])
+        s_state = [0.0] * (self._model.count_states() * ni)
+        for k, x in enumerate(self._sensitivities[1]):
+            if x[:5] == 'init(':
+                i = self._model.get(x[5:-1]).indice()
+                s_state[i * ni + k] = 1.0
+        return s_state
+
+    def _conditions(self, thresholds, stop_on):
+        """
+        Returns the threshold condition specification passed to the C code.
+        """
+        if self._model.count_states() == 0:
+            raise ValueError(
+                'Thresholds can only be used with models that have states.')
+
+        # Get indices of conditions that end the run
+        n = len(thresholds)
+        if stop_on is None:
+            stop_on = []
+        else:
+            try:
+                stop_on = [int(stop_on)]
+            except TypeError:
+                stop_on = [int(i) for i in stop_on]
+        for i in stop_on:
+            if i < 0 or i >= n:
+                raise ValueError(
+                    'Indices in stop_on must refer to entries in thresholds,'
+                    ' got ' + str(i) + '.')
+
+        # Parse conditions
+        indices, names, values, directions = [], {}, [], []
+        for i, condition in enumerate(thresholds):
+            condition = tuple(condition)
+            if len(condition) == 2:
+                var, value = condition
+                direction = 0
+            elif len(condition) == 3:
+                var, value, direction = condition
+            else:
+                raise ValueError(
+                    'Thresholds must be given as tuples (variable, value) or'
+                    ' (variable, value, direction).')
+            if direction not in (-1, 0, 1):
+                raise ValueError(
+                    'Threshold directions must be -1, 0, or 1, got '
+                    + str(direction) + '.')
+
+            # Get variable
+            if isinstance(var, myokit.Variable):
+                var = var.qname()
+            deriv = var[:4] == 'dot(' and var[-1:] == ')'
+            try:
+                v = self._model.get(var[4:-1] if deriv else var)
+            except KeyError:
+                raise ValueError('Unknown variable in thresholds: ' + var)
+            if deriv and not v.is_state():
+                raise ValueError(
+                    'Derivatives can only be used for states, got ' + var
+                    + '.')
+            if v.is_constant():
+                raise ValueError(
+                    'Thresholds cannot be set on constants, got ' + var + '.')
+
+            # States are evaluated from the state vector, all other variables
+            # via the model's rhs.
+            if v.is_state() and not deriv:
+                indices.append(v.indice())
+            else:
+                indices.append(-1)
+                name = 'dot(' + v.qname() + ')' if deriv else v.qname()
+                names.setdefault(name, []).append(i)
+            values.append(float(value))
+            directions.append(int(direction))
+
+        stops = [i in stop_on for i in range(n)]
+        return [indices, names, values, directions, stops, bytearray(), False]
+
     def default_state(self):
         """
         Returns the default state.
@@ -182,7 +510,7 @@ class Simulation(myokit.CModule):
         else:
             y = self._model.map_to_state(y)
         dy = list(self._state)
-        self._sim.eval_derivatives(y, dy, 0, 0)
+        self._sim.eval_derivatives(self._instance, y, dy, 0, 0)
         return dy
 
     def last_number_of_evaluations(self):
@@ -190,16 +518,35 @@ class Simulation(myokit.CModule):
         Returns the number of rhs evaluations performed by the solver during
         the last simulation.
         """
-        return self._sim.number_of_evaluations()
+        return self._sim.number_of_evaluations(self._instance)
 
     def last_number_of_steps(self):
         """
         Returns the number of steps taken by the solver during the last
         simulation.
         """
-        return self._sim.number_of_steps()
+        return self._sim.number_of_steps(self._instance)
+
+    def linear_solver(self):
+        """
+        Returns the linear solver used by this simulation: one of ``'dense'``,
+        ``'band'``, or ``'sparse'``.
+
+        This can differ from the solver requested when the simulation was
+        created, if the requested solver was not available.
+        """
+        return self._linear_solver_used
 
-    def pre(self, duration, progress=None, msg='Pre-pacing Simulation'):
+    def parameters(self):
+        """
+        Returns a list containing the qnames of the variables declared as
+        parameters when this simulation was created (see
+        :meth:`set_parameters`).
+        """
+        return [p.qname() for p in self._parameters]
+
+    def pre(self, duration, progress=None, msg='Pre-pacing Simulation',
+            period=None, tolerance=1e-6):
         """
         This method can be used to perform an unlogged simulation, typically to
         pre-pace to a (semi-)stable orbit.
@@ -211,16 +558,47 @@ class Simulation(myokit.CModule):
           state reached in the simulation.
 
         Calls to :meth:`reset` after using :meth:`pre` will set the current
-        state to this new default state.
+        state to this new default state. If sensitivities are calculated, the
+        default state sensitivities are updated in the same way.
 
         To obtain feedback on the simulation progress, an object implementing
         the :class:`myokit.ProgressReporter` interface can be passed in.
         passed in as ``progress``. An optional description of the current
         simulation to use in the ProgressReporter can be passed in as `msg`.
+
+        If a beat ``period`` is given, the simulation stops as soon as a
+        periodic steady state is reached, and ``duration`` is used as the
+        maximum pre-pacing time. The state at the start of each beat (at
+        times ``n * period`` after the current time) is compared with the
+        state at the start of the previous beat, and a steady state is
+        reached when every state ``x`` satisfies
+        ``|x_n - x_{n-1}| <= tolerance * (1 + |x_n|)``. In this case the
+        method returns the number of beats simulated, and the new default
+        state is the state at the start of the final beat. If no steady state
+        is reached within ``duration``, a warning is logged and the number of
+        completed beats is returned.
         """
         duration = float(duration)
-        self._run(duration, myokit.LOG_NONE, None, None, None, progress, msg)
+        steady = None
+        if period is not None:
+            period = float(period)
+            if period <= 0:
+                raise ValueError('The period must be greater than zero.')
+            tolerance = float(tolerance)
+            if tolerance < 0:
+                raise ValueError('The tolerance cannot be negative.')
+            steady = [period, tolerance, 0, False]
+        self._run(duration, myokit.LOG_NONE, None, None, None, progress, msg,
+                  steady)
         self._default_state = self._state
+        self._s_default_state = self._s_state
+        if steady is not None:
+            if not steady[3]:
+                log = logging.getLogger(__name__)
+                log.warning(
+                    'No steady state reached after ' + str(steady[2])
+                    + ' beats.')
+            return steady[2]
 
     def __reduce__(self):
         """
@@ -228,10 +606,21 @@ class Simulation(myokit.CModule):
 
         See: https://docs.python.org/3/library/pickle.html#object.__reduce__
         """
+        self._update_parameters()
         apd_var = None if self._apd_var is None else self._apd_var.qname()
+        parameters = [p.qname() for p in self._parameters]
         return (
             self.__class__,
-            (self._model, self._protocol, apd_var),
+            (
+                self._model,
+                self._protocol,
+                apd_var,
+                self._profile,
+                self._linear_solver,
+                self._analytic_jacobian,
+                self._sensitivities,
+                parameters if parameters else None,
+            ),
             (
                 self._time,
                 self._state,
@@ -240,6 +629,8 @@ class Simulation(myokit.CModule):
                 self._tolerance,
                 self._dtmin,
                 self._dtmax,
+                self._s_state,
+                self._s_default_state,
             ),
         )
 
@@ -249,14 +640,19 @@ class Simulation(myokit.CModule):
 
         - The time variable is set to 0
         - The state is set to the default state
+        - If sensitivities are calculated, the state sensitivities are set
+          back to their default values
 
         """
         self._time = 0
         self._state = list(self._default_state)
+        self._s_state = list(self._s_default_state)
 
     def run(
             self, duration, log=None, log_interval=None, log_times=None,
-            apd_threshold=None, progress=None, msg='Running simulation'):
+            apd_threshold=None, progress=None, msg='Running simulation',
+            log_sink=None, log_changes=None, biomarkers=None,
+            thresholds=None, stop_on=None, dense_output=False):
         """
         Runs a simulation and returns the logged results. Running a simulation
         has the following effects:
@@ -268,9 +664,9 @@ class Simulation(myokit.CModule):
         The number of time units to simulate can be set with ``duration``.
 
         The method returns a :class:`myokit.DataLog` dictionary that maps
-        variable names to lists of logged values. The variables to log can be
-        indicated using the ``log`` argument. There are several options for its
-        value:
+        variable names to NumPy arrays of logged values. The variables to log
+        can be indicated using the ``log`` argument. There are several options
+        for its value:
 
         - ``None`` (default), to log all states.
         - An integer flag or a combination of flags. Options:
@@ -284,12 +680,34 @@ class Simulation(myokit.CModule):
         For detailed information about the ``log`` argument, see the function
         :meth:`myokit.prepare_log`.
 
+        For long simulations, the logged data can be written to a
+        ``log_sink`` instead of being stored in memory. This should be an
+        object with a method ``write(log)``, for example a
+        :class:`myokit.DataLogWriter`. During the simulation, the data is
+        passed to the sink in fixed-size chunks, so that memory use stays
+        bounded, and the returned log will not contain any new data.
+        Sensitivities (see below) are not passed to the sink.
+
         By default, every step the solver takes is logged. This is usually
         advantageous, since more points are added exactly at the times the
         system gets more interesting. However, if equidistant points are
         required a ``log_interval`` can be set. Alternatively, the
         ``log_times`` argument can be used to specify logging times directly.
 
+        When logging every step, long periods of little activity (e.g. the
+        diastolic interval) can lead to large logs with many near-identical
+        points. To log only the points where the signal changes, a dict
+        ``log_changes`` can be passed in, mapping logged variables to change
+        thresholds. Each threshold is either a number ``a`` or a tuple
+        ``(a, r)``, and a point is logged only if, for at least one of the
+        variables in ``log_changes``, the value ``x`` differs from the value
+        ``x_last`` at the last logged point by more than
+        ``a + r * |x_last|``. For example, using
+        ``log_changes={'membrane.V': (0.1, 0.01)}`` logs a point whenever
+        ``membrane.V`` has changed by more than 0.1 mV plus 1%. The first and
+        last point of each run are always logged. This option cannot be
+        combined with ``log_interval`` or ``log_times``.
+
         To obtain accurate measurements of the action potential (AP) duration,
         the argument ``apd_threshold`` can be set to a fixed threshold level
         used to define the AP. This functionality is only available for
@@ -297,6 +715,52 @@ class Simulation(myokit.CModule):
         measurements are enabled, the value returned by this method has the
         form ``(log, apds)``.
 
+        Biomarkers such as action potential durations and calcium transient
+        amplitudes can be calculated for every beat during the simulation,
+        by passing in a :class:`myokit.Biomarkers` specification as
+        ``biomarkers``. In this case, a :class:`myokit.DataLog` with one entry
+        per beat is added to the end of the returned tuple, e.g.
+        ``(log, biomarkers)`` or ``(log, apds, biomarkers)``. To avoid storing
+        the simulated traces, this can be combined with
+        ``log=myokit.LOG_NONE``.
+
+        Threshold crossings of any state, derivative, or intermediary or bound
+        variable can be detected during the simulation, by passing in a list
+        of ``thresholds``. Each entry is a tuple ``(variable, value)`` or
+        ``(variable, value, direction)``, where ``direction`` is ``1`` to
+        detect upward crossings only, ``-1`` for downward crossings only, or
+        ``0`` (the default) for both. Crossing times are found by CVODE's
+        root finding, and returned as a :class:`myokit.DataLog` with entries
+        ``time``, ``index`` (the index of the crossed threshold in
+        ``thresholds``) and ``direction``. This log is added to the returned
+        tuple after any apds, but before any biomarkers, e.g.
+        ``(log, crossings)`` or ``(log, apds, crossings, biomarkers)``. To
+        stop the simulation as soon as a threshold is crossed, its index can
+        be passed in as ``stop_on`` (or a list of indices can be given to stop
+        on any of several thresholds). In this case the simulation ends at the
+        time of the crossing, and the simulation time is updated to this time
+        instead of by ``duration``. For example, to run until an action
+        potential is triggered, use
+        ``log, crossings = s.run(1000, thresholds=[('membrane.V', 0, 1)],
+        stop_on=0)``.
+
+        To evaluate the state at times that were not logged, without running
+        the simulation again, ``dense_output=True`` can be set. In this case,
+        the interpolating polynomials used by CVODE on every step are stored,
+        and returned as a :class:`myokit.DenseOutput` object at the end of the
+        returned tuple, e.g. ``(log, dense)`` or ``(log, apds, dense)``.
+
+        If the simulation was created with a ``sensitivities`` argument, the
+        value returned by this method has the form ``(log, sensitivities)``,
+        or ``(log, sensitivities, apds)`` if apd measurements are enabled.
+        Here ``sensitivities`` is a 3d NumPy array, where the first axis
+        represents the logged time points, the second the dependent variables
+        ``y``, and the third the independents ``p``, such that
+        ``sensitivities[i, j, k]`` is the derivative of dependent ``j`` with
+        respect to independent ``k`` at the ``i``-th logged point. When
+        appending to an existing log, only the sensitivities for the newly
+        logged points are returned.
+
         To obtain feedback on the simulation progress, an object implementing
         the :class:`myokit.ProgressReporter` interface can be passed in.
         passed in as ``progress``. An optional description of the current
@@ -315,16 +779,163 @@ class Simulation(myokit.CModule):
         duration = float(duration)
         output = self._run(
             duration, log, log_interval, log_times, apd_threshold, progress,
-            msg)
-        self._time += duration
+            msg, log_sink=log_sink, log_changes=log_changes,
+            biomarkers=biomarkers, thresholds=thresholds, stop_on=stop_on,
+            dense_output=dense_output)
+        if self._stop_time is None:
+            self._time += duration
+        else:
+            self._time = self._stop_time
         return output
 
+    def run_ensemble(
+            self, values, duration, log=None, log_interval=None,
+            log_times=None, threads=None, parameters=None):
+        """
+        Runs an ensemble of simulations, each with a different set of values
+        for one or more literal constants, and returns the stacked results.
+
+        By default, the constants that are varied are the parameters declared
+        when this simulation was created (see :meth:`parameters`). A different
+        list of literal constants can be given as a sequence ``parameters`` of
+        variables or fully qualified variable names. The values are given as a
+        2d array ``values`` with one column per parameter, where each row
+        describes a single ensemble member. All members start from the
+        simulation's current time and state, and use its current protocol,
+        tolerances, and step size settings. Constants that are not varied
+        retain the values set with :meth:`set_constant` or
+        :meth:`set_parameters`.
+
+        The members are simulated inside the compiled module, without holding
+        Python's global interpreter lock (GIL), using ``threads`` threads that
+        each create their own CVODE solver. By default, one thread is used per
+        CPU core.
+
+        The variables to log can be set with ``log``, which accepts the same
+        input as :meth:`run`, except that ``None`` (default) means nothing is
+        logged. Logging is only possible at fixed times, which can be set with
+        either ``log_interval`` or ``log_times``. As in :meth:`run`, only
+        points in the half-open interval ``[time, time + duration)`` are
+        logged.
+
+        Returns a tuple ``(logs, states)``, where ``logs`` is an ordered
+        dictionary mapping each logged variable name to an array of shape
+        ``(n, n_times)``, and ``states`` is an array of shape
+        ``(n, n_states)`` containing the final state for every member. Members
+        for which the simulation failed are indicated with NaN rows in both
+        ``logs`` and ``states``.
+
+        Unlike :meth:`run`, this method does not change the simulation time or
+        state.
+        """
+        import multiprocessing
+        import numpy as np
+        from collections import OrderedDict
+
+        # Check parameters and values, and get their offsets in the compiled
+        # module
+        if parameters is None:
+            offsets = self._parameter_offsets
+        else:
+            names = []
+            for var in parameters:
+                if isinstance(var, myokit.Variable):
+                    var = var.qname()
+                var = self._model.get(var)
+                if not var.is_literal():
+                    raise ValueError(
+                        'The given variable <' + var.qname() + '> is not a'
+                        ' literal.')
+                names.append(var.qname())
+            offsets = np.array(
+                self._sim.parameter_offsets(names), dtype=np.intp)
+        values = np.array(values, dtype=float, ndmin=2, order='C')
+        if values.ndim != 2 or values.shape[1] != len(offsets):
+            raise ValueError(
+                'The argument `values` must be a 2d array with one column per'
+                ' parameter.')
+        n = values.shape[0]
+
+        # Simulation times
+        duration = float(duration)
+        if duration < 0:
+            raise ValueError('Simulation time can\'t be negative.')
+        tmin = self._time
+        tmax = tmin + duration
+
+        # Parse log argument
+        log = myokit.prepare_log(log, self._model, if_empty=myokit.LOG_NONE)
+        log = list(log.keys())
+
+        # Logging times
+        if log_interval is not None and log_times is not None:
+            raise ValueError(
+                'The arguments log_times and log_interval cannot be used'
+                ' simultaneously.')
+        if log_interval is not None:
+            log_interval = float(log_interval)
+            if log_interval <= 0:
+                raise ValueError('The log interval must be greater than 0.')
+            log_times = tmin + log_interval * np.arange(
+                np.ceil(duration / log_interval))
+            log_times = log_times[log_times < tmax]
+        elif log_times is not None:
+            log_times = np.array(log_times, dtype=float)
+            if np.any(log_times[1:] < log_times[:-1]):
+                raise ValueError('Values in log_times must be non-decreasing.')
+            log_times = log_times[(log_times >= tmin) & (log_times < tmax)]
+        elif log:
+            raise ValueError(
+                'Either log_interval or log_times must be set when logging'
+                ' ensemble simulations.')
+        else:
+            log_times = np.zeros(0)
+        log_times = np.ascontiguousarray(log_times)
+
+        # Number of threads
+        if threads is None:
+            threads = multiprocessing.cpu_count()
+        threads = int(threads)
+        if threads < 1:
+            raise ValueError('Number of threads must be at least 1.')
+        threads = max(1, min(threads, n))
+
+        # Create output arrays
+        logs = np.empty((len(log), n, len(log_times)))
+        logs.fill(np.nan)
+        states = np.empty((n, self._model.count_states()))
+        states[:] = self._state
+
+        # Run
+        if n > 0 and tmin + duration > tmin:
+            self._sim.sim_ensemble(
+                self._instance,
+                tmin,
+                tmax,
+                list(self._state),
+                self._protocol,
+                self._fixed_form_protocol,
+                offsets,
+                values,
+                n,
+                log,
+                log_times,
+                logs,
+                states,
+                threads,
+            )
+
+        return OrderedDict(zip(log, logs)), states
+
     def _run(
             self, duration, log, log_interval, log_times, apd_threshold,
-            progress, msg):
+            progress, msg, steady=None, log_sink=None, log_changes=None,
+            biomarkers=None, thresholds=None, stop_on=None,
+            dense_output=False):
 
-        # Reset error state
+        # Reset error state, and time at which the run was stopped early
         self._error_state = None
+        self._stop_time = None
 
         # Simulation times
         if duration < 0:
@@ -358,6 +969,33 @@ class Simulation(myokit.CModule):
                 'The arguments log_times and log_interval cannot be used'
                 ' simultaneously.')
 
+        # Change-driven logging (None or empty dict = disabled)
+        if log_changes:
+            if log_times is not None or log_interval > 0:
+                raise ValueError(
+                    'The argument log_changes cannot be used in combination'
+                    ' with log_interval or log_times.')
+            changes = {}
+            for key, threshold in log_changes.items():
+                if isinstance(key, myokit.Variable):
+                    key = key.qname()
+                if key not in log:
+                    raise ValueError(
+                        'Variables in log_changes must be logged, got "'
+                        + str(key) + '".')
+                try:
+                    a, r = threshold
+                except TypeError:
+                    a, r = threshold, 0
+                a, r = float(a), float(r)
+                if not (a >= 0 and r >= 0):
+                    raise ValueError(
+                        'Thresholds in log_changes must be non-negative.')
+                changes[key] = (a, r)
+            log_changes = changes
+        else:
+            log_changes = None
+
         # Threshold for APD measurement
         root_list = None
         root_threshold = 0
@@ -370,6 +1008,24 @@ class Simulation(myokit.CModule):
                 root_list = []
                 root_threshold = float(apd_threshold)
 
+        # Biomarkers
+        markers = None
+        if biomarkers is not None:
+            if not isinstance(biomarkers, Biomarkers):
+                raise ValueError(
+                    'The argument "biomarkers" must be a myokit.Biomarkers'
+                    ' object or None.')
+            markers = biomarkers._markers(self._model)
+
+        # Threshold conditions
+        conditions = None
+        if thresholds:
+            conditions = self._conditions(thresholds, stop_on)
+        elif stop_on is not None:
+            raise ValueError(
+                'The argument stop_on can only be used in combination with'
+                ' thresholds.')
+
         # Get progress indication function (if any)
         if progress is None:
             progress = myokit._Simulation_progress
@@ -391,95 +1047,157 @@ class Simulation(myokit.CModule):
         # stronger check than (duration == 0), which will return true even for
         # very short durations (and will cause zero iterations of the
         # "while (t < tmax)" loop below).
-
-        with myokit.SubCapture() as capture:
-            istate = list(self._state)
-            if tmin + duration > tmin:
-
-                # Lists to return state in
-                rstate = list(istate)
-                rbound = [0, 0, 0, 0]  # time, pace, realtime, evaluations
-
-                # Initialize
-                self._sim.sim_init(
-                    tmin,
-                    tmax,
-                    istate,
-                    rstate,
-                    rbound,
-                    self._protocol,
-                    self._fixed_form_protocol,
-                    log,
-                    log_interval,
-                    log_times,
-                    root_list,
-                    root_threshold,
-                    bench,
-                )
-                t = tmin
-
-                try:
-                    if progress:
-                        # Allow progress reporters to bypass the subcapture
-                        progress._set_output_stream(capture.bypass())
-                        # Loop with feedback
-                        with progress.job(msg):
-                            r = 1.0 / duration if duration != 0 else 1
-                            while t < tmax:
-                                t = self._sim.sim_step()
-                                if not progress.update(min((t - tmin) * r, 1)):
-                                    raise myokit.SimulationCancelledError()
+        istate = list(self._state)
+        if tmin + duration > tmin:
+
+            # Lists to return state in
+            rstate = list(istate)
+            rbound = [0, 0, 0, 0]  # time, pace, realtime, evaluations
+
+            # Buffers to log in
+            buffers = self._log_buffers(log)
+            appending = any(len(x) > 0 for x in log.values())
+
+            # Buffer to store dense output records in
+            dense = bytearray() if dense_output else None
+
+            # Sensitivities: initial and final state sensitivities, a buffer
+            # to log in, and scaling factors used in the error control
+            s_state = s_rstate = s_buffer = s_scale = None
+            if self._sensitivities is not None:
+                self._update_parameters()
+                s_state = list(self._s_state)
+                s_rstate = list(s_state)
+                s_buffer = bytearray() if len(log) else None
+                s_scale = []
+                for x in self._sensitivities[1]:
+                    if x[:5] == 'init(':
+                        x = istate[self._model.get(x[5:-1]).indice()]
                     else:
-                        # Loop without feedback
+                        x = self._model.get(x).eval()
+                    s_scale.append(abs(x) if x != 0 else 1.0)
+
+            # Initialize
+            run = self._sim.sim_init(
+                self._instance,
+                tmin,
+                tmax,
+                istate,
+                rstate,
+                rbound,
+                self._protocol,
+                self._fixed_form_protocol,
+                buffers,
+                1 if appending else 0,
+                log_interval,
+                log_times,
+                log_changes,
+                root_list,
+                root_threshold,
+                bench,
+                s_state,
+                s_rstate,
+                s_buffer,
+                s_scale,
+                steady,
+                markers,
+                conditions,
+                dense,
+            )
+            t = tmin
+
+            try:
+                if progress:
+                    # Loop with feedback
+                    with progress.job(msg):
+                        r = 1.0 / duration if duration != 0 else 1
                         while t < tmax:
-                            t = self._sim.sim_step()
-                except ArithmeticError as e:
-                    # Some CVODE errors are set to raise an ArithmeticError,
-                    # which users may be able to debug.
-                    self._error_state = list(rstate)
-                    txt = ['A numerical error occurred during simulation at'
-                           ' t = ' + str(t) + '.', 'Last reached state: ']
-                    txt.extend(['  ' + x for x in
-                                self._model.format_state(rstate).splitlines()])
-                    txt.append('Inputs for binding: ')
-                    txt.append('  time        = ' + myokit.strfloat(rbound[0]))
-                    txt.append('  pace        = ' + myokit.strfloat(rbound[1]))
-                    txt.append('  realtime    = ' + myokit.strfloat(rbound[2]))
-                    txt.append('  evaluations = ' + myokit.strfloat(rbound[3]))
-                    txt.append(str(e))
-                    try:
-                        self._model.eval_state_derivatives(rstate)
-                    except myokit.NumericalError as en:
-                        txt.append(str(en))
-                    raise myokit.SimulationError('\n'.join(txt))
-                except Exception as e:
-
-                    # Store error state
-                    self._error_state = list(rstate)
-
-                    # Check for known CVODE errors
-                    if 'Function CVode()' in str(e):
-                        raise myokit.SimulationError(str(e))
-
-                    # Check for zero step error
-                    if str(e)[:10] == 'ZERO_STEP ':  # pragma: no cover
-                        t = float(str(e)[10:])
-                        raise myokit.SimulationError(
-                            'Maximum number of zero-size steps made at t='
-                            + str(t))
-
-                    # Unknown exception: re-raise!
-                    raise
-                finally:
-                    # Clean even after KeyboardInterrupt or other Exception
-                    self._sim.sim_clean()
-
-                # Update internal state
-                self._state = rstate
-
-        # Return
+                            t = self._sim.sim_step(run)
+                            if log_sink is not None:
+                                self._flush_log_buffers(
+                                    log, buffers, log_sink)
+                            if not progress.update(min((t - tmin) * r, 1)):
+                                raise myokit.SimulationCancelledError()
+                else:
+                    # Loop without feedback
+                    while t < tmax:
+                        t = self._sim.sim_step(run)
+                        if log_sink is not None:
+                            self._flush_log_buffers(log, buffers, log_sink)
+            except ArithmeticError as e:
+                # Some CVODE errors are set to raise an ArithmeticError,
+                # which users may be able to debug.
+                self._error_state = list(rstate)
+                self._update_parameters()
+                txt = ['A numerical error occurred during simulation at'
+                       ' t = ' + str(t) + '.', 'Last reached state: ']
+                txt.extend(['  ' + x for x in
+                            self._model.format_state(rstate).splitlines()])
+                txt.append('Inputs for binding: ')
+                txt.append('  time        = ' + myokit.strfloat(rbound[0]))
+                txt.append('  pace        = ' + myokit.strfloat(rbound[1]))
+                txt.append('  realtime    = ' + myokit.strfloat(rbound[2]))
+                txt.append('  evaluations = ' + myokit.strfloat(rbound[3]))
+                txt.append(str(e))
+                try:
+                    self._model.eval_state_derivatives(rstate)
+                except myokit.NumericalError as en:
+                    txt.append(str(en))
+                raise myokit.SimulationError('\n'.join(txt))
+            except Exception as e:
+
+                # Store error state
+                self._error_state = list(rstate)
+
+                # Check for known CVODE errors
+                if 'Function CVode()' in str(e):
+                    raise myokit.SimulationError(str(e))
+
+                # Check for zero step error
+                if str(e)[:10] == 'ZERO_STEP ':  # pragma: no cover
+                    t = float(str(e)[10:])
+                    raise myokit.SimulationError(
+                        'Maximum number of zero-size steps made at t='
+                        + str(t))
+
+                # Unknown exception: re-raise!
+                raise
+            finally:
+                # Clean even after KeyboardInterrupt or other Exception
+                self._sim.sim_clean(run)
+
+                # Add logged data, even if the run didn't complete
+                if log_sink is None:
+                    self._merge_log_buffers(log, buffers)
+                else:
+                    self._flush_log_buffers(log, buffers, log_sink, True)
+
+            # Update internal state
+            self._state = rstate
+            if s_rstate is not None:
+                self._s_state = s_rstate
+
+            # Run stopped early by a threshold condition?
+            if conditions is not None and conditions[6]:
+                self._stop_time = rbound[0]
+        elif log_sink is not None:
+            # Nothing to log, but tell the sink which keys to expect
+            self._flush_log_buffers(
+                log, self._log_buffers(log), log_sink, True)
+
+        # Gather sensitivities
+        output = [log]
+        if self._sensitivities is not None:
+            import numpy as np
+            shape = (len(self._sensitivities[0]), len(self._sensitivities[1]))
+            if tmin + duration > tmin and s_buffer:
+                sens = np.frombuffer(s_buffer, dtype=np.float64)
+                output.append(sens.reshape((-1, ) + shape))
+            else:
+                output.append(np.zeros((0, ) + shape))
+
+        # Calculate apds
         if root_list is not None:
-            # Calculate apds and return (log, apds)
             st = []
             dr = []
             if root_list:
@@ -495,15 +1213,51 @@ class Simulation(myokit.CModule):
             apds = myokit.DataLog()
             apds['start'] = st
             apds['duration'] = dr
-            return log, apds
-        else:
-            # Return log
-            return log
+            output.append(apds)
+
+        # Convert threshold crossings
+        if conditions is not None:
+            import numpy as np
+            records = np.zeros((0, 3))
+            if tmin + duration > tmin and conditions[5]:
+                records = np.frombuffer(
+                    conditions[5], dtype=np.float64).reshape((-1, 3))
+            crossings = myokit.DataLog()
+            crossings['time'] = records[:, 0]
+            crossings['index'] = records[:, 1].astype(int)
+            crossings['direction'] = records[:, 2].astype(int)
+            output.append(crossings)
+
+        # Convert biomarker records
+        if biomarkers is not None:
+            import numpy as np
+            records = np.zeros((0, ))
+            if tmin + duration > tmin and markers[4]:
+                records = np.frombuffer(markers[4], dtype=np.float64)
+            output.append(biomarkers._log(records))
+
+        # Create dense output
+        if dense_output:
+            import numpy as np
+            records = np.zeros((0, ))
+            tend = tmin
+            if tmin + duration > tmin:
+                tend = tmax if self._stop_time is None else self._stop_time
+                if dense:
+                    records = np.frombuffer(dense, dtype=np.float64)
+            output.append(DenseOutput(
+                self._model, tmin, tend, istate, records))
+
+        # Return log, or tuple with log, sensitivities, apds, crossings,
+        # biomarkers and/or dense output
+        return output[0] if len(output) == 1 else tuple(output)
 
     def set_constant(self, var, value):
         """
         Changes a model constant. Only literal constants (constants not
-        dependent on any other variable) can be changed.
+        dependent on any other variable) can be changed. Constants declared as
+        parameters cannot be changed with this method but may be set using
+        :meth:`set_parameters`.
 
         The constant ``var`` can be given as a :class:`Variable` or a string
         containing a variable qname. The ``value`` should be given as a float.
@@ -515,6 +1269,10 @@ class Simulation(myokit.CModule):
         if not var.is_literal():
             raise ValueError(
                 'The given variable <' + var.qname() + '> is not a literal.')
+        if var in self._parameters:
+            raise ValueError(
+                'The given variable <' + var.qname() + '> is set as a'
+                ' parameter. Use set_parameters() instead.')
 
         # Update value in internal model: This is required for error handling
         # (to show the correct values), but also takes care of constants in
@@ -522,7 +1280,7 @@ class Simulation(myokit.CModule):
         self._model.set_value(var.qname(), value)
 
         # Update value in compiled simulation module
-        self._sim.set_constant(var.qname(), value)
+        self._sim.set_constant(self._instance, var.qname(), value)
 
     def set_default_state(self, state):
         """
@@ -543,7 +1301,7 @@ class Simulation(myokit.CModule):
         self._dtmax = dtmax
 
         # Set in simulation
-        self._sim.set_max_step_size(dtmax)
+        self._sim.set_max_step_size(self._instance, dtmax)
 
     def set_min_step_size(self, dtmin=None):
         """
@@ -558,7 +1316,7 @@ class Simulation(myokit.CModule):
         self._dtmin = dtmin
 
         # Set in simulation
-        self._sim.set_min_step_size(dtmin)
+        self._sim.set_min_step_size(self._instance, dtmin)
 
     def set_fixed_form_protocol(self, times=None, values=None):
         """
@@ -607,6 +1365,57 @@ class Simulation(myokit.CModule):
             # Copy data and set
             self._fixed_form_protocol = (list(times), list(values))
 
+    def set_parameters(self, values):
+        """
+        Changes the values of the parameters declared when this simulation was
+        created.
+
+        The argument ``values`` must either be an ordered sequence (for
+        example a NumPy array) containing the values for every parameter, in
+        the order returned by :meth:`parameters`, or a mapping from one or
+        more parameter names to their new values.
+
+        Unlike :meth:`set_constant`, this method does not reset or otherwise
+        change the simulation time and state.
+        """
+        import numpy as np
+
+        if isinstance(values, dict):
+            # Create array to update so that values only change after error
+            # checks.
+            new_values = np.array(self._parameter_values)
+            for k, v in values.items():
+                if isinstance(k, myokit.Variable):
+                    k = k.qname()
+                try:
+                    k = self._model.get(k, myokit.Variable)
+                except KeyError:
+                    raise ValueError('Unknown parameter: <' + str(k) + '>.')
+                try:
+                    i = self._parameters.index(k)
+                except ValueError:
+                    raise ValueError(
+                        'Variable <' + str(k) + '> was not set as a'
+                        ' parameter.')
+                new_values[i] = float(v)
+            values = new_values
+
+        else:
+            values = np.ascontiguousarray(values, dtype=float)
+            if values.shape != self._parameter_values.shape:
+                raise ValueError(
+                    'Argument `values` should be either a dict or a sequence'
+                    ' of ' + str(len(self._parameters)) + ' values.')
+
+        # Update values in compiled simulation module
+        self._sim.set_parameters(
+            self._instance, self._parameter_offsets, values)
+
+        # Store values: the internal model is updated only when needed (see
+        # _update_parameters).
+        self._parameter_values[:] = values
+        self._parameters_changed = True
+
     def set_protocol(self, protocol=None):
         """
         Sets the pacing :class:`Protocol` used by this simulation.
@@ -640,6 +1449,10 @@ class Simulation(myokit.CModule):
         self.set_min_step_size(state[5])
         self.set_max_step_size(state[6])
 
+        # State sensitivities
+        self._s_state = state[7]
+        self._s_default_state = state[8]
+
     def set_state(self, state):
         """
         Sets the current state.
@@ -669,7 +1482,7 @@ class Simulation(myokit.CModule):
         self._tolerance = (abs_tol, rel_tol)
 
         # Set tolerance in simulation
-        self._sim.set_tolerance(abs_tol, rel_tol)
+        self._sim.set_tolerance(self._instance, abs_tol, rel_tol)
 
     def state(self):
         """
@@ -682,3 +1495,503 @@ class Simulation(myokit.CModule):
         Returns the current simulation time.
         """
         return self._time
+
+    def _update_parameters(self):
+        """
+        Copies any parameter values set with :meth:`set_parameters` into the
+        internal model. This is required for error handling and pickling, but
+        is skipped in :meth:`set_parameters` to keep it fast.
+        """
+        if self._parameters_changed:
+            for p, x in zip(self._parameters, self._parameter_values):
+                p.set_rhs(float(x))
+            self._parameters_changed = False
+
+
+class Biomarkers(object):
+    """
+    Specifies a set of biomarkers to calculate for every beat during a
+    :meth:`Simulation.run`.
+
+    Biomarkers are calculated in the simulation's C code, while the simulation
+    is running, so that they can be obtained without logging (or storing) the
+    full simulated traces. The results are returned as a :class:`DataLog`
+    with one entry per beat.
+
+    Beats are defined as consecutive intervals of length ``period``, starting
+    at the simulation time at the start of the run. Only beats that end
+    before (or at) the end of the run are reported.
+
+    Arguments:
+
+    ``period``
+        The duration of a single beat (e.g. the pacing cycle length).
+    ``potential``
+        A membrane potential state variable (given as a
+        :class:`myokit.Variable` or a qname), or ``None``.
+    ``calcium``
+        A calcium concentration state variable (given as a
+        :class:`myokit.Variable` or a qname), or ``None``.
+    ``apd``
+        A sequence of percentages of repolarisation at which to calculate
+        action potential durations.
+    ``catd``
+        A sequence of percentages of decay at which to calculate calcium
+        transient durations.
+
+    For each beat, the returned log has an entry ``time`` containing the start
+    time of the beat. If a ``potential`` is given, the following entries are
+    added:
+
+    ``rest``
+        The resting potential, defined as the value at the start of the beat.
+    ``peak``
+        The maximum potential reached during the beat.
+    ``dvdt_max``
+        The maximum rate of change of the potential during the beat.
+    ``apd30``, ``apd50``, etc.
+        The time from the point of maximum ``dV/dt`` until the potential first
+        drops below ``peak - 0.3 * (peak - rest)``, ``peak - 0.5 *
+        (peak - rest)``, etc. after the peak. If this doesn't happen before the
+        end of the beat, the value is ``NaN``.
+
+    Similarly, if a ``calcium`` state is given, the entries ``cat_diastolic``,
+    ``cat_peak`` and ``cat_amplitude`` (``cat_peak - cat_diastolic``) are
+    added, along with durations ``catd50``, ``catd90``, etc.
+
+    Maxima and maximum rates of change are evaluated at the points visited by
+    the solver, while the level crossings that define the durations are
+    found by bisection using CVODE's interpolating polynomials.
+
+    Example::
+
+        b = myokit.Biomarkers(1000, 'membrane.V', 'calcium.Cai')
+        log, markers = s.run(100000, log=myokit.LOG_NONE, biomarkers=b)
+        print(markers['apd90'])
+
+    """
+    def __init__(
+            self, period, potential=None, calcium=None, apd=(30, 50, 90),
+            catd=(50, 90)):
+        self._period = float(period)
+        if not self._period > 0:
+            raise ValueError('The period must be greater than zero.')
+        if potential is None and calcium is None:
+            raise ValueError(
+                'At least one of potential and calcium must be set.')
+        if isinstance(potential, myokit.Variable):
+            potential = potential.qname()
+        if isinstance(calcium, myokit.Variable):
+            calcium = calcium.qname()
+        self._potential = potential
+        self._calcium = calcium
+
+        # Check percentages
+        self._apd = [float(x) for x in apd] if potential else []
+        self._catd = [float(x) for x in catd] if calcium else []
+        for x in self._apd + self._catd:
+            if not 0 < x < 100:
+                raise ValueError('Percentages must be between 0 and 100.')
+
+    def calcium(self):
+        """
+        Returns the qname of the calcium variable, or ``None``.
+        """
+        return self._calcium
+
+    def keys(self):
+        """
+        Returns a list of the keys in the logs created using this
+        specification.
+        """
+        keys = ['time']
+        if self._potential:
+            keys.extend(['rest', 'peak', 'dvdt_max'])
+            keys.extend(['apd' + _percentage(x) for x in self._apd])
+        if self._calcium:
+            keys.extend(['cat_diastolic', 'cat_peak', 'cat_amplitude'])
+            keys.extend(['catd' + _percentage(x) for x in self._catd])
+        return keys
+
+    def period(self):
+        """
+        Returns the beat period.
+        """
+        return self._period
+
+    def potential(self):
+        """
+        Returns the qname of the membrane potential variable, or ``None``.
+        """
+        return self._potential
+
+    def _log(self, records):
+        """
+        Converts an array of records created by the C code into a
+        :class:`myokit.DataLog`.
+        """
+        import numpy as np
+        traces = [x for x in (self._potential, self._calcium) if x]
+        nt = len(traces)
+        levels = self._apd + self._catd
+        records = records.reshape((-1, 1 + 3 * nt + len(levels)))
+
+        log = myokit.DataLog(time='time')
+        log['time'] = np.array(records[:, 0])
+        i, j = 0, 1 + 3 * nt
+        if self._potential:
+            log['rest'] = np.array(records[:, 1])
+            log['peak'] = np.array(records[:, 2])
+            log['dvdt_max'] = np.array(records[:, 3])
+            for x in self._apd:
+                log['apd' + _percentage(x)] = np.array(records[:, j])
+                j += 1
+            i += 1
+        if self._calcium:
+            log['cat_diastolic'] = np.array(records[:, 1 + 3 * i])
+            log['cat_peak'] = np.array(records[:, 2 + 3 * i])
+            log['cat_amplitude'] = log['cat_peak'] - log['cat_diastolic']
+            for x in self._catd:
+                log['catd' + _percentage(x)] = np.array(records[:, j])
+                j += 1
+        return log
+
+    def _markers(self, model):
+        """
+        Returns the specification passed to the C code, for the given
+        ``model``.
+        """
+        indices, level_traces, levels = [], [], []
+        for name, percentages in (
+                (self._potential, self._apd), (self._calcium, self._catd)):
+            if name is None:
+                continue
+            try:
+                var = model.get(name)
+            except KeyError:
+                raise ValueError('Unknown biomarker variable: ' + name + '.')
+            if not var.is_state():
+                raise ValueError(
+                    'Biomarker variables must be states, got ' + name + '.')
+            level_traces.extend([len(indices)] * len(percentages))
+            levels.extend([x / 100 for x in percentages])
+            indices.append(var.indice())
+        return [self._period, indices, level_traces, levels, bytearray()]
+
+
+class DenseOutput(object):
+    """
+    Stores the interpolating polynomials used by CVODE during a single call to
+    :meth:`Simulation.run`, so that the state can be evaluated at any time in
+    the simulated interval without running the simulation again.
+
+    Dense output objects are created by passing ``dense_output=True`` to
+    :meth:`Simulation.run`. For every step taken by the solver, they store the
+    start and end time of the step, along with the Nordsieck array that CVODE
+    uses to represent the solution on that step. Evaluating the state at any
+    time in a step then gives the same result (up to rounding errors) as
+    logging at that time with ``log_times``, and is accurate to the order of
+    the method used on that step.
+
+    Dense output objects can be pickled.
+    """
+    # Maximum order stored for each step (must match DN_QMAX in cvodesim.c)
+    _QMAX = 5
+
+    def __init__(self, model, tmin, tmax, state, records):
+        import numpy as np
+        self._states = [x.qname() for x in model.states()]
+        self._time_key = model.time().qname()
+        self._tmin = float(tmin)
+        self._tmax = float(tmax)
+        self._state = np.array(state, dtype=float)
+
+        # Split records into step info and Nordsieck arrays, dropping any
+        # columns above the highest order used.
+        n = len(self._states)
+        records = np.asarray(records, dtype=float).reshape(
+            (-1, 5 + (self._QMAX + 1) * n))
+        self._t1 = np.array(records[:, 1])
+        self._tn = np.array(records[:, 2])
+        self._h = np.array(records[:, 3])
+        q = int(np.max(records[:, 4])) if len(records) else 0
+        self._z = np.array(records[:, 5:5 + (q + 1) * n]).reshape(
+            (-1, q + 1, n))
+
+    def interpolate(self, times):
+        """
+        Evaluates the state at the given ``times``, and returns a NumPy array
+        of shape ``(len(times), n_states)``.
+
+        All times must be within the simulated interval
+        ``[tmin(), tmax()]``. Times do not need to be sorted.
+        """
+        import numpy as np
+        times = np.array(times, dtype=float, ndmin=1)
+        if times.ndim != 1:
+            raise ValueError('The argument `times` must be a 1d array.')
+        if np.any(times < self._tmin) or np.any(times > self._tmax):
+            raise ValueError(
+                'All times must be within the simulated interval ['
+                + str(self._tmin) + ', ' + str(self._tmax) + '].')
+
+        # No steps taken: state is constant
+        if len(self._t1) == 0:
+            return np.tile(self._state, (len(times), 1))
+
+        # Find step for each time, and evaluate the polynomial in Nordsieck
+        # form y(t) = sum z[k] * ((t - tn) / h)^k using Horner's method
+        i = np.minimum(
+            np.searchsorted(self._t1, times, side='left'), len(self._t1) - 1)
+        s = ((times - self._tn[i]) / self._h[i])[:, None]
+        z = self._z[i]
+        y = z[:, -1]
+        for k in range(z.shape[1] - 2, -1, -1):
+            y = y * s + z[:, k]
+        return y
+
+    def log(self, times):
+        """
+        Evaluates the state at the given ``times``, and returns a
+        :class:`myokit.DataLog` containing the times and all states.
+        """
+        import numpy as np
+        times = np.array(times, dtype=float, ndmin=1)
+        y = self.interpolate(times)
+        log = myokit.DataLog(time=self._time_key)
+        log[self._time_key] = times
+        for i, key in enumerate(self._states):
+            log[key] = y[:, i]
+        return log
+
+    def states(self):
+        """
+        Returns a list containing the qnames of the states, in the order used
+        by :meth:`interpolate`.
+        """
+        return list(self._states)
+
+    def steps(self):
+        """
+        Returns the number of solver steps stored in this object.
+        """
+        return len(self._t1)
+
+    def tmax(self):
+        """
+        Returns the end of the simulated interval.
+        """
+        return self._tmax
+
+    def tmin(self):
+        """
+        Returns the start of the simulated interval.
+        """
+        return self._tmin
+
+
+def _percentage(x):
+    """
+    Formats a percentage for use in a biomarker name, e.g. ``90`` for 90% or
+    ``12.5`` for 12.5%.
+    """
+    return str(int(x)) if x == int(x) else str(x)
+
+
+def _chain_rule(equations, derivs, prefix, k):
+    """
+    Applies the chain rule to each equation in ``equations``, in order, to find
+    the derivatives of their left-hand sides with respect to some independent
+    variable.
+
+    The dict ``derivs`` must map :class:`myokit.LhsExpression` objects to
+    expressions for their derivatives. It is updated with an entry for every
+    left-hand side that depends on one of its keys. The new derivatives are
+    stored in temporary variables, with names made from ``prefix`` and a
+    counter starting at ``k``.
+
+    Returns a tuple ``(temporaries, k)``, where ``temporaries`` is a list of
+    tuples ``(name, expression)`` and ``k`` is the next unused counter value.
+    """
+    temporaries = []
+    for eq in equations:
+        terms = []
+        for ref in eq.rhs.references():
+            try:
+                deriv = derivs[ref]
+            except KeyError:
+                continue
+            partial = eq.rhs.diff(ref)
+            if isinstance(partial, myokit.Number) and partial.eval() == 0:
+                continue
+            if isinstance(deriv, myokit.Number):
+                terms.append(partial)
+            else:
+                terms.append(myokit.Multiply(partial, deriv))
+        if terms:
+            name = prefix + str(k)
+            k += 1
+            expr = terms[0]
+            for term in terms[1:]:
+                expr = myokit.Plus(expr, term)
+            temporaries.append((name, expr))
+            derivs[eq.lhs] = myokit.Name(name)
+    return temporaries, k
+
+
+def _jacobian_columns(model):
+    """
+    Derives the equations needed to calculate the model's Jacobian, column by
+    column.
+
+    For each state ``x_j`` a tuple ``(j, temporaries, entries)`` is returned.
+    Here ``temporaries`` is a list of tuples ``(name, expression)``, in
+    solvable order, where each ``name`` is the name of a temporary variable
+    holding the derivative of some variable with respect to ``x_j``. The
+    derivatives are calculated by applying the chain rule to the partial
+    derivatives (see :meth:`myokit.Expression.diff`) of each equation in the
+    model, so that only variables that depend on ``x_j`` are included.
+    The ``entries`` list contains tuples ``(i, name)`` for each non-zero
+    element ``(i, j)`` in the Jacobian.
+
+    The expressions use :class:`myokit.Name` objects with a string value to
+    refer to the temporary variables.
+    """
+    # Get equations, in solvable order
+    equations = []
+    for eqs in model.solvable_order().values():
+        equations.extend(eqs.equations(const=False))
+
+    k = 0
+    columns = []
+    states = list(model.states())
+    for j, state in enumerate(states):
+
+        # Map from left-hand sides to expressions for their derivatives with
+        # respect to x_j, for all lhs's that depend on x_j
+        derivs = {myokit.Name(state): myokit.Number(1)}
+        temporaries, k = _chain_rule(equations, derivs, 'jac_', k)
+
+        # Gather non-zero entries
+        entries = []
+        for i, x in enumerate(states):
+            try:
+                entries.append((i, derivs[x.lhs()].var()))
+            except KeyError:
+                pass
+        columns.append((j, temporaries, entries))
+    return columns
+
+
+def _jacobian_pattern(model):
+    """
+    Returns the sparsity pattern of the given model's Jacobian, as a list of
+    lists ``p`` where ``p[i][j]`` is 1 if ``dot(x_i)`` depends on ``x_j`` or
+    if ``i == j``, and 0 otherwise.
+    """
+    import myokit.lib.deps as deps
+    pattern = deps.create_state_dependency_matrix(model, direct=True)
+    for i, row in enumerate(pattern):
+        row[i] = 1
+    return pattern
+
+
+def _bandwidth(pattern):
+    """
+    Returns the upper and lower bandwidth ``(mu, ml)`` of a sparsity pattern.
+    """
+    mu = ml = 0
+    for i, row in enumerate(pattern):
+        for j, x in enumerate(row):
+            if x:
+                mu = max(mu, j - i)
+                ml = max(ml, i - j)
+    return mu, ml
+
+
+def _sparsity(pattern):
+    """
+    Converts a sparsity pattern to compressed sparse column format, and groups
+    its columns so that no two columns in a group have a non-zero in the same
+    row.
+
+    Returns a tuple ``(colptr, rowind, groups)``, where ``groups[j]`` is the
+    group that column ``j`` belongs to.
+    """
+    n = len(pattern)
+    colptr = [0]
+    rowind = []
+    groups = []
+    group_rows = []
+    for j in range(n):
+        rows = set([i for i in range(n) if pattern[i][j]])
+        rowind.extend(sorted(rows))
+        colptr.append(len(rowind))
+
+        # Add to the first group with no overlapping rows
+        for g, used in enumerate(group_rows):
+            if not (used & rows):
+                used.update(rows)
+                groups.append(g)
+                break
+        else:
+            groups.append(len(group_rows))
+            group_rows.append(rows)
+    return colptr, rowind, groups
+
+
+def _sensitivity_equations(model, dependents, independents):
+    """
+    Derives the equations needed to calculate the sensitivities of the states
+    and of a list of ``dependents`` with respect to a list of
+    ``independents``, using forward sensitivity analysis.
+
+    Dependents must be given as :class:`myokit.Name` or
+    :class:`myokit.Derivative` objects. Independents must be given as
+    variables, where a literal constant represents a parameter, and a state
+    represents that state's initial value.
+
+    For each independent ``p_k`` a tuple
+    ``(k, seeds, temporaries, states, outputs)`` is returned. Here ``seeds`` is
+    a list of tuples ``(name, i)`` giving the name used to refer to the
+    sensitivity of state ``x_i`` with respect to ``p_k``. The ``temporaries``
+    are tuples ``(name, expression)``, in solvable order, as in
+    :meth:`_jacobian_columns`, but now including the calculated constants.
+    The ``states`` list contains a tuple ``(i, expression)`` for the
+    derivative of ``dot(x_i)`` with respect to ``p_k``, for every state. The
+    ``outputs`` list contains a tuple ``(m, expression)`` for the derivative
+    of the ``m``-th dependent with respect to ``p_k``.
+    """
+    # Get equations, in solvable order, with calculated constants first
+    order = model.solvable_order().values()
+    equations = []
+    for eqs in order:
+        for eq in eqs.equations(const=True):
+            if not eq.rhs.is_literal():
+                equations.append(eq)
+    for eqs in order:
+        equations.extend(eqs.equations(const=False))
+
+    k = 0
+    columns = []
+    states = list(model.states())
+    zero = myokit.Number(0)
+    for p, independent in enumerate(independents):
+
+        # Seed the derivatives with the state sensitivities and, for
+        # parameters, with dp/dp = 1
+        seeds = []
+        derivs = {}
+        for i, state in enumerate(states):
+            name = 'ys_' + str(p) + '_' + str(i)
+            seeds.append((name, i))
+            derivs[myokit.Name(state)] = myokit.Name(name)
+        if not independent.is_state():
+            derivs[myokit.Name(independent)] = myokit.Number(1)
+        temporaries, k = _chain_rule(equations, derivs, 'sen_', k)
+
+        # Gather derivatives of state derivatives and outputs
+        rhs = [(i, derivs.get(x.lhs(), zero)) for i, x in enumerate(states)]
+        out = [(m, derivs.get(x, zero)) for m, x in enumerate(dependents)]
+        columns.append((p, seeds, temporaries, rhs, out))
+    return columns
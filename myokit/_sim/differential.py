@@ -0,0 +1,133 @@
+#
+# Code generation for sparse forward-mode automatic differentiation, using the
+# FirstDifferential type defined in differential.hpp.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import myokit
+
+
+def sparsity(model, independents, integrate=False):
+    """
+    Determines which partial derivatives can be non-zero for each variable in
+    a ``model``, with respect to an ordered list of ``independents``.
+
+    The independents should be given as a list of :class:`myokit.Variable`
+    objects, and can be literal constants (e.g. parameters) or states (e.g.
+    initial conditions).
+
+    If ``integrate`` is ``False``, the model's right-hand side function is
+    evaluated only once, so that each state's partial derivatives are zero
+    unless it is an independent itself. If ``integrate`` is ``True``, the model
+    is integrated over time, so that a state can become dependent on every
+    independent its time derivative depends on (directly or through other
+    states).
+
+    The dependencies are obtained from :meth:`Model.map_deep_dependencies`.
+
+    Returns a dict mapping :class:`myokit.LhsExpression` objects to sorted
+    lists of indices in ``independents``. The dict contains an entry for every
+    equation's left-hand side and for every state.
+    """
+    index = dict((myokit.Name(x), i) for i, x in enumerate(independents))
+    deps = model.map_deep_dependencies(omit_states=False)
+
+    # Get independents each lhs depends on, not counting states
+    direct = {}
+    for lhs, dep in deps.items():
+        direct[lhs] = set([index[x] for x in dep if x in index])
+
+    # Get independents each state depends on
+    states = {}
+    for state in model.states():
+        lhs = myokit.Name(state)
+        states[lhs] = set([index[lhs]]) if lhs in index else set()
+    if integrate:
+        changed = True
+        while changed:
+            changed = False
+            for state in model.states():
+                ind = set(direct[state.lhs()])
+                for x in deps[state.lhs()]:
+                    if x in states:
+                        ind |= states[x]
+                lhs = myokit.Name(state)
+                if not ind <= states[lhs]:
+                    states[lhs] |= ind
+                    changed = True
+
+    # Combine direct dependencies and dependencies through states
+    result = {}
+    for lhs, dep in deps.items():
+        ind = set(direct[lhs])
+        for x in dep:
+            if x in states:
+                ind |= states[x]
+        if lhs in index:
+            ind.add(index[lhs])
+        result[lhs] = sorted(ind)
+    for lhs, ind in states.items():
+        result[lhs] = sorted(ind)
+    return result
+
+
+def sparse_equation(eq, sparse, v, w):
+    """
+    Returns a list of lines of C++ code that evaluate the equation ``eq``, by
+    calculating its value and then only those partial derivatives that are
+    structurally non-zero.
+
+    The sparsity pattern should be given as ``sparse``, as returned by
+    :meth:`sparsity()`. The function ``v`` should return the C++ name of a
+    differential object, given an :class:`LhsExpression`, while the
+    :class:`myokit.formats.cpp.CppExpressionWriter` ``w`` is used to write
+    expressions in terms of plain (real) values.
+
+    Partial derivatives are obtained using :meth:`Expression.diff()`, and
+    are exact everywhere except at discontinuities:
+
+    - ``floor``, ``ceil`` and quotients (``//``) are treated as piecewise
+      constant, so that their derivatives are zero.
+    - Conditional expressions take the derivative of the selected branch.
+    - ``abs(x)`` has derivative ``x'`` for ``x >= 0`` and ``-x'`` otherwise.
+    - Remainders ``x % y`` have derivative ``x' - floor(x / y) * y'``.
+
+    As a result, these functions do not yield ``NaN`` in sparse mode, unlike
+    in the dense code used by :class:`myokit.PSimulation`,
+    :class:`myokit.ICSimulation`, :class:`myokit.JacobianTracer` and
+    :class:`myokit.JacobianCalculator`.
+    """
+    lhs = v(eq.lhs)
+    value = w.ex(eq.rhs)
+    ind = sparse[eq.lhs]
+    if not ind:
+        return [lhs + '.value(' + value + ');']
+
+    # Get partial derivatives with respect to every dependency that has any
+    # non-zero partial derivatives itself
+    partials = []
+    for ref in sorted(eq.rhs.references(), key=lambda x: v(x)):
+        if sparse.get(ref):
+            partial = eq.rhs.diff(ref)
+            if not (partial.is_literal() and partial.eval() == 0):
+                partials.append((ref, partial))
+
+    # Evaluate partials, then value, then apply chain rule
+    lines = ['{']
+    for k, (ref, partial) in enumerate(partials):
+        lines.append('    const Real d' + str(k) + ' = ' + w.ex(partial) + ';')
+    lines.append('    ' + lhs + '.value(' + value + ');')
+    for i in ind:
+        terms = []
+        for k, (ref, partial) in enumerate(partials):
+            if i in sparse[ref]:
+                terms.append(
+                    'd' + str(k) + ' * ' + v(ref) + '[' + str(i) + ']')
+        terms = ' + '.join(terms) if terms else '0'
+        lines.append('    ' + lhs + '[' + str(i) + '] = ' + terms + ';')
+    lines.append('}')
+    return lines
@@ -89,6 +89,28 @@ static int log_add(PyObject* log_dict, PyObject** logs, Real** vars, int i, char
     return added;
 }
 
+/*
+ * Appends the current value of each logged variable to its log, where each
+ * log is a bytearray used as a growable buffer of doubles.
+ *
+ * Arguments
+ *  logs     : Pointers to a log for each logged variables
+ *  vars     : Pointers to each variable to log
+ *  n_vars   : The number of logged variables
+ * Returns 0 if successful, or -1 (with a Python exception set) if not.
+ */
+static int log_values(PyObject** logs, Real** vars, int n_vars)
+{
+    int i;
+    Py_ssize_t size;
+    for(i=0; i<n_vars; i++) {
+        size = PyByteArray_Size(logs[i]);
+        if(PyByteArray_Resize(logs[i], size + (Py_ssize_t)sizeof(double))) return -1;
+        *(double*)(PyByteArray_AsString(logs[i]) + size) = (double)*vars[i];
+    }
+    return 0;
+}
+
 /*
  * Simulation variables
  *
@@ -123,8 +145,8 @@ PyObject *protocol;     // A pacing protocol
 int cfx;                // The x-coord. on the fiber where the tissue connects
 int ctx;                // The x-coord. on the tissue where the fiber connects
 int cty;                // The first connected y-coord. on the tissue
-PyObject *log_dict_f;   // A logging dict for the fiber
-PyObject *log_dict_t;   // A logging dict for the tissue
+PyObject *log_dict_f;   // A logging dict for the fiber, with bytearray buffers
+PyObject *log_dict_t;   // A logging dict for the tissue, with bytearray buffers
 double log_interval;    // The time between log writes
 PyObject *inter_log_f;  // A list of intermediary fiber variables to log
 PyObject *inter_log_t;  // A list of intermediary tissue variables to log
@@ -215,7 +237,6 @@ int n_inter_t;          // The number of unique intermediary variables logged
 // (Unless you got it through PyList_GetItem or PyTuble_GetItem)
 PyObject* flt;              // PyFloat, various uses
 PyObject* ret;              // PyFloat, used as return value
-PyObject* list_update_str;  // PyUnicode, used to call "append" method
 
 /*
  * Cleans up after a simulation
@@ -265,9 +286,6 @@ sim_clean()
         free(vars_f); vars_f = NULL;
         free(vars_t); vars_t = NULL;
 
-        // No longer need update string
-        Py_XDECREF(list_update_str); list_update_str = NULL;
-
         // No longer running
         running = 0;
     }
@@ -337,7 +355,6 @@ sim_init(PyObject* self, PyObject* args)
     }
 
     // Set all pointers used by sim_clean to null
-    list_update_str = NULL;
     command_queue = NULL;
     mbuf_state_f = NULL;
     mbuf_state_t = NULL;
@@ -888,6 +905,12 @@ print(4*tab + '}')
         PyErr_SetString(PyExc_Exception, "Unknown variables found in fiber logging dictionary.");
         return sim_clean();
     }
+    for(i=0; i<n_vars_f; i++) {
+        if(!PyByteArray_Check(logs_f[i])) {
+            PyErr_SetString(PyExc_Exception, "Fiber logging dictionary must contain bytearray buffers.");
+            return sim_clean();
+        }
+    }
 
     #ifdef MYOKIT_DEBUG
     printf("Created log for %d fiber variables.\n", n_vars_f);
@@ -959,14 +982,17 @@ print(4*tab + '}')
         PyErr_SetString(PyExc_Exception, "Unknown variables found in tissue logging dictionary.");
         return sim_clean();
     }
+    for(i=0; i<n_vars_t; i++) {
+        if(!PyByteArray_Check(logs_t[i])) {
+            PyErr_SetString(PyExc_Exception, "Tissue logging dictionary must contain bytearray buffers.");
+            return sim_clean();
+        }
+    }
 
     #ifdef MYOKIT_DEBUG
     printf("Created log for %d tissue variables.\n", n_vars_t);
     #endif
 
-    /* Log update method: */
-    list_update_str = PyUnicode_FromString("append");
-
     /* First point to step to */
     istep = 1;
 
@@ -1072,29 +1098,8 @@ sim_step(PyObject *self, PyObject *args)
             }
 
             /* Write everything to the logs */
-            for(i=0; i<n_vars_f; i++) {
-                flt = PyFloat_FromDouble(*vars_f[i]);
-                ret = PyObject_CallMethodObjArgs(logs_f[i], list_update_str, flt, NULL);
-                Py_DECREF(flt);
-                Py_XDECREF(ret);
-                if(ret == NULL) {
-                    flt = NULL;
-                    PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                    return sim_clean();
-                }
-            }
-            flt = ret = NULL;
-            for(i=0; i<n_vars_t; i++) {
-                flt = PyFloat_FromDouble(*vars_t[i]);
-                ret = PyObject_CallMethodObjArgs(logs_t[i], list_update_str, flt, NULL);
-                Py_DECREF(flt); flt = NULL;
-                Py_XDECREF(ret);
-                if(ret == NULL) {
-                    PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                    return sim_clean();
-                }
-            }
-            ret = NULL;
+            if(log_values(logs_f, vars_f, n_vars_f)) return sim_clean();
+            if(log_values(logs_t, vars_t, n_vars_t)) return sim_clean();
 
             /* Set next logging point */
             inext_log++;
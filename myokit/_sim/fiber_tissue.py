@@ -839,6 +839,8 @@ class FiberTissueSimulation(myokit.CModule):
             state_int = self._statet
             state_outf = list(state_inf)
             state_outt = list(state_int)
+            buffersf = self._log_buffers(logf)
+            bufferst = self._log_buffers(logt)
             self._sim.sim_init(
                 platform,
                 device,
@@ -866,8 +868,8 @@ class FiberTissueSimulation(myokit.CModule):
                 state_outf,
                 state_outt,
                 self._protocol,
-                logf,
-                logt,
+                buffersf,
+                bufferst,
                 log_interval,
                 [x.qname().encode('ascii') for x in inter_logf],
                 [x.qname().encode('ascii') for x in inter_logt],
@@ -895,6 +897,11 @@ class FiberTissueSimulation(myokit.CModule):
             finally:
                 # Clean even after KeyboardInterrupt or other Exception
                 self._sim.sim_clean()
+
+                # Add logged data, even if the run didn't complete
+                self._merge_log_buffers(logf, buffersf)
+                self._merge_log_buffers(logt, bufferst)
+
             # Update states
             self._statef = state_outf
             self._statet = state_outt
@@ -8,6 +8,11 @@
 # -----------------------------------------------------------------------------
 # module_name      A module name
 # model            A myokit model
+# method           The integration method: 'euler', 'rl', or 'rk45'
+# rl_states        A map {state: (inf, tau)} of states for which to use Rush-
+#                  Larsen updates (empty unless method is 'rl')
+# sparse           True if only structurally non-zero partial derivatives
+#                  should be propagated
 # -----------------------------------------------------------------------------
 #
 # This file is part of Myokit.
@@ -22,8 +27,8 @@ model.create_unique_names()
 
 # Get mapping of bound variables
 bound = model.prepare_bindings({
-    'time' : 'engine_time',
-    'pace' : 'engine_pace',
+    'time' : 'r->time',
+    'pace' : 'r->pace',
     })
 
 # Get equations
@@ -43,10 +48,27 @@ def v(var):
     # Convert LhsExpressions to Variables
     if isinstance(var, myokit.Name):
         var = var.var()
-    # Handle bound variables, states, constants and others
-    return 'V_' + var.uname()
+    # States and constants (aliased)
+    if var.is_state() or var.is_constant():
+        return 'V_' + var.uname()
+    # Other variables: stored in the run struct
+    return 'r->V_' + var.uname()
 w.set_lhs_function(v)
 
+# In sparse mode, get the structurally non-zero partial derivatives of each
+# variable, and create a writer for expressions in terms of plain values
+if sparse:
+    from myokit._sim.differential import sparsity, sparse_equation
+    sparse_map = sparsity(model, model.states(), integrate=True)
+
+    def vr(var):
+        if isinstance(var, myokit.Name) and var.var().is_constant():
+            return v(var)
+        return v(var) + '.value()'
+    wr = cpp.CppExpressionWriter()
+    wr.set_condition_function('ifte')
+    wr.set_lhs_function(vr)
+
 # Tab
 tab = '    '
 
@@ -58,6 +80,9 @@ tab = '    '
 #define N_STATE <?= model.count_states() ?>
 #define N_MATRIX <?= model.count_states() ** 2 ?>
 
+// Integration method: Dormand-Prince if set, or fixed step otherwise
+#define USE_RK45 <?= 1 if method == 'rk45' else 0 ?>
+
 // Define numerical type
 typedef double Real;
 
@@ -73,12 +98,12 @@ typedef FirstDifferential Diff;
 <?
 print('// Aliases of state variable derivatives')
 for var in model.states():
-    print('#define ' + v(var.lhs()) + ' deriv[' + str(var.indice()) + ']')
+    print('#define ' + v(var.lhs()) + ' r->deriv[' + str(var.indice()) + ']')
 print('')
 
 print('// Aliases of state variable values')
 for var in model.states():
-    print('#define ' + v(var) + ' state[' + str(var.indice()) + ']')
+    print('#define ' + v(var) + ' r->state[' + str(var.indice()) + ']')
 print('')
 
 print('// Aliases of constants and calculated constants')
@@ -90,17 +115,8 @@ for group in equations.values():
             print('#define ' + v(eq.lhs) + ' (' + w.ex(eq.rhs) + ')')
 print('')
 
-print('// Declare remaining variables')
-for var in model.variables(state=False, const=False, deep=True):
-    print('static Diff ' + v(var) + ';')
-print('')
-
 ?>
 
-// Inputs
-double engine_time;
-double engine_pace;
-
 // Simple exceptions
 PyObject* e(const char* msg)
 {
@@ -108,9 +124,81 @@ PyObject* e(const char* msg)
     return 0;
 }
 
+//
+// Simulation run
+//
+// All the state of a single simulation run is stored in a SimRun struct,
+// which is created by sim_init and passed back to Python as a capsule. This
+// allows several runs to be active at the same time, and lets sim_step
+// release the GIL while stepping.
+//
+struct SimRun {
+    // Simulation state
+    int running;
+
+    // Input arguments
+    double tmin;                // The initial simulation time
+    double tmax;                // The final simulation time
+    double default_dt;          // The default step size
+    PyObject* state_out;        // The final state (new reference)
+    PyObject* deriv_out;        // The final partial derivatives (new reference)
+    PyObject* log_dict;         // The simulation log to log to (new reference)
+    PyObject* log_deriv;        // A list to store lists of partial derivatives in (new reference)
+    double log_interval;        // The logging interval
+
+    // Engine variables
+    double time;
+    double pace;
+
+    // State vector & derivatives
+    Diff* state;
+    Diff* deriv;
+
+    // Model variables
+<?
+for var in model.variables(state=False, const=False, deep=True):
+    print(tab + 'Diff ' + v(var)[3:] + ';')
+?>
+
+    // Step size
+    // Typically, dt = default_dt. However, if that dt would take the
+    // simulation beyond the next pacing event or the end of the simulation,
+    // it will be shortened to arrive there exactly.
+    double dt;
+    double dt_min;              // Minimum step size
+
+    // Adaptive step size (rk45 only)
+    double h;                   // The proposed step size
+    double abs_tol;             // Absolute tolerance
+    double rel_tol;             // Relative tolerance
+    Diff* rk_y0;                // The state at the start of the step
+    Diff* rk_k;                 // The state derivatives at each stage
+
+    // Logging
+    PyObject** logs;            // An array of lists to log into
+    Diff** vars;                // An array of pointers to variables to log
+    Py_ssize_t n_vars;          // Number of logging variables
+    unsigned long ilog;         // Index of next logging point
+    double tlog;                // Time of next logging point
+    PyObject* list_update_str;  // PyUnicode, used to call "append" method
+
+    // Buffer for logged points, filled without the GIL. Each point contains
+    // n_vars values, followed by N_MATRIX partial derivatives.
+    double* log_buffer;
+    Py_ssize_t n_log_buffer;    // Number of points in the buffer
+    Py_ssize_t c_log_buffer;    // Capacity of the buffer, in points
+
+    // Pacing
+    ESys pacing;                // Pacing system
+    double tpace;               // Time of next event
+    ESys_Flag flag_pacing;      // Error flag set during stepping
+};
+
+#define SIM_CAPSULE_NAME "myokit.ICSimulation.run"
+
 // Right-hand-side function of the model ODE
 static int
-rhs(Diff* state, Diff* deriv)
+rhs(SimRun* r)
 {
 <?
 for label, eqs in equations.items():
@@ -119,7 +207,13 @@ for label, eqs in equations.items():
         for eq in eqs.equations(const=False):
             var = eq.lhs.var()
             if var in bound:
-                print(tab + v(var) + ' = ' + bound[var] + ';')
+                if sparse:
+                    print(tab + v(var) + '.value(' + bound[var] + ');')
+                else:
+                    print(tab + v(var) + ' = ' + bound[var] + ';')
+            elif sparse:
+                for line in sparse_equation(eq, sparse_map, v, wr):
+                    print(tab + line)
             else:
                 print(tab + w.eq(eq) + ';')
         print(tab)
@@ -142,106 +236,384 @@ log_add(PyObject* log_dict, PyObject** logs, Diff** vars, int i, const char* nam
     return added;
 }
 
-// Input arguments
-double tmin;                // The initial simulation time
-double tmax;                // The final simulation time
-double default_dt;          // The default step size
-PyObject* state_in;         // The initial state
-PyObject* deriv_in;         // The initial partial derivatives (as a list)
-PyObject* state_out;        // The final state
-PyObject* deriv_out;        // The final partial derivatives (as a list)
-PyObject* protocol;         // The pacing protocol (if any)
-PyObject* log_dict;         // The simulation log to log to
-PyObject* log_deriv;        // A list to store lists of partial derivatives in
-double log_interval;        // The logging interval
-
-// State vector & derivatives
-Diff* state;
-Diff* deriv;
-
-// Step size
-// Typically, dt = default_dt. However, if that dt would take the simulation
-// beyond the next pacing event or the end of the simulation, it will be
-// shortened to arrive there exactly.
-double dt;
-double dt_min;  // Minimum step size
-
-// Simulation state
-int running;
-
-// Logging
-PyObject** logs = NULL;     // An array of lists to log into
-Diff** vars = NULL;         // An array of pointers to variables to log
-Py_ssize_t n_vars;          // Number of logging variables
-unsigned long ilog;         // Index of next logging point
-double tlog;                // Time of next logging point
-
-// Pacing
-ESys pacing = NULL;         // Pacing system
-double tpace;               // Time of next event
-
-// Temporary python objects
-PyObject* flt = NULL;               // PyFloat, various uses
-PyObject* ret = NULL;               // PyFloat, used as return value
-PyObject* list_update_str = NULL;   // PyUnicode, used to call "append" method
-PyObject* list = NULL;              // A new list, created to hold derivatives
+//
+// Adds the current values of all logged variables and partial derivatives to
+// the log buffer. Does not use the Python API. Returns 0 if successful.
+//
+static int
+sim_log_point(SimRun* r)
+{
+    Py_ssize_t i, j;
+    double* buffer;
+    if (r->n_log_buffer == r->c_log_buffer) {
+        r->c_log_buffer = (r->c_log_buffer < 64) ? 64 : 2 * r->c_log_buffer;
+        buffer = (double*)realloc(r->log_buffer, sizeof(double) * r->c_log_buffer * (r->n_vars + N_MATRIX > 0 ? r->n_vars + N_MATRIX : 1));
+        if (buffer == NULL) return -1;
+        r->log_buffer = buffer;
+    }
+    buffer = r->log_buffer + r->n_log_buffer * (r->n_vars + N_MATRIX);
+    for(i=0; i<r->n_vars; i++) {
+        *(buffer++) = r->vars[i]->value();
+    }
+    for(i=0; i<N_STATE; i++) {
+        for(j=0; j<N_STATE; j++) {
+            *(buffer++) = r->state[i][j];
+        }
+    }
+    r->n_log_buffer++;
+    return 0;
+}
+
+//
+// Moves all buffered log points to the Python log. Must be called while
+// holding the GIL. Returns 0 if successful, or -1 (with a Python exception
+// set) if not.
+//
+static int
+sim_flush(SimRun* r)
+{
+    Py_ssize_t i, j;
+    double* buffer = r->log_buffer;
+    PyObject* flt;
+    PyObject* ret;
+    PyObject* list;
+
+    for(j=0; j<r->n_log_buffer; j++) {
+
+        // Log variables
+        for(i=0; i<r->n_vars; i++) {
+            flt = PyFloat_FromDouble(*(buffer++)); // Append doesn't steal
+            ret = PyObject_CallMethodObjArgs(r->logs[i], r->list_update_str, flt, NULL);
+            Py_DECREF(flt);
+            Py_XDECREF(ret);
+            if (ret == NULL) {
+                r->n_log_buffer = 0;
+                PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
+                return -1;
+            }
+        }
+
+        // Log partial derivatives
+        list = PyList_New(N_MATRIX);
+        if (list == NULL) {
+            r->n_log_buffer = 0;
+            return -1;
+        }
+        for(i=0; i<N_MATRIX; i++) {
+            // PyList_SetItem steals a reference: no need to decref the Float!
+            PyList_SetItem(list, i, PyFloat_FromDouble(*(buffer++)));
+        }
+        if (PyList_Append(r->log_deriv, list) != 0) {
+            Py_DECREF(list);
+            r->n_log_buffer = 0;
+            return -1;
+        }
+        Py_DECREF(list);
+    }
+    r->n_log_buffer = 0;
+    return 0;
+}
+
+#if USE_RK45
+//
+// Dormand-Prince 5(4) coefficients. The final stage is evaluated at the new
+// fifth-order solution, so that its derivatives can be reused as the first
+// stage of the next step.
+//
+static const double rk_c[7] = {0, 1.0/5, 3.0/10, 4.0/5, 8.0/9, 1, 1};
+static const double rk_a[7][6] = {
+    {0},
+    {1.0/5},
+    {3.0/40, 9.0/40},
+    {44.0/45, -56.0/15, 32.0/9},
+    {19372.0/6561, -25360.0/2187, 64448.0/6561, -212.0/729},
+    {9017.0/3168, -355.0/33, 46732.0/5247, 49.0/176, -5103.0/18656},
+    {35.0/384, 0, 500.0/1113, 125.0/192, -2187.0/6784, 11.0/84},
+};
+static const double rk_e[7] = {
+    71.0/57600, 0, -71.0/16695, 71.0/1920, -17253.0/339200, 22.0/525, -1.0/40};
+
+//
+// Attempts a single Dormand-Prince step of size r->dt, arriving at time t1.
+// Afterwards, the state and all other variables are evaluated at t1, and the
+// state at the start of the step is stored in r->rk_y0 (with its derivatives
+// in the first N_STATE entries of r->rk_k), so that the step can be undone.
+//
+// Returns a weighted root-mean-square estimate of the local error in the
+// state values and their partial derivatives, where a value <= 1 means the
+// step can be accepted.
+//
+static double
+rk_attempt(SimRun* r, double t1)
+{
+    int i, j, k;
+    double x, y0, y1, err;
+    double t0 = r->time;
+    Diff* ks = r->rk_k;
+
+    // First stage: derivatives at the start of the step
+    for(i=0; i<N_STATE; i++) {
+        r->rk_y0[i] = r->state[i];
+        ks[i] = r->deriv[i];
+    }
+
+    // Remaining stages
+    for(k=1; k<7; k++) {
+        for(i=0; i<N_STATE; i++) {
+            r->state[i] = r->rk_y0[i];
+            for(j=0; j<k; j++) {
+                if (rk_a[k][j] != 0) r->state[i] += ks[j*N_STATE + i] * (rk_a[k][j] * r->dt);
+            }
+        }
+        r->time = (rk_c[k] == 1) ? t1 : t0 + rk_c[k] * r->dt;
+        rhs(r);
+        for(i=0; i<N_STATE; i++) ks[k*N_STATE + i] = r->deriv[i];
+    }
+
+    // Estimate error, for the state values and their partial derivatives
+    err = 0;
+    for(i=0; i<N_STATE; i++) {
+        x = 0;
+        for(k=0; k<7; k++) x += rk_e[k] * ks[k*N_STATE + i].value();
+        y0 = fabs(r->rk_y0[i].value());
+        y1 = fabs(r->state[i].value());
+        x *= r->dt / (r->abs_tol + r->rel_tol * (y0 > y1 ? y0 : y1));
+        err += x * x;
+        for(j=0; j<N_DIFFS; j++) {
+            x = 0;
+            for(k=0; k<7; k++) x += rk_e[k] * ks[k*N_STATE + i][j];
+            y0 = fabs(r->rk_y0[i][j]);
+            y1 = fabs(r->state[i][j]);
+            x *= r->dt / (r->abs_tol + r->rel_tol * (y0 > y1 ? y0 : y1));
+            err += x * x;
+        }
+    }
+    return (N_STATE > 0) ? sqrt(err / (N_STATE * (1 + N_DIFFS))) : 0;
+}
+#endif
+
+//
+// Takes up to max_steps steps, logging to the log buffer. This function does
+// not use the Python API, so that it can be called without holding the GIL.
+//
+// Returns 1 if the simulation finished, 0 if it should be continued, -1 if
+// the pacing system failed (in which case r->flag_pacing is set), -2 if
+// memory allocation failed, -3 if the step size became too small, or -4 if
+// the error estimate became NaN.
+//
+static int
+sim_advance(SimRun* r, int max_steps)
+{
+    int steps_taken = 0;    // Steps taken during this call
+    double d;
+#if USE_RK45
+    int i, truncated;
+    double t0, t1, err, fac, pace;
+
+    while(1) {
+
+        // Calculate next step size: the proposed step size, shortened if
+        // needed to arrive exactly at the next event, logging point, or end of
+        // the simulation
+        r->dt = r->h;
+        t0 = r->time;
+        t1 = t0 + r->dt;
+        truncated = 0;
+        d = r->tpace - t0; if (d > 0 && d < r->dt) { r->dt = d; t1 = r->tpace; truncated = 1; }
+        d = r->tmax - t0; if (d > 0 && d < r->dt) { r->dt = d; t1 = r->tmax; truncated = 1; }
+        d = r->tlog - t0; if (d > 0 && d < r->dt) { r->dt = d; t1 = r->tlog; truncated = 1; }
+
+        // Attempt step
+        err = rk_attempt(r, t1);
+        if (isnan(err)) return -4;
+        if (err > 1) {
+            // Reject step: restore state, and retry with a smaller step
+            for(i=0; i<N_STATE; i++) {
+                r->state[i] = r->rk_y0[i];
+                r->deriv[i] = r->rk_k[i];
+            }
+            r->time = t0;
+            fac = 0.9 * pow(err, -0.2);
+            r->h = r->dt * (fac < 0.2 ? 0.2 : fac);
+            if (t0 + r->h == t0) return -3;
+
+            steps_taken++;
+            if (steps_taken >= max_steps) return 0;
+            continue;
+        }
+
+        // Accept step, and update the proposed step size. After a truncated
+        // step the previous proposal is kept, unless a larger one is found.
+        fac = (err > 0) ? 0.9 * pow(err, -0.2) : 5;
+        fac = (fac < 0.2) ? 0.2 : ((fac > 5) ? 5 : fac);
+        if (!truncated || r->dt * fac > r->h) r->h = r->dt * fac;
+
+        // Update pacing, and re-evaluate if the pacing level changed
+        r->time = t1;
+        r->flag_pacing = ESys_AdvanceTime(r->pacing, r->time);
+        if (r->flag_pacing!=ESys_OK) return -1;
+        r->tpace = ESys_GetNextTime(r->pacing, NULL);
+        pace = ESys_GetLevel(r->pacing, NULL);
+        if (pace != r->pace) {
+            r->pace = pace;
+            rhs(r);
+        }
+#else
+
+    while(1) {
+
+        // Calculate next step size
+        r->dt = r->default_dt;
+        d = r->tpace - r->time; if (d > r->dt_min && d < r->dt) r->dt = d;
+        d = r->tmax - r->time; if (d > r->dt_min && d < r->dt) r->dt = d;
+        d = r->tlog - r->time; if (d > r->dt_min && d < r->dt) r->dt = d;
+
+        // Advance to next time step
+<?
+for var in model.states():
+    if var in rl_states:
+        inf, tau = rl_states[var]
+        inf, tau, x = v(inf), v(tau), v(var)
+        print(tab * 2 + x + ' = ' + inf + ' - (' + inf + ' - ' + x + ') * exp(-r->dt / ' + tau + ');')
+    else:
+        print(tab * 2 + v(var) + ' += ' + v(var.lhs()) + ' * r->dt;')
+?>
+        r->time += r->dt;
+        r->flag_pacing = ESys_AdvanceTime(r->pacing, r->time);
+        if (r->flag_pacing!=ESys_OK) return -1;
+        r->tpace = ESys_GetNextTime(r->pacing, NULL);
+        r->pace = ESys_GetLevel(r->pacing, NULL);
+        rhs(r);
+#endif
+
+        // Check if we're finished
+        // Do this *before* logging (half-open interval rule)
+        if (r->time >= r->tmax) return 1;
+
+        // Logging
+        if (r->time >= r->tlog) {
+            if (sim_log_point(r)) return -2;
+
+            // Calculate next logging point
+            r->ilog++;
+            r->tlog = r->tmin + (double)r->ilog * r->log_interval;
+        }
+
+        // Report back to python after every x steps
+        steps_taken++;
+        if (steps_taken >= max_steps) return 0;
+    }
+}
 
 // Python callable methods
 extern "C" {
 
     /*
-     * Cleans up after a simulation
+     * Cleans up after a simulation, can safely be called more than once
      */
     static PyObject*
-    sim_clean()
+    sim_clean_run(SimRun* r)
     {
-        if (running != 0) {
+        if (r->running != 0) {
             // Done with str="append", decref it
-            Py_XDECREF(list_update_str); list_update_str = NULL;
+            Py_XDECREF(r->list_update_str); r->list_update_str = NULL;
+
+            // Release input arguments
+            Py_XDECREF(r->state_out); r->state_out = NULL;
+            Py_XDECREF(r->deriv_out); r->deriv_out = NULL;
+            Py_XDECREF(r->log_dict); r->log_dict = NULL;
+            Py_XDECREF(r->log_deriv); r->log_deriv = NULL;
 
             // Free allocated memory
-            free(state); state = NULL;
-            free(deriv); deriv = NULL;
-            free(vars); vars = NULL;
-            free(logs); logs = NULL;
+            free(r->state); r->state = NULL;
+            free(r->deriv); r->deriv = NULL;
+            free(r->rk_y0); r->rk_y0 = NULL;
+            free(r->rk_k); r->rk_k = NULL;
+            free(r->vars); r->vars = NULL;
+            free(r->logs); r->logs = NULL;
+            free(r->log_buffer); r->log_buffer = NULL;
 
             // Free pacing system space
-            ESys_Destroy(pacing); pacing = NULL;
+            ESys_Destroy(r->pacing); r->pacing = NULL;
 
             // No longer running
-            running = 0;
+            r->running = 0;
         }
 
         // Return 0, allowing the construct
         //  PyErr_SetString(PyExc_Exception, "Oh noes!");
-        //  return sim_clean()
+        //  return sim_clean_run(r)
         // to terminate a python function.
         return 0;
     }
+
+    /*
+     * Frees a SimRun when its capsule is garbage collected
+     */
+    static void
+    sim_run_destructor(PyObject* capsule)
+    {
+        SimRun* r = (SimRun*)PyCapsule_GetPointer(capsule, SIM_CAPSULE_NAME);
+        if (r != NULL) {
+            sim_clean_run(r);
+            delete r;
+        }
+    }
+
+    /*
+     * Returns the SimRun stored in the capsule passed in as args, or NULL
+     * (with a Python exception set) if no valid capsule was passed in.
+     */
+    static SimRun*
+    sim_get_run(PyObject* args)
+    {
+        PyObject* capsule;
+        if (!PyArg_ParseTuple(args, "O", &capsule)) {
+            PyErr_SetString(PyExc_Exception, "Expected input argument: run (capsule).");
+            return NULL;
+        }
+        return (SimRun*)PyCapsule_GetPointer(capsule, SIM_CAPSULE_NAME);
+    }
+
+    /*
+     * Cleans up after an aborted simulation run
+     */
     static PyObject*
     py_sim_clean(PyObject *self, PyObject *args)
     {
-        sim_clean();
-
+        SimRun* r = sim_get_run(args);
+        if (r == NULL) return 0;
+        sim_clean_run(r);
         Py_RETURN_NONE;
     }
 
     /*
-     * Initializes a simulation
+     * Initializes a simulation run, and returns a capsule containing its state
      */
     static PyObject*
     sim_init(PyObject* self, PyObject* args)
     {
         int i, j;
-
-        // Check if already running
-        if (running != 0) {
-            PyErr_SetString(PyExc_Exception, "Simulation already initialized.");
-            return 0;
-        }
+        SimRun* r;
+        PyObject* capsule;
+
+        // Input arguments (borrowed references)
+        double tmin;                // The initial simulation time
+        double tmax;                // The final simulation time
+        double default_dt;          // The default step size
+        PyObject* state_in;         // The initial state
+        PyObject* deriv_in;         // The initial partial derivatives (as a list)
+        PyObject* state_out;        // The final state
+        PyObject* deriv_out;        // The final partial derivatives (as a list)
+        PyObject* protocol;         // The pacing protocol (if any)
+        PyObject* log_dict;         // The simulation log to log to
+        PyObject* log_deriv;        // A list to store lists of partial derivatives in
+        double log_interval;        // The logging interval
+        double abs_tol;             // The absolute tolerance (rk45 only)
+        double rel_tol;             // The relative tolerance (rk45 only)
 
         // Check input arguments
-        if (!PyArg_ParseTuple(args, "dddOOOOOOOd",
+        if (!PyArg_ParseTuple(args, "dddOOOOOOOddd",
                 &tmin,
                 &tmax,
                 &default_dt,
@@ -252,7 +624,9 @@ extern "C" {
                 &protocol,
                 &log_dict,
                 &log_deriv,
-                &log_interval
+                &log_interval,
+                &abs_tol,
+                &rel_tol
                 )) {
             PyErr_SetString(PyExc_Exception, "Incorrect input arguments.");
             // Nothing allocated yet, no pyobjects _created_, return directly
@@ -264,7 +638,6 @@ extern "C" {
 
         // Check default step size
         if (default_dt <= 0) return e("Error: step size must be > 0");
-        dt_min = default_dt * 1e-2;
 
         // Check initial state vector state_in
         if (!PyList_Check(state_in)) { return e("Not a list: state_in."); }
@@ -302,40 +675,68 @@ extern "C" {
         ///////////////////////////////////////////////////////////////////////
         //
         // From this point on, memory will be allocated. Any further errors
-        // should call sim_clean() before returning
+        // should goto error, which cleans up the run and decrefs the capsule.
         //
 
+        // Create run struct, with all pointers set to NULL
+        r = new SimRun();
+        capsule = PyCapsule_New((void*)r, SIM_CAPSULE_NAME, sim_run_destructor);
+        if (capsule == NULL) {
+            delete r;
+            return 0;
+        }
+
         // From this point on, we're running!
-        running = 1;
+        r->running = 1;
+
+        // Store input arguments
+        r->tmin = tmin;
+        r->tmax = tmax;
+        r->default_dt = default_dt;
+        r->dt_min = default_dt * 1e-2;
+        r->h = default_dt;
+        r->abs_tol = abs_tol;
+        r->rel_tol = rel_tol;
+        r->log_interval = log_interval;
+        Py_INCREF(state_out); r->state_out = state_out;
+        Py_INCREF(deriv_out); r->deriv_out = deriv_out;
+        Py_INCREF(log_dict); r->log_dict = log_dict;
+        Py_INCREF(log_deriv); r->log_deriv = log_deriv;
 
         // Initialize state vector
-        state = (Diff*)malloc(sizeof(Diff) * N_STATE);
+        r->state = (Diff*)malloc(sizeof(Diff) * N_STATE);
         for(i=0; i<N_STATE; i++) {
-            state[i] = Diff(PyFloat_AsDouble(PyList_GetItem(state_in, i)));
+            r->state[i] = Diff(PyFloat_AsDouble(PyList_GetItem(state_in, i)));
             for(j=0; j<N_STATE; j++) {
-                state[i][j] = PyFloat_AsDouble(PyList_GetItem(deriv_in, i*N_STATE+j));
+                r->state[i][j] = PyFloat_AsDouble(PyList_GetItem(deriv_in, i*N_STATE+j));
             }
         }
 
         // Initialize derivatives vector
-        deriv = (Diff*)malloc(sizeof(Diff) * N_STATE);
+        r->deriv = (Diff*)malloc(sizeof(Diff) * N_STATE);
+        for(i=0; i<N_STATE; i++) r->deriv[i] = Diff(0);
+#if USE_RK45
+        // Initialize Runge-Kutta stages
+        r->rk_y0 = (Diff*)malloc(sizeof(Diff) * N_STATE);
+        r->rk_k = (Diff*)malloc(sizeof(Diff) * N_STATE * 7);
+#endif
 
         // Set up pacing
         ESys_Flag flag_pacing;
-        pacing = ESys_Create(&flag_pacing);
-        if (flag_pacing != ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-        flag_pacing = ESys_Populate(pacing, protocol);
-        if (flag_pacing != ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-        flag_pacing = ESys_AdvanceTime(pacing, tmin);
-        if (flag_pacing != ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
+        r->pacing = ESys_Create(&flag_pacing);
+        if (flag_pacing != ESys_OK) { ESys_SetPyErr(flag_pacing); goto error; }
+        flag_pacing = ESys_Populate(r->pacing, protocol);
+        if (flag_pacing != ESys_OK) { ESys_SetPyErr(flag_pacing); goto error; }
+        flag_pacing = ESys_AdvanceTime(r->pacing, tmin);
+        if (flag_pacing != ESys_OK) { ESys_SetPyErr(flag_pacing); goto error; }
 
         // Initialize inputs
-        engine_time = tmin;
-        engine_pace = ESys_GetLevel(pacing, NULL);
+        r->time = tmin;
+        r->pace = ESys_GetLevel(r->pacing, NULL);
 
         // Evaluate derivatives at this point. This will be used for logging
         // and to take the first step.
-        rhs(state, deriv);
+        rhs(r);
 
         //
         // Running & logging:
@@ -355,61 +756,42 @@ extern "C" {
         //
 
         // Next event & logging times
-        tpace = ESys_GetNextTime(pacing, NULL);
-        tlog = tmin;
+        r->tpace = ESys_GetNextTime(r->pacing, NULL);
+        r->tlog = tmin;
 
         // Set up logging
-        n_vars = PyDict_Size(log_dict);
-        logs = (PyObject**)malloc(sizeof(PyObject*)*n_vars);
-        vars = (Diff**)malloc(sizeof(Diff*)*n_vars);
+        r->list_update_str = PyUnicode_FromString("append");
+        r->n_vars = PyDict_Size(log_dict);
+        r->logs = (PyObject**)malloc(sizeof(PyObject*)*r->n_vars);
+        r->vars = (Diff**)malloc(sizeof(Diff*)*r->n_vars);
         i = 0;
 <?
 for var in model.variables(deep=True, const=False):
-    print(tab*2 + 'i += log_add(log_dict, logs, vars, i, "' + var.qname() + '", &' + v(var)  + ');')
+    print(tab*2 + 'i += log_add(log_dict, r->logs, r->vars, i, "' + var.qname() + '", &' + v(var)  + ');')
 ?>
-        if (i != n_vars) {
+        if (i != r->n_vars) {
             PyErr_SetString(PyExc_Exception, "Unknown variables found in logging dictionary.");
-            return sim_clean();
+            goto error;
         }
 
-        /* Always store initial position in logs */
-        list_update_str = PyUnicode_FromString("append");
-
-        /* Log variables */
-        for(i=0; i<n_vars; i++) {
-            flt = PyFloat_FromDouble(vars[i]->value()); // Append doesn't steal
-            ret = PyObject_CallMethodObjArgs(logs[i], list_update_str, flt, NULL);
-            Py_DECREF(flt); flt = NULL;
-            Py_XDECREF(ret);
-            if (ret == NULL) {
-                PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                return sim_clean();
-            }
+        // Always store initial position in logs
+        if (sim_log_point(r)) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for logging.");
+            goto error;
         }
-        ret = NULL;
-
-        /* Log partial derivatives */
-        list = PyList_New(N_MATRIX);
-        if (list == NULL) return sim_clean();
-        for(i=0; i<N_STATE; i++) {
-            for(j=0; j<N_STATE; j++) {
-                PyList_SetItem(list, i*N_STATE+j, PyFloat_FromDouble(state[i][j]));
-            }
-        }
-        if (PyList_Append(log_deriv, list) != 0) {
-            Py_DECREF(list);
-            list = NULL;
-            return sim_clean();
-        }
-        Py_DECREF(list);
-        list = NULL;
+        if (sim_flush(r)) goto error;
 
         // Set periodic log point 1 log_interval ahead
-        ilog = 1;
-        tlog = tmin + log_interval;
+        r->ilog = 1;
+        r->tlog = tmin + log_interval;
 
         // Done!
-        Py_RETURN_NONE;
+        return capsule;
+
+    error:
+        sim_clean_run(r);
+        Py_DECREF(capsule);
+        return 0;
     }
 
     /*
@@ -418,93 +800,62 @@ for var in model.variables(deep=True, const=False):
     static PyObject*
     sim_step(PyObject *self, PyObject *args)
     {
-        ESys_Flag flag_pacing;
         int i, j;
-        int steps_taken = 0;    /* Steps taken during this call */
-        double d;
-
-        while(1) {
-
-            /* Calculate next step size */
-            dt = default_dt;
-            d = tpace - engine_time; if (d > dt_min && d < dt) dt = d;
-            d = tmax - engine_time; if (d > dt_min && d < dt) dt = d;
-            d = tlog - engine_time; if (d > dt_min && d < dt) dt = d;
-
-            /* Advance to next time step */
-            for(i=0; i<N_STATE; i++) state[i] += deriv[i] * dt;
-            engine_time += dt;
-            flag_pacing = ESys_AdvanceTime(pacing, engine_time);
-            if (flag_pacing!=ESys_OK) { ESys_SetPyErr(flag_pacing); return sim_clean(); }
-            tpace = ESys_GetNextTime(pacing, NULL);
-            engine_pace = ESys_GetLevel(pacing, NULL);
-            rhs(state, deriv);
-
-            /* Check if we're finished
-               Do this *before* logging (half-open interval rule) */
-            if (engine_time >= tmax) break;
-
-            /* Logging */
-            if (engine_time >= tlog) {
-
-                /* Log variables */
-                for(i=0; i<n_vars; i++) {
-                    flt = PyFloat_FromDouble(vars[i]->value());
-                    ret = PyObject_CallMethodObjArgs(logs[i], list_update_str, flt, NULL);
-                    Py_DECREF(flt); flt = NULL;
-                    Py_XDECREF(ret);
-                    if (ret == NULL) {
-                        PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                        return sim_clean();
-                    }
-                }
-                ret = NULL;
-
-                /* Log partial derivatives */
-                list = PyList_New(N_MATRIX);
-                if (list == NULL) return sim_clean();
-                for(i=0; i<N_STATE; i++) {
-                    for(j=0; j<N_STATE; j++) {
-                        PyList_SetItem(list, i*N_STATE+j, PyFloat_FromDouble(state[i][j]));
-                    }
-                }
-                if (PyList_Append(log_deriv, list) != 0) {
-                    Py_DECREF(list); list = NULL;
-                    return sim_clean();
-                }
-                Py_DECREF(list); list = NULL;
-
-                /* Calculate next logging point */
-                ilog++;
-                tlog = tmin + (double)ilog * log_interval;
-            }
+        int status;
+        SimRun* r;
+
+        // Get run
+        r = sim_get_run(args);
+        if (r == NULL) return 0;
+        if (r->running == 0) return e("Simulation not initialized.");
+
+        // Take the next steps, without holding the GIL
+        Py_BEGIN_ALLOW_THREADS
+        status = sim_advance(r, 20);
+        Py_END_ALLOW_THREADS
+
+        // Move logged points to Python lists
+        if (sim_flush(r)) return sim_clean_run(r);
+
+        // Handle errors
+        if (status == -1) {
+            ESys_SetPyErr(r->flag_pacing);
+            return sim_clean_run(r);
+        } else if (status == -2) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for logging.");
+            return sim_clean_run(r);
+        } else if (status == -3) {
+            PyErr_SetString(PyExc_Exception, "Step size became too small to satisfy the error tolerances. Perhaps there is an error in the model code or the tolerances should be relaxed.");
+            return sim_clean_run(r);
+        } else if (status == -4) {
+            PyErr_SetString(PyExc_Exception, "NaN occurred in state vector during simulation. Perhaps there is an error in the model code.");
+            return sim_clean_run(r);
+        }
 
-            /* Perform any Python signal handling */
-            if (PyErr_CheckSignals() != 0) {
-                /* Exception (e.g. timeout or keyboard interrupt) occurred?
-                   Then cancel everything! */
-                return sim_clean();
-            }
+        // Perform any Python signal handling
+        if (PyErr_CheckSignals() != 0) {
+            // Exception (e.g. timeout or keyboard interrupt) occurred?
+            // Then cancel everything!
+            return sim_clean_run(r);
+        }
 
-            /* Report back to python after every x steps */
-            steps_taken++;
-            if (steps_taken >= 20) {
-                return PyFloat_FromDouble(engine_time);
-            }
+        // Not finished? Then report back to python
+        if (status == 0) {
+            return PyFloat_FromDouble(r->time);
         }
 
-        /* Set final state & partial derivatives */
+        // Set final state & partial derivatives
         for(i=0; i<N_STATE; i++) {
-            PyList_SetItem(state_out, i, PyFloat_FromDouble(state[i].value()));
-            /* PyList_SetItem steals a reference: no need to decref the Float! */
+            PyList_SetItem(r->state_out, i, PyFloat_FromDouble(r->state[i].value()));
+            // PyList_SetItem steals a reference: no need to decref the Float!
             for(j=0; j<N_STATE; j++) {
-                PyList_SetItem(deriv_out, i*N_STATE+j, PyFloat_FromDouble(state[i][j]));
+                PyList_SetItem(r->deriv_out, i*N_STATE+j, PyFloat_FromDouble(r->state[i][j]));
             }
         }
 
-        /* Clean up and return */
-        sim_clean();
-        return PyFloat_FromDouble(engine_time);
+        // Clean up and return
+        sim_clean_run(r);
+        return PyFloat_FromDouble(r->time);
     }
 
     /*
@@ -19,8 +19,8 @@ SOURCE_FILE = 'icsim.cpp'
 
 class ICSimulation(myokit.CppModule):
     """
-    Runs a forward-Euler based simulation and calculates the partial
-    derivatives of the state vector with respect to the initial conditions.
+    Runs a simulation and calculates the partial derivatives of the state
+    vector with respect to the initial conditions.
 
     The simulation is based on automatic differentiation implemented using a
     C++ data type that replaces a single scalar float with a float and a list
@@ -50,6 +50,16 @@ class ICSimulation(myokit.CppModule):
     A protocol can be passed in as ``protocol`` or set later using
     :meth:`set_protocol`.
 
+    The integration method can be chosen with the argument ``method``, which
+    can be ``'euler'`` (forward Euler, default), ``'rl'`` (Rush-Larsen for
+    states written in a Hodgkin-Huxley form, requires a variable labelled
+    ``membrane_potential``), or ``'rk45'`` (an adaptive Dormand-Prince
+    method). See :class:`PSimulation` for details.
+
+    If ``sparse=True``, only the partial derivatives that can be non-zero,
+    according to the dependencies between the model variables, are propagated.
+    See :class:`PSimulation` for details.
+
     Simulations maintain an internal state consisting of
 
     - the current simulation time
@@ -78,14 +88,33 @@ class ICSimulation(myokit.CppModule):
     """
     _index = 0  # Simulation id
 
-    def __init__(self, model, protocol=None):
+    def __init__(self, model, protocol=None, method='euler', sparse=False):
         super(ICSimulation, self).__init__()
 
+        # Check method
+        if method not in ('euler', 'rl', 'rk45'):
+            raise ValueError(
+                'Unknown method "' + str(method) + '", expecting "euler",'
+                ' "rl", or "rk45".')
+        self._method = method
+        self._sparse = bool(sparse)
+
         # Require a valid model
         if not model.is_valid():
             model.validate()
-        model = model.clone()
-        self._model = model
+
+        # Prepare for Rush-Larsen updates, and/or clone model
+        self._rl_states = {}
+        if self._method == 'rl':
+            if model.label('membrane_potential') is None:
+                raise ValueError(
+                    'The "rl" method requires the membrane potential variable'
+                    ' to be labelled as "membrane_potential".')
+            import myokit.lib.hh as hh
+            self._model, self._rl_states = hh.get_rl_states(model)
+        else:
+            self._model = model.clone()
+        del(model)
 
         # Set protocol
         self.set_protocol(protocol)
@@ -103,9 +132,10 @@ class ICSimulation(myokit.CppModule):
         # Starting time
         self._time = 0
 
-        # Default time step
+        # Default time step and tolerances
         self._dt = 0
         self.set_step_size()
+        self.set_tolerance()
 
         # Unique simulation id
         ICSimulation._index += 1
@@ -116,6 +146,9 @@ class ICSimulation(myokit.CppModule):
         args = {
             'module_name': module_name,
             'model': self._model,
+            'method': self._method,
+            'rl_states': self._rl_states,
+            'sparse': self._sparse,
         }
         fname = os.path.join(myokit.DIR_CFUNC, SOURCE_FILE)
 
@@ -182,6 +215,12 @@ class ICSimulation(myokit.CppModule):
         n = len(self._state)
         return np.array(self._deriv, copy=True).reshape((n, n))
 
+    def method(self):
+        """
+        Returns the integration method used by this simulation.
+        """
+        return self._method
+
     def reset(self):
         """
         Resets the simulation:
@@ -282,7 +321,7 @@ class ICSimulation(myokit.CppModule):
             n = len(self._state)
             state = [0] * n
             deriv = [0] * (n ** 2)
-            self._sim.sim_init(
+            run = self._sim.sim_init(
                 tmin,
                 tmax,
                 self._dt,
@@ -294,6 +333,8 @@ class ICSimulation(myokit.CppModule):
                 log,
                 derivs,
                 log_interval,
+                self._abs_tol,
+                self._rel_tol,
             )
             t = tmin
             try:
@@ -302,16 +343,16 @@ class ICSimulation(myokit.CppModule):
                     with progress.job(msg):
                         r = 1 / duration
                         while t < tmax:
-                            t = self._sim.sim_step()
+                            t = self._sim.sim_step(run)
                             if not progress.update(min((t - tmin) * r, 1)):
                                 raise myokit.SimulationCancelledError()
                 else:
                     # Loop without feedback
                     while t < tmax:
-                        t = self._sim.sim_step()
+                        t = self._sim.sim_step(run)
             finally:
                 # Clean even after KeyboardInterrupt or other Exception
-                self._sim.sim_clean()
+                self._sim.sim_clean(run)
             # Update internal state
             self._state = list(state)
             self._deriv = list(deriv)
@@ -329,6 +370,18 @@ class ICSimulation(myokit.CppModule):
         # Return
         return log, derivs
 
+    def set_default_state(self, state):
+        """
+        Changes the default state used by the simulation.
+
+        Calls to :meth:`reset` after using this method will set the current
+        state to this new default state, and the derivatives back to ``I``.
+        """
+        n = self._model.count_states()
+        if len(state) != n:
+            raise ValueError('State vector must have length ' + str(n) + '.')
+        self._default_state = [float(x) for x in state]
+
     def set_protocol(self, protocol=None):
         """
         Changes the pacing protocol used by this simulation.
@@ -340,13 +393,28 @@ class ICSimulation(myokit.CppModule):
 
     def set_step_size(self, dt=0.01):
         """
-        Sets the step size used in the forward Euler solving routine.
+        Sets the step size used in the forward Euler and Rush-Larsen solving
+        routines, or the initial step size for the ``'rk45'`` method.
         """
         dt = float(dt)
         if dt <= 0:
             raise ValueError('Step size must be greater than zero.')
         self._dt = dt
 
+    def set_tolerance(self, abs_tol=1e-6, rel_tol=1e-4):
+        """
+        Sets the absolute and relative tolerances used to control the step size
+        in the ``'rk45'`` method.
+        """
+        abs_tol = float(abs_tol)
+        if abs_tol <= 0:
+            raise ValueError('Absolute tolerance must be positive float.')
+        rel_tol = float(rel_tol)
+        if rel_tol <= 0:
+            raise ValueError('Relative tolerance must be positive float.')
+        self._abs_tol = abs_tol
+        self._rel_tol = rel_tol
+
     def state(self):
         """
         Returns the current state.
@@ -8,6 +8,8 @@
 # module_name      A module name
 # model            A myokit model
 # inputs           An ordered list of input labels used in the model
+# sparse           True if only structurally non-zero partial derivatives
+#                  should be propagated
 # -----------------------------------------------------------------------------
 #
 # This file is part of Myokit.
@@ -41,6 +43,21 @@ def v(var):
     return 'V_' + var.uname()
 w.set_lhs_function(v)
 
+# In sparse mode, get the structurally non-zero partial derivatives of each
+# variable, and create a writer for expressions in terms of plain values
+if sparse:
+    from myokit._sim.differential import sparsity, sparse_equation
+    sparse_map = sparsity(model, model.states())
+
+    def vr(var):
+        if isinstance(var, myokit.Name):
+            if var.var().is_constant() or var.var().is_bound():
+                return v(var)
+        return v(var) + '.value()'
+    wr = cpp.CppExpressionWriter()
+    wr.set_condition_function('ifte')
+    wr.set_lhs_function(vr)
+
 # Tab
 tab = '    '
 
@@ -114,7 +131,11 @@ for label, eqs in equations.items():
     if eqs.has_equations(const=False, bound=False):
         print(tab + '// ' + label)
         for eq in eqs.equations(const=False, bound=False):
-            print(tab + w.eq(eq) + ';')
+            if sparse:
+                for line in sparse_equation(eq, sparse_map, v, wr):
+                    print(tab + line)
+            else:
+                print(tab + w.eq(eq) + ';')
         print(tab)
 ?>
     return 0;
@@ -199,6 +220,7 @@ extern "C" {
         input = (Real*)malloc(sizeof(Real) * N_INPUT);
         for(i=0; i<N_STATE; i++) {
             state[i] = Diff(PyFloat_AsDouble(PyList_GetItem(arg_state, i)), i);
+            deriv[i] = Diff(0);
         }
         for(i=0; i<N_INPUT; i++) {
             input[i] = PyFloat_AsDouble(PyList_GetItem(arg_input, i));
@@ -220,9 +242,79 @@ extern "C" {
         Py_RETURN_NONE;
     }
 
+    // Calculates the partial derivatives for a batch of nt points, stored in
+    // C-contiguous buffers of doubles. The states should have shape
+    // (nt, N_STATE), the inputs (nt, N_INPUT), and the output buffer for the
+    // partial derivatives (nt, N_STATE, N_STATE).
+    static PyObject*
+    calculate_batch(PyObject* self, PyObject* args)
+    {
+        PyObject *states_in, *inputs_in, *partials_out;
+        Py_buffer b_states, b_inputs, b_partials;
+        int got_states = 0, got_inputs = 0, got_partials = 0;
+        int success = 0;
+        Py_ssize_t i, j, k, nt;
+        double *x, *u, *p;
+
+        // Check input arguments
+        if (!PyArg_ParseTuple(args, "nOOO", &nt, &states_in, &inputs_in, &partials_out)) {
+            PyErr_SetString(PyExc_Exception, "Expected input arguments: nt (int), states (buffer), inputs (buffer), partials (buffer).");
+            return 0;
+        }
+        if (PyObject_GetBuffer(states_in, &b_states, PyBUF_C_CONTIGUOUS) < 0) goto finish;
+        got_states = 1;
+        if (PyObject_GetBuffer(inputs_in, &b_inputs, PyBUF_C_CONTIGUOUS) < 0) goto finish;
+        got_inputs = 1;
+        if (PyObject_GetBuffer(partials_out, &b_partials, PyBUF_C_CONTIGUOUS | PyBUF_WRITABLE) < 0) goto finish;
+        got_partials = 1;
+
+        // Check buffer sizes
+        if (nt < 0 || b_states.len != (Py_ssize_t)(nt * N_STATE * sizeof(double))
+                || b_inputs.len != (Py_ssize_t)(nt * N_INPUT * sizeof(double))
+                || b_partials.len != (Py_ssize_t)(nt * N_STATE2 * sizeof(double))) {
+            PyErr_SetString(PyExc_Exception, "Buffer sizes do not match number of points.");
+            goto finish;
+        }
+        x = (double*)b_states.buf;
+        u = (double*)b_inputs.buf;
+        p = (double*)b_partials.buf;
+
+        // Create state vector, derivatives vector & input vector
+        state = (Diff*)malloc(sizeof(Diff) * N_STATE);
+        deriv = (Diff*)malloc(sizeof(Diff) * N_STATE);
+        input = (Real*)malloc(sizeof(Real) * N_INPUT);
+
+        // Evaluate every point
+        for(k=0; k<nt; k++) {
+            for(i=0; i<N_STATE; i++) {
+                state[i] = Diff(x[k * N_STATE + i], i);
+                deriv[i] = Diff(0);
+            }
+            for(i=0; i<N_INPUT; i++) {
+                input[i] = u[k * N_INPUT + i];
+            }
+            rhs(state, deriv, input);
+            for(i=0; i<N_STATE; i++) {
+                for(j=0; j<N_STATE; j++) {
+                    p[k * N_STATE2 + i * N_STATE + j] = deriv[i][j];
+                }
+            }
+        }
+        clean();
+        success = 1;
+
+    finish:
+        if (got_states) PyBuffer_Release(&b_states);
+        if (got_inputs) PyBuffer_Release(&b_inputs);
+        if (got_partials) PyBuffer_Release(&b_partials);
+        if (!success) return 0;
+        Py_RETURN_NONE;
+    }
+
     // Methods in this module
     static PyMethodDef SimMethods[] = {
         {"calculate", calculate, METH_VARARGS, "Calculates the derivatives and partial derivatives."},
+        {"calculate_batch", calculate_batch, METH_VARARGS, "Calculates the partial derivatives for a batch of points."},
         {NULL},
     };
 
@@ -41,10 +41,16 @@ class JacobianTracer(myokit.CppModule):
     However, in many cases, these functions will only occur as part of a
     condition in an if statement, so the ``NaN``'s won't propagate to the final
     result.
+
+    If ``sparse=True``, the dependencies between the model variables are used
+    to determine which partial derivatives can be non-zero, and only those are
+    calculated. In this mode, the functions listed above have well-defined
+    partial derivatives, as described in
+    :meth:`myokit._sim.differential.sparse_equation`.
     """
     _index = 0  # Unique id
 
-    def __init__(self, model):
+    def __init__(self, model, sparse=False):
         super(JacobianTracer, self).__init__()
 
         # Require a valid model
@@ -66,6 +72,7 @@ class JacobianTracer(myokit.CppModule):
             'module_name': module_name,
             'model': self._model,
             'inputs': self._inputs,
+            'sparse': bool(sparse),
         }
         fname = os.path.join(myokit.DIR_CFUNC, SOURCE_FILE)
 
@@ -86,7 +93,8 @@ class JacobianTracer(myokit.CppModule):
         incd = [myokit.DIR_CFUNC]
         self._ext = self._compile(module_name, fname, args, libs, libd, incd)
 
-    def dominant_eigenvalues(self, log=None, block=None):
+    def dominant_eigenvalues(
+            self, log=None, block=None, step=1, chunk_size=None):
         """
         Calculates the dominant eigenvalues of the jacobian matrix for each
         point in time. The returned value is 1d numpy array.
@@ -99,14 +107,85 @@ class JacobianTracer(myokit.CppModule):
         ``log``, the jacobians are calculated on the fly. To re-use a set of
         jacobians generated earlier, pass in the :class:`DataBlock2d` generated
         by :meth:`jacobians` as ``block``.
+
+        The arguments ``step`` and ``chunk_size`` can be used to subsample the
+        data and limit memory use, as described in :meth:`eigenvalues`.
+        """
+        e = self.eigenvalues(log, block, step, chunk_size)
+        return e[np.arange(len(e)), np.argmax(np.absolute(e), axis=1)]
+
+    def eigenvalues(self, log=None, block=None, step=1, chunk_size=None):
+        """
+        Calculates the eigenvalues of the jacobian matrix for each point in
+        time. The returned value is a 2d numpy array where the first axis is
+        time and the second axis is the index of each eigenvalue.
+
+        If a :class:`DataLog` suitable for :meth:`jacobians` is given as
+        ``log``, the jacobians are calculated on the fly. To re-use a set of
+        jacobians generated earlier, pass in the :class:`DataBlock2d` generated
+        by :meth:`jacobians` as ``block``.
+
+        To analyse only every ``step``-th point in the log or block, set
+        ``step`` to an integer greater than 1. The eigenvalues returned then
+        correspond to the times ``log.time()[::step]``.
+
+        By default, the jacobians for all (selected) points are calculated at
+        once, using a single call to the compiled back-end, and the
+        eigenvalues are then calculated with a single call to
+        ``numpy.linalg.eigvals``. For long logs, this can require a lot of
+        memory. To process the points in chunks of at most ``chunk_size``
+        points instead, so that the jacobians for the full log are never
+        stored, set ``chunk_size`` to a positive integer.
         """
+        step = int(step)
+        if step < 1:
+            raise ValueError('The argument `step` must be at least 1.')
+        if chunk_size is not None:
+            chunk_size = int(chunk_size)
+            if chunk_size < 1:
+                raise ValueError(
+                    'The argument `chunk_size` must be None or at least 1.')
+
+        # Get states and inputs, or jacobians
         if log:
-            block = self.jacobians(log)
-        if block:
-            return block.dominant_eigenvalues('jacobians')
-        raise ValueError(
-            'This method requires either a DataLog suitable'
-            ' for the method jacobians() or a DataBlock2d it generated.')
+            states, inputs = self._log_arrays(log)
+            states, inputs = states[::step], inputs[::step]
+            nt = len(states)
+        elif block:
+            jacobians = block.get2d('jacobians')[::step]
+            nt = len(jacobians)
+        else:
+            raise ValueError(
+                'This method requires either a DataLog suitable for the method'
+                ' jacobians() or a DataBlock2d it generated.')
+
+        # Calculate eigenvalues, chunk by chunk
+        if chunk_size is None:
+            chunk_size = max(1, nt)
+        ns = self._model.count_states()
+        eigenvalues = [np.zeros((0, ns))]
+        for i in range(0, nt, chunk_size):
+            if log:
+                j = self._jacobians(
+                    states[i:i + chunk_size], inputs[i:i + chunk_size])
+            else:
+                j = jacobians[i:i + chunk_size]
+            eigenvalues.append(np.linalg.eigvals(j))
+        return np.concatenate(eigenvalues)
+
+    def _jacobians(self, states, inputs):
+        """
+        Calculates the jacobians for a 2d array of ``states`` and a 2d array of
+        ``inputs``, with one row per point, using a single call to the
+        compiled back-end. Returns a 3d array of shape ``(nt, n, n)``.
+        """
+        states = np.ascontiguousarray(states, dtype=float)
+        inputs = np.ascontiguousarray(inputs, dtype=float)
+        nt = len(states)
+        ns = self._model.count_states()
+        partials = np.empty((nt, ns, ns))
+        self._ext.calculate_batch(nt, states, inputs, partials)
+        return partials
 
     def jacobians(self, log):
         """
@@ -120,6 +199,51 @@ class JacobianTracer(myokit.CppModule):
         variables whose value does not appear in the log must be unbound before
         creating the :class:`JacobianTracer`. Only results from one-dimensional
         simulations are supported.
+
+        All jacobians are calculated in a single call to the compiled back-end,
+        and stored in a single array of shape ``(nt, n, n)``. For very long
+        logs, consider using :meth:`eigenvalues` with a ``chunk_size`` instead.
+        """
+        states, inputs = self._log_arrays(log)
+
+        # Create data block
+        tvar = self._model.time().qname()
+        time = log[tvar]    # Already checked that all bound variables exist!
+        nstates = self._model.count_states()
+        block = myokit.DataBlock2d(nstates, nstates, time)
+        for k, v in log.items():
+            if k != tvar:
+                block.set0d(k, v)
+
+        # Calculate and store jacobians
+        block.set2d('jacobians', self._jacobians(states, inputs), copy=False)
+        return block
+
+    def largest_eigenvalues(
+            self, log=None, block=None, step=1, chunk_size=None):
+        """
+        Calculates the largest eigenvalues of the jacobian matrix at each point
+        in time. The returned value is 1d numpy array.
+
+        The "largest eigenvalue" is defined as the eigenvalue with the most
+        positive real part. Note that the returned values may be complex.
+
+        If a :class:`DataLog` suitable for :meth:`jacobians` is given as
+        ``log``, the jacobians are calculated on the fly. To re-use a set of
+        jacobians generated earlier, pass in the :class:`DataBlock2d` generated
+        by :meth:`jacobians` as ``block``.
+
+        The arguments ``step`` and ``chunk_size`` can be used to subsample the
+        data and limit memory use, as described in :meth:`eigenvalues`.
+        """
+        e = self.eigenvalues(log, block, step, chunk_size)
+        return e[np.arange(len(e)), np.argmax(np.real(e), axis=1)]
+
+    def _log_arrays(self, log):
+        """
+        Checks that a :class:`DataLog` is suitable for :meth:`jacobians`, and
+        returns a tuple ``(states, inputs)`` containing a 2d array of state
+        values and a 2d array of input values, with one row per logged point.
         """
         # Test if all states are in log
         n = None
@@ -146,63 +270,14 @@ class JacobianTracer(myokit.CppModule):
                     'The given log must contain logged data for input used by'
                     ' the model. Missing: <' + v.qname() + '>  which is bound'
                     ' to ' + label + '.')
+            if n != len(inputs[-1]):
+                raise ValueError(
+                    'Each entry in the log must have the same length.')
 
-        # Create data block
-        tvar = self._model.time().qname()
-        time = log[tvar]    # Already checked that all bound variables exist!
-        nstates = self._model.count_states()
-        block = myokit.DataBlock2d(nstates, nstates, time)
-        for k, v in log.items():
-            if k != tvar:
-                block.set0d(k, v)
-
-        # Create iterators over lists of state and input values
-        istates = [iter(x) for x in states]
-        iinputs = [iter(x) for x in inputs]
-
-        # Length of derivs and partials lists
-        ns = self._model.count_states()
-        ns2 = ns * ns
-
-        # Pass every state into the generator, store the output
-        partials = []
-        for i in range(n):
-            state = [next(x) for x in istates]
-            bound = [next(x) for x in iinputs]
-            deriv = [0] * ns
-            partial = [0] * ns2
-            self._ext.calculate(state, bound, deriv, partial)
-            # Discard derivatives
-            # Convert partial derivatives to numpy array and store
-            partial = np.array(partial, copy=False)
-            partial = partial.reshape((ns, ns))
-            partials.append(partial)
-        partials = np.array(partials)
-
-        # Create a simulation
-        block.set2d('jacobians', partials, copy=False)
-        return block
-
-    def largest_eigenvalues(self, log=None, block=None):
-        """
-        Calculates the largest eigenvalues of the jacobian matrix at each point
-        in time. The returned value is 1d numpy array.
-
-        The "largest eigenvalue" is defined as the eigenvalue with the most
-        positive real part. Note that the returned values may be complex.
-
-        If a :class:`DataLog` suitable for :meth:`jacobians` is given as
-        ``log``, the jacobians are calculated on the fly. To re-use a set of
-        jacobians generated earlier, pass in the :class:`DataBlock2d` generated
-        by :meth:`jacobians` as ``block``.
-        """
-        if log:
-            block = self.jacobians(log)
-        if block:
-            return block.largest_eigenvalues('jacobians')
-        raise ValueError(
-            'This method requires either a DataLog suitable for the method'
-            ' jacobians() or a DataBlock2d it generated.')
+        # Create arrays with one row per point
+        states = np.array(states, dtype=float).reshape((len(states), n)).T
+        inputs = np.array(inputs, dtype=float).reshape((len(inputs), n)).T
+        return states, inputs
 
 
 class JacobianCalculator(myokit.CppModule):
@@ -219,10 +294,16 @@ class JacobianCalculator(myokit.CppModule):
     However, in many cases, these functions will only occur as part of a
     condition in an if statement, so the ``NaN``'s won't propagate to the final
     result.
+
+    If ``sparse=True``, the dependencies between the model variables are used
+    to determine which partial derivatives can be non-zero, and only those are
+    calculated. In this mode, the functions listed above have well-defined
+    partial derivatives, as described in
+    :meth:`myokit._sim.differential.sparse_equation`.
     """
     _index = 0  # Unique id
 
-    def __init__(self, model):
+    def __init__(self, model, sparse=False):
         super(JacobianCalculator, self).__init__()
         # Require a valid model
         model.validate()
@@ -245,6 +326,7 @@ class JacobianCalculator(myokit.CppModule):
             'module_name': module_name,
             'model': self._model,
             'inputs': [],
+            'sparse': bool(sparse),
         }
         fname = os.path.join(myokit.DIR_CFUNC, SOURCE_FILE)
 
@@ -343,23 +425,9 @@ class JacobianCalculator(myokit.CppModule):
             # Solve J*s = -f
             s = np.dot(np.linalg.pinv(j), -f)
 
-            # Estimate relative step size
-            if not np.any(x == 0):
-                # Calculate relative step size
-                d = np.max(np.abs(s / x))
-            elif not np.all(x == 0):
-                # Remove zeros and calculate relative step size
-                d = np.nonzero(x)
-                d = np.max(np.abs(s[d] / x[d]))  # Bugfix due to Enno de Lange
-            else:
-                # Unable to calculate
-                d = 1
-
-            # Provide maximum relative step size based damping
-            d = min(100 / d, damping)
-
-            # Take step to next point
-            x2 = x + d * s
+            # Take damped step to next point, limiting the relative change
+            s, _ = _limit_newton_step(x, s, damping)
+            x2 = x + s
             if np.all(x2 == x):     # pragma: no cover
                 break
             x = x2
@@ -376,3 +444,32 @@ class JacobianCalculator(myokit.CppModule):
                 best = x, f, j, e
 
         return best
+
+
+def _limit_newton_step(x, s, damping=1, max_change=100, scale=None):
+    """
+    Damps and limits a Newton step ``s`` taken from a point ``x``, and returns
+    a tuple ``(step, size)``.
+
+    The ``size`` is the largest relative change ``max|s_i / x_i|`` that the
+    undamped step would make, where entries with ``x_i = 0`` are ignored (and
+    ``size = 1`` is used if all entries are zero). If a vector ``scale`` is
+    given, changes are measured relative to ``scale`` instead of ``x``.
+
+    The returned ``step`` is ``damping * s``, unless this would change any
+    entry by more than ``max_change`` times its magnitude. In this case the
+    step is shortened, so that the largest relative change equals
+    ``max_change``. This prevents a single step far outside the region where
+    the linearisation is valid, e.g. near a singular Jacobian, without slowing
+    down convergence once the iterates are close to a root.
+
+    This method is used by :meth:`JacobianCalculator.newton_root`, and by the
+    Newton solvers in :mod:`myokit.lib`.
+    """
+    if scale is None:
+        scale = x
+    scale = np.asarray(scale)
+    i = np.nonzero(scale)
+    size = np.max(np.abs(s[i] / scale[i])) if len(i[0]) else 1
+    factor = min(max_change / size, damping) if size > 0 else damping
+    return factor * s, size
@@ -67,7 +67,8 @@ class OpenCL(myokit.CModule):
         try:
             OpenCL._message = None
             OpenCL._instance = self._compile(
-                mname, fname, args, libs, libd, incd, larg=flags)
+                mname, fname, args, libs, libd, incd, larg=flags,
+                cache=False)
         except myokit.CompilationError as e:
             OpenCL._instance = False
             OpenCL._message = str(e)
@@ -64,6 +64,28 @@ static int log_add(PyObject* log_dict, PyObject** logs, Real** vars, int i, char
     return added;
 }
 
+/*
+ * Appends the current value of each logged variable to its log, where each
+ * log is a bytearray used as a growable buffer of doubles.
+ *
+ * Arguments
+ *  logs     : Pointers to a log for each logged variables
+ *  vars     : Pointers to each variable to log
+ *  n_vars   : The number of logged variables
+ * Returns 0 if successful, or -1 (with a Python exception set) if not.
+ */
+static int log_values(PyObject** logs, Real** vars, int n_vars)
+{
+    int i;
+    Py_ssize_t size;
+    for(i=0; i<n_vars; i++) {
+        size = PyByteArray_Size(logs[i]);
+        if(PyByteArray_Resize(logs[i], size + (Py_ssize_t)sizeof(double))) return -1;
+        *(double*)(PyByteArray_AsString(logs[i]) + size) = (double)*vars[i];
+    }
+    return 0;
+}
+
 /*
  * Simulation variables
  *
@@ -85,10 +107,11 @@ double default_dt;      // The default time between steps
 PyObject* state_in;     // The initial state
 PyObject* state_out;    // The final state
 PyObject *protocol;     // A pacing protocol
-PyObject *log_dict;     // A logging dict
+PyObject *log_dict;     // A logging dict, mapping names to bytearray buffers
 double log_interval;    // The time between log writes
 PyObject *inter_log;    // A list of intermediary variables to log
 PyObject *field_data;   // A list containing all field data
+PyObject *steady;       // Steady-state detection list, or None
 
 // OpenCL objects
 cl_context context = NULL;
@@ -133,6 +156,14 @@ int intermediary_step;  /* True if an intermediary step is being taken */
 /* Halt on NaN */
 int halt_sim;
 
+/* Steady-state detection */
+double beat_period;     /* The beat period (0 to disable detection) */
+double beat_tol;        /* The tolerance for beat-to-beat changes */
+double tbeat;           /* The start of the next beat */
+long beats;             /* Number of beats completed */
+int converged;          /* True if a steady state was detected */
+Real *rvec_beat = NULL; /* The state at the start of the current beat */
+
 /* Pacing */
 ESys pacing = NULL;
 double engine_pace = 0;
@@ -176,7 +207,6 @@ int n_field_data;       /* The number of floats in the field data */
 /* (Unless you got it through PyList_GetItem or PyTuble_GetItem) */
 PyObject* flt = NULL;               /* PyObject, various uses */
 PyObject* ret = NULL;               /* PyObject, used as return value */
-PyObject* list_update_str = NULL;   /* PyUnicode, used to call "append" method */
 
 /*
  * Cleans up after a simulation
@@ -226,6 +256,7 @@ sim_clean()
 
         // Free dynamically allocated arrays
         free(rvec_state); rvec_state = NULL;
+        free(rvec_beat); rvec_beat = NULL;
         free(rvec_idiff); rvec_idiff = NULL;
         free(rvec_inter_log); rvec_inter_log = NULL;
         free(rvec_field_data); rvec_field_data = NULL;
@@ -235,9 +266,6 @@ sim_clean()
         free(logs); logs = NULL;
         free(vars); vars = NULL;
 
-        // No longer need update string
-        Py_XDECREF(list_update_str); list_update_str = NULL;
-
         // No longer running
         running = 0;
     }
@@ -326,6 +354,7 @@ sim_init(PyObject* self, PyObject* args)
     context = NULL;
     pacing = NULL;
     rvec_state = NULL;
+    rvec_beat = NULL;
     rvec_idiff = NULL;
     rvec_inter_log = NULL;
     rvec_field_data = NULL;
@@ -334,10 +363,9 @@ sim_init(PyObject* self, PyObject* args)
     rvec_conn3 = NULL;
     logs = NULL;
     vars = NULL;
-    list_update_str = NULL;
 
     // Check input arguments
-    if(!PyArg_ParseTuple(args, "OOsiibddOdddOOOOdOO",
+    if(!PyArg_ParseTuple(args, "OOsiibddOdddOOOOdOOO",
             &platform_name,     // Must be bytes
             &device_name,       // Must be bytes
             &kernel_source,
@@ -356,7 +384,8 @@ sim_init(PyObject* self, PyObject* args)
             &log_dict,
             &log_interval,
             &inter_log,
-            &field_data
+            &field_data,
+            &steady
             )) {
         PyErr_SetString(PyExc_Exception, "Wrong number of arguments.");
         // Nothing allocated yet, no pyobjects _created_, return directly
@@ -466,6 +495,32 @@ sim_init(PyObject* self, PyObject* args)
         rvec_state[i] = (Real)PyFloat_AsDouble(flt);
     }
 
+    // Set up steady-state detection, storing the initial state
+    beat_period = 0;
+    beats = 0;
+    converged = 0;
+    tbeat = tmax;
+    if (steady != Py_None) {
+        if (!PyList_Check(steady) || PyList_Size(steady) != 4) {
+            PyErr_SetString(PyExc_Exception, "'steady' must be a list of size 4 or None.");
+            return sim_clean();
+        }
+        beat_period = PyFloat_AsDouble(PyList_GetItem(steady, 0));
+        beat_tol = PyFloat_AsDouble(PyList_GetItem(steady, 1));
+        if (PyErr_Occurred()) return sim_clean();
+        if (beat_period <= 0) {
+            PyErr_SetString(PyExc_Exception, "Beat period must be greater than zero.");
+            return sim_clean();
+        }
+        tbeat = tmin + beat_period;
+        rvec_beat = (Real*)malloc(dsize_state);
+        if (rvec_beat == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory for steady-state detection.");
+            return sim_clean();
+        }
+        for(i=0; i<nx*ny*n_state; i++) rvec_beat[i] = rvec_state[i];
+    }
+
     // Create diffusion current vector
     if (diffusion) {
         dsize_idiff = nx*ny * sizeof(Real);
@@ -857,14 +912,17 @@ print(4*tab + '}')
         PyErr_SetString(PyExc_Exception, "Unknown variables found in logging dictionary.");
         return sim_clean();
     }
+    for(i=0; i<n_vars; i++) {
+        if(!PyByteArray_Check(logs[i])) {
+            PyErr_SetString(PyExc_Exception, "Logging dictionary must contain bytearray buffers.");
+            return sim_clean();
+        }
+    }
 
     #ifdef MYOKIT_DEBUG
     printf("Created log for %d variables.\n", n_vars);
     #endif
 
-    /* Log update method: */
-    list_update_str = PyUnicode_FromString("append");
-
     /* First point to step to */
     istep = 1;
 
@@ -910,6 +968,7 @@ sim_step(PyObject *self, PyObject *args)
         d = tmax - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
         d = tnext_pace - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
         d = tnext_log - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
+        d = tbeat - engine_time; if (d > dt_min && d < dt) {dt = d; intermediary_step = 1; }
         if (!intermediary_step) istep++;
         arg_dt = (Real)dt;
 
@@ -969,17 +1028,7 @@ sim_step(PyObject *self, PyObject *args)
             }
 
             /* Write everything to the log */
-            for(i=0; i<n_vars; i++) {
-                flt = PyFloat_FromDouble(*vars[i]);
-                ret = PyObject_CallMethodObjArgs(logs[i], list_update_str, flt, NULL);
-                Py_DECREF(flt); flt = NULL;
-                Py_XDECREF(ret);
-                if(ret == NULL) {
-                    PyErr_SetString(PyExc_Exception, "Call to append() failed on logging list.");
-                    return sim_clean();
-                }
-            }
-            ret = NULL;
+            if(log_values(logs, vars, n_vars)) return sim_clean();
 
             /* Set next logging point */
             inext_log++;
@@ -1004,6 +1053,22 @@ sim_step(PyObject *self, PyObject *args)
         engine_pace = ESys_GetLevel(pacing, NULL);
         arg_pace = (Real)engine_pace;
 
+        /* Start of a new beat? Then download the state, and stop if the
+           change since the start of the previous beat is within tolerance */
+        if (beat_period > 0 && engine_time >= tbeat) {
+            flag = clEnqueueReadBuffer(command_queue, mbuf_state, CL_TRUE, 0, dsize_state, rvec_state, 0, NULL, NULL);
+            if(mcl_flag(flag)) return sim_clean();
+            beats++;
+            tbeat = tmin + (double)(beats + 1) * beat_period;
+            /* Note: The negated comparison ensures NaNs are never accepted */
+            converged = 1;
+            for(i=0; i<n_state*nx*ny; i++) {
+                if (!(fabs(rvec_state[i] - rvec_beat[i]) <= beat_tol * (1 + fabs(rvec_state[i])))) converged = 0;
+                rvec_beat[i] = rvec_state[i];
+            }
+            if (converged) break;
+        }
+
         /* Check if we're finished
          * Do this before logging, to ensure we don't log the final time position!
          * Logging with fixed time steps should always be half-open: including the
@@ -1039,6 +1104,12 @@ sim_step(PyObject *self, PyObject *args)
         /* PyList_SetItem steals a reference: no need to decref the double! */
     }
 
+    /* Set number of beats used in steady-state detection */
+    if (steady != Py_None) {
+        PyList_SetItem(steady, 2, PyLong_FromLong(beats));
+        PyList_SetItem(steady, 3, PyBool_FromLong(converged));
+    }
+
     #ifdef MYOKIT_DEBUG
     printf("Final state copied.\n");
     printf("Tyding up...\n");
@@ -1056,7 +1127,9 @@ sim_step(PyObject *self, PyObject *args)
         #ifdef MYOKIT_DEBUG
         printf("Finished tidiying up, ending simulation.\n");
         #endif
-        return PyFloat_FromDouble(engine_time);
+        /* Return tmax, even if the run was stopped early because a steady
+           state was reached, so that the calling loop ends */
+        return PyFloat_FromDouble(tmax);
     }
 }
 
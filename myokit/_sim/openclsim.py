@@ -7,6 +7,7 @@
 from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
+import logging
 import os
 import myokit
 import numpy as np
@@ -49,6 +50,10 @@ class SimulationOpenCL(myokit.CModule):
     ``rl``
         Use Rush-Larsen updates instead of forward Euler for any Hodgkin-Huxley
         gating variables (default=``False``).
+    ``parameters``
+        An optional list of constants that will be varied between runs. These
+        are treated as scalar fields (see :meth:`set_field`), but their values
+        can all be set at once with :meth:`set_parameters`.
 
     The simulation provides the following inputs variables can bind to:
 
@@ -146,7 +151,8 @@ class SimulationOpenCL(myokit.CModule):
 
     def __init__(
             self, model, protocol=None, ncells=256, diffusion=True,
-            precision=myokit.SINGLE_PRECISION, native_maths=False, rl=False):
+            precision=myokit.SINGLE_PRECISION, native_maths=False, rl=False,
+            parameters=None):
         super(SimulationOpenCL, self).__init__()
 
         # Require a valid model
@@ -216,18 +222,10 @@ class SimulationOpenCL(myokit.CModule):
         self._rl_states = {}
         if self._rl:
             import myokit.lib.hh as hh
-
-            # Convert alpha-beta formulations to inf-tau forms, cloning model
-            self._model = hh.convert_hh_states_to_inf_tau_form(model, vm)
+            self._model, self._rl_states = hh.get_rl_states(model, vm)
             self._vm = self._model.get(vm.qname())
             del(model, vm)
 
-            # Get (inf, tau) tuple for every Rush-Larsen state
-            for state in self._model.states():
-                res = hh.get_inf_and_tau(state, self._vm)
-                if res is not None:
-                    self._rl_states[state] = res
-
         else:
             # Clone model, store
             self._model = model.clone()
@@ -250,6 +248,27 @@ class SimulationOpenCL(myokit.CModule):
         # Scalar fields
         self._fields = OrderedDict()
 
+        # Parameters, stored as fields with shape (n_parameters, n_cells)
+        self._parameters = []
+        if parameters is not None:
+            for p in parameters:
+                if isinstance(p, myokit.Variable):
+                    p = p.qname()
+                p = self._model.get(p, myokit.Variable)
+                if not p.is_constant():
+                    raise ValueError(
+                        'Only constants can be used as parameters.')
+                if p.is_bound():
+                    raise ValueError('Parameters cannot be bound variables.')
+                if p in self._parameters:
+                    raise ValueError(
+                        'Duplicate parameter <' + p.qname() + '>.')
+                self._parameters.append(p)
+        self._parameter_values = np.empty(
+            (len(self._parameters), self._ntotal))
+        for i, p in enumerate(self._parameters):
+            self._parameter_values[i] = p.eval()
+
         # Set default time step
         self.set_step_size()
 
@@ -779,8 +798,16 @@ class SimulationOpenCL(myokit.CModule):
                 neighbours.append((x, y + 1))
         return neighbours
 
+    def parameters(self):
+        """
+        Returns a list containing the qnames of the variables declared as
+        parameters when this simulation was created (see
+        :meth:`set_parameters`).
+        """
+        return [p.qname() for p in self._parameters]
+
     def pre(self, duration, report_nan=True, progress=None,
-            msg='Pre-pacing SimulationOpenCL'):
+            msg='Pre-pacing SimulationOpenCL', period=None, tolerance=1e-6):
         """
         This method can be used to perform an unlogged simulation, typically to
         pre-pace to a (semi-)stable orbit.
@@ -805,9 +832,38 @@ class SimulationOpenCL(myokit.CModule):
         the :class:`myokit.ProgressReporter` interface can be passed in.
         passed in as ``progress``. An optional description of the current
         simulation to use in the ProgressReporter can be passed in as `msg`.
+
+        If a beat ``period`` is given, the simulation stops as soon as a
+        periodic steady state is reached, and ``duration`` is used as the
+        maximum pre-pacing time. At the start of each beat the state of all
+        cells is copied from the device and compared with the state at the
+        start of the previous beat, and a steady state is reached when every
+        state ``x`` satisfies ``|x_n - x_{n-1}| <= tolerance * (1 + |x_n|)``.
+        In this case the method returns the number of beats simulated. If no
+        steady state is reached within ``duration``, a warning is logged and
+        the number of completed beats is returned. Note that in single
+        precision simulations the ``tolerance`` should not be set much lower
+        than ``1e-6``.
         """
-        self._run(duration, myokit.LOG_NONE, 1, report_nan, progress, msg)
+        steady = None
+        if period is not None:
+            period = float(period)
+            if period <= 0:
+                raise ValueError('The period must be greater than zero.')
+            tolerance = float(tolerance)
+            if tolerance < 0:
+                raise ValueError('The tolerance cannot be negative.')
+            steady = [period, tolerance, 0, False]
+        self._run(
+            duration, myokit.LOG_NONE, 1, report_nan, progress, msg, steady)
         self._default_state = list(self._state)
+        if steady is not None:
+            if not steady[3]:
+                log = logging.getLogger(__name__)
+                log.warning(
+                    'No steady state reached after ' + str(steady[2])
+                    + ' beats.')
+            return steady[2]
 
     def remove_field(self, var):
         """
@@ -816,6 +872,10 @@ class SimulationOpenCL(myokit.CModule):
         if isinstance(var, myokit.Variable):
             var = var.qname()
         var = self._model.get(var)
+        if var in self._parameters:
+            raise ValueError(
+                'The given variable <' + var.qname() + '> is set as a'
+                ' parameter.')
         try:
             del(self._fields[var])
         except KeyError:
@@ -834,7 +894,7 @@ class SimulationOpenCL(myokit.CModule):
         self._state = list(self._default_state)
 
     def run(self, duration, log=None, log_interval=1.0, report_nan=True,
-            progress=None, msg='Running SimulationOpenCL'):
+            progress=None, msg='Running SimulationOpenCL', log_sink=None):
         """
         Runs a simulation and returns the logged results. Running a simulation
         has the following effects:
@@ -895,16 +955,27 @@ class SimulationOpenCL(myokit.CModule):
         The results of these operations will be written to ``stdout``. To
         disable this feature, set ``report_nan=False``.
 
+        For large or long simulations, the logged data can be written to a
+        ``log_sink`` instead of being stored in memory. This can be any object
+        with a ``write(log)`` method, for example a
+        :class:`myokit.DataLogWriter`. The logged data will then be passed to
+        the sink in fixed-size chunks during the simulation, and the returned
+        log will not contain any new data.
+
         To obtain feedback on the simulation progress, an object implementing
         the :class:`myokit.ProgressReporter` interface can be passed in.
         passed in as ``progress``. An optional description of the current
         simulation to use in the ProgressReporter can be passed in as `msg`.
          """
-        r = self._run(duration, log, log_interval, report_nan, progress, msg)
+        r = self._run(
+            duration, log, log_interval, report_nan, progress, msg,
+            log_sink=log_sink)
         self._time += duration
         return r
 
-    def _run(self, duration, log, log_interval, report_nan, progress, msg):
+    def _run(
+            self, duration, log, log_interval, report_nan, progress, msg,
+            steady=None, log_sink=None):
         # Simulation times
         if duration < 0:
             raise Exception('Simulation time can\'t be negative.')
@@ -953,7 +1024,7 @@ class SimulationOpenCL(myokit.CModule):
             'bound_variables': self._bound_variables,
             'inter_log': inter_log,
             'diffusion': self._diffusion_enabled,
-            'fields': self._fields.keys(),
+            'fields': list(self._fields.keys()) + self._parameters,
             'paced_cells': self._paced_cells,
             'rl_states': self._rl_states,
         }
@@ -972,10 +1043,11 @@ class SimulationOpenCL(myokit.CModule):
             log_interval = 1e-9
 
         # Create field values vector
-        n = len(self._fields) * self._nx * self._ny
+        n = (len(self._fields) + len(self._parameters)) * self._nx * self._ny
         if n:
             field_data = self._fields.values()
             field_data = [np.array(x, copy=False) for x in field_data]
+            field_data.append(self._parameter_values)
             field_data = np.vstack(field_data)
             field_data = list(field_data.reshape(n, order='F'))
         else:
@@ -996,6 +1068,7 @@ class SimulationOpenCL(myokit.CModule):
             # Initialize
             state_in = self._state
             state_out = list(state_in)
+            buffers = self._log_buffers(log)
             self._sim.sim_init(
                 platform,
                 device,
@@ -1012,10 +1085,11 @@ class SimulationOpenCL(myokit.CModule):
                 state_in,
                 state_out,
                 self._protocol,
-                log,
+                buffers,
                 log_interval,
                 [x.qname().encode('ascii') for x in inter_log],
                 field_data,
+                steady,
             )
             t = tmin
             try:
@@ -1025,19 +1099,35 @@ class SimulationOpenCL(myokit.CModule):
                         r = 1.0 / duration if duration != 0 else 1
                         while t < tmax:
                             t = self._sim.sim_step()
+                            if log_sink is not None:
+                                self._flush_log_buffers(
+                                    log, buffers, log_sink)
                             if not progress.update(min((t - tmin) * r, 1)):
                                 raise myokit.SimulationCancelledError()
                 else:
                     # Loop without feedback
                     while t < tmax:
                         t = self._sim.sim_step()
+                        if log_sink is not None:
+                            self._flush_log_buffers(log, buffers, log_sink)
             except ArithmeticError:
                 arithmetic_error = True
             finally:
                 # Clean even after KeyboardInterrupt or other Exception
                 self._sim.sim_clean()
+
+                # Add logged data, even if the run didn't complete
+                if log_sink is None:
+                    self._merge_log_buffers(log, buffers)
+                else:
+                    self._flush_log_buffers(log, buffers, log_sink, True)
+
             # Update state
             self._state = state_out
+        elif log_sink is not None:
+            # Nothing to log, but tell the sink which keys to expect
+            self._flush_log_buffers(
+                log, self._log_buffers(log), log_sink, True)
 
         # Check for NaN
         if report_nan and (arithmetic_error or log.has_nan()):
@@ -1259,7 +1349,8 @@ class SimulationOpenCL(myokit.CModule):
         containing a variable qname. The ``value`` should be given as a float.
 
         Note that any scalar fields set for the same variable will overwrite
-        this value without warning.
+        this value without warning. Constants declared as parameters cannot be
+        changed with this method but may be set using :meth:`set_parameters`.
         """
         value = float(value)
         if isinstance(var, myokit.Variable):
@@ -1268,6 +1359,10 @@ class SimulationOpenCL(myokit.CModule):
         if not var.is_literal():
             raise ValueError(
                 'The given variable <' + var.qname() + '> is not a literal.')
+        if var in self._parameters:
+            raise ValueError(
+                'The given variable <' + var.qname() + '> is set as a'
+                ' parameter. Use set_parameters() instead.')
         # Update value in internal model (will update its defined value when
         # the kernel is generated before the next run).
         self._model.set_value(var.qname(), value)
@@ -1314,6 +1409,10 @@ class SimulationOpenCL(myokit.CModule):
             raise ValueError('Only constants can be used for fields.')
         if var.is_bound():
             raise ValueError('Bound values cannot be replaced by fields.')
+        if var in self._parameters:
+            raise ValueError(
+                'The given variable <' + var.qname() + '> is set as a'
+                ' parameter. Use set_parameters() instead.')
         # Check values
         values = np.array(values, copy=False, dtype=float)
         if len(self._dims) == 1:
@@ -1417,6 +1516,59 @@ class SimulationOpenCL(myokit.CModule):
         # Set list of paced cells
         self._paced_cells = paced_cells
 
+    def set_parameters(self, values):
+        """
+        Changes the values of the parameters declared when this simulation was
+        created.
+
+        The argument ``values`` must either be an array or sequence containing
+        a value for every parameter, in the order returned by
+        :meth:`parameters`, or a mapping from one or more parameter names to
+        their new values. Each value can be a scalar, which is used for all
+        cells, or a field with the dimensions used by :meth:`set_field`.
+        Similarly, an array of shape ``(n_parameters, )`` sets the same values
+        in all cells, while an array of shape ``(n_parameters, nx)`` (1d) or
+        ``(n_parameters, ny, nx)`` (2d) sets a field for every parameter.
+        """
+        if isinstance(values, dict):
+            # Create array to update so that values only change after error
+            # checks.
+            new_values = np.array(self._parameter_values)
+            for k, v in values.items():
+                if isinstance(k, myokit.Variable):
+                    k = k.qname()
+                try:
+                    k = self._model.get(k, myokit.Variable)
+                except KeyError:
+                    raise ValueError('Unknown parameter: <' + str(k) + '>.')
+                try:
+                    i = self._parameters.index(k)
+                except ValueError:
+                    raise ValueError(
+                        'Variable <' + str(k) + '> was not set as a'
+                        ' parameter.')
+                v = np.array(v, copy=False, dtype=float)
+                if v.shape not in ((), tuple(reversed(self._dims))):
+                    raise ValueError(
+                        'The value for <' + k.qname() + '> must be a scalar'
+                        ' or have dimensions '
+                        + str(tuple(reversed(self._dims))) + '.')
+                new_values[i] = v.reshape(-1)
+            self._parameter_values = new_values
+
+        else:
+            n = len(self._parameters)
+            values = np.array(values, copy=False, dtype=float)
+            if values.shape == (n, ):
+                self._parameter_values[:] = values[:, None]
+            elif values.shape == (n, ) + tuple(reversed(self._dims)):
+                self._parameter_values[:] = values.reshape(n, self._ntotal)
+            else:
+                raise ValueError(
+                    'Argument `values` should be either a dict or an array of'
+                    ' shape ' + str((n, )) + ' or '
+                    + str((n, ) + tuple(reversed(self._dims))) + '.')
+
     def set_protocol(self, protocol=None):
         """
         Changes the pacing protocol used by this simulation.
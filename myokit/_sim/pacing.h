@@ -41,6 +41,17 @@
 #include <stdio.h>
 #include <float.h>
 
+/*
+ * Checks for Python signals (e.g. keyboard interrupts), but only if the
+ * current thread holds the GIL. This allows the pacing systems to be used
+ * from threads that have released the GIL.
+ */
+#if PY_MAJOR_VERSION >= 3
+#define Pacing_CheckSignals() (PyGILState_Check() ? PyErr_CheckSignals() : 0)
+#else
+#define Pacing_CheckSignals() PyErr_CheckSignals()
+#endif
+
 /*
  * Event-based pacing error flags
  */
@@ -308,6 +319,7 @@ ESys_Reset(ESys sys)
         next->period = next->operiod;
         next->multiplier = next->omultiplier;
         next->next = 0;
+        next++;
     }
 
     // Set up the event queue
@@ -534,7 +546,7 @@ ESys_AdvanceTime(ESys sys, double new_time)
             sys->tnext = sys->head->start;
 
         /* Allow interrupting if something goes wrong */
-        if (PyErr_CheckSignals() != 0) {
+        if (Pacing_CheckSignals() != 0) {
             return ESys_PYTHON_INTERRUPT;
         }
     }
@@ -20,9 +20,8 @@ SOURCE_FILE = 'psim.cpp'
 
 class PSimulation(myokit.CppModule):
     """
-    Runs a forward-Euler based simulation and calculates the partial
-    derivatives of the model variables with respect to a given set of
-    parameters.
+    Runs a simulation and calculates the partial derivatives of the model
+    variables with respect to a given set of parameters.
 
     The simulation is based on automatic differentiation implemented using a
     C++ data type that replaces a single scalar float with a float and a list
@@ -43,6 +42,33 @@ class PSimulation(myokit.CppModule):
     A protocol can be passed in as ``protocol`` or set later using
     :meth:`set_protocol`.
 
+    The integration method can be chosen with the argument ``method``:
+
+    ``'euler'``
+        A forward Euler method with a fixed step size, set with
+        :meth:`set_step_size` (default).
+    ``'rl'``
+        As ``'euler'``, but with states written in a Hodgkin-Huxley form
+        updated using a Rush-Larsen step, as in
+        :class:`myokit.SimulationOpenCL`. This method requires the membrane
+        potential to be labelled as ``membrane_potential``.
+    ``'rk45'``
+        An embedded Runge-Kutta method (Dormand-Prince 5(4)) with an adaptive
+        step size, controlled using the tolerances set with
+        :meth:`set_tolerance`. The error is estimated on both the state
+        values and their partial derivatives.
+
+    By default, every intermediate value carries a partial derivative with
+    respect to every parameter. If ``sparse=True``, the dependencies between
+    the model variables (see :meth:`myokit.Model.map_deep_dependencies`) are
+    used to determine which partial derivatives can be non-zero, and code is
+    generated that only propagates those. This can make the simulation
+    considerably faster when many parameters are tracked but most variables
+    depend on only a few of them. In sparse mode, discontinuous functions
+    such as ``floor`` have well-defined partial derivatives instead of
+    yielding ``NaN``, as described in
+    :meth:`myokit._sim.differential.sparse_equation`.
+
     The model and protocol passed to the simulation are cloned and stored
     internally. Any changes to the original model or protocol will not affect
     the simulation.
@@ -78,7 +104,8 @@ class PSimulation(myokit.CppModule):
     _index = 0  # Unique id for generated module
 
     def __init__(
-            self, model, protocol=None, variables=None, parameters=None):
+            self, model, protocol=None, variables=None, parameters=None,
+            method='euler', sparse=False):
         super(PSimulation, self).__init__()
 
         # Check presence of variables and parameters arguments (are required
@@ -90,11 +117,30 @@ class PSimulation(myokit.CppModule):
         if parameters is None:
             raise ValueError('Please specify a set of parameters.')
 
+        # Check method
+        if method not in ('euler', 'rl', 'rk45'):
+            raise ValueError(
+                'Unknown method "' + str(method) + '", expecting "euler",'
+                ' "rl", or "rk45".')
+        self._method = method
+        self._sparse = bool(sparse)
+
         # Require a valid model
         if not model.is_valid():
             model.validate()
-        model = model.clone()
-        self._model = model
+
+        # Prepare for Rush-Larsen updates, and/or clone model
+        self._rl_states = {}
+        if self._method == 'rl':
+            if model.label('membrane_potential') is None:
+                raise ValueError(
+                    'The "rl" method requires the membrane potential variable'
+                    ' to be labelled as "membrane_potential".')
+            import myokit.lib.hh as hh
+            self._model, self._rl_states = hh.get_rl_states(model)
+        else:
+            self._model = model.clone()
+        del(model)
 
         # Set protocol
         self.set_protocol(protocol)
@@ -150,9 +196,10 @@ class PSimulation(myokit.CppModule):
         # Starting time
         self._time = 0
 
-        # Default time step
+        # Default time step and tolerances
         self._dt = 0
         self.set_step_size()
+        self.set_tolerance()
 
         # Unique simulation id
         PSimulation._index += 1
@@ -165,6 +212,9 @@ class PSimulation(myokit.CppModule):
             'model': self._model,
             'variables': self._variables,
             'parameters': self._parameters,
+            'method': self._method,
+            'rl_states': self._rl_states,
+            'sparse': self._sparse,
         }
         fname = os.path.join(myokit.DIR_CFUNC, SOURCE_FILE)
 
@@ -232,6 +282,19 @@ class PSimulation(myokit.CppModule):
         mp = len(self._parameters)
         return np.array(self._state_ddp, copy=True).reshape((ms, mp))
 
+    def method(self):
+        """
+        Returns the integration method used by this simulation.
+        """
+        return self._method
+
+    def parameters(self):
+        """
+        Returns a list containing the qnames of the parameters under
+        investigation, in the order used by :meth:`set_parameters`.
+        """
+        return [p.qname() for p in self._parameters]
+
     def reset(self):
         """
         Resets the simulation:
@@ -340,7 +403,7 @@ class PSimulation(myokit.CppModule):
         # Run simulation
         if duration > 0:
             # Initialize
-            self._sim.sim_init(
+            run = self._sim.sim_init(
                 tmin,
                 tmax,
                 self._dt,
@@ -353,6 +416,8 @@ class PSimulation(myokit.CppModule):
                 log,
                 varab_ddp,
                 log_interval,
+                self._abs_tol,
+                self._rel_tol,
             )
             t = tmin
             try:
@@ -361,17 +426,17 @@ class PSimulation(myokit.CppModule):
                     with progress.job(msg):
                         r = 1.0 / duration
                         while t < tmax:
-                            t = self._sim.sim_step()
+                            t = self._sim.sim_step(run)
                             if not progress.update(min((t - tmin) * r, 1)):
                                 raise myokit.SimulationCancelledError()
                 else:
                     # Loop without feedback
                     # (But with repeated returns to Python to allow Ctrl-C etc)
                     while t < tmax:
-                        t = self._sim.sim_step()
+                        t = self._sim.sim_step(run)
             finally:
                 # Clean even after KeyboardInterrupt or other Exception
-                self._sim.sim_clean()
+                self._sim.sim_clean(run)
 
             # Update internal state
             self._state = list(state)
@@ -471,13 +536,28 @@ class PSimulation(myokit.CppModule):
 
     def set_step_size(self, dt=0.01):
         """
-        Sets the step size used in the forward Euler solving routine.
+        Sets the step size used in the forward Euler and Rush-Larsen solving
+        routines, or the initial step size for the ``'rk45'`` method.
         """
         dt = float(dt)
         if dt <= 0:
             raise ValueError('Step size must be greater than zero.')
         self._dt = dt
 
+    def set_tolerance(self, abs_tol=1e-6, rel_tol=1e-4):
+        """
+        Sets the absolute and relative tolerances used to control the step size
+        in the ``'rk45'`` method.
+        """
+        abs_tol = float(abs_tol)
+        if abs_tol <= 0:
+            raise ValueError('Absolute tolerance must be positive float.')
+        rel_tol = float(rel_tol)
+        if rel_tol <= 0:
+            raise ValueError('Relative tolerance must be positive float.')
+        self._abs_tol = abs_tol
+        self._rel_tol = rel_tol
+
     def state(self):
         """
         Returns the current state.
@@ -38,10 +38,16 @@ class RhsBenchmarker(myokit.CModule):
     the given list will be tested.
 
     A valid myokit model should be provided as the ``model`` argument.
+
+    The optimisation profile used to compile the benchmarker can be set with
+    ``profile`` (see ``myokit.OPTIMISATION_PROFILES``). If not set, the
+    value of ``myokit.OPTIMISATION_PROFILE`` is used. To compare the
+    performance of different profiles, use :meth:`bench_profiles`.
     """
     _index = 0  # Unique id for the generated module
 
-    def __init__(self, model, variables=None, exclude_selected=False):
+    def __init__(
+            self, model, variables=None, exclude_selected=False, profile=None):
         super(RhsBenchmarker, self).__init__()
 
         # Require a valid model
@@ -80,7 +86,8 @@ class RhsBenchmarker(myokit.CModule):
             libs.append('m')
 
         # Create extension
-        self._ext = self._compile(module_name, fname, args, libs)
+        self._ext = self._compile(
+            module_name, fname, args, libs, profile=profile)
 
     def bench_full(self, log, repeats=40000, fastest=False):
         """
@@ -157,6 +164,37 @@ class RhsBenchmarker(myokit.CModule):
         times = self._ext.bench_part(bench, log, start, stop, repeats, fastest)
         return times
 
+    @classmethod
+    def bench_profiles(
+            cls, model, log, profiles=None, repeats=4000, fastest=False):
+        """
+        Benchmarks the entire RHS of a ``model`` when compiled with different
+        optimisation profiles, and returns the speed-up obtained with each
+        profile.
+
+        For each profile in ``profiles`` (by default all profiles in
+        ``myokit.OPTIMISATION_PROFILES``), a new :class:`RhsBenchmarker` is
+        created and :meth:`bench_full` is called with the given ``log``,
+        ``repeats``, and ``fastest`` arguments. The benchmarked times are then
+        reduced to a single number with :meth:`mean`.
+
+        Returns a list of tuples ``(profile, time, speed_up)``, where
+        ``speed_up`` is the time for the first profile divided by the time for
+        the current one (so that the first entry always has a speed-up of 1).
+        """
+        if profiles is None:
+            profiles = myokit.OPTIMISATION_PROFILES
+        profiles = [str(x).strip().lower() for x in profiles]
+        if len(profiles) == 0:
+            raise ValueError('At least one profile must be given.')
+
+        results = []
+        for profile in profiles:
+            b = cls(model, profile=profile)
+            t = b.mean(b.bench_full(log, repeats, fastest))
+            results.append((profile, t, results[0][1] / t if results else 1))
+        return results
+
     def mean(self, times):
         """
         Like meth:`mean_std()` but returns only the final mean.
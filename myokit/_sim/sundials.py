@@ -50,7 +50,7 @@ class Sundials(myokit.CModule):
         args = {'module_name': mname}
         try:
             Sundials._instance = self._compile(
-                mname, fname, args, libs, libd, incd)
+                mname, fname, args, libs, libd, incd, cache=False)
         except myokit.CompilationError as e:  # pragma: no cover
             Sundials._instance = False
             Sundials._message = str(e)
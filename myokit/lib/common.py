@@ -946,8 +946,15 @@ class StrengthDuration(object):
         # Create simulation
         s = myokit.Simulation(self._model)
 
-        # Variables to log
-        vvar = self._vvar.qname()
+        # Detect depolarisations as upward crossings of the threshold, and
+        # stop each run as soon as one is found
+        thresholds = [(self._vvar.qname(), self._threshold, 1)]
+
+        def depolarises():
+            d, c = s.run(
+                self._time, log=myokit.LOG_NONE, thresholds=thresholds,
+                stop_on=0)
+            return len(c['time']) > 0
 
         # Output data
         durations = np.array(self._durations, copy=True)
@@ -965,8 +972,7 @@ class StrengthDuration(object):
             s.reset()
             s.set_constant(self._avar, a1)
             try:
-                d = s.run(self._time, log=[vvar]).npview()
-                t1 = (np.max(d[vvar]) > self._threshold)
+                t1 = depolarises()
             except Exception:
                 if debug:
                     traceback.print_exc()
@@ -978,8 +984,7 @@ class StrengthDuration(object):
             s.reset()
             s.set_constant(self._avar, a2)
             try:
-                d = s.run(self._time, log=[vvar]).npview()
-                t2 = (np.max(d[vvar]) > self._threshold)
+                t2 = depolarises()
             except Exception:
                 if debug:
                     traceback.print_exc()
@@ -999,12 +1004,11 @@ class StrengthDuration(object):
                 s.reset()
                 s.set_constant(self._avar, a)
                 try:
-                    d = s.run(self._time, log=[vvar]).npview()
+                    t = depolarises()
                 except Exception:
                     if debug:
                         traceback.print_exc()
                     break
-                t = (np.max(d[vvar]) > self._threshold)
                 if t1 == t:
                     a1 = a
                 else:
@@ -0,0 +1,391 @@
+#
+# Continuation of equilibria and detection of bifurcations.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import numpy as np
+import myokit
+
+
+class ContinuationSolver(object):
+    """
+    Traces how the equilibria (steady states) of a model, and their stability,
+    change as a single model constant is varied, using pseudo-arclength
+    continuation.
+
+    Starting from an equilibrium ``x*`` at a parameter value ``p``, each new
+    point on the branch of equilibria is found by first taking a step along
+    the tangent to the branch (the predictor), and then using Newton's method
+    to move back onto the branch (the corrector). Because each point is found
+    from a warm start, this is much cheaper than searching for each
+    equilibrium independently. And because the step is taken along the
+    branch rather than in the parameter, the branch can be followed around
+    fold points, where it turns back on itself.
+
+    The derivatives needed by the predictor and the corrector are calculated
+    using automatic differentiation, by a :class:`myokit.JacobianCalculator`
+    for a copy of the model in which the parameter has been turned into a
+    state with a zero derivative. As with the ``JacobianCalculator``, all
+    inputs (e.g. pacing) are unbound, so that their default values are used.
+
+    The stability of every point is determined from the eigenvalues of the
+    Jacobian matrix, which are also used to detect bifurcations (see
+    :meth:`bifurcations`).
+
+    Arguments:
+
+    ``model``
+        The :class:`myokit.Model` to trace the equilibria of.
+    ``parameter``
+        A literal constant in the model, given as a :class:`myokit.Variable`
+        or a fully qualified name.
+
+    Example::
+
+        import myokit
+        import myokit.lib.continuation as continuation
+
+        m, p, _ = myokit.load('example')
+        s = continuation.ContinuationSolver(m, 'ib.gb')
+        d, e = s.run(0.1)
+        for kind, p, x in s.bifurcations():
+            print(kind + ' at ' + str(p))
+
+    """
+    def __init__(self, model, parameter):
+        super(ContinuationSolver, self).__init__()
+
+        # Clone model
+        model.validate()
+        self._model = model.clone()
+
+        # Check parameter
+        if isinstance(parameter, myokit.Variable):
+            parameter = parameter.qname()
+        var = self._model.get(parameter, myokit.Variable)
+        if var.is_state() or var.is_bound() or not var.is_literal():
+            raise ValueError(
+                'The parameter must be a literal constant, got <'
+                + var.qname() + '>.')
+        self._parameter = var.qname()
+        self._value = var.eval()
+
+        # Turn parameter into a state with a zero derivative, so that the
+        # derivatives with respect to it are included in the Jacobian.
+        var.promote(self._value)
+        var.set_rhs(0)
+        self._calculator = myokit.JacobianCalculator(self._model)
+
+        # Number of (original) states
+        self._n = self._model.count_states() - 1
+
+        # Bifurcations detected during the last call to run()
+        self._bifurcations = []
+
+    def bifurcations(self):
+        """
+        Returns a list of the bifurcations detected during the last call to
+        :meth:`run`.
+
+        Each bifurcation is returned as a tuple ``(kind, p, x)``, where
+        ``kind`` is either ``'fold'`` or ``'hopf'``, ``p`` is the parameter
+        value and ``x`` is the state.
+
+        A fold (saddle-node) point is detected when a single real eigenvalue
+        changes sign between two neighbouring points, and a Hopf point is
+        detected when a pair of complex eigenvalues crosses the imaginary
+        axis. The location of each bifurcation is estimated by linear
+        interpolation between the two neighbouring points, so that its
+        accuracy depends on the step size used.
+        """
+        return list(self._bifurcations)
+
+    def _check_start(self, p, x):
+        """
+        Checks (or creates) a starting parameter value and state, and returns
+        them as a tuple ``(p, x)``.
+        """
+        p = self._value if p is None else float(p)
+        if x is None:
+            x = self._model.state()[:self._n]
+        x = np.array(x, dtype=float)
+        if x.shape != (self._n, ):
+            raise ValueError(
+                'State vector must have length ' + str(self._n) + '.')
+        return p, x
+
+    def _detect(self, points, eigenvalues):
+        """
+        Checks for bifurcations between two neighbouring ``points``, given
+        their ``eigenvalues``.
+        """
+        e0, e1 = eigenvalues
+        r0, r1 = e0[e0.imag == 0].real, e1[e1.imag == 0].real
+        c0, c1 = e0[e0.imag != 0].real, e1[e1.imag != 0].real
+
+        # Fold: a single real eigenvalue crosses zero, changing the sign of
+        # the determinant
+        fold = np.sum(r0 > 0) % 2 != np.sum(r1 > 0) % 2
+        if fold:
+            self._bifurcations.append(
+                ('fold', ) + _interpolate(points, r0, r1))
+
+        # Hopf: a complex pair crosses the imaginary axis, changing the number
+        # of eigenvalues with a positive real part in a way not explained by
+        # changes in the real eigenvalues.
+        du = np.sum(e1.real > 0) - np.sum(e0.real > 0)
+        if fold:
+            du -= np.sum(r1 > 0) - np.sum(r0 > 0)
+        if du != 0 and len(c0) and len(c1):
+            self._bifurcations.append(
+                ('hopf', ) + _interpolate(points, c0, c1))
+
+    def equilibrium(self, p=None, x=None, tolerance=1e-8, max_iter=50):
+        """
+        Uses Newton's method to search for an equilibrium at a fixed parameter
+        value ``p``.
+
+        An initial guess can be given as ``x``, if no guess is provided the
+        model's initial state is used. If no parameter value is given the
+        value set in the model is used.
+
+        The search is halted when the largest step, relative to the initial
+        guess, falls below ``tolerance``, or after ``max_iter`` iterations.
+
+        Returns a tuple ``(x*, f*, j*, e*)``, where ``x*`` is an equilibrium,
+        ``f*`` is the derivative vector at ``x*``, ``j*`` is the Jacobian
+        matrix at this point and ``e* = max|f(x*)|``.
+        """
+        p, x = self._check_start(p, x)
+        x, _ = self._newton(x, p, tolerance, max_iter)
+        f, j, _ = self.evaluate(x, p)
+        return x, f, j, np.max(np.abs(f)) if self._n else 0
+
+    def evaluate(self, x, p):
+        """
+        Evaluates the model at the state ``x`` and parameter value ``p``, and
+        returns a tuple ``(f, j, g)`` where ``f`` is the vector of state
+        derivatives, ``j`` is the Jacobian matrix ``df/dx``, and ``g`` is the
+        vector of partial derivatives ``df/dp``.
+        """
+        n = self._n
+        if len(x) != n:
+            raise ValueError('State vector must have length ' + str(n) + '.')
+        f, j = self._calculator.calculate(list(x) + [p])
+        return f[:n], j[:n, :n], j[:n, n]
+
+    def _newton(self, x, p, tolerance, max_iter):
+        """
+        Applies Newton's method at a fixed parameter value ``p``, starting
+        from ``x``, and returns a tuple ``(x, converged)``.
+        """
+        if self._n == 0:
+            return x, True
+        scale = _scale(x)
+        for i in range(max_iter):
+            f, j, _ = self.evaluate(x, p)
+            if not (np.all(np.isfinite(f)) and np.all(np.isfinite(j))):
+                return x, False
+            s = np.dot(np.linalg.pinv(j), -f)
+
+            # Limit step size, relative to the magnitudes of the initial guess
+            s, d = myokit._limit_newton_step(x, s, scale=scale)
+            if not np.isfinite(d):
+                return x, False
+            x = x + s
+            if d < tolerance:
+                return x, True
+        return x, False
+
+    def parameter(self):
+        """
+        Returns the fully qualified name of the parameter varied by this
+        solver.
+        """
+        return self._parameter
+
+    def run(self, p_end, p=None, x=None, step=1e-2, min_step=1e-6,
+            max_step=1e-1, max_points=1000, tolerance=1e-8, max_iter=10):
+        """
+        Traces a branch of equilibria, starting at the parameter value ``p``
+        and continuing in the direction of ``p_end``.
+
+        If no starting value ``p`` is given, the value set in the model is
+        used. An initial guess for the state can be given as ``x``, if no guess
+        is provided the model's initial state is used. This guess is first
+        improved using :meth:`equilibrium`.
+
+        Continuation stops when the parameter reaches ``p_end``, in which case
+        the final point is placed at exactly ``p_end`` (or omitted, if no
+        equilibrium can be found there), when ``max_points`` points have been
+        found, or when the corrector fails to converge with a step size larger
+        than ``min_step``. Note that the parameter may never reach ``p_end``,
+        for example if the branch turns back at a fold.
+
+        All states and the parameter are scaled by the magnitudes of their
+        starting values (or by 1, for any that start at zero), so that the
+        step sizes ``step``, ``min_step`` and ``max_step`` are relative. The
+        step size is halved whenever the corrector fails to converge in
+        ``max_iter`` iterations, and increased if it converges quickly. The
+        corrector has converged when its largest (relative) step falls below
+        ``tolerance``.
+
+        Returns a tuple ``(log, eigenvalues)`` where ``log`` is a
+        :class:`myokit.DataLog` containing the parameter and state values at
+        every point on the branch, and ``eigenvalues`` is a 2d NumPy array
+        with the eigenvalues of the Jacobian at each point. Any bifurcations
+        found can be obtained afterwards from :meth:`bifurcations`.
+        """
+        # Check arguments
+        p_end = float(p_end)
+        step = float(step)
+        min_step = float(min_step)
+        max_step = float(max_step)
+        if min_step <= 0:
+            raise ValueError('The minimum step size must be greater than 0.')
+        if not (min_step <= step <= max_step):
+            raise ValueError(
+                'The step size must be between the minimum and maximum step'
+                ' sizes.')
+        if max_points < 1:
+            raise ValueError(
+                'The maximum number of points must be at least 1.')
+        if max_iter < 1:
+            raise ValueError(
+                'The maximum number of iterations must be at least 1.')
+        tolerance = float(tolerance)
+
+        # Find starting point
+        p, x = self._check_start(p, x)
+        x, converged = self._newton(x, p, tolerance, 50)
+        if not converged:
+            raise ValueError(
+                'Unable to find an equilibrium at the starting parameter'
+                ' value.')
+        direction = 1 if p_end >= p else -1
+
+        # Scale states and parameter by magnitude of starting point, and use
+        # w = u / scale as the continuation variables, where u = [x, p].
+        n = self._n
+        scale = _scale(np.concatenate((x, [p])))
+        w = np.concatenate((x, [p])) / scale
+
+        # Initial tangent, in the direction of p_end
+        t = np.zeros(n + 1)
+        t[n] = direction
+        f, j, g = self.evaluate(x, p)
+        t = self._tangent(j, g, scale, t)
+
+        # Store first point
+        points = [w * scale]
+        eigenvalues = [np.linalg.eigvals(j)]
+        self._bifurcations = []
+
+        # Trace branch
+        h = step
+        while len(points) < max_points and direction * (p_end - p) > 0:
+
+            # Predictor
+            wp = w + h * t
+
+            # Corrector, using Newton's method on the extended system
+            #  f(u) = 0
+            #  t . (w - wp) = 0
+            w2 = wp
+            converged = False
+            for i in range(max_iter):
+                u = w2 * scale
+                f, j, g = self.evaluate(u[:n], u[n])
+                a = np.vstack((np.hstack((j, g[:, None])) * scale, t))
+                r = np.concatenate((f, [np.dot(t, w2 - wp)]))
+                if not (np.all(np.isfinite(a)) and np.all(np.isfinite(r))):
+                    break
+                s = np.dot(np.linalg.pinv(a), -r)
+                w2 = w2 + s
+                d = np.max(np.abs(s))
+                if not np.isfinite(d):
+                    break
+                if d < tolerance:
+                    converged = True
+                    break
+
+            # Reduce step size and try again if the corrector failed, or made
+            # a step much larger than the predictor
+            if not converged or np.max(np.abs(w2 - w)) > 2 * h:
+                h *= 0.5
+                if h < min_step:
+                    break
+                continue
+
+            # Accept new point, and update tangent
+            u = w2 * scale
+            x, p = u[:n], u[n]
+            f, j, g = self.evaluate(x, p)
+            t = self._tangent(j, g, scale, t)
+            w = w2
+
+            # Place final point at p_end
+            if direction * (p_end - p) < 0:
+                u0 = points[-1]
+                alpha = (p_end - u0[n]) / (p - u0[n])
+                x = u0[:n] + alpha * (x - u0[:n])
+                p = p_end
+                x, converged = self._newton(x, p, tolerance, max_iter)
+                if not converged:
+                    break
+                f, j, g = self.evaluate(x, p)
+
+            # Store point and check for bifurcations
+            points.append(np.concatenate((x, [p])))
+            eigenvalues.append(np.linalg.eigvals(j))
+            self._detect(points[-2:], eigenvalues[-2:])
+
+            # Increase step size if the corrector converged quickly
+            if i < 3:
+                h = min(h * 1.5, max_step)
+
+        # Create log
+        points = np.array(points)
+        log = myokit.DataLog()
+        log[self._parameter] = points[:, n]
+        for k, var in enumerate(list(self._model.states())[:n]):
+            log[var.qname()] = points[:, k]
+        return log, np.array(eigenvalues)
+
+    def _tangent(self, j, g, scale, t):
+        """
+        Calculates the unit tangent to the branch of equilibria, in scaled
+        coordinates, with the same orientation as the previous tangent ``t``.
+        """
+        a = np.vstack((np.hstack((j, g[:, None])) * scale, t))
+        b = np.zeros(len(t))
+        b[-1] = 1
+        t = np.dot(np.linalg.pinv(a), b)
+        return t / np.linalg.norm(t)
+
+
+def _interpolate(points, g0, g1):
+    """
+    Estimates the location of a bifurcation between two ``points``, by linear
+    interpolation of the values ``g0`` and ``g1`` closest to zero, and returns
+    a tuple ``(p, x)``.
+    """
+    g0 = g0[np.argmin(np.abs(g0))]
+    g1 = g1[np.argmin(np.abs(g1))]
+    alpha = g0 / (g0 - g1) if g0 * g1 < 0 else 0.5
+    u = points[0] + alpha * (points[1] - points[0])
+    return u[-1], u[:-1]
+
+
+def _scale(x):
+    """
+    Returns the magnitudes of the entries in ``x``, with any zeros replaced by
+    ones.
+    """
+    x = np.abs(x)
+    x[x == 0] = 1
+    return x
@@ -1272,6 +1272,46 @@ def get_rl_expression(x, dt, v=None):
     )
 
 
+def get_rl_states(model, v=None):
+    """
+    Prepares a :class:`myokit.Model` for simulation with Rush-Larsen (RL)
+    updates, by converting any states written in "alpha-beta form" to
+    "inf-tau form" (see :meth:`convert_hh_states_to_inf_tau_form`) and then
+    finding all states in "inf-tau form".
+
+    Arguments:
+
+    ``model``
+        A :class:`myokit.Model` object to convert.
+    ``v``
+        An optional :class:`myokit.Variable`` representing the membrane
+        potential. If not given, the method will search for a variable labelled
+        ``membrane_potential``. An error is raised if no membrane potential
+        variable can be found.
+
+    Returns a tuple ``(model, states)`` where ``model`` is an updated copy of
+    the given model, and ``states`` is a dict mapping each state that can be
+    updated with an RL step onto a tuple ``(x_inf, tau_x)`` (as returned by
+    :meth:`get_inf_and_tau`). All variables are from the updated model.
+    """
+    # Convert alpha-beta formulations to inf-tau forms, cloning model
+    model = convert_hh_states_to_inf_tau_form(model, v)
+    if v is None:
+        v = model.label('membrane_potential')
+    else:
+        if isinstance(v, myokit.Variable):
+            v = v.qname()
+        v = model.get(v)
+
+    # Get (inf, tau) tuple for every Rush-Larsen state
+    states = {}
+    for x in model.states():
+        res = get_inf_and_tau(x, v)
+        if res is not None:
+            states[x] = res
+    return model, states
+
+
 def has_alpha_beta_form(x, v=None):
     """
     Tests if the given ``x`` is a state variable with an expression of the form
@@ -0,0 +1,236 @@
+#
+# Finds periodic orbits of paced models using shooting methods.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import numpy as np
+import myokit
+
+
+class ShootingSolver(object):
+    """
+    Finds the periodic orbit (limit cycle) of a periodically paced model, by
+    searching for a fixed point of its one-period map.
+
+    The one-period map ``F(x)`` takes a state ``x`` at the start of a beat,
+    and returns the state reached after simulating a single ``period``. A
+    periodic orbit is a fixed point ``x* = F(x*)``, which is found here by
+    applying Newton's method (or a quasi-Newton method) to
+    ``G(x) = F(x) - x``. This requires the matrix of derivatives ``dF/dx``,
+    also known as the monodromy matrix, which is obtained using an
+    :class:`myokit.ICSimulation`.
+
+    Unlike brute-force pre-pacing, which converges at a rate determined by the
+    slowest processes in the model (e.g. ionic concentrations), Newton's
+    method converges quadratically once it is close to a solution. As a
+    result, the orbit can often be found in tens of beats instead of
+    thousands.
+
+    Arguments:
+
+    ``model``
+        The :class:`myokit.Model` to find a periodic orbit for.
+    ``protocol``
+        A :class:`myokit.Protocol` that is periodic with period ``period``.
+    ``period``
+        The period of the pacing protocol.
+    ``step_size=0.01``
+        The step size used in the forward-Euler integration performed by the
+        :class:`myokit.ICSimulation`.
+
+    Example::
+
+        import myokit
+        import myokit.lib.shooting as shooting
+
+        m, p, _ = myokit.load('example')
+        s = shooting.ShootingSolver(m, p, 1000)
+        x, f, j, e = s.solve()
+        print('Orbit found after ' + str(s.beats()) + ' beats.')
+
+    """
+    def __init__(self, model, protocol, period, step_size=0.01):
+        super(ShootingSolver, self).__init__()
+
+        # Check period
+        self._period = float(period)
+        if self._period <= 0:
+            raise ValueError('The period must be greater than zero.')
+
+        # Clone model and protocol
+        model.validate()
+        self._model = model.clone()
+        self._protocol = None if protocol is None else protocol.clone()
+
+        # Create simulation to evaluate the one-period map and its derivatives
+        self._sim = myokit.ICSimulation(self._model, self._protocol)
+        self._sim.set_step_size(step_size)
+
+        # Simulation used to evaluate the map without derivatives, created
+        # when first needed.
+        self._fsim = None
+
+        # Number of periods simulated during the last call to solve()
+        self._beats = 0
+
+    def beats(self):
+        """
+        Returns the number of periods simulated in the last call to
+        :meth:`solve`.
+        """
+        return self._beats
+
+    def map(self, x):
+        """
+        Evaluates the one-period map at the state ``x``, and returns a tuple
+        ``(F(x), dF/dx)``, where ``F(x)`` is the state reached after one
+        period and ``dF/dx`` is the monodromy matrix.
+
+        The map is evaluated using an :class:`myokit.ICSimulation`, starting at
+        time zero.
+        """
+        self._sim.set_default_state(x)
+        self._sim.reset()
+        self._sim.run(
+            self._period, log=myokit.LOG_NONE, log_interval=2 * self._period)
+        return np.array(self._sim.state()), self._sim.derivatives()
+
+    def _map_fast(self, x):
+        """
+        Evaluates the one-period map at ``x`` using a
+        :class:`myokit.Simulation` and returns ``F(x)``.
+        """
+        if self._fsim is None:
+            self._fsim = myokit.Simulation(self._model, self._protocol)
+        self._fsim.set_time(0)
+        self._fsim.set_state(x)
+        self._fsim.run(self._period, log=myokit.LOG_NONE)
+        return np.array(self._fsim.state())
+
+    def period(self):
+        """
+        Returns the period used by this solver.
+        """
+        return self._period
+
+    def solve(
+            self, x=None, method='newton', tolerance=1e-6, max_iter=50,
+            damping=1):
+        """
+        Searches for a periodic orbit, and returns a tuple
+        ``(x*, f*, j*, e*)``, where ``x*`` is the state at the start of a beat
+        on the orbit, ``f* = F(x*)`` is the state one period later, ``j*`` is
+        the (approximate) monodromy matrix at ``x*``, and ``e*`` is the
+        remaining error.
+
+        An initial guess can be given as ``x``, if no guess is provided the
+        model's initial state is used.
+
+        The method to use can be set with ``method``:
+
+        ``'newton'``
+            Newton's method, in which both ``F(x)`` and its derivatives are
+            evaluated in every iteration using a :class:`myokit.ICSimulation`.
+        ``'broyden'``
+            A quasi-Newton method, in which the monodromy matrix is calculated
+            once with a :class:`myokit.ICSimulation`, and then updated using
+            Broyden's method. The map ``F(x)`` is evaluated using a (CVODE)
+            :class:`myokit.Simulation`, which is much faster but will lead to
+            a slightly different orbit than found with ``'newton'`` (as the
+            forward-Euler method used by the ICSimulation has a larger
+            numerical error).
+
+        The error is calculated as the maximum over all states of
+        ``|F(x) - x| / (1 + |F(x)|)``, and the search is halted when it drops
+        below ``tolerance``, or after ``max_iter`` iterations. The tolerance
+        and maximum iterations criteria can be disabled by setting the
+        parameters to 0. The search is also halted if the map returns NaNs, in
+        which case the best point found so far is returned. The number of
+        periods simulated can be obtained afterwards from :meth:`beats`.
+
+        A damping factor can be applied to every step by setting a damping
+        factor ``damping`` to some value between ``0`` and ``1``. With
+        ``damping=1`` the full step suggested by Newton's method is taken. With
+        any smaller value only a fraction of the suggested step is made.
+        """
+        # Check arguments
+        if method not in ('newton', 'broyden'):
+            raise ValueError(
+                'Unknown method "' + str(method) + '", expecting "newton" or'
+                ' "broyden".')
+        if damping <= 0 or damping > 1:
+            raise ValueError('Damping must be between 0 and 1.')
+        tolerance = float(tolerance)
+        newton = method == 'newton'
+
+        # Get initial state
+        if x is None:
+            x = self._model.state()
+        x = np.array(x, dtype=float)
+        n = len(x)
+        if x.shape != (n, ) or n != self._model.count_states():
+            raise ValueError(
+                'State vector must have length '
+                + str(self._model.count_states()) + '.')
+        eye = np.eye(n)
+
+        # Evaluate map and monodromy matrix at initial state
+        self._beats = 0
+        f, j = self.map(x)
+        if not newton:
+            f = self._map_fast(x)
+            self._beats += 1
+        self._beats += 1
+        e = _error(x, f)
+
+        # Best solution
+        best = x, f, j, e
+
+        # Iterations
+        iterations = 0
+
+        # Start (stops if a NaN is encountered, as NaN > tolerance is False)
+        while e > tolerance:
+            # Solve (J - I) * s = -(F(x) - x)
+            g = f - x
+            s = np.dot(np.linalg.pinv(j - eye), -g)
+
+            # Take damped step to next point, limiting the relative change
+            s, _ = myokit._limit_newton_step(x, s, damping)
+            x2 = x + s
+            if np.all(x2 == x):     # pragma: no cover
+                break
+
+            # Evaluate map at next point
+            if newton:
+                f2, j2 = self.map(x2)
+            else:
+                f2 = self._map_fast(x2)
+                j2 = j + np.outer(
+                    (f2 - f) - np.dot(j, x2 - x), x2 - x
+                ) / np.dot(x2 - x, x2 - x)
+            self._beats += 1
+            x, f, j = x2, f2, j2
+            e = _error(x, f)
+            if e < best[3] or np.isnan(best[3]):
+                best = x, f, j, e
+
+            # Check iterations
+            iterations += 1
+            if max_iter > 0 and iterations >= max_iter:
+                break
+
+        return best
+
+
+def _error(x, f):
+    """
+    Returns the maximum over all states of ``|F(x) - x| / (1 + |F(x)|)``.
+    """
+    if len(x) == 0:
+        return 0
+    return np.max(np.abs(f - x) / (1 + np.abs(f)))
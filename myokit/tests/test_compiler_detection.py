@@ -8,10 +8,19 @@
 from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
+import os
 import unittest
 
 import myokit
 
+from shared import DIR_DATA, TemporaryDirectory
+
+# Unit testing in Python 2 and 3
+try:
+    unittest.TestCase.assertRaisesRegex
+except AttributeError:
+    unittest.TestCase.assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
 
 # Strings in Python2 and Python3
 try:
@@ -29,5 +38,57 @@ class CompilerDetectionTest(unittest.TestCase):
         self.assertIsInstance(myokit.Compiler.info(), basestring)
 
 
+class BrokenModule(myokit.CModule):
+    """
+    Module with a source file that can't be compiled.
+    """
+    def __init__(self, path):
+        super(BrokenModule, self).__init__()
+        self._compile('myokit_broken_module', path, {}, [])
+
+
+class CompilerBackendTest(unittest.TestCase):
+    """
+    Tests compiling with the different compiler backends.
+    """
+    def test_backends(self):
+        # Test that both backends create working modules
+
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        backend = myokit.COMPILER_BACKEND
+        cache = myokit.CACHE_COMPILED_MODULES
+        try:
+            myokit.CACHE_COMPILED_MODULES = False
+            results = []
+            for name in ('setuptools', 'direct', 'auto'):
+                myokit.COMPILER_BACKEND = name
+                s = myokit.PSimulation(
+                    m, p, variables=['membrane.V'], parameters=['ina.gNa'])
+                d, dp = s.run(2, log_interval=1)
+                results.append(list(d['membrane.V']))
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0], results[2])
+
+            # Compilation errors are reported by the direct backend
+            with TemporaryDirectory() as d:
+                path = d.path('broken.c')
+                with open(path, 'w') as f:
+                    f.write('This is not C code.')
+                for name in ('direct', 'auto', 'setuptools'):
+                    myokit.COMPILER_BACKEND = name
+                    self.assertRaisesRegex(
+                        myokit.CompilationError, 'Unable to compile',
+                        BrokenModule, path)
+
+            # Unknown backend
+            myokit.COMPILER_BACKEND = 'fast'
+            self.assertRaisesRegex(
+                ValueError, 'Unknown compiler backend', myokit.RhsBenchmarker,
+                m)
+        finally:
+            myokit.COMPILER_BACKEND = backend
+            myokit.CACHE_COMPILED_MODULES = cache
+
+
 if __name__ == '__main__':
     unittest.main()
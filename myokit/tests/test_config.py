@@ -36,6 +36,12 @@ inc = three;four
 [opencl]
 lib = five;six
 inc = three;eight
+[compilation]
+backend = setuptools
+profile = native
+cache = false
+cache_size = 12.5
+cache_path = /test/cache
 """
 
 # Config with empty paths and spaces
@@ -131,6 +137,11 @@ class TestConfig(unittest.TestCase):
         sundials_inc = myokit.SUNDIALS_INC
         opencl_lib = myokit.OPENCL_LIB
         opencl_inc = myokit.OPENCL_INC
+        compiler_backend = myokit.COMPILER_BACKEND
+        optimisation_profile = myokit.OPTIMISATION_PROFILE
+        cache_modules = myokit.CACHE_COMPILED_MODULES
+        cache_size = myokit.CACHE_SIZE
+        cache_dir = myokit.DIR_CACHE
 
         # Change myokit config dir temporarily
         path = myokit.DIR_USER
@@ -164,6 +175,11 @@ class TestConfig(unittest.TestCase):
                 self.assertEqual(myokit.SUNDIALS_INC, ['three', 'four'])
                 self.assertEqual(myokit.OPENCL_LIB, ['five', 'six'])
                 self.assertEqual(myokit.OPENCL_INC, ['three', 'eight'])
+                self.assertEqual(myokit.COMPILER_BACKEND, 'setuptools')
+                self.assertEqual(myokit.OPTIMISATION_PROFILE, 'native')
+                self.assertFalse(myokit.CACHE_COMPILED_MODULES)
+                self.assertEqual(myokit.CACHE_SIZE, 12.5)
+                self.assertEqual(myokit.DIR_CACHE, '/test/cache')
 
                 # Lists of paths should be filtered for empty values and
                 # trimmed
@@ -257,6 +273,11 @@ class TestConfig(unittest.TestCase):
             myokit.SUNDIALS_INC = sundials_inc
             myokit.OPENCL_LIB = opencl_lib
             myokit.OPENCL_INC = opencl_inc
+            myokit.COMPILER_BACKEND = compiler_backend
+            myokit.OPTIMISATION_PROFILE = optimisation_profile
+            myokit.CACHE_COMPILED_MODULES = cache_modules
+            myokit.CACHE_SIZE = cache_size
+            myokit.DIR_CACHE = cache_dir
 
             # Reload local settings
             config._load()
@@ -272,6 +293,7 @@ class TestConfig(unittest.TestCase):
             self.assertNotEqual(myokit.SUNDIALS_INC, ['three', 'four'])
             self.assertNotEqual(myokit.OPENCL_LIB, ['five', 'six'])
             self.assertNotEqual(myokit.OPENCL_INC, ['three', 'eight'])
+            self.assertNotEqual(myokit.DIR_CACHE, '/test/cache')
 
 
 if __name__ == '__main__':
@@ -674,6 +674,10 @@ class DataLogTest(unittest.TestCase):
             ValueError, 'support the append', prepare_log,
             {'membrane.V': 'hi'}, m)
 
+        # NumPy arrays are allowed
+        d = prepare_log({'membrane.V': np.array([1.0, 2.0])}, m)
+        self.assertIsInstance(d['membrane.V'], np.ndarray)
+
         # Argument `log` doesn't match any of the options
         self.assertRaisesRegex(
             ValueError, 'unexpected type', prepare_log, IOError, m)
@@ -1235,6 +1239,57 @@ class DataLogTest(unittest.TestCase):
             self.assertTrue(np.all(e.time() == d.time()))
             self.assertTrue(np.all(e.time() == d['c.d']))
 
+    def test_writer(self):
+        # Test writing a log to disk in chunks.
+
+        d = myokit.DataLog(time='t')
+        d['t'] = np.arange(0, 100) * 0.5
+        d['x'] = np.sqrt(np.arange(0, 100) * 1.2)
+
+        # Write in chunks, load, and compare
+        with TemporaryDirectory() as td:
+            fname = td.path('test.zip')
+            with myokit.DataLogWriter(fname) as w:
+                for i in range(0, 100, 30):
+                    w.write(d.trim(d['t'][i], d['t'][min(99, i + 30)]))
+                w.write(myokit.DataLog({'x': [], 't': []}))
+                w.write({'x': [d['x'][-1]], 't': [d['t'][-1]]})
+                self.assertEqual(w.length(), 100)
+            e = myokit.DataLog.load(fname)
+            self.assertEqual(list(e.keys()), ['t', 'x'])
+            self.assertEqual(e.time_key(), 't')
+            self.assertEqual(e['t'].typecode, 'd')
+            self.assertEqual(list(e['t']), list(d['t']))
+            self.assertEqual(list(e['x']), list(d['x']))
+
+            # Closing again has no effect, writing raises an error
+            w.close()
+            self.assertRaisesRegex(ValueError, 'closed', w.write, d)
+
+        # Single precision, no time key
+        d = myokit.DataLog()
+        d['a'] = np.arange(0, 10, dtype=np.float32)
+        with TemporaryDirectory() as td:
+            fname = td.path('test.zip')
+            w = myokit.DataLogWriter(fname, myokit.SINGLE_PRECISION)
+            w.write(d)
+            w.write(d)
+            w.close()
+            e = myokit.DataLog.load(fname)
+            self.assertIsNone(e.time_key())
+            self.assertEqual(e['a'].typecode, 'f')
+            self.assertEqual(list(e['a']), list(d['a']) * 2)
+
+        # Bad chunks
+        with TemporaryDirectory() as td:
+            with myokit.DataLogWriter(td.path('test.zip')) as w:
+                w.write({'a': [1, 2], 'b': [3, 4]})
+                self.assertRaisesRegex(
+                    ValueError, 'same', w.write, {'a': [1, 2]})
+                self.assertRaisesRegex(
+                    ValueError, 'same length', w.write,
+                    {'a': [1, 2], 'b': [3]})
+
     def test_load_errors(self):
         # Test if the correct load errors are raised.
 
@@ -48,6 +48,68 @@ class ExpressionTest(unittest.TestCase):
         self.assertTrue(e.contains_type(myokit.Number))
         self.assertFalse(e.contains_type(myokit.Minus))
 
+    def test_diff(self):
+        # Test :meth:`Expression.diff()`.
+
+        x = myokit.Name('x')
+        y = myokit.Name('y')
+
+        # Literals and names
+        self.assertEqual(myokit.Number(3).diff(x), myokit.Number(0))
+        self.assertEqual(x.diff(x), myokit.Number(1))
+        self.assertEqual(y.diff(x), myokit.Number(0))
+
+        # Terms known to be zero are omitted
+        e = myokit.parse_expression('3 * x + y')
+        self.assertEqual(e.diff(x), myokit.Number(3))
+        self.assertEqual(e.diff(y), myokit.Number(1))
+        e = myokit.parse_expression('exp(y) * floor(x)')
+        self.assertEqual(e.diff(x), myokit.Number(0))
+        e = myokit.parse_expression('if(x > 1, 2, 3)')
+        self.assertEqual(e.diff(x), myokit.Number(0))
+        e = myokit.parse_expression('x^2')
+        self.assertEqual(e.diff(x), myokit.parse_expression('2 * x'))
+        e = myokit.parse_expression('x^3 + y')
+        self.assertEqual(e.diff(x), myokit.parse_expression('3 * x^2'))
+
+        # Compare with finite differences
+        expressions = [
+            '+x', '-x', 'x + y', 'x - y', 'x * y', 'x / y', 'y / x',
+            'x // y', 'x % y', 'x^3', 'x^y', 'y^x', '2^(x * y)', 'sqrt(x)',
+            'sin(x)', 'cos(x * y)', 'tan(x)', 'asin(x / 3)', 'acos(x / 3)',
+            'atan(x)', 'exp(x * y)', 'log(x)', 'log(x, y)', 'log(y, x)',
+            'log10(x)', 'floor(x)', 'ceil(x)', 'abs(x)', 'abs(-x)',
+            'if(x > 1, x^2, y * x)', 'if(x < 1, x^2, y * x)',
+            'piecewise(x < 0, x, x < 2, x^2, y * x)',
+            '1 / (1 + exp((x - y) / 3))',
+            'x * (x + 1) / (exp(-y / x) - 1)',
+        ]
+        values = {x: 1.2, y: 2.7}
+        h = 1e-6
+        for e in expressions:
+            e = myokit.parse_expression(e)
+            for var in (x, y):
+                d = e.diff(var).eval(values)
+                v1 = dict(values)
+                v2 = dict(values)
+                v1[var] += h
+                v2[var] -= h
+                f = (e.eval(v1) - e.eval(v2)) / (2 * h)
+                self.assertAlmostEqual(d, f, places=5, msg=e.code())
+
+        # Derivatives
+        m = myokit.Model()
+        c = m.add_component('c')
+        a = c.add_variable('a')
+        b = c.add_variable('b')
+        a.set_rhs('-b')
+        a.promote(1)
+        b.set_rhs('3 * dot(a) + a')
+        self.assertEqual(b.rhs().diff(a.lhs()), myokit.Number(3))
+        self.assertEqual(b.rhs().diff(myokit.Name(a)), myokit.Number(1))
+        self.assertEqual(a.lhs().diff(a.lhs()), myokit.Number(1))
+        self.assertEqual(a.lhs().diff(myokit.Name(a)), myokit.Number(0))
+
     def test_eval(self):
         # Test :meth:`Expression.eval()`.
 
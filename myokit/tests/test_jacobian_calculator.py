@@ -68,6 +68,19 @@ class JacobianCalculatorTest(unittest.TestCase):
         self.assertRaisesRegex(
             ValueError, 'floats', c.calculate, x)
 
+    def test_sparse(self):
+        # Test calculating with sparse partial derivatives
+        m = myokit.load_model(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        x = m.state()
+        f1, j1 = myokit.JacobianCalculator(m).calculate(x)
+        f2, j2 = myokit.JacobianCalculator(m, sparse=True).calculate(x)
+        self.assertTrue(np.all(f1 == f2))
+        self.assertTrue(np.allclose(j1, j2, rtol=1e-12, atol=0))
+
+        # Structural zeros should be zero in both
+        self.assertEqual(j1[1, 2], 0)
+        self.assertEqual(j2[1, 2], 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,6 +10,7 @@ from __future__ import print_function, unicode_literals
 
 import os
 import unittest
+import numpy as np
 
 import myokit
 
@@ -68,6 +69,64 @@ class JacobianTracerTest(unittest.TestCase):
         del(d2['engine.time'])
         self.assertRaisesRegex(ValueError, 'bound', g.jacobians, d2)
 
+    def test_batched(self):
+        # Test batched jacobians and eigenvalues, with subsampling and chunks
+
+        # Create a log with perturbed states
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        m.binding('diffusion_current').set_binding(None)
+        n = 25
+        r = np.random.RandomState(1)
+        d = myokit.DataLog(time='engine.time')
+        d['engine.time'] = np.linspace(0, 10, n)
+        d['engine.pace'] = r.choice([0, 1], size=n).astype(float)
+        d['engine.realtime'] = np.zeros(n)
+        d['engine.evaluations'] = np.zeros(n)
+        for v in m.states():
+            d[v.qname()] = v.state_value() * (1 + 0.01 * r.normal(size=n))
+
+        # Compare with jacobians calculated one by one
+        g = myokit.JacobianTracer(m)
+        b = g.jacobians(d)
+        j = b.get2d('jacobians')
+        self.assertEqual(j.shape, (n, 8, 8))
+        for i in (0, 12, n - 1):
+            state = [float(d[v.qname()][i]) for v in m.states()]
+            inputs = [
+                float(d[m.binding(x).qname()][i]) for x in g._inputs]
+            deriv = [0] * 8
+            partial = [0] * 64
+            g._ext.calculate(state, inputs, deriv, partial)
+            self.assertTrue(np.all(np.array(partial).reshape(8, 8) == j[i]))
+
+        # Test eigenvalues, subsampling, and chunking
+        e = np.array([np.linalg.eigvals(x) for x in j])
+        self.assertTrue(np.all(g.eigenvalues(block=b) == e))
+        self.assertTrue(np.all(g.eigenvalues(log=d) == e))
+        self.assertTrue(np.all(g.eigenvalues(log=d, step=3) == e[::3]))
+        self.assertTrue(np.all(g.eigenvalues(block=b, step=4) == e[::4]))
+        self.assertTrue(np.all(
+            g.eigenvalues(log=d, step=2, chunk_size=5) == e[::2]))
+        self.assertTrue(np.all(g.eigenvalues(log=d, chunk_size=100) == e))
+        dom = e[np.arange(n), np.argmax(np.abs(e), axis=1)]
+        self.assertTrue(np.all(g.dominant_eigenvalues(log=d) == dom))
+        self.assertTrue(np.all(
+            g.dominant_eigenvalues(log=d, step=2, chunk_size=3) == dom[::2]))
+        lar = e[np.arange(n), np.argmax(np.real(e), axis=1)]
+        self.assertTrue(np.all(g.largest_eigenvalues(block=b) == lar))
+        self.assertTrue(np.all(
+            g.largest_eigenvalues(log=d, step=5, chunk_size=2) == lar[::5]))
+
+        # Invalid arguments
+        self.assertRaisesRegex(
+            ValueError, 'step', g.eigenvalues, log=d, step=0)
+        self.assertRaisesRegex(
+            ValueError, 'chunk_size', g.eigenvalues, log=d, chunk_size=0)
+        self.assertRaisesRegex(ValueError, 'requires', g.eigenvalues)
+        d2 = d.clone()
+        d2['engine.pace'] = d['engine.pace'][:-1]
+        self.assertRaisesRegex(ValueError, 'same length', g.jacobians, d2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#
+# Tests the lib.continuation module.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import os
+import unittest
+import numpy as np
+
+import myokit
+import myokit.lib.continuation as continuation
+
+from shared import DIR_DATA
+
+# Unit testing in Python 2 and 3
+try:
+    unittest.TestCase.assertRaisesRegex
+except AttributeError:
+    unittest.TestCase.assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
+
+class ContinuationSolverTest(unittest.TestCase):
+    """
+    Tests the :class:`ContinuationSolver`.
+    """
+
+    def test_fold(self):
+        # Test following a branch around a fold
+
+        m = myokit.parse_model('''
+            [[model]]
+            a.x = 1
+            a.y = 0.5
+
+            [a]
+            time = 0 bind time
+            p = 1
+            dot(x) = p - x^2
+            dot(y) = -y
+            ''')
+        s = continuation.ContinuationSolver(m, 'a.p')
+        self.assertEqual(s.parameter(), 'a.p')
+        d, e = s.run(-1, step=0.05, max_points=100)
+        self.assertEqual(e.shape, (100, 2))
+        p, x, y = d['a.p'], d['a.x'], d['a.y']
+        self.assertEqual(len(p), 100)
+
+        # All points are equilibria
+        self.assertTrue(np.allclose(x**2, p))
+        self.assertTrue(np.allclose(y, 0))
+
+        # The branch turns around at p=0, and continues with x < 0
+        self.assertEqual(p[0], 1)
+        self.assertTrue(np.all(p > -1e-6))
+        self.assertGreater(p[-1], 1)
+        self.assertLess(x[-1], -1)
+
+        # Upper branch is stable, lower branch is unstable
+        self.assertTrue(np.all(np.max(e.real, axis=1)[x > 0.01] < 0))
+        self.assertTrue(np.all(np.max(e.real, axis=1)[x < -0.01] > 0))
+
+        # A single fold is detected
+        b = s.bifurcations()
+        self.assertEqual(len(b), 1)
+        kind, p, x = b[0]
+        self.assertEqual(kind, 'fold')
+        self.assertAlmostEqual(p, 0, delta=0.01)
+        self.assertAlmostEqual(x[0], 0, delta=0.1)
+        self.assertAlmostEqual(x[1], 0)
+
+    def test_hopf(self):
+        # Test detecting a Hopf bifurcation
+
+        m = myokit.parse_model('''
+            [[model]]
+            a.x = 0.1
+            a.y = 0.1
+
+            [a]
+            time = 0 bind time
+            p = -1
+            dot(x) = p * x - y - x * (x^2 + y^2)
+            dot(y) = x + p * y - y * (x^2 + y^2)
+            ''')
+        s = continuation.ContinuationSolver(m, 'a.p')
+        d, e = s.run(1)
+
+        # Final point is placed at p_end
+        self.assertEqual(d['a.p'][0], -1)
+        self.assertEqual(d['a.p'][-1], 1)
+        self.assertTrue(np.all(np.diff(d['a.p']) > 0))
+        self.assertTrue(np.allclose(d['a.x'], 0))
+        self.assertTrue(np.allclose(e.real[:, 0], d['a.p']))
+        self.assertTrue(np.allclose(np.abs(e.imag), 1))
+
+        b = s.bifurcations()
+        self.assertEqual(len(b), 1)
+        kind, p, x = b[0]
+        self.assertEqual(kind, 'hopf')
+        self.assertAlmostEqual(p, 0)
+
+        # Continue in other direction, from other starting point
+        d, e = s.run(-2, p=0.5, x=[0.1, -0.1])
+        self.assertEqual(d['a.p'][0], 0.5)
+        self.assertEqual(d['a.p'][-1], -2)
+        b = s.bifurcations()
+        self.assertEqual(len(b), 1)
+        self.assertEqual(b[0][0], 'hopf')
+        self.assertAlmostEqual(b[0][1], 0)
+
+    def test_lr1991(self):
+        # Test continuation in a cell model, against JacobianCalculator
+
+        m, _, _ = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        m.binding('pace').set_rhs(0)
+        s = continuation.ContinuationSolver(m, m.get('ib.gb'))
+        self.assertEqual(s.parameter(), 'ib.gb')
+
+        # Starting point
+        x, f, j, e = s.equilibrium()
+        self.assertLess(e, 1e-10)
+        c = myokit.JacobianCalculator(m)
+        x2, f2, j2, e2 = c.newton_root(x)
+        self.assertTrue(np.allclose(x, x2))
+        self.assertTrue(np.allclose(j, j2))
+
+        # Trace branch
+        d, e = s.run(0.1)
+        self.assertEqual(d['ib.gb'][-1], 0.1)
+        self.assertTrue(np.all(np.diff(d['ib.gb']) > 0))
+        self.assertTrue(np.all(np.diff(d['membrane.V']) > 0))
+        self.assertTrue(np.all(e.real < 0))
+        self.assertEqual(s.bifurcations(), [])
+        for i in (0, len(e) // 2, len(e) - 1):
+            x = [d[v.qname()][i] for v in m.states()]
+            f, j, g = s.evaluate(x, d['ib.gb'][i])
+            self.assertLess(np.max(np.abs(f)), 1e-8)
+            self.assertTrue(np.allclose(np.linalg.eigvals(j), e[i]))
+
+            # Compare partial derivatives to the parameter with finite
+            # differences
+            h = 1e-7
+            fd = (s.evaluate(x, d['ib.gb'][i] + h)[0] - f) / h
+            self.assertTrue(np.allclose(g, fd, atol=1e-6))
+
+    def test_end_point(self):
+        # Test placing the final point at p_end
+
+        m = myokit.parse_model('''
+            [[model]]
+            a.x = 1
+
+            [a]
+            time = 0 bind time
+            p = 1
+            dot(x) = p * (p - 2) / (p - 2) - x
+            ''')
+        s = continuation.ContinuationSolver(m, 'a.p')
+        d, e = s.run(1.9, step=0.05)
+        self.assertEqual(d['a.p'][-1], 1.9)
+        self.assertAlmostEqual(d['a.x'][-1], 1.9)
+        self.assertEqual(len(e), len(d['a.p']))
+
+        # Corrector fails at p_end: final point is omitted
+        d, e = s.run(2, step=0.05)
+        p = d['a.p']
+        self.assertTrue(np.all(np.isfinite(p)))
+        self.assertTrue(np.all(np.isfinite(e)))
+        self.assertTrue(np.allclose(d['a.x'], p))
+        self.assertLess(p[-1], 2)
+        self.assertGreater(p[-1], 1.8)
+        self.assertEqual(len(e), len(p))
+
+    def test_invalid_arguments(self):
+        # Test argument checking
+
+        m, _, _ = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        CS = continuation.ContinuationSolver
+        self.assertRaisesRegex(ValueError, 'literal', CS, m, 'membrane.V')
+        self.assertRaisesRegex(ValueError, 'literal', CS, m, 'engine.time')
+        self.assertRaisesRegex(ValueError, 'literal', CS, m, 'ina.INa')
+
+        # Default pacing value is 1, so no equilibrium from default state
+        s = CS(m, 'ib.gb')
+        self.assertRaisesRegex(
+            ValueError, 'Unable to find', s.run, 0.1, max_points=10)
+
+        self.assertRaisesRegex(ValueError, 'length 8', s.evaluate, [1], 1)
+        self.assertRaisesRegex(ValueError, 'length 8', s.equilibrium, 1, [1])
+        self.assertRaisesRegex(
+            ValueError, 'minimum step', s.run, 1, min_step=0)
+        self.assertRaisesRegex(ValueError, 'between', s.run, 1, step=1)
+        self.assertRaisesRegex(
+            ValueError, 'between', s.run, 1, step=1e-7, min_step=1e-6)
+        self.assertRaisesRegex(ValueError, 'points', s.run, 1, max_points=0)
+        self.assertRaisesRegex(ValueError, 'iterations', s.run, 1, max_iter=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
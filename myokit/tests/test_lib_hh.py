@@ -383,6 +383,34 @@ class HHDetectionTest(unittest.TestCase):
         self.assertIsNone(hh.get_rl_expression(
             m1.get('ikr.r'), myokit.Name(dt)))
 
+    def test_get_rl_states(self):
+        # Tests finding all states that can be updated with RL steps
+        m1 = myokit.parse_model(MODEL)
+        m2, states = hh.get_rl_states(m1)
+        self.assertIsNot(m1, m2)
+        self.assertEqual(
+            set(x.qname() for x in states),
+            set(x.qname() for x in m2.states()) - {'membrane.V'})
+        for x, (inf, tau) in states.items():
+            self.assertIs(x.model(), m2)
+            self.assertEqual(hh.get_inf_and_tau(x), (inf, tau))
+        self.assertFalse(hh.has_inf_tau_form(m1.get('ikr.r')))
+        self.assertTrue(hh.has_inf_tau_form(m2.get('ikr.r')))
+
+        # Membrane potential given explicitly (not as label)
+        m1.get('membrane.V').set_label(None)
+        m3, states3 = hh.get_rl_states(m1, m1.get('membrane.V'))
+        self.assertEqual(
+            set(x.qname() for x in states), set(x.qname() for x in states3))
+        m3, states3 = hh.get_rl_states(m1, 'membrane.V')
+        self.assertEqual(
+            set(x.qname() for x in states), set(x.qname() for x in states3))
+
+        # Unknown membrane potential
+        self.assertRaisesRegex(
+            ValueError, 'Membrane potential must be given',
+            hh.get_rl_states, m1)
+
 
 class HHModelTest(unittest.TestCase):
     """
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# Tests the lib.shooting module.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import os
+import unittest
+import numpy as np
+
+import myokit
+import myokit.lib.shooting as shooting
+
+from shared import DIR_DATA
+
+# Unit testing in Python 2 and 3
+try:
+    unittest.TestCase.assertRaisesRegex
+except AttributeError:
+    unittest.TestCase.assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
+
+class ShootingSolverTest(unittest.TestCase):
+    """
+    Tests the :class:`ShootingSolver`.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        m, p, _ = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        cls.model = m
+        cls.protocol = p
+        cls.solver = shooting.ShootingSolver(m, p, 1000)
+
+    def test_newton(self):
+        # Test finding a periodic orbit with Newton's method
+
+        s = self.solver
+        self.assertEqual(s.period(), 1000)
+        x, f, j, e = s.solve(tolerance=1e-8)
+        n = self.model.count_states()
+        self.assertEqual(x.shape, (n, ))
+        self.assertEqual(f.shape, (n, ))
+        self.assertEqual(j.shape, (n, n))
+        self.assertLess(e, 1e-8)
+        self.assertTrue(0 < s.beats() < 20)
+
+        # The orbit is a fixed point of the one-period map
+        f2, j2 = s.map(x)
+        self.assertTrue(np.all(np.abs(f2 - x) < 1e-8 * (1 + np.abs(f2))))
+        self.assertTrue(np.allclose(j, j2))
+
+        # Maximum iterations
+        x, f, j, e = s.solve(max_iter=1, tolerance=0)
+        self.assertEqual(s.beats(), 2)
+
+        # Damping
+        x, f, j, e = s.solve(damping=0.5, tolerance=1e-4)
+        self.assertLess(e, 1e-4)
+
+    def test_broyden(self):
+        # Test finding a periodic orbit with Broyden's method
+
+        s = self.solver
+        x, f, j, e = s.solve(method='broyden', tolerance=1e-8)
+        self.assertLess(e, 1e-8)
+        self.assertTrue(0 < s.beats() < 30)
+
+        # Should be close to orbit found with Newton (but uses a different
+        # solver)
+        y = s.solve(tolerance=1e-8)[0]
+        self.assertTrue(np.all(np.abs(y - x) < 1e-3 * (1 + np.abs(x))))
+
+    def test_slow_concentration(self):
+        # Test against pre-pacing, in a model with a slow concentration
+
+        m = myokit.parse_model('''
+            [[model]]
+            c.V = -80
+            c.Na = 10
+
+            [engine]
+            time = 0 bind time
+            pace = 0 bind pace
+
+            [c]
+            dot(V) = (-80 - V) / 10 + 50 * engine.pace
+            dot(Na) = (1e-3 * (V + 80) + 5 - Na) / 20000
+            ''')
+        p = myokit.pacing.blocktrain(1000, 2)
+
+        # Both methods use the same stopping criterion
+        s = shooting.ShootingSolver(m, p, 1000)
+        x, f, j, e = s.solve(tolerance=1e-6)
+        self.assertLess(e, 1e-6)
+        sim = myokit.Simulation(m, p)
+        beats = sim.pre(1000 * 1000, period=1000, tolerance=1e-6)
+        y = np.array(sim.state())
+
+        # Pre-pacing ends up close to the orbit, but needs far more beats
+        self.assertTrue(np.all(np.abs(y - x) < 1e-3 * (1 + np.abs(x))))
+        self.assertLess(s.beats(), 10)
+        self.assertGreater(beats, 10 * s.beats())
+
+    def test_bad_arguments(self):
+        # Test errors for invalid arguments
+
+        m, p = self.model, self.protocol
+        self.assertRaisesRegex(
+            ValueError, 'period', shooting.ShootingSolver, m, p, 0)
+        s = self.solver
+        self.assertRaisesRegex(ValueError, 'Unknown method', s.solve,
+                               method='bisection')
+        self.assertRaisesRegex(ValueError, 'Damping', s.solve, damping=0)
+        self.assertRaisesRegex(ValueError, 'Damping', s.solve, damping=1.1)
+        self.assertRaisesRegex(ValueError, 'length', s.solve, x=[1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# Tests the compiled module cache.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import os
+import time
+import unittest
+
+import numpy as np
+
+import myokit
+
+from shared import DIR_DATA, TemporaryDirectory
+
+# Unit testing in Python 2 and 3
+try:
+    unittest.TestCase.assertRaisesRegex
+except AttributeError:
+    unittest.TestCase.assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
+
+class ModuleCacheTest(unittest.TestCase):
+    """
+    Tests the :class:`myokit.ModuleCache`.
+    """
+
+    def test_key(self):
+        # Test creating cache keys
+
+        c = myokit.ModuleCache()
+        src = 'int x; PyInit_mod_1(void) {};'
+        k = c.key('mod_1', src, 'source.c', ['m'])
+        self.assertEqual(len(k), 64)
+
+        # Same key for same source but different module name
+        src2 = src.replace('mod_1', 'mod_2')
+        self.assertEqual(k, c.key('mod_2', src2, 'source.c', ['m']))
+
+        # Different key for different source, type, or arguments
+        self.assertNotEqual(k, c.key('mod_1', src + ' ', 'source.c', ['m']))
+        self.assertNotEqual(k, c.key('mod_1', src, 'source.cpp', ['m']))
+        self.assertNotEqual(k, c.key('mod_1', src, 'source.c', []))
+        self.assertNotEqual(
+            k, c.key('mod_1', src, 'source.c', ['m'], carg=['-O3']))
+
+        # Different key for different sundials version
+        version = myokit.SUNDIALS_VERSION
+        try:
+            myokit.SUNDIALS_VERSION = version + 1
+            self.assertNotEqual(k, c.key('mod_1', src, 'source.c', ['m']))
+        finally:
+            myokit.SUNDIALS_VERSION = version
+
+    def test_store_fetch_prune(self):
+        # Test storing, retrieving, and evicting modules
+
+        self.assertRaisesRegex(
+            ValueError, 'negative', myokit.ModuleCache, max_size=-1)
+
+        with TemporaryDirectory() as d:
+            # Fake compiled modules of 100KB
+            os.makedirs(d.path('build'))
+            data = b'x' * 100 * 1024
+            for name in ('a', 'b', 'c'):
+                with open(d.path('build/' + name + '.so'), 'wb') as f:
+                    f.write(data)
+
+            c = myokit.ModuleCache(d.path('cache'), max_size=0.25)
+            self.assertEqual(c.path(), d.path('cache'))
+            self.assertEqual(c.entries(), [])
+            self.assertEqual(c.size(), 0)
+
+            # Store and fetch
+            ka, kb, kc = 'a' * 64, 'b' * 64, 'c' * 64
+            self.assertTrue(c.store(ka, 'a', d.path('build')))
+            self.assertFalse(c.store(ka, 'a', d.path('build')))
+            self.assertEqual(len(c.entries()), 1)
+            self.assertGreater(c.size(), 100 * 1024)
+            os.makedirs(d.path('out'))
+            self.assertEqual(c.fetch(ka, d.path('out')), 'a')
+            self.assertTrue(os.path.isfile(d.path('out/a.so')))
+            self.assertIsNone(c.fetch(kb, d.path('out')))
+            self.assertRaisesRegex(
+                ValueError, 'No compiled module', c.store, kb, 'd',
+                d.path('build'))
+
+            # Least recently used modules are removed first
+            t = time.time()
+            c.store(kb, 'b', d.path('build'))
+            os.utime(d.path('cache/' + kb), (t - 10, t - 10))
+            os.utime(d.path('cache/' + ka), (t - 5, t - 5))
+            c.store(kc, 'c', d.path('build'))
+            keys = [x[0] for x in c.entries()]
+            self.assertEqual(keys, [kc, ka])
+
+            # Prune to a specific size
+            self.assertEqual(c.prune(0.15), 1)
+            self.assertEqual([x[0] for x in c.entries()], [kc])
+
+            # Clear
+            self.assertEqual(c.clear(), 1)
+            self.assertEqual(c.entries(), [])
+
+    def test_compiled_modules(self):
+        # Test that compiled modules are reused, but have independent memory
+
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        path = myokit.DIR_CACHE
+        enabled = myokit.CACHE_COMPILED_MODULES
+        try:
+            with TemporaryDirectory() as d:
+                myokit.DIR_CACHE = d.path()
+                myokit.CACHE_COMPILED_MODULES = True
+                cache = myokit.ModuleCache()
+
+                kwargs = {
+                    'variables': ['membrane.V'], 'parameters': ['ina.gNa']}
+                s1 = myokit.PSimulation(m, p, **kwargs)
+                self.assertEqual(len(cache.entries()), 1)
+                s2 = myokit.PSimulation(m, p, **kwargs)
+                self.assertEqual(len(cache.entries()), 1)
+
+                # Modules loaded from the cache have their own constants
+                s2.set_constant('ica.gCa', 0)
+                d1, _ = s1.run(5, log_interval=1)
+                d2, _ = s2.run(5, log_interval=1)
+                s1.reset()
+                d3, _ = s1.run(5, log_interval=1)
+                self.assertTrue(np.all(
+                    np.array(d1['membrane.V']) == np.array(d3['membrane.V'])))
+                self.assertFalse(np.all(
+                    np.array(d1['membrane.V']) == np.array(d2['membrane.V'])))
+
+                # Different model, different module
+                m.set_value('ica.gCa', 1)
+                myokit.PSimulation(m, p, **kwargs)
+                self.assertEqual(len(cache.entries()), 2)
+
+                # No caching if disabled
+                myokit.CACHE_COMPILED_MODULES = False
+                m.set_value('ica.gCa', 2)
+                myokit.PSimulation(m, p, **kwargs)
+                self.assertEqual(len(cache.entries()), 2)
+
+        finally:
+            myokit.DIR_CACHE = path
+            myokit.CACHE_COMPILED_MODULES = enabled
+
+
+class ParallelBuildTest(unittest.TestCase):
+    """
+    Tests asynchronous and parallel construction of compiled objects.
+    """
+
+    def test_build_async_and_many(self):
+        # Test build_async() and build_many()
+
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        kwargs = {'variables': ['membrane.V'], 'parameters': ['ina.gNa']}
+        models = []
+        for g in (0.09, 0.05):
+            models.append(m.clone())
+            models[-1].set_value('ica.gCa', g)
+
+        path = myokit.DIR_CACHE
+        enabled = myokit.CACHE_COMPILED_MODULES
+        cwd = os.getcwd()
+        try:
+            with TemporaryDirectory() as d:
+                myokit.DIR_CACHE = d.path()
+                cache = myokit.ModuleCache()
+
+                # Reference results
+                myokit.CACHE_COMPILED_MODULES = False
+                s = myokit.PSimulation(models[1], p, **kwargs)
+                v1 = list(s.run(5, log_interval=1)[0]['membrane.V'])
+
+                # Asynchronous creation, without caching
+                f0 = myokit.PSimulation.build_async(models[0], p, **kwargs)
+                f1 = myokit.PSimulation.build_async(models[1], p, **kwargs)
+                s0, s1 = f0.result(), f1.result()
+                self.assertIsInstance(s1, myokit.PSimulation)
+                self.assertEqual(
+                    list(s1.run(5, log_interval=1)[0]['membrane.V']), v1)
+                v0 = list(s0.run(5, log_interval=1)[0]['membrane.V'])
+                self.assertNotEqual(v0, v1)
+                self.assertEqual(cache.entries(), [])
+
+                # Errors are raised by result()
+                f = myokit.PSimulation.build_async(
+                    models[0], p, variables=['membrane.V'],
+                    parameters=['membrane.V'])
+                self.assertRaises(ValueError, f.result)
+
+                # Parallel creation in worker processes, via the cache
+                myokit.CACHE_COMPILED_MODULES = True
+                sims = myokit.PSimulation.build_many(
+                    models, p, processes=2, **kwargs)
+                self.assertEqual(len(sims), 2)
+                self.assertEqual(len(cache.entries()), 2)
+                self.assertEqual(
+                    list(sims[0].run(5, log_interval=1)[0]['membrane.V']),
+                    v0)
+                self.assertEqual(
+                    list(sims[1].run(5, log_interval=1)[0]['membrane.V']),
+                    v1)
+
+                # Parallel creation in threads
+                myokit.CACHE_COMPILED_MODULES = False
+                sims = myokit.PSimulation.build_many(models, p, **kwargs)
+                self.assertEqual(len(sims), 2)
+                self.assertEqual(
+                    list(sims[1].run(5, log_interval=1)[0]['membrane.V']),
+                    v1)
+
+                # Invalid number of processes
+                self.assertRaisesRegex(
+                    ValueError, 'at least 1', myokit.PSimulation.build_many,
+                    models, p, processes=0, **kwargs)
+
+            # Working directory is never changed
+            self.assertEqual(os.getcwd(), cwd)
+
+        finally:
+            myokit.DIR_CACHE = path
+            myokit.CACHE_COMPILED_MODULES = enabled
+
+
+if __name__ == '__main__':
+    unittest.main()
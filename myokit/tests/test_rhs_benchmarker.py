@@ -131,6 +131,57 @@ class RhsBenchmarkerTest(unittest.TestCase):
         self.assertRaisesRegex(
             ValueError, 'bound', myokit.RhsBenchmarker, m, [t])
 
+    def test_profiles(self):
+        # Test benchmarking with optimisation profiles.
+
+        # Create test model
+        m = myokit.Model('test')
+        c = m.add_component('c')
+        t = c.add_variable('time')
+        t.set_rhs('0')
+        t.set_binding('time')
+        v = c.add_variable('V')
+        v.set_rhs('1 / (7 * exp((V + 12) / 35) + 9 * exp(-(V + 77) / 6))')
+        v.promote(-80.1)
+        m.validate()
+
+        # Create simulation log
+        log = myokit.DataLog()
+        log['c.time'] = np.zeros(10)
+        log['c.V'] = np.linspace(-80.0, 50.0, 10)
+
+        # Compare all profiles
+        r = myokit.RhsBenchmarker.bench_profiles(m, log, repeats=10)
+        self.assertEqual(
+            [x[0] for x in r], list(myokit.OPTIMISATION_PROFILES))
+        self.assertEqual(r[0][2], 1)
+        for profile, time, speed_up in r:
+            self.assertGreater(time, 0)
+            self.assertGreater(speed_up, 0)
+
+        # Compare selected profiles
+        r = myokit.RhsBenchmarker.bench_profiles(
+            m, log, ['optimised', 'Default'], repeats=10)
+        self.assertEqual([x[0] for x in r], ['optimised', 'default'])
+
+        # Invalid profiles
+        self.assertRaisesRegex(
+            ValueError, 'At least one', myokit.RhsBenchmarker.bench_profiles,
+            m, log, [])
+        self.assertRaisesRegex(
+            ValueError, 'Unknown optimisation profile', myokit.RhsBenchmarker,
+            m, profile='fastest')
+
+        # Global profile is used by default
+        profile = myokit.OPTIMISATION_PROFILE
+        try:
+            myokit.OPTIMISATION_PROFILE = 'fastest'
+            self.assertRaisesRegex(
+                ValueError, 'Unknown optimisation profile',
+                myokit.RhsBenchmarker, m)
+        finally:
+            myokit.OPTIMISATION_PROFILE = profile
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -14,7 +14,7 @@ import numpy as np
 
 import myokit
 
-from shared import DIR_DATA, CancellingReporter
+from shared import DIR_DATA, CancellingReporter, TemporaryDirectory
 
 # Unit testing in Python 2 and 3
 try:
@@ -198,6 +198,68 @@ class Simulation1dTest(unittest.TestCase):
         self.assertRaises(ValueError, s.default_state, -1)
         self.assertRaises(ValueError, s.default_state, n)
 
+    def test_pre_steady_state(self):
+        # Test pre-pacing until a periodic steady state is reached.
+
+        m, p, _ = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        s = myokit.Simulation1d(m, p, ncells=5)
+        n = s.pre(100000, period=1000, tolerance=1e-4)
+        self.assertTrue(0 < n < 100)
+        self.assertEqual(s.time(), 0)
+        self.assertEqual(s.state(), s.default_state())
+
+        # Next beat should hardly change the state
+        x0 = np.array(s.state())
+        s.pre(1000)
+        x1 = np.array(s.state())
+        self.assertTrue(np.all(np.abs(x1 - x0) <= 1e-3 * (1 + np.abs(x1))))
+
+        # Invalid arguments
+        self.assertRaisesRegex(ValueError, 'period', s.pre, 1, period=-1)
+        self.assertRaisesRegex(
+            ValueError, 'tolerance', s.pre, 1, period=1, tolerance=-1)
+
+    def test_log_sink(self):
+        # Test writing the log to a sink instead of returning it.
+
+        m, p, _ = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        s = myokit.Simulation1d(m, p, ncells=3)
+        d = s.run(100, log=['engine.time', 'membrane.V'], log_interval=0.01)
+        s.reset()
+
+        # Use small chunks, to test writing in multiple parts
+        chunk_size = myokit._sim.LOG_SINK_CHUNK_SIZE
+        myokit._sim.LOG_SINK_CHUNK_SIZE = 8 * 1000
+        try:
+            with TemporaryDirectory() as td:
+                fname = td.path('log.zip')
+                with myokit.DataLogWriter(fname) as w:
+                    e = s.run(
+                        100, log=['engine.time', 'membrane.V'],
+                        log_interval=0.01, log_sink=w)
+                    self.assertEqual(w.length(), len(d.time()))
+                    self.assertTrue(len(w._chunks) > 1)
+                self.assertEqual(len(e.time()), 0)
+                self.assertEqual(set(e.keys()), set(d.keys()))
+                f = myokit.DataLog.load(fname)
+        finally:
+            myokit._sim.LOG_SINK_CHUNK_SIZE = chunk_size
+
+        self.assertEqual(f.time_key(), 'engine.time')
+        self.assertEqual(set(f.keys()), set(d.keys()))
+        for key, value in d.items():
+            self.assertTrue(np.all(np.array(f[key]) == value))
+
+        # Zero-length runs still write a file that can be loaded
+        with TemporaryDirectory() as td:
+            fname = td.path('log.zip')
+            with myokit.DataLogWriter(fname) as w:
+                s.run(0, log=['engine.time', 'membrane.V'], log_sink=w)
+            f = myokit.DataLog.load(fname)
+        self.assertEqual(f.time_key(), 'engine.time')
+        self.assertEqual(set(f.keys()), set(d.keys()))
+        self.assertEqual(len(f.time()), 0)
+
     def test_against_cvode(self):
         # Compare the Simulation1d output with CVODE output
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Tests the LeastSquaresAdjoint class.
+#
+# This file is part of Myokit.
+# See http://myokit.org for copyright, sharing, and licensing details.
+#
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+
+import os
+import unittest
+import numpy as np
+
+import myokit
+
+from shared import DIR_DATA
+
+# Unit testing in Python 2 and 3
+try:
+    unittest.TestCase.assertRaisesRegex
+except AttributeError:
+    unittest.TestCase.assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
+
+class LeastSquaresAdjointTest(unittest.TestCase):
+    """
+    Tests the :class:`LeastSquaresAdjoint`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.protocol, _ = myokit.load(
+            os.path.join(DIR_DATA, 'lr-1991.mmt'))
+
+    def test_gradient(self):
+        # Test the error and gradient against a simulation and finite
+        # differences
+
+        parameters = ['ina.gNa', 'ica.gCa', 'ib.gb', 'cell.K_o']
+        x = np.array([self.model.get(p).eval() for p in parameters])
+
+        # Create data, with data points at the start and at pacing events
+        s = myokit.Simulation(self.model, self.protocol)
+        s.set_tolerance(1e-8, 1e-8)
+        times = np.concatenate(([0, 0], np.arange(0, 500, 2), [500]))
+        d = s.run(500.001, log_times=times, log=['membrane.V'])
+        values = np.array(d['membrane.V'])
+        values += np.random.RandomState(1).normal(0, 1, values.shape)
+        s.reset()
+
+        a = myokit.LeastSquaresAdjoint(
+            s, times, values, 'membrane.V', parameters)
+        self.assertEqual(a.output(), 'membrane.V')
+        self.assertEqual(a.parameters(), parameters)
+        self.assertTrue(np.all(a.times() == times))
+        self.assertTrue(np.all(a.values() == values))
+
+        # Test error
+        x *= 1.05
+        e, g = a.evaluate(x)
+        s2 = myokit.Simulation(
+            self.model, self.protocol, parameters=parameters)
+        s2.set_tolerance(1e-8, 1e-8)
+        s2.set_parameters(x)
+        d = s2.run(500.001, log_times=times, log=['membrane.V'])
+        e2 = np.sum((np.array(d['membrane.V']) - values)**2)
+        self.assertAlmostEqual(e, e2, delta=e * 1e-2)
+
+        # Test gradient
+        self.assertEqual(g.shape, (len(parameters), ))
+        for i, p in enumerate(parameters):
+            h = x[i] * 1e-5
+            xp, xm = np.array(x), np.array(x)
+            xp[i] += h
+            xm[i] -= h
+            fd = (a.evaluate(xp)[0] - a.evaluate(xm)[0]) / (2 * h)
+            self.assertAlmostEqual(g[i], fd, delta=abs(fd) * 1e-2)
+
+        # Simulation is not changed, but its time and state are used
+        self.assertEqual(s.time(), 0)
+        s.run(10)
+        self.assertRaisesRegex(
+            ValueError, 'greater than or equal', a.evaluate, x)
+
+    def test_intermediary_output(self):
+        # Test using an intermediary output, without a protocol
+
+        s = myokit.Simulation(self.model)
+        s.set_tolerance(1e-8, 1e-8)
+        s.set_state([-20] + s.state()[1:])
+        times = np.linspace(0, 20, 21)
+        values = np.zeros(times.shape)
+        a = myokit.LeastSquaresAdjoint(
+            s, times, values, 'ica.ICa', ['ica.gCa'])
+        x = self.model.get('ica.gCa').eval()
+        e, g = a.evaluate([x])
+        h = x * 1e-5
+        fd = (a.evaluate([x + h])[0] - a.evaluate([x - h])[0]) / (2 * h)
+        self.assertAlmostEqual(g[0], fd, delta=abs(fd) * 1e-2)
+
+    def test_invalid_arguments(self):
+        # Test argument checking
+
+        s = myokit.Simulation(self.model, self.protocol)
+        t = [0, 1, 2]
+        v = [0, 0, 0]
+        p = ['ina.gNa']
+        LSA = myokit.LeastSquaresAdjoint
+        self.assertRaisesRegex(
+            ValueError, 'Simulation', LSA, None, t, v, 'membrane.V', p)
+        self.assertRaisesRegex(
+            ValueError, 'non-empty', LSA, s, [], [], 'membrane.V', p)
+        self.assertRaisesRegex(
+            ValueError, 'same length', LSA, s, t, v[1:], 'membrane.V', p)
+        self.assertRaisesRegex(
+            ValueError, 'non-decreasing', LSA, s, [0, 2, 1], v,
+            'membrane.V', p)
+        self.assertRaisesRegex(
+            ValueError, 'bound', LSA, s, t, v, 'engine.time', p)
+        self.assertRaisesRegex(
+            ValueError, 'state or an intermediary', LSA, s, t, v,
+            'ina.gNa', p)
+        self.assertRaisesRegex(
+            ValueError, 'At least one', LSA, s, t, v, 'membrane.V', [])
+        self.assertRaisesRegex(
+            ValueError, 'literal constants', LSA, s, t, v, 'membrane.V',
+            ['ina.INa'])
+        self.assertRaisesRegex(
+            ValueError, 'Duplicate', LSA, s, t, v, 'membrane.V',
+            ['ina.gNa', 'ina.gNa'])
+        a = LSA(s, t, v, 'membrane.V', p)
+        self.assertRaisesRegex(
+            ValueError, 'sequence of 1', a.evaluate, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,17 +8,19 @@
 from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
+import array
 import numpy as np
 import os
 import pickle
 import platform
 import re
+import threading
 import unittest
 import sys
 
 import myokit
 
-from shared import DIR_DATA, CancellingReporter
+from shared import DIR_DATA, CancellingReporter, TemporaryDirectory
 
 # Unit testing in Python 2 and 3
 try:
@@ -47,6 +49,37 @@ class SimulationTest(unittest.TestCase):
         self.sim.reset()
         self.sim.pre(200)
 
+    def test_pre_steady_state(self):
+        # Test pre-pacing until a periodic steady state is reached.
+
+        s = myokit.Simulation(self.model, self.protocol)
+        n = s.pre(100000, period=1000, tolerance=1e-4)
+        self.assertIsInstance(n, int)
+        self.assertTrue(0 < n < 100)
+        self.assertEqual(s.time(), 0)
+        self.assertEqual(s.state(), s.default_state())
+
+        # Next beat should hardly change the state
+        x0 = np.array(s.state())
+        s.pre(1000)
+        x1 = np.array(s.state())
+        self.assertTrue(np.all(np.abs(x1 - x0) <= 1e-3 * (1 + np.abs(x1))))
+
+        # No steady state reached: Full duration is simulated
+        s.reset()
+        s.set_default_state(self.model.state())
+        s.reset()
+        self.assertEqual(s.pre(2000, period=1000, tolerance=0), 2)
+        s2 = myokit.Simulation(self.model, self.protocol)
+        s2.pre(2000)
+        self.assertTrue(np.allclose(s.state(), s2.state()))
+
+        # Invalid arguments
+        self.assertRaisesRegex(
+            ValueError, 'period', s.pre, 1000, period=0)
+        self.assertRaisesRegex(
+            ValueError, 'tolerance', s.pre, 1000, period=1, tolerance=-1)
+
     def test_simple(self):
         # Test simple run.
 
@@ -72,7 +105,7 @@ class SimulationTest(unittest.TestCase):
         d1 = self.sim.run(5)
         self.sim.reset()
         d2 = self.sim.run(5, log_interval=-5)
-        self.assertEqual(d1.time(), d2.time())
+        self.assertEqual(list(d1.time()), list(d2.time()))
 
     def test_no_protocol(self):
         # Test running without a protocol.
@@ -148,6 +181,45 @@ class SimulationTest(unittest.TestCase):
         self.assertNotEqual(e['engine.time'][n - 1], e['engine.time'][n])
         self.assertGreater(e['engine.time'][n], e['engine.time'][n - 1])
 
+    def test_numpy_logs(self):
+        # Test that logs are returned as NumPy arrays, and can be appended to.
+
+        self.sim.reset()
+        d = self.sim.run(10, log=['engine.time', 'membrane.V'])
+        self.assertIsInstance(d['engine.time'], np.ndarray)
+        self.assertIsInstance(d['membrane.V'], np.ndarray)
+        self.assertEqual(d['membrane.V'].dtype, np.float64)
+        n = len(d.time())
+
+        # Append to a log returned by a previous run
+        d = self.sim.run(10, log=d)
+        self.assertIsInstance(d['membrane.V'], np.ndarray)
+        self.assertEqual(d.time()[n - 1], 10)
+        self.assertGreater(d.time()[n], 10)
+        self.assertEqual(d.time()[-1], 20)
+        self.assertTrue(np.all(np.diff(d.time()) > 0))
+
+        # Append to a log with list entries
+        e = myokit.DataLog()
+        e.set_time_key('engine.time')
+        e['engine.time'] = [0, 1]
+        e['membrane.V'] = [-80, -80]
+        self.sim.reset()
+        e = self.sim.run(5, log=e, log_interval=1)
+        self.assertEqual(list(e.time()), [0, 1, 0, 1, 2, 3, 4])
+        self.assertEqual(len(e['membrane.V']), 7)
+        self.assertEqual(e['membrane.V'].dtype, np.float64)
+        self.assertNotEqual(e['membrane.V'][2], int(e['membrane.V'][2]))
+
+        # Single precision arrays are preserved
+        e = myokit.DataLog()
+        e.set_time_key('engine.time')
+        e['engine.time'] = array.array(str('f'))
+        self.sim.reset()
+        e = self.sim.run(5, log=e, log_interval=1)
+        self.assertEqual(e['engine.time'].dtype, np.float32)
+        self.assertEqual(list(e.time()), [0, 1, 2, 3, 4])
+
     def test_pacing_values_at_event_transitions(self):
         # Tests the value of the pacing signal at event transitions
 
@@ -343,6 +415,60 @@ class SimulationTest(unittest.TestCase):
         self.assertRaisesRegex(
             ValueError, 'not a literal', self.sim.set_constant, 'ina.ENa', 11)
 
+    def test_parameters(self):
+        # Test declaring parameters and setting them with set_parameters()
+
+        m, p, _ = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        s = myokit.Simulation(m, p, parameters=['ina.gNa', 'ica.gCa'])
+        self.assertEqual(s.parameters(), ['ina.gNa', 'ica.gCa'])
+        t = myokit.Simulation(m, p)
+        self.assertEqual(t.parameters(), [])
+
+        # Compare with set_constant
+        s.set_parameters(np.array([14, 0.1]))
+        t.set_constant('ina.gNa', 14)
+        t.set_constant('ica.gCa', 0.1)
+        d = s.run(100, log=['membrane.V'])
+        e = t.run(100, log=['membrane.V'])
+        self.assertTrue(np.all(np.array(d['membrane.V']) == e['membrane.V']))
+        s.reset()
+        t.reset()
+        s.set_parameters({'ica.gCa': 0.08})
+        s.set_parameters({m.get('ina.gNa'): 12})
+        t.set_constant('ina.gNa', 12)
+        t.set_constant('ica.gCa', 0.08)
+        d = s.run(100, log=['membrane.V'])
+        e = t.run(100, log=['membrane.V'])
+        self.assertTrue(np.all(np.array(d['membrane.V']) == e['membrane.V']))
+
+        # Values are copied to the internal model when pickling
+        u = pickle.loads(pickle.dumps(s))
+        self.assertEqual(u.parameters(), s.parameters())
+        s.reset()
+        u.reset()
+        d = s.run(100, log=['membrane.V'])
+        e = u.run(100, log=['membrane.V'])
+        self.assertTrue(np.all(np.array(d['membrane.V']) == e['membrane.V']))
+
+        # Bad values
+        self.assertRaisesRegex(
+            ValueError, '2 values', s.set_parameters, [1, 2, 3])
+        self.assertRaisesRegex(
+            ValueError, 'Unknown', s.set_parameters, {'bert': 2})
+        self.assertRaisesRegex(
+            ValueError, 'not set as a parameter', s.set_parameters,
+            {'cell.Na_i': 2})
+        self.assertRaisesRegex(
+            ValueError, 'parameter', s.set_constant, 'ina.gNa', 1)
+
+        # Bad parameters
+        self.assertRaisesRegex(
+            ValueError, 'literal', myokit.Simulation, m, p,
+            parameters=['ina.ENa'])
+        self.assertRaisesRegex(
+            ValueError, 'Duplicate', myokit.Simulation, m, p,
+            parameters=['ina.gNa', 'ina.gNa'])
+
     def test_short_runs(self):
         # Test for simulations run a very short time
 
@@ -431,8 +557,8 @@ class SimulationTest(unittest.TestCase):
         self.assertEqual(list(d1['c.w']), [0, 0])
         s2 = myokit.Simulation(m2)
         d2 = s2.run(6, log_times=d1.time())
-        self.assertEqual(d1.time(), d2.time())
-        self.assertEqual(d1['c.w'], d2['c.w'])
+        self.assertEqual(list(d1.time()), list(d2.time()))
+        self.assertEqual(list(d1['c.w']), list(d2['c.w']))
 
         # Test with a protocol and dynamic logging
         p = myokit.Protocol()
@@ -449,8 +575,8 @@ class SimulationTest(unittest.TestCase):
         s2.reset()
         s2.set_protocol(p)
         d2 = s2.run(p.characteristic_time() + 1, log_times=d1.time())
-        self.assertEqual(d1.time(), d2.time())
-        self.assertEqual(d1['c.w'], d2['c.w'])
+        self.assertEqual(list(d1.time()), list(d2.time()))
+        self.assertEqual(list(d1['c.w']), list(d2['c.w']))
 
         # Test with fixed logging times
         s1.reset()
@@ -459,8 +585,8 @@ class SimulationTest(unittest.TestCase):
         self.assertEqual(list(d1['c.w']), [0, 2, 4, 6, 0])
         s2.reset()
         d2 = s2.run(p.characteristic_time() + 1, log_times=d1.time())
-        self.assertEqual(d1.time(), d2.time())
-        self.assertEqual(d1['c.w'], d2['c.w'])
+        self.assertEqual(list(d1.time()), list(d2.time()))
+        self.assertEqual(list(d1['c.w']), list(d2['c.w']))
 
         # Test appending to log
         s1.reset()
@@ -475,6 +601,384 @@ class SimulationTest(unittest.TestCase):
         self.assertEqual(list(d1.time()), [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
         self.assertEqual(list(d1['c.w']), [0, 0, 2, 2, 4, 4, 4, 4, 6, 6, 0])
 
+    def test_log_changes(self):
+        # Test change-driven logging
+
+        s = myokit.Simulation(self.model, self.protocol)
+        d = s.run(1000, log=['engine.time', 'membrane.V', 'ica.Ca_i'])
+        s.reset()
+        e = s.run(
+            1000, log=['engine.time', 'membrane.V', 'ica.Ca_i'],
+            log_changes={'membrane.V': (0.5, 0.01)})
+        self.assertLess(len(e.time()), len(d.time()) / 10)
+        self.assertEqual(e.time()[0], d.time()[0])
+        self.assertEqual(e.time()[-1], d.time()[-1])
+
+        # Every point except the last differs from the point before by more
+        # than the threshold
+        v = np.asarray(e['membrane.V'])
+        self.assertTrue(np.all(
+            np.abs(v[1:-1] - v[:-2]) > 0.5 + 0.01 * np.abs(v[:-2])))
+
+        # The logged points are a subset of the normally logged points
+        self.assertTrue(np.all(np.in1d(e.time(), d.time())))
+
+        # Multiple variables and absolute thresholds, using variable objects
+        s.reset()
+        f = s.run(
+            1000, log=['engine.time', 'membrane.V', 'ica.Ca_i'],
+            log_changes={
+                'membrane.V': 0.5,
+                self.model.get('ica.Ca_i'): 1e-5,
+            })
+        self.assertGreater(len(f.time()), 2)
+        self.assertLess(len(f.time()), len(d.time()))
+
+        # Invalid arguments
+        self.assertRaisesRegex(
+            ValueError, 'log_interval', s.run, 1, log_interval=1,
+            log_changes={'membrane.V': 1})
+        self.assertRaisesRegex(
+            ValueError, 'log_interval or log_times', s.run, 1,
+            log_times=[0, 1], log_changes={'membrane.V': 1})
+        self.assertRaisesRegex(
+            ValueError, 'must be logged', s.run, 1,
+            log=['engine.time'], log_changes={'membrane.V': 1})
+        self.assertRaisesRegex(
+            ValueError, 'non-negative', s.run, 1,
+            log_changes={'membrane.V': -1})
+        self.assertRaisesRegex(
+            ValueError, 'non-negative', s.run, 1,
+            log_changes={'membrane.V': (1, -1)})
+
+    def test_log_sink(self):
+        # Test writing the log to a sink instead of returning it.
+
+        class Sink(object):
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, log):
+                self.chunks.append(log)
+
+        s = myokit.Simulation(self.model, self.protocol)
+        d = s.run(1000, log_interval=0.5)
+        s.reset()
+
+        chunk_size = myokit._sim.LOG_SINK_CHUNK_SIZE
+        myokit._sim.LOG_SINK_CHUNK_SIZE = 8 * 100
+        try:
+            sink = Sink()
+            e = s.run(1000, log_interval=0.5, log_sink=sink)
+        finally:
+            myokit._sim.LOG_SINK_CHUNK_SIZE = chunk_size
+        self.assertEqual(len(e.time()), 0)
+        self.assertTrue(len(sink.chunks) > 1)
+        for chunk in sink.chunks:
+            self.assertIsInstance(chunk, myokit.DataLog)
+            self.assertEqual(chunk.time_key(), d.time_key())
+            self.assertEqual(list(chunk.keys()), list(d.keys()))
+        for key, value in d.items():
+            x = np.concatenate([chunk[key] for chunk in sink.chunks])
+            if key != 'engine.realtime':
+                self.assertTrue(np.all(x == value))
+
+        # Zero-length runs still write a file that can be loaded
+        with TemporaryDirectory() as td:
+            fname = td.path('log.zip')
+            with myokit.DataLogWriter(fname) as w:
+                s.run(0, log_sink=w)
+            e = myokit.DataLog.load(fname)
+        self.assertEqual(e.time_key(), d.time_key())
+        self.assertEqual(list(e.keys()), list(d.keys()))
+        self.assertEqual(len(e.time()), 0)
+
+    def test_biomarkers(self):
+        # Test calculating biomarkers during a simulation
+
+        s = myokit.Simulation(self.model, self.protocol)
+        b = myokit.Biomarkers(1000, 'membrane.V', 'ica.Ca_i')
+        d, e = s.run(3000, biomarkers=b)
+        self.assertEqual(list(e.keys()), b.keys())
+        self.assertEqual(e.time_key(), 'time')
+        self.assertEqual(list(e.time()), [0, 1000, 2000])
+
+        # Compare with values calculated from the full traces
+        t = np.asarray(d.time())
+        for i, t0 in enumerate(e.time()):
+            j = (t >= t0) & (t <= t0 + 1000)
+            time = t[j]
+            v = np.asarray(d['membrane.V'])[j]
+            dv = np.asarray(d['dot(membrane.V)'])[j]
+            ca = np.asarray(d['ica.Ca_i'])[j]
+            self.assertAlmostEqual(e['rest'][i], v[0], delta=1e-3)
+            self.assertAlmostEqual(e['peak'][i], np.max(v))
+            self.assertAlmostEqual(e['dvdt_max'][i], np.max(dv))
+            self.assertAlmostEqual(e['cat_diastolic'][i], ca[0], delta=1e-8)
+            self.assertAlmostEqual(e['cat_peak'][i], np.max(ca))
+            self.assertAlmostEqual(
+                e['cat_amplitude'][i], np.max(ca) - ca[0], delta=1e-8)
+            tup = time[np.argmax(dv)]
+            for x in (30, 50, 90):
+                level = np.max(v) - x / 100 * (np.max(v) - v[0])
+                k = np.argmax(v)
+                k += np.argmax(v[k:] <= level)
+                self.assertLessEqual(e['apd' + str(x)][i], time[k] - tup)
+                self.assertGreater(e['apd' + str(x)][i], time[k - 1] - tup)
+            tup = time[np.argmax(np.asarray(d['dot(ica.Ca_i)'])[j])]
+            level = np.max(ca) - 0.9 * (np.max(ca) - ca[0])
+            k = np.argmax(ca)
+            k += np.argmax(ca[k:] <= level)
+            self.assertLessEqual(e['catd90'][i], time[k] - tup)
+            self.assertGreater(e['catd90'][i], time[k - 1] - tup)
+
+        # Partial beats are not reported, without logging
+        s.reset()
+        d, e = s.run(2500, log=myokit.LOG_NONE, biomarkers=b)
+        self.assertEqual(len(d), 0)
+        self.assertEqual(list(e.time()), [0, 1000])
+
+        # Combined with apds
+        s = myokit.Simulation(self.model, self.protocol, apd_var='membrane.V')
+        b = myokit.Biomarkers(1000, 'membrane.V', apd=[90])
+        d, apds, e = s.run(1000, apd_threshold=-70, biomarkers=b)
+        self.assertEqual(list(e.keys()), ['time', 'rest', 'peak', 'dvdt_max',
+                                          'apd90'])
+        self.assertEqual(len(apds['duration']), 1)
+        self.assertEqual(len(e['apd90']), 1)
+
+        # No runs
+        d, e = s.run(0, biomarkers=b)
+        self.assertEqual(len(e.time()), 0)
+
+        # Invalid arguments
+        self.assertRaisesRegex(
+            ValueError, 'Biomarkers', s.run, 1, biomarkers=12)
+        b = myokit.Biomarkers(1000, 'ina.INa')
+        self.assertRaisesRegex(ValueError, 'states', s.run, 1, biomarkers=b)
+        b = myokit.Biomarkers(1000, 'membrane.W')
+        self.assertRaisesRegex(ValueError, 'Unknown', s.run, 1, biomarkers=b)
+
+    def test_biomarkers_two_traces(self):
+        # Test biomarkers for two traces, when a level crossing of the first
+        # trace occurs in the final step of a beat
+
+        m = myokit.parse_model('''
+            [[model]]
+            membrane.V = 0
+            calcium.Ca = 0
+
+            [engine]
+            time = 0 bind time
+            pace = 0 bind pace
+
+            [membrane]
+            dot(V) = (100 * engine.pace - V) / 20
+
+            [calcium]
+            dot(Ca) = (100 * engine.pace - Ca) / 5
+            ''')
+
+        # After a 2ms stimulus, V drops below 10% of its peak at t1 (and Ca
+        # long before). End the first beat shortly after.
+        s = myokit.Simulation(m, myokit.pacing.blocktrain(1000, 2))
+        d = s.run(100, log_times=np.arange(0, 100, 0.001))
+        v = np.asarray(d['membrane.V'])
+        k = np.argmax(v)
+        t1 = d.time()[k + np.argmax(v[k:] < 0.1 * v[k])]
+        period = t1 + 0.05
+        p = myokit.pacing.blocktrain(period, 2)
+        b = myokit.Biomarkers(
+            period, 'membrane.V', 'calcium.Ca', apd=[90], catd=[50, 90])
+
+        # Log finely, including the beat starts and the ends of the stimuli
+        times = np.concatenate((
+            np.arange(0, 2 * period, 0.001), [period, 2, period + 2]))
+        s = myokit.Simulation(m, p)
+        d, e = s.run(2 * period, log_times=np.unique(times), biomarkers=b)
+        self.assertEqual(list(e.time()), [0, period])
+
+        # Compare both traces with the logged reference
+        t = np.asarray(d.time())
+        for i, t0 in enumerate(e.time()):
+            j = (t >= t0) & (t <= t0 + period)
+            time = t[j]
+            for x, rest, peak, durations in (
+                    ('membrane.V', 'rest', 'peak', {'apd90': 0.9}),
+                    ('calcium.Ca', 'cat_diastolic', 'cat_peak',
+                     {'catd50': 0.5, 'catd90': 0.9})):
+                v = np.asarray(d[x])[j]
+                self.assertAlmostEqual(e[rest][i], v[0])
+                self.assertAlmostEqual(e[peak][i], np.max(v))
+
+                # Durations are measured from the maximum slope, which is at
+                # the first solver step after the start of the beat
+                for key, f in durations.items():
+                    level = np.max(v) - f * (np.max(v) - v[0])
+                    k = np.argmax(v)
+                    k += np.argmax(v[k:] <= level)
+                    self.assertAlmostEqual(e[key][i], time[k] - t0, delta=0.05)
+
+    def test_thresholds(self):
+        # Test detecting threshold crossings during a simulation
+
+        s = myokit.Simulation(self.model, self.protocol)
+        c = [('membrane.V', -40), ('membrane.V', 0, 1), ('ina.INa', -100, -1)]
+        d, e = s.run(2000, thresholds=c)
+        self.assertEqual(list(e.keys()), ['time', 'index', 'direction'])
+        self.assertEqual(s.time(), 2000)
+
+        # Compare with crossings in the full traces
+        t = np.asarray(d.time())
+        for i, (var, level) in enumerate([x[:2] for x in c]):
+            x = np.asarray(d[var]) - level
+            up = np.sum((x[:-1] < 0) & (x[1:] >= 0))
+            down = np.sum((x[:-1] > 0) & (x[1:] <= 0))
+            j = e['index'] == i
+            if len(c[i]) == 2:
+                self.assertEqual(np.sum(e['direction'][j] == 1), up)
+                self.assertEqual(np.sum(e['direction'][j] == -1), down)
+            elif c[i][2] > 0:
+                self.assertEqual(list(e['direction'][j]), [1] * up)
+            else:
+                self.assertEqual(list(e['direction'][j]), [-1] * down)
+            for tc in e['time'][j]:
+                k = np.searchsorted(t, tc)
+                y = x[k - 1:k + 2]
+                self.assertLessEqual(np.min(y) * np.max(y), 0)
+        self.assertEqual(list(e['time']), sorted(e['time']))
+        self.assertEqual(np.sum(e['index'] == 0), 4)
+
+        # Stop at the first upstroke
+        s.reset()
+        d, e = s.run(1000, thresholds=c, stop_on=1)
+        self.assertEqual(sorted(e['index']), [0, 1, 2])
+        self.assertEqual(e['index'][-1], 1)
+        self.assertEqual(s.time(), e['time'][-1])
+        self.assertEqual(d.time()[-1], s.time())
+        self.assertAlmostEqual(d['membrane.V'][-1], 0, delta=2)
+        self.assertEqual(s.state()[0], d['membrane.V'][-1])
+
+        # Continue, stopping on a derivative, with periodic logging
+        d, e = s.run(
+            1000, log_interval=1, thresholds=[('dot(membrane.V)', -1, -1)],
+            stop_on=[0])
+        self.assertEqual(len(e['time']), 1)
+        self.assertEqual(s.time(), e['time'][0])
+        self.assertLess(d.time()[-1], s.time())
+
+        # Combined with apds
+        s = myokit.Simulation(self.model, self.protocol, apd_var='membrane.V')
+        d, apds, e = s.run(1000, apd_threshold=-70, thresholds=c)
+        self.assertEqual(len(apds['duration']), 1)
+        self.assertEqual(sorted(e['index']), [0, 0, 1, 2])
+
+        # No runs
+        d, apds, e = s.run(0, apd_threshold=-70, thresholds=c)
+        self.assertEqual(len(e['time']), 0)
+
+        # Invalid arguments
+        self.assertRaisesRegex(
+            ValueError, 'tuples', s.run, 1, thresholds=[('membrane.V', )])
+        self.assertRaisesRegex(
+            ValueError, 'directions', s.run, 1,
+            thresholds=[('membrane.V', 0, 2)])
+        self.assertRaisesRegex(
+            ValueError, 'Unknown', s.run, 1, thresholds=[('membrane.W', 0)])
+        self.assertRaisesRegex(
+            ValueError, 'Derivatives', s.run, 1,
+            thresholds=[('dot(ina.INa)', 0)])
+        self.assertRaisesRegex(
+            ValueError, 'constants', s.run, 1, thresholds=[('ina.gNa', 0)])
+        self.assertRaisesRegex(
+            ValueError, 'stop_on', s.run, 1, thresholds=c, stop_on=3)
+        self.assertRaisesRegex(ValueError, 'stop_on', s.run, 1, stop_on=0)
+
+    def test_dense_output(self):
+        # Test evaluating the state after a run using dense output
+
+        s = myokit.Simulation(self.model, self.protocol)
+        d, f = s.run(1000, dense_output=True)
+        self.assertIsInstance(f, myokit.DenseOutput)
+        self.assertEqual(f.tmin(), 0)
+        self.assertEqual(f.tmax(), 1000)
+        self.assertTrue(0 < f.steps() < len(d.time()))
+        self.assertEqual(f.states(), [x.qname() for x in self.model.states()])
+
+        # Compare with logged steps and with point-list logging
+        y = f.interpolate(d.time())
+        for i, key in enumerate(f.states()):
+            self.assertTrue(np.allclose(y[:, i], d[key], rtol=1e-12))
+        times = np.sort(np.random.uniform(0, 1000, 200))
+        s.reset()
+        e = s.run(1000, log_times=times)
+        g = f.log(times[::-1])
+        self.assertEqual(g.time_key(), 'engine.time')
+        for key in f.states():
+            self.assertTrue(np.allclose(g[key][::-1], e[key], rtol=1e-9))
+
+        # Pickling
+        g = pickle.loads(pickle.dumps(f))
+        self.assertTrue(np.all(g.interpolate(times) == f.interpolate(times)))
+
+        # Times outside of interval
+        self.assertRaisesRegex(
+            ValueError, 'within', f.interpolate, [-1, 100])
+        self.assertRaisesRegex(
+            ValueError, 'within', f.interpolate, [1001])
+
+        # Combined with early stopping
+        s.reset()
+        d, e, f = s.run(
+            1000, thresholds=[('membrane.V', 0, 1)], stop_on=0,
+            dense_output=True)
+        self.assertEqual(f.tmax(), s.time())
+        self.assertAlmostEqual(f.interpolate([s.time()])[0, 0], 0, delta=2)
+
+        # Zero duration
+        s.reset()
+        d, f = s.run(0, dense_output=True)
+        self.assertEqual(f.steps(), 0)
+        self.assertEqual(list(f.interpolate([0])[0]), s.state())
+
+    def test_solver_reuse(self):
+        # Test reusing the solver memory between runs
+
+        # Reference run, with a newly created solver
+        s = myokit.Simulation(self.model, self.protocol, apd_var='membrane.V')
+        created = s._sim.number_of_solvers_created
+        self.assertEqual(created(s._instance), 0)
+        d1 = s.run(600, log_interval=1)
+        n1 = s.last_number_of_steps()
+        self.assertEqual(created(s._instance), 1)
+
+        # Runs with a reused solver give the same results, also after runs
+        # that used root finding
+        s.reset()
+        s.run(60, apd_threshold=-70, thresholds=[('membrane.V', 0, 1)])
+        s.run(10)
+        s.reset()
+        d2 = s.run(600, log_interval=1)
+        self.assertEqual(s.last_number_of_steps(), n1)
+        self.assertTrue(np.allclose(d1['membrane.V'], d2['membrane.V']))
+        s.reset()
+        d2, apds = s.run(600, apd_threshold=-70)
+        self.assertEqual(len(apds['start']), 1)
+        self.assertEqual(created(s._instance), 1)
+
+        # A new solver is created after freeing the old one
+        s._sim.free_solver(s._instance)
+        s.reset()
+        d2 = s.run(600, log_interval=1)
+        self.assertEqual(s.last_number_of_steps(), n1)
+        self.assertEqual(created(s._instance), 2)
+
+        # Solvers are not shared between simulations
+        s2 = myokit.Simulation(self.model, self.protocol)
+        s2.run(10)
+        self.assertEqual(created(s2._instance), 1)
+        self.assertEqual(created(s._instance), 2)
+
     def test_pickling(self):
         # Test pickling a simulation
 
@@ -510,6 +1014,350 @@ class SimulationTest(unittest.TestCase):
         self.assertEqual(s1.time(), s2.time())
         self.assertEqual(s1.state(), s2.state())
 
+    def test_run_ensemble(self):
+        # Test running an ensemble of simulations
+
+        s = myokit.Simulation(self.model, self.protocol)
+        s.set_time(10)
+        s.set_constant('ina.gNa', 14)
+        values = [[0.09], [0.05], [0.07]]
+        log = ['membrane.V', 'dot(membrane.V)', 'engine.time', 'ica.ICa']
+        logs, states = s.run_ensemble(
+            values, 500, log=log, log_interval=1, threads=2,
+            parameters=['ica.gCa'])
+        self.assertEqual(list(logs.keys()), log)
+        self.assertEqual(logs['membrane.V'].shape, (3, 500))
+        self.assertEqual(states.shape, (3, 8))
+        self.assertEqual(
+            list(logs['engine.time'][2]), list(10 + np.arange(500)))
+
+        # Simulation time and state are unchanged
+        self.assertEqual(s.time(), 10)
+        self.assertEqual(s.state(), s.default_state())
+
+        # Results equal those of a normal run
+        for i, row in enumerate(values):
+            s.reset()
+            s.set_time(10)
+            s.set_constant('ica.gCa', row[0])
+            d = s.run(500, log=log, log_interval=1)
+            for key in log:
+                self.assertTrue(np.all(logs[key][i] == d[key]))
+            self.assertEqual(list(states[i]), s.state())
+
+        # Point-list logging, one thread, variable object
+        s.reset()
+        logs, states = s.run_ensemble(
+            values, 50, log=['membrane.V'], log_times=[20, 30, 30, 70],
+            threads=1, parameters=[self.model.get('ica.gCa')])
+        self.assertEqual(logs['membrane.V'].shape, (3, 3))
+
+        # No logging
+        logs, states = s.run_ensemble(values, 50, parameters=['ica.gCa'])
+        self.assertEqual(len(logs), 0)
+        self.assertEqual(states.shape, (3, 8))
+
+        # Failed members are indicated with NaNs
+        logs, states = s.run_ensemble(
+            [[0.09], [1e300]], 50, log=['membrane.V'], log_interval=1,
+            parameters=['ica.gCa'])
+        self.assertFalse(np.any(np.isnan(states[0])))
+        self.assertFalse(np.any(np.isnan(logs['membrane.V'][0])))
+        self.assertTrue(np.all(np.isnan(states[1])))
+        self.assertTrue(np.all(np.isnan(logs['membrane.V'][1])))
+
+        # Declared parameters are used by default
+        s2 = myokit.Simulation(
+            self.model, self.protocol, parameters=['ica.gCa', 'ina.gNa'])
+        s2.set_parameters([0.1, 14])
+        logs2, states2 = s2.run_ensemble(
+            [[0.09, 16], [0.05, 16]], 50, log=['membrane.V'], log_interval=1)
+        for i, gca in enumerate([0.09, 0.05]):
+            s.reset()
+            s.set_constant('ica.gCa', gca)
+            s.set_constant('ina.gNa', 16)
+            d = s.run(50, log=['membrane.V'], log_interval=1)
+            self.assertTrue(np.all(logs2['membrane.V'][i] == d['membrane.V']))
+
+        # Constants that are not varied keep their values
+        s2.reset()
+        logs2, states2 = s2.run_ensemble(
+            [[0.08]], 50, log=['membrane.V'], log_interval=1,
+            parameters=['ica.gCa'])
+        s.reset()
+        s.set_constant('ica.gCa', 0.08)
+        s.set_constant('ina.gNa', 14)
+        d = s.run(50, log=['membrane.V'], log_interval=1)
+        self.assertTrue(np.all(logs2['membrane.V'][0] == d['membrane.V']))
+
+        # Invalid input
+        self.assertRaisesRegex(
+            ValueError, 'not a literal', s.run_ensemble, values, 10,
+            parameters=['ica.ICa'])
+        self.assertRaisesRegex(
+            ValueError, 'one column per', s.run_ensemble, [[1, 2]], 10,
+            parameters=['ica.gCa'])
+        self.assertRaisesRegex(
+            ValueError, 'one column per', s2.run_ensemble, values, 10)
+        self.assertRaisesRegex(
+            ValueError, 'negative', s.run_ensemble, values, -1,
+            parameters=['ica.gCa'])
+        self.assertRaisesRegex(
+            ValueError, 'log_interval or log_times', s.run_ensemble,
+            values, 10, log=['membrane.V'], parameters=['ica.gCa'])
+        self.assertRaisesRegex(
+            ValueError, 'simultaneously', s.run_ensemble, values, 10,
+            log_interval=1, log_times=[1], parameters=['ica.gCa'])
+        self.assertRaisesRegex(
+            ValueError, 'non-decreasing', s.run_ensemble, values, 10,
+            log_times=[2, 1], parameters=['ica.gCa'])
+        self.assertRaisesRegex(
+            ValueError, 'at least 1', s.run_ensemble, values, 10,
+            threads=0, parameters=['ica.gCa'])
+
+    def test_threads(self):
+        # Test running independent simulations in parallel threads.
+
+        sims = [myokit.Simulation(self.model, self.protocol) for i in range(3)]
+        for i, s in enumerate(sims):
+            s.set_constant('ica.gCa', 0.09 * (1 + 0.1 * i))
+
+        # Serial results
+        serial = []
+        for s in sims:
+            s.reset()
+            serial.append(s.run(500, log=['engine.time', 'membrane.V']))
+            s.reset()
+
+        # Threaded results
+        threaded = [None] * len(sims)
+
+        def run(i):
+            threaded[i] = sims[i].run(500, log=['engine.time', 'membrane.V'])
+
+        threads = [
+            threading.Thread(target=run, args=(i, )) for i in range(len(sims))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for a, b in zip(serial, threaded):
+            self.assertEqual(list(a.time()), list(b.time()))
+            self.assertEqual(list(a['membrane.V']), list(b['membrane.V']))
+        self.assertNotEqual(
+            list(serial[0]['membrane.V']), list(serial[1]['membrane.V']))
+
+    def test_shared_module(self):
+        # Test that constants, settings, and statistics are stored per
+        # instance, so that simulations can share a compiled module.
+
+        log = ['engine.time', 'membrane.V']
+        s1 = myokit.Simulation(self.model, self.protocol)
+        s1.set_constant('ica.gCa', 0.1)
+        s1.set_tolerance(1e-8, 1e-8)
+        s1.set_max_step_size(0.5)
+        d1 = s1.run(200, log=log)
+        n1 = s1.last_number_of_steps(), s1.last_number_of_evaluations()
+        s1.reset()
+
+        # Reference result with default settings, from a separate module
+        s2 = myokit.Simulation(self.model, self.protocol)
+        d2 = s2.run(200, log=log)
+        n2 = s2.last_number_of_steps(), s2.last_number_of_evaluations()
+
+        # Second instance of the first simulation's module
+        s3 = myokit.Simulation(self.model, self.protocol)
+        s3._sim = s1._sim
+        s3._instance = s1._sim.sim_create()
+        d3 = s3.run(200, log=log)
+        n3 = s3.last_number_of_steps(), s3.last_number_of_evaluations()
+        self.assertEqual(list(d2.time()), list(d3.time()))
+        self.assertEqual(list(d2['membrane.V']), list(d3['membrane.V']))
+        self.assertEqual(n2, n3)
+
+        # First instance is unaffected
+        self.assertEqual(
+            (s1.last_number_of_steps(), s1.last_number_of_evaluations()), n1)
+        d4 = s1.run(200, log=log)
+        self.assertEqual(list(d1.time()), list(d4.time()))
+        self.assertEqual(list(d1['membrane.V']), list(d4['membrane.V']))
+        self.assertNotEqual(list(d1['membrane.V']), list(d3['membrane.V']))
+
+    def test_linear_solver(self):
+        # Test using band and sparse linear solvers
+
+        d = myokit.Simulation(self.model, self.protocol)
+        self.assertEqual(d.linear_solver(), 'dense')
+        d = d.run(500, log=['engine.time', 'membrane.V'])
+
+        # Banded solver
+        s = myokit.Simulation(self.model, self.protocol, linear_solver='band')
+        self.assertEqual(s.linear_solver(), 'band')
+        b = s.run(500, log=['engine.time', 'membrane.V'])
+        v = np.interp(d.time(), b.time(), b['membrane.V'])
+        self.assertTrue(np.allclose(v, d['membrane.V'], atol=1e-1))
+
+        # Sparse solver, falls back to dense if KLU is not available
+        s = myokit.Simulation(
+            self.model, self.protocol, linear_solver='sparse')
+        self.assertIn(s.linear_solver(), ('sparse', 'dense'))
+        e = s.run(500, log=['engine.time', 'membrane.V'])
+        v = np.interp(d.time(), e.time(), e['membrane.V'])
+        self.assertTrue(np.allclose(v, d['membrane.V'], atol=1e-1))
+
+        # Solver is retained when pickling
+        s = myokit.Simulation(self.model, self.protocol, linear_solver='band')
+        s = pickle.loads(pickle.dumps(s))
+        self.assertEqual(s.linear_solver(), 'band')
+
+        # Unknown solver
+        self.assertRaisesRegex(
+            ValueError, 'Unknown linear solver', myokit.Simulation,
+            self.model, self.protocol, linear_solver='magic')
+
+    def test_analytic_jacobian(self):
+        # Test using an analytic Jacobian, and compare the number of steps and
+        # rhs evaluations to a finite difference approximation.
+
+        s = myokit.Simulation(self.model, self.protocol)
+        d = s.run(1000, log=['engine.time', 'membrane.V'])
+        n_steps = s.last_number_of_steps()
+        n_evals = s.last_number_of_evaluations()
+
+        for solver in ('dense', 'band', 'sparse'):
+            s = myokit.Simulation(
+                self.model, self.protocol, linear_solver=solver,
+                analytic_jacobian=True)
+            e = s.run(1000, log=['engine.time', 'membrane.V'])
+
+            # No rhs evaluations are needed to update the Jacobian
+            self.assertLess(s.last_number_of_evaluations(), n_evals)
+            self.assertLess(s.last_number_of_steps(), 1.5 * n_steps)
+
+            v = np.interp(d.time(), e.time(), e['membrane.V'])
+            self.assertTrue(np.allclose(v, d['membrane.V'], atol=1e-1))
+
+        # Setting is retained when pickling
+        s = pickle.loads(pickle.dumps(s))
+        s.run(1000, log=myokit.LOG_NONE)
+        self.assertLess(s.last_number_of_evaluations(), n_evals)
+
+    def test_sensitivities(self):
+        # Test forward sensitivity calculation, and compare with PSimulation
+
+        dependents = ['membrane.V', 'ina.m', 'ik.IK', 'dot(membrane.V)']
+        independents = ['ina.gNa', 'ica.gCa', 'init(membrane.V)']
+        s = myokit.Simulation(
+            self.model, self.protocol,
+            sensitivities=(dependents, independents))
+        s.set_tolerance(1e-8, 1e-8)
+        times = np.linspace(10, 50, 41)
+        d, e = s.run(51, log_times=times)
+        self.assertEqual(e.shape, (41, 4, 3))
+
+        p = myokit.PSimulation(
+            self.model, self.protocol, variables=dependents[:3],
+            parameters=independents[:2])
+        p.set_step_size(0.001)
+        f, g = p.run(51, log_interval=1)
+        for j in range(3):
+            for k in range(2):
+                x = np.interp(times, f.time(), g[:, j, k])
+                self.assertLess(
+                    np.max(np.abs(e[:, j, k] - x)),
+                    5e-2 * np.max(np.abs(x)))
+
+        # Sensitivities of states to their own initial value start at 1
+        s.reset()
+        d, e = s.run(1)
+        self.assertEqual(e.shape, (len(d.time()), 4, 3))
+        self.assertEqual(e[0, 0, 2], 1)
+        self.assertEqual(e[0, 1, 2], 0)
+        self.assertEqual(list(e[0, 0, :2]), [0, 0])
+
+        # Sensitivities are continued, and retained when pickling
+        s2 = pickle.loads(pickle.dumps(s))
+        d, e = s.run(5, log_interval=1)
+        d2, e2 = s2.run(5, log_interval=1)
+        self.assertTrue(np.allclose(e, e2))
+        self.assertNotEqual(e[0, 0, 0], 0)
+
+        # Combined with apd tracking
+        s = myokit.Simulation(
+            self.model, self.protocol, apd_var='membrane.V',
+            sensitivities=(dependents, independents))
+        d, e, apds = s.run(600, log=myokit.LOG_NONE, apd_threshold=-70)
+        self.assertEqual(e.shape, (0, 4, 3))
+        self.assertEqual(len(apds['duration']), 1)
+
+        # Invalid arguments
+        self.assertRaisesRegex(
+            ValueError, 'must be None or a tuple', myokit.Simulation,
+            self.model, sensitivities=dependents)
+        self.assertRaisesRegex(
+            ValueError, 'cannot be constants', myokit.Simulation,
+            self.model, sensitivities=(['ina.gNa'], independents))
+        self.assertRaisesRegex(
+            ValueError, 'derivatives of state', myokit.Simulation,
+            self.model, sensitivities=(['dot(ina.INa)'], independents))
+        self.assertRaisesRegex(
+            ValueError, 'literal constants', myokit.Simulation,
+            self.model, sensitivities=(dependents, ['ina.INa']))
+        self.assertRaisesRegex(
+            ValueError, 'Initial values can only', myokit.Simulation,
+            self.model, sensitivities=(dependents, ['init(ina.INa)']))
+        self.assertRaisesRegex(
+            ValueError, 'bound to external', myokit.Simulation,
+            self.model, sensitivities=(dependents, ['engine.time']))
+
+    def test_jacobian_pattern(self):
+        # Test deriving bandwidth and sparsity from the dependency matrix
+        from myokit._sim.cvodesim import _bandwidth, _sparsity
+
+        pattern = [
+            [1, 1, 0, 0],
+            [1, 1, 1, 0],
+            [0, 0, 1, 0],
+            [0, 1, 0, 1],
+        ]
+        self.assertEqual(_bandwidth(pattern), (1, 2))
+        colptr, rowind, groups = _sparsity(pattern)
+        self.assertEqual(colptr, [0, 2, 5, 7, 8])
+        self.assertEqual(rowind, [0, 1, 0, 1, 3, 1, 2, 3])
+        self.assertEqual(groups, [0, 1, 2, 0])
+
+
+class BiomarkersTest(unittest.TestCase):
+    """
+    Tests the :class:`myokit.Biomarkers` specification.
+    """
+    def test_biomarkers(self):
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        v = m.get('membrane.V')
+        b = myokit.Biomarkers(500, v, apd=(20, 12.5))
+        self.assertEqual(b.period(), 500)
+        self.assertEqual(b.potential(), 'membrane.V')
+        self.assertIsNone(b.calcium())
+        self.assertEqual(
+            b.keys(),
+            ['time', 'rest', 'peak', 'dvdt_max', 'apd20', 'apd12.5'])
+        b = myokit.Biomarkers(500, calcium='ica.Ca_i', catd=[80])
+        self.assertIsNone(b.potential())
+        self.assertEqual(b.calcium(), 'ica.Ca_i')
+        self.assertEqual(
+            b.keys(),
+            ['time', 'cat_diastolic', 'cat_peak', 'cat_amplitude', 'catd80'])
+
+        # Invalid specifications
+        self.assertRaisesRegex(
+            ValueError, 'period', myokit.Biomarkers, 0, 'membrane.V')
+        self.assertRaisesRegex(ValueError, 'potential', myokit.Biomarkers, 1)
+        self.assertRaisesRegex(
+            ValueError, 'Percentages', myokit.Biomarkers, 1, v, apd=[100])
+        self.assertRaisesRegex(
+            ValueError, 'Percentages', myokit.Biomarkers, 1, v, apd=[0])
+
 
 class RuntimeSimulationTest(unittest.TestCase):
     """
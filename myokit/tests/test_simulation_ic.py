@@ -73,6 +73,18 @@ class ICSimulationTest(unittest.TestCase):
         # Test negative log interval is ignored
         s.run(1, log_interval=-1)
 
+        # Test changing the default state
+        x = [float(i) for i in range(n)]
+        s.set_default_state(x)
+        self.assertEqual(s.default_state(), x)
+        self.assertNotEqual(s.state(), x)
+        s.reset()
+        self.assertEqual(s.time(), 0)
+        self.assertEqual(s.state(), x)
+        self.assertTrue(np.all(s.derivatives() == np.eye(n)))
+        self.assertRaisesRegex(
+            ValueError, 'length', s.set_default_state, x[:-1])
+
     def test_progress_reporter(self):
         """ Test running with a progress reporter. """
         m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
@@ -93,6 +105,78 @@ class ICSimulationTest(unittest.TestCase):
             myokit.SimulationCancelledError, s.run, 1,
             progress=CancellingReporter(0))
 
+    def test_methods(self):
+        """ Test the different integration methods. """
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+
+        # Reference solution
+        r = myokit.ICSimulation(m, p, method='rk45')
+        self.assertEqual(r.method(), 'rk45')
+        r.set_tolerance(1e-10, 1e-10)
+        r.run(60)
+        x0 = np.array(r.state())
+        y0 = r.derivatives()
+
+        # Compare errors in final state and derivatives
+        errors = {}
+        for method in ('euler', 'rl', 'rk45'):
+            s = myokit.ICSimulation(m, p, method=method)
+            self.assertEqual(s.method(), method)
+            d, e = s.run(60, log_interval=10)
+            self.assertEqual(len(d.time()), 6)
+            self.assertEqual(e.shape, (6, 8, 8))
+            x = np.array(s.state())
+            y = s.derivatives()
+            errors[method] = (
+                np.max(np.abs(x - x0) / (1e-3 + np.abs(x0))),
+                np.max(np.abs(y - y0)) / np.max(np.abs(y0)),
+            )
+            self.assertLess(errors[method][0], 0.1)
+            self.assertLess(errors[method][1], 0.1)
+        self.assertLess(errors['rk45'][0], errors['euler'][0])
+        self.assertLess(errors['rk45'][1], errors['euler'][1])
+
+        # Invalid tolerances
+        self.assertRaisesRegex(
+            ValueError, 'Absolute', s.set_tolerance, 0, 1e-4)
+        self.assertRaisesRegex(
+            ValueError, 'Relative', s.set_tolerance, 1e-6, 0)
+
+        # NaN in error estimate with rk45
+        m3 = myokit.parse_model('''
+            [[model]]
+            c.x = 0
+
+            [engine]
+            time = 0 bind time
+
+            [c]
+            k = 1
+            dot(x) = k * sqrt(1 - engine.time)
+            ''')
+        s = myokit.ICSimulation(m3, method='rk45')
+        self.assertRaisesRegex(Exception, 'NaN', s.run, 2)
+
+        # Unknown method
+        self.assertRaisesRegex(
+            ValueError, 'Unknown method', myokit.ICSimulation, m, p, 'rk4')
+
+        # Rush-Larsen requires membrane potential
+        m.label('membrane_potential').set_label(None)
+        self.assertRaisesRegex(
+            ValueError, 'membrane_potential', myokit.ICSimulation, m, p,
+            'rl')
+
+    def test_sparse(self):
+        """ Test propagating only the structurally non-zero derivatives. """
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        s1 = myokit.ICSimulation(m, p)
+        s2 = myokit.ICSimulation(m, p, sparse=True)
+        d1, e1 = s1.run(20, log_interval=5)
+        d2, e2 = s2.run(20, log_interval=5)
+        self.assertTrue(np.allclose(e1, e2, rtol=1e-9, atol=1e-12))
+        self.assertTrue(np.allclose(s1.derivatives(), s2.derivatives()))
+
     def test_invalid_model(self):
         """ Test running with an invalid model. """
         m = myokit.Model()
@@ -15,7 +15,7 @@ import numpy as np
 import myokit
 
 from shared import OpenCL_FOUND, DIR_DATA
-from shared import WarningCollector
+from shared import TemporaryDirectory, WarningCollector
 
 # Unit testing in Python 2 and 3
 try:
@@ -693,6 +693,106 @@ class SimulationOpenCLTest(unittest.TestCase):
 
     #TODO Add test_set_state_2d
 
+    def test_pre_steady_state(self):
+        # Test pre-pacing until a periodic steady state is reached
+
+        m, p, _ = myokit.load('example')
+        s = myokit.SimulationOpenCL(m, p, 10)
+        n = s.pre(100000, period=1000, tolerance=1e-4)
+        self.assertTrue(0 < n < 100)
+        self.assertEqual(s.time(), 0)
+        self.assertEqual(s.state(), s.default_state())
+        x0 = np.array(s.state())
+        s.pre(1000)
+        x1 = np.array(s.state())
+        self.assertTrue(np.all(np.abs(x1 - x0) <= 1e-3 * (1 + np.abs(x1))))
+        self.assertRaisesRegex(ValueError, 'period', s.pre, 1, period=0)
+
+    def test_log_sink(self):
+        # Test writing a 2d simulation log to disk
+
+        m, p, _ = myokit.load('example')
+        s = myokit.SimulationOpenCL(m, p, (4, 4))
+        d = s.run(10, log=['engine.time', 'membrane.V'], log_interval=0.1)
+        s.reset()
+        with TemporaryDirectory() as td:
+            fname = td.path('log.zip')
+            with myokit.DataLogWriter(fname) as w:
+                e = s.run(
+                    10, log=['engine.time', 'membrane.V'], log_interval=0.1,
+                    log_sink=w)
+            self.assertEqual(len(e.time()), 0)
+            f = myokit.DataLog.load(fname)
+        self.assertEqual(f.time_key(), 'engine.time')
+        self.assertEqual(set(f.keys()), set(d.keys()))
+        for key, value in d.items():
+            self.assertTrue(np.all(np.array(f[key]) == value))
+
+        # Zero-length runs still write a file that can be loaded
+        with TemporaryDirectory() as td:
+            fname = td.path('log.zip')
+            with myokit.DataLogWriter(fname) as w:
+                s.run(0, log=['engine.time', 'membrane.V'], log_sink=w)
+            f = myokit.DataLog.load(fname)
+        self.assertEqual(f.time_key(), 'engine.time')
+        self.assertEqual(set(f.keys()), set(d.keys()))
+        self.assertEqual(len(f.time()), 0)
+
+    def test_parameters(self):
+        # Test setting parameters, compared to setting fields
+
+        m, p, _ = myokit.load('example')
+        s = myokit.SimulationOpenCL(
+            m, p, 3, diffusion=False, parameters=['ina.gNa', 'ica.gCa'])
+        self.assertEqual(s.parameters(), ['ina.gNa', 'ica.gCa'])
+        t = myokit.SimulationOpenCL(m, p, 3, diffusion=False)
+
+        # Same values in all cells, or a field per parameter
+        s.set_parameters(np.array([10, 0.1]))
+        t.set_field('ina.gNa', [10, 10, 10])
+        t.set_field('ica.gCa', [0.1, 0.1, 0.1])
+        d = s.run(10, log=['membrane.V'])
+        e = t.run(10, log=['membrane.V'])
+        for key, value in d.items():
+            self.assertTrue(np.all(np.array(e[key]) == value))
+        s.reset()
+        t.reset()
+        s.set_parameters(np.array([[10, 12, 14], [0.1, 0.1, 0.1]]))
+        s.set_parameters({'ica.gCa': [0.1, 0.09, 0.08]})
+        t.set_field('ina.gNa', [10, 12, 14])
+        t.set_field('ica.gCa', [0.1, 0.09, 0.08])
+        d = s.run(10, log=['membrane.V'])
+        e = t.run(10, log=['membrane.V'])
+        for key, value in d.items():
+            self.assertTrue(np.all(np.array(e[key]) == value))
+
+        # Bad values
+        self.assertRaisesRegex(
+            ValueError, 'shape', s.set_parameters, [1, 2, 3])
+        self.assertRaisesRegex(
+            ValueError, 'dimensions', s.set_parameters, {'ina.gNa': [1, 2]})
+        self.assertRaisesRegex(
+            ValueError, 'Unknown', s.set_parameters, {'bert': 2})
+        self.assertRaisesRegex(
+            ValueError, 'not set as a parameter', s.set_parameters,
+            {'ina.ENa': 2})
+
+        # Parameters can't be set in other ways
+        self.assertRaisesRegex(
+            ValueError, 'parameter', s.set_constant, 'ina.gNa', 1)
+        self.assertRaisesRegex(
+            ValueError, 'parameter', s.set_field, 'ina.gNa', [1, 2, 3])
+        self.assertRaisesRegex(
+            ValueError, 'parameter', s.remove_field, 'ina.gNa')
+
+        # Bad parameters
+        self.assertRaisesRegex(
+            ValueError, 'Only constants', myokit.SimulationOpenCL, m, p, 3,
+            parameters=['membrane.V'])
+        self.assertRaisesRegex(
+            ValueError, 'Duplicate', myokit.SimulationOpenCL, m, p, 3,
+            parameters=['ina.gNa', 'ina.gNa'])
+
     def test_sim_1d(self):
         # Test running a short 1d simulation (doesn't inspect output)
 
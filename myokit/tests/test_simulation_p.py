@@ -9,6 +9,7 @@ from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 
 import os
+import threading
 import unittest
 import numpy as np
 
@@ -155,6 +156,67 @@ class PSimulationTest(unittest.TestCase):
         # Wrong size derivatives array
         self.assertRaisesRegex(ValueError, 'shape', s.block, d, dp[:, :-1])
 
+    def test_sparse(self):
+        """
+        Test propagating only the structurally non-zero derivatives.
+        """
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        parameters = [
+            v for v in m.variables(const=True, deep=True) if v.is_literal()]
+        s1 = myokit.PSimulation(
+            m, p, variables=['membrane.V', 'ica.ICa'], parameters=parameters)
+        s2 = myokit.PSimulation(
+            m, p, variables=['membrane.V', 'ica.ICa'], parameters=parameters,
+            sparse=True)
+        d1, e1 = s1.run(20, log_interval=5)
+        d2, e2 = s2.run(20, log_interval=5)
+        self.assertTrue(np.allclose(d1['membrane.V'], d2['membrane.V']))
+        self.assertTrue(np.allclose(e1, e2, rtol=1e-9, atol=1e-12))
+        self.assertTrue(np.allclose(s1.derivatives(), s2.derivatives()))
+
+        # Check that not all derivatives are trivially zero
+        self.assertFalse(np.all(e2[-1] == 0))
+
+        # Sparse mode works with other methods
+        s3 = myokit.PSimulation(
+            m, p, variables=['membrane.V', 'ica.ICa'], parameters=parameters,
+            method='rk45', sparse=True)
+        d3, e3 = s3.run(20, log_interval=5)
+        self.assertEqual(e3.shape, e1.shape)
+
+    def test_threads(self):
+        """
+        Test running independent simulations in parallel threads.
+        """
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+
+        def create():
+            s = myokit.PSimulation(
+                m, p, variables=['membrane.V'], parameters=['ina.gNa'])
+            s.set_step_size(0.01)
+            return s
+
+        # Serial results
+        serial = [create().run(50, log_interval=1) for i in range(3)]
+
+        # Threaded results
+        sims = [create() for i in range(3)]
+        threaded = [None] * len(sims)
+
+        def run(i):
+            threaded[i] = sims[i].run(50, log_interval=1)
+
+        threads = [
+            threading.Thread(target=run, args=(i, )) for i in range(len(sims))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for (d1, e1), (d2, e2) in zip(serial, threaded):
+            self.assertEqual(list(d1['membrane.V']), list(d2['membrane.V']))
+            self.assertTrue(np.all(e1 == e2))
+
     def test_set_constant(self):
         """
         Test :meth:`PSimulation.set_constant()` and
@@ -175,7 +237,9 @@ class PSimulationTest(unittest.TestCase):
             ValueError, 'parameter', s.set_constant, 'ina.gNa', 1)
 
         # Set parameter values
+        self.assertEqual(s.parameters(), ['ina.gNa'])
         s.set_parameters([1])
+        s.set_parameters(np.array([1.5]))
         self.assertRaisesRegex(
             ValueError, '1 values', s.set_parameters, [1, 2])
         s.set_parameters({'ina.gNa': 1})
@@ -185,6 +249,103 @@ class PSimulationTest(unittest.TestCase):
         self.assertRaisesRegex(
             ValueError, 'parameter', s.set_parameters, {'ica.gCa': 2})
 
+    def test_methods(self):
+        """
+        Test the different integration methods, and their accuracy.
+        """
+        m, p, x = myokit.load(os.path.join(DIR_DATA, 'lr-1991.mmt'))
+        kw = {'variables': ['membrane.V'], 'parameters': ['ina.gNa']}
+
+        # Reference solution
+        r = myokit.PSimulation(m, p, method='rk45', **kw)
+        self.assertEqual(r.method(), 'rk45')
+        r.set_tolerance(1e-10, 1e-10)
+        d0, e0 = r.run(100, log_interval=10)
+        self.assertEqual(len(d0.time()), 10)
+        x0 = np.array(r.state())
+        y0 = r.derivatives()
+
+        # Returns the maximum (nearly) relative error in the states, and the
+        # maximum error in the derivatives relative to the largest derivative
+        def error(s):
+            x = np.array(s.state())
+            y = s.derivatives()
+            ex = np.max(np.abs(x - x0) / (1e-3 + np.abs(x0)))
+            ey = np.max(np.abs(y - y0)) / np.max(np.abs(y0))
+            return ex, ey
+
+        # Run with each method, and compare
+        errors = {}
+        for method, dt in (
+                ('euler', 0.01), ('euler', 0.001), ('rl', 0.01),
+                ('rk45', 0.01)):
+            s = myokit.PSimulation(m, p, method=method, **kw)
+            self.assertEqual(s.method(), method)
+            s.set_step_size(dt)
+            d, e = s.run(100, log_interval=10)
+            errors[method, dt] = error(s)
+            self.assertEqual(len(d.time()), len(d0.time()))
+            self.assertEqual(e.shape, e0.shape)
+            self.assertLess(errors[method, dt][0], 0.1)
+            self.assertLess(errors[method, dt][1], 0.1)
+
+        # Adaptive method is more accurate than euler, for states and
+        # derivatives, and takes fewer steps than euler with a small step
+        # size.
+        self.assertLess(errors['rk45', 0.01][0], errors['euler', 0.01][0])
+        self.assertLess(errors['rk45', 0.01][1], errors['euler', 0.01][1])
+        steps = {}
+        for method, dt in (('euler', 0.001), ('rk45', 0.01)):
+            s = myokit.PSimulation(m, p, method=method, **kw)
+            s.set_step_size(dt)
+            d, e = s.run(100, log_interval=0)
+            steps[method] = len(d.time())
+        self.assertLess(steps['rk45'], steps['euler'])
+
+        # Tolerances can be changed
+        s = myokit.PSimulation(m, p, method='rk45', **kw)
+        s.set_tolerance(1e-8, 1e-8)
+        s.run(100)
+        self.assertLess(error(s)[0], errors['rk45', 0.01][0])
+        self.assertRaisesRegex(
+            ValueError, 'Absolute', s.set_tolerance, 0, 1e-4)
+        self.assertRaisesRegex(
+            ValueError, 'Relative', s.set_tolerance, 1e-6, 0)
+
+        # Logging every step with rk45
+        s.reset()
+        d, e = s.run(10, log_interval=0)
+        self.assertEqual(len(d.time()), len(e))
+        self.assertTrue(np.all(np.diff(d.time()) > 0))
+
+        # NaN in error estimate with rk45
+        m3 = myokit.parse_model('''
+            [[model]]
+            c.x = 0
+
+            [engine]
+            time = 0 bind time
+
+            [c]
+            k = 1
+            dot(x) = k * sqrt(1 - engine.time)
+            ''')
+        s = myokit.PSimulation(
+            m3, method='rk45', variables=['c.x'], parameters=['c.k'])
+        self.assertRaisesRegex(Exception, 'NaN', s.run, 2)
+
+        # Unknown method
+        self.assertRaisesRegex(
+            ValueError, 'Unknown method', myokit.PSimulation, m, p,
+            method='rk4', **kw)
+
+        # Rush-Larsen requires membrane potential
+        m2 = m.clone()
+        m2.label('membrane_potential').set_label(None)
+        self.assertRaisesRegex(
+            ValueError, 'membrane_potential', myokit.PSimulation, m2, p,
+            method='rl', **kw)
+
     def test_progress_reporter(self):
         """
         Test running with a progress reporter.